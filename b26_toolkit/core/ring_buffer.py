@@ -0,0 +1,175 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """
+    Preallocated buffer for a stream of samples (e.g. the counts of a continuous counter), written by one thread and
+    read by any number of subscribers. Every sample has an absolute index (the number of samples written before it),
+    the buffer keeps the last capacity samples and older samples are overwritten.
+
+    Each subscriber (see subscribe) reads the samples it has not read yet, either at full rate (e.g. to save them) or
+    decimated (e.g. to plot them). A subscriber that does not keep up loses the samples that have been overwritten,
+    they are counted in its num_lost.
+
+    """
+
+    def __init__(self, capacity, num_columns=1, dtype=np.float64):
+        """
+        Args:
+            capacity: number of samples the buffer keeps
+            num_columns: number of values of each sample (e.g. the counts and the voltage of a photodiode)
+            dtype: data type of the values
+        """
+        self.capacity = int(capacity)
+        self.num_columns = int(num_columns)
+        self._data = np.zeros((self.capacity, self.num_columns), dtype=dtype)
+        self.num_written = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def write(self, samples):
+        """
+        appends samples to the buffer and wakes up the subscribers that wait for them
+
+        Args:
+            samples: array (number of samples, num_columns) or, for a single column, (number of samples,)
+
+        """
+        samples = np.asarray(samples).reshape(-1, self.num_columns)
+        num_samples = len(samples)
+        if num_samples > self.capacity:
+            # only the last samples fit, the others are overwritten right away
+            samples = samples[-self.capacity:]
+        with self._condition:
+            start = (self.num_written + num_samples - len(samples)) % self.capacity
+            first_part = min(len(samples), self.capacity - start)
+            self._data[start:start + first_part] = samples[:first_part]
+            self._data[:len(samples) - first_part] = samples[first_part:]
+            self.num_written += num_samples
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        marks the end of the stream, subscribers that wait for samples return
+        """
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def read(self, start, stop):
+        """
+        Args:
+            start: absolute index of the first sample
+            stop: absolute index after the last sample
+
+        Returns: copy of the samples, array (stop - start, num_columns)
+
+        """
+        with self._condition:
+            if start < self.num_written - self.capacity or stop > self.num_written:
+                raise IndexError('samples {:d} to {:d} are not in the buffer'.format(start, stop))
+            indices = np.arange(start, stop) % self.capacity
+            return self._data[indices]
+
+    def latest(self, num_samples):
+        """
+        Args:
+            num_samples: number of samples
+
+        Returns: copy of the last num_samples samples (less if fewer have been written)
+
+        """
+        with self._condition:
+            num_samples = min(num_samples, self.num_written, self.capacity)
+            return self.read(self.num_written - num_samples, self.num_written)
+
+    def subscribe(self, decimation=1, from_start=False):
+        """
+        Args:
+            decimation: number of samples that are averaged into one sample of the subscriber
+            from_start: if True the subscriber starts with the oldest sample in the buffer, otherwise with the next
+                sample that is written
+
+        Returns: a RingBufferSubscriber
+
+        """
+        with self._condition:
+            start = max(self.num_written - self.capacity, 0) if from_start else self.num_written
+        return RingBufferSubscriber(self, decimation, start)
+
+
+class RingBufferSubscriber(object):
+    """
+    Reader of a RingBuffer, see RingBuffer.subscribe
+    """
+
+    def __init__(self, buffer, decimation, start):
+        """
+        Args:
+            buffer: the RingBuffer
+            decimation: number of samples that are averaged into one sample
+            start: absolute index of the first sample to read
+        """
+        self.buffer = buffer
+        self.decimation = max(int(decimation), 1)
+        self.position = start
+        self.num_lost = 0
+
+    @property
+    def num_available(self):
+        """
+        number of (decimated) samples that can be read
+        """
+        return (self.buffer.num_written - self.position) // self.decimation
+
+    def read(self, timeout=None, max_samples=None):
+        """
+        reads the samples that have not been read yet, decimated samples are only returned once all their samples have
+        been written
+
+        Args:
+            timeout (optional): time in s to wait for at least one sample, None returns right away
+            max_samples (optional): maximum number of (decimated) samples to read
+
+        Returns: array (number of samples, number of columns)
+
+        """
+        buffer = self.buffer
+        with buffer._condition:
+            if timeout is not None:
+                buffer._condition.wait_for(lambda: self.num_available > 0 or buffer.closed, timeout)
+            oldest = buffer.num_written - buffer.capacity
+            if self.position < oldest:
+                # the samples have been overwritten before they were read, the decimated samples start again at the
+                # oldest sample
+                self.num_lost += oldest - self.position
+                self.position = oldest
+            num_samples = self.num_available
+            if max_samples is not None:
+                num_samples = min(num_samples, max_samples)
+            stop = self.position + num_samples * self.decimation
+            samples = buffer.read(self.position, stop)
+            self.position = stop
+        if self.decimation > 1:
+            samples = samples.reshape(num_samples, self.decimation, buffer.num_columns).mean(axis=1)
+        return samples
@@ -0,0 +1,267 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# phases that are run for every acquisition (every sequence, or every program when all sequences of a block run in a
+# single program)
+ACQUISITION_PHASES = ['compile', 'program', 'daq_arm', 'readback']
+
+# mean duration of each phase in s that is used until the phase has been measured
+DEFAULT_OVERHEAD = {'compile': 2e-3, 'program': 5e-3, 'daq_arm': 10e-3, 'readback': 2e-3, 'find_nv': 15.,
+                    'esr_tracking': 60.}
+
+# weight of the newest run in the measured mean durations (the first runs are averaged equally)
+MAX_RUN_WEIGHT = 0.3
+
+
+class RuntimeModel(object):
+    """
+    Predicts the runtime of a pulsed experiment from the durations of its pulse sequences and the overhead of the other
+    phases of the experiment (compiling and loading the pulseblaster programs, arming and reading the daq, tracking the
+    NV and its ESR). The overhead is learned from the timing summaries (see core.timing) of previous runs: update
+    averages the mean duration of every phase, the fraction of acquisitions after which the NV is tracked and the
+    ratio between the measured and the predicted acquisition time.
+
+    estimate returns the predicted time of each phase, which also answers what-if questions, e.g. how long the
+    experiment takes with twice the averages or with another tau grid. num_averages_for inverts it.
+
+    """
+
+    def __init__(self, overhead=None, tracking_rate=0.0, acquire_scale=1.0, num_runs=0):
+        """
+        Args:
+            overhead: dictionary with the mean duration in s of each phase, phases that are not given use
+                DEFAULT_OVERHEAD
+            tracking_rate: number of NV trackings per acquisition (in addition to the one at the start)
+            acquire_scale: ratio between the measured and the predicted acquisition time
+            num_runs: number of runs the model has been learned from
+        """
+        self.overhead = dict(DEFAULT_OVERHEAD)
+        if overhead is not None:
+            self.overhead.update(overhead)
+        self.tracking_rate = tracking_rate
+        self.acquire_scale = acquire_scale
+        self.num_runs = num_runs
+
+    def update(self, summary, predicted_acquire=None, tracking=True):
+        """
+        updates the model with the timing summary of a run
+
+        Args:
+            summary: timing summary of the run, as returned by Timer.summary (or loaded with load_timing)
+            predicted_acquire (optional): acquisition time in s that the model predicted for the run, used to learn
+                the ratio between measured and predicted acquisition time
+            tracking: True if the NV was tracked during the run (otherwise the tracking rate is not updated)
+
+        """
+        weight = max(1. / (self.num_runs + 1), MAX_RUN_WEIGHT)
+        stats = {phase: (count, total) for phase, count, total in zip(summary['phase'], summary['count'],
+                                                                       summary['total'])}
+        for phase, (count, total) in stats.items():
+            # the acquisition time is predicted from the sequence durations and learned as acquire_scale
+            if count > 0 and phase != 'acquire':
+                mean = total / count
+                self.overhead[phase] = (1 - weight) * self.overhead.get(phase, mean) + weight * mean
+
+        num_acquisitions = stats.get('acquire', (0, 0.))[0]
+        if tracking and num_acquisitions > 0:
+            # the NV is tracked once at the start of the experiment
+            num_tracking = max(stats.get('find_nv', (0, 0.))[0] - 1, 0)
+            self.tracking_rate = (1 - weight) * self.tracking_rate + weight * num_tracking / float(num_acquisitions)
+        if predicted_acquire and 'acquire' in stats:
+            self.acquire_scale = (1 - weight) * self.acquire_scale + weight * stats['acquire'][1] / predicted_acquire
+        self.num_runs += 1
+
+    def estimate(self, sequence_durations, num_averages, block_size, tracking=False, esr_every_n=0,
+                 single_program=False, pipelined=False, num_outer=1, settle_time=0., sequence_separation=0.):
+        """
+        predicts the runtime of an experiment
+
+        Args:
+            sequence_durations: duration of one loop of each pulse sequence in ns
+            num_averages: number of loops of each sequence
+            block_size: number of loops of each sequence in an average block (the last block has the remainder)
+            tracking: True if the NV is tracked
+            esr_every_n: the ESR is tracked every esr_every_n blocks, 0 if it is not tracked
+            single_program: True if all sequences of a block run in a single program (one acquisition per block)
+            pipelined: True if the overhead of the next sequence overlaps with the acquisition of the current one
+            num_outer: number of values of the outer axis of a 2D sweep, the averages are run for every value
+            settle_time: time in s that is waited after each value of the outer axis has been set
+            sequence_separation: time in ns between two sequences of a single program (see
+                B26PulseBlaster.SEQUENCE_SEPARATION_TIME), which is part of the acquisition
+
+        Returns: dictionary with the phase, the number of times it is run and the total time in s as lists
+
+        """
+        sequence_durations = np.asarray(sequence_durations, dtype=float) * 1e-9
+        num_full_blocks, remainder = divmod(int(num_averages), int(block_size))
+        num_blocks = num_full_blocks + (1 if remainder else 0)
+
+        acquire = np.sum(sequence_durations) * num_averages * self.acquire_scale
+        if single_program:
+            num_acquisitions = num_blocks
+            # the pulseblaster idles between the sequences of a program
+            acquire += num_blocks * (len(sequence_durations) - 1) * sequence_separation * 1e-9 * self.acquire_scale
+        else:
+            num_acquisitions = num_blocks * len(sequence_durations)
+        overhead = sum(self.overhead[phase] for phase in ACQUISITION_PHASES)
+
+        phases = OrderedDict()
+        if pipelined and not single_program:
+            # the overhead is only waited for if it takes longer than the acquisition of the running sequence
+            loops = np.array([block_size] * num_full_blocks + ([remainder] if remainder else []))
+            acquisition_times = np.outer(loops, sequence_durations) * self.acquire_scale
+            phases['acquire'] = (num_acquisitions, acquire)
+            phases['overhead'] = (num_acquisitions, float(np.sum(np.maximum(overhead - acquisition_times, 0))))
+        else:
+            phases['acquire'] = (num_acquisitions, acquire)
+            for phase in ACQUISITION_PHASES:
+                phases[phase] = (num_acquisitions, num_acquisitions * self.overhead[phase])
+        phases = OrderedDict([(phase, (count * num_outer, time * num_outer)) for phase, (count, time) in phases.items()])
+
+        if tracking:
+            num_tracking = 1 + int(round(self.tracking_rate * num_acquisitions * num_outer))
+            phases['find_nv'] = (num_tracking, num_tracking * self.overhead['find_nv'])
+        if esr_every_n > 0:
+            num_esr = int(np.ceil(num_full_blocks / float(esr_every_n))) * num_outer
+            phases['esr_tracking'] = (num_esr, num_esr * self.overhead['esr_tracking'])
+        if num_outer > 1 and settle_time > 0:
+            phases['settle'] = (num_outer, num_outer * settle_time)
+
+        return {'phase': list(phases.keys()), 'count': [count for count, _ in phases.values()],
+                'time': [float(time) for _, time in phases.values()]}
+
+    def num_averages_for(self, duration, sequence_durations, block_size, **kwargs):
+        """
+        Args:
+            duration: available time in s
+            sequence_durations: duration of one loop of each pulse sequence in ns
+            block_size: number of loops of each sequence in an average block
+            **kwargs: other arguments of estimate
+
+        Returns: the largest number of averages (in multiples of block_size, unless it is less than a block) for which
+            the experiment is predicted to finish within duration, 0 if even a single average takes longer
+
+        """
+        def runtime(num_averages):
+            return sum(self.estimate(sequence_durations, num_averages, block_size, **kwargs)['time'])
+
+        if runtime(1) > duration:
+            return 0
+        if runtime(block_size) > duration:
+            low, high = 1, block_size
+            unit = 1
+        else:
+            low, high = 1, 2
+            while runtime(high * block_size) <= duration:
+                low, high = high, 2 * high
+            unit = block_size
+        # bisection for the largest number of units that still fits
+        while high - low > 1:
+            middle = (low + high) // 2
+            if runtime(middle * unit) <= duration:
+                low = middle
+            else:
+                high = middle
+        return low * unit
+
+    def to_dict(self):
+        """
+        Returns: the model as dictionary (e.g. to save it as json)
+        """
+        return {'overhead': dict(self.overhead), 'tracking_rate': self.tracking_rate,
+                'acquire_scale': self.acquire_scale, 'num_runs': self.num_runs}
+
+    @classmethod
+    def load(cls, filename, name):
+        """
+        Args:
+            filename: json file with the models of several experiments
+            name: name of the model in the file (e.g. the script class)
+
+        Returns: the model, a new model with the default overhead if the file or the model does not exist
+
+        """
+        if not os.path.exists(filename):
+            return cls()
+        with open(filename, 'r') as model_file:
+            models = json.load(model_file)
+        if name not in models:
+            return cls()
+        return cls(**models[name])
+
+    def save(self, filename, name):
+        """
+        writes the model into a json file, the other models in the file are kept
+
+        Args:
+            filename: json file with the models of several experiments
+            name: name of the model in the file
+        """
+        models = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as model_file:
+                models = json.load(model_file)
+        models[name] = self.to_dict()
+        with open(filename, 'w') as model_file:
+            json.dump(models, model_file, indent=1, sort_keys=True)
+
+
+def load_timing(filename):
+    """
+    Args:
+        filename: timing csv file that has been saved with the data of a run (file ending -timing.csv)
+
+    Returns: the timing summary of the run (the columns phase, count and total, see Timer.summary)
+
+    """
+    table = pd.read_csv(filename)
+    return {'phase': table['phase'].tolist(), 'count': table['count'].tolist(), 'total': table['total'].tolist()}
+
+
+def estimate_remaining_time(estimated_total, elapsed, fraction_done):
+    """
+    Estimates the remaining time of a run from its predicted total time and its progress. The predicted time of the rest
+    of the run is scaled with the observed rate, i.e. the ratio between the elapsed time and the predicted time of the
+    part that has been run, weighted with the fraction done: at the start the estimate is the prediction, the more of
+    the run is done the more it follows the observed rate.
+
+    Args:
+        estimated_total: predicted total time in s (if it is 0 the remaining time is extrapolated from the elapsed time)
+        elapsed: time in s since the start of the run
+        fraction_done: fraction of the run that is done (between 0 and 1)
+
+    Returns: the remaining time in s, the estimated total time minus the elapsed time (at least 0)
+
+    """
+    fraction_done = min(max(fraction_done, 0.), 1.)
+    if estimated_total > 0:
+        observed_rate = elapsed / (fraction_done * estimated_total) if fraction_done > 0 else 1.
+        rate = (1 - fraction_done) + fraction_done * observed_rate
+        total = elapsed + (1 - fraction_done) * estimated_total * rate
+    elif fraction_done > 0:
+        total = elapsed / fraction_done
+    else:
+        total = elapsed
+    return max(total - elapsed, 0.)
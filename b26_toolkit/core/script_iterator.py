@@ -1,6 +1,8 @@
 from pylabcontrol.core.script_iterator import ScriptIterator
 from pylabcontrol.core import Script, Parameter
+from b26_toolkit.core.runtime_model import estimate_remaining_time
 import numpy as np
+import datetime
 
 class ScriptIteratorB26(ScriptIterator):
 
@@ -8,6 +10,8 @@ class ScriptIteratorB26(ScriptIterator):
 
     def __init__(self, scripts, name=None, settings=None, log_function=None, data_path=None):
         super(ScriptIteratorB26, self).__init__(scripts=scripts, name=name, settings=settings, log_function=log_function, data_path=data_path)
+        self._runtime_estimate = None  # predicted runtime of the subscripts for 'iter nvs' and 'iter points'
+        self._point_index = 0  # index of the point that is currently run for 'iter nvs' and 'iter points'
 
 
     @staticmethod
@@ -201,8 +205,11 @@ class ScriptIteratorB26(ScriptIterator):
 
             points = self.scripts['select_points'].data['nv_locations']
             N_points = len(points)
+            # the estimates of the subscripts are computed once, they are used for the progress of every point
+            self._runtime_estimate = self.estimate_runtime(N_points)
 
             for i, pt in enumerate(points):
+                self._point_index = i
 
                 # account for displacements found by correlation
                 shifted_pt[0] = pt[0] + x_shift
@@ -253,6 +260,106 @@ class ScriptIteratorB26(ScriptIterator):
 
         return dictator
 
+    def _executes(self, script_name, index):
+        """
+        Args:
+            script_name: name of the subscript
+            index: index of the point
+
+        Returns: True if the subscript is run for the point (see script_execution_freq and run_all_first)
+        """
+        freq = self.settings['script_execution_freq'][script_name]
+        j = index if self.settings['run_all_first'] else (index + 1)
+        return freq != 0 and j % freq == 0
+
+    def _sorted_subscripts(self):
+        """
+        Returns: the names of the subscripts that are run for each point in the order of execution (select_points is
+            only run before the iteration and left out)
+        """
+        script_names = list(self.settings['script_order'].keys())
+        script_indices = [self.settings['script_order'][name] for name in script_names]
+        _, sorted_script_names = list(zip(*sorted(zip(script_indices, script_names))))
+        return [name for name in sorted_script_names if name != 'select_points']
+
+    def _num_points(self):
+        """
+        Returns: number of points of an 'iter nvs' or 'iter points' iteration
+        """
+        if 'nv_locations' in self.scripts['select_points'].data:
+            return len(self.scripts['select_points'].data['nv_locations'])
+        return self.scripts['select_points'].settings['Nx'] * self.scripts['select_points'].settings['Ny']
+
+    def estimate_runtime(self, num_points=None):
+        """
+        Predicts the runtime of an 'iter nvs' or 'iter points' iteration from the runtime of a single run of each
+        subscript: the estimate of subscripts that can predict their runtime (e.g. pulsed experiments, see
+        PulsedExperimentBaseScript.estimate_runtime), otherwise the mean duration of the runs in this iteration (0 before
+        the first run)
+
+        Args:
+            num_points (optional): number of points, if None the points selected by select_points
+
+        Returns: dictionary with the subscript, the number of times it is run and the predicted time of all its runs
+            in s as lists
+
+        """
+        if self.iterator_type not in ('iter nvs', 'iter points'):
+            raise NotImplementedError('runtime estimate is only implemented for iter nvs and iter points')
+        if num_points is None:
+            num_points = self._num_points()
+
+        estimate = {'script': [], 'runs': [], 'time': []}
+        for script_name in self._sorted_subscripts():
+            num_runs = sum(self._executes(script_name, index) for index in range(num_points))
+            duration = self._current_subscript_stage['subscript_exec_duration'].get(script_name, datetime.timedelta(0))
+            duration = duration.total_seconds()
+            script = self.scripts[script_name]
+            if hasattr(script, 'estimate_runtime'):
+                try:
+                    duration = sum(script.estimate_runtime()['time'])
+                except (KeyError, ValueError, NotImplementedError) as e:
+                    self.log('could not estimate the runtime of {:s}: {:s}'.format(script_name, str(e)))
+            estimate['script'].append(script_name)
+            estimate['runs'].append(num_runs)
+            estimate['time'].append(num_runs * duration)
+        return estimate
+
+    def _runtime_progress(self):
+        """
+        Returns: the predicted time in s of the part of the iteration that has been run and of the whole iteration,
+            None if the iteration can not be predicted
+        """
+        estimate = self._runtime_estimate
+        if estimate is None or not self.is_running:
+            return None
+
+        durations = {}  # duration of a single run of each subscript in s
+        for script_name, num_runs, time in zip(estimate['script'], estimate['runs'], estimate['time']):
+            durations[script_name] = time / num_runs if num_runs > 0 else 0.
+            # subscripts without own estimate are predicted from the duration of the runs so far
+            measured = self._current_subscript_stage['subscript_exec_duration'].get(script_name)
+            if time == 0 and measured is not None:
+                durations[script_name] = measured.total_seconds()
+        total = sum(durations[script_name] * num_runs for script_name, num_runs in zip(estimate['script'],
+                                                                                      estimate['runs']))
+        if total <= 0:
+            return None
+
+        index = self._point_index
+        current_subscript = self._current_subscript_stage['current_subscript']
+        done = 0.
+        for script_name in estimate['script']:
+            # runs of the completed points
+            done += durations[script_name] * sum(self._executes(script_name, i) for i in range(index))
+        for script_name in estimate['script']:
+            if current_subscript is not None and script_name == current_subscript.name:
+                done += durations[script_name] * min(current_subscript.progress, 100.) / 100.
+                break
+            if self._executes(script_name, index):
+                done += durations[script_name]
+        return done, total
+
     def _estimate_progress(self):
         """
         estimates the current progress that is then used in _receive_signal
@@ -261,15 +368,13 @@ class ScriptIteratorB26(ScriptIterator):
         """
 
         # ==== get number of iterations and loop index ======================
-        if self.iterator_type == 'iter nvs':
-            progress = 50 #todo implement estimate progress for iter nvs
-        elif self.iterator_type == 'iter points':
-
-
-            N = self.scripts['select_points'].settings['Nx']* self.scripts['select_points'].settings['Ny']
-            loop_index = self.loop_index
-
-            progress = 50 #todo implement estimate progress for iter points
+        if self.iterator_type in ('iter nvs', 'iter points'):
+            runtime_progress = self._runtime_progress()
+            if runtime_progress is None:
+                progress = 100. * self._point_index / max(self._num_points(), 1)
+            else:
+                done, total = runtime_progress
+                progress = 100. * done / total
         elif self.iterator_type == 'test':
             progress = 50
 
@@ -277,4 +382,21 @@ class ScriptIteratorB26(ScriptIterator):
             # if can't estimate the remaining time fall back to parent class method
             progress = super(ScriptIteratorB26, self)._estimate_progress()
 
-        return progress
\ No newline at end of file
+        return progress
+
+    @property
+    def remaining_time(self):
+        """
+        estimates the time remaining until the iteration is finished: for 'iter nvs' and 'iter points' at the start
+        from the runtime estimate, then the more of the iteration has been run the more from the observed rate (see
+        estimate_remaining_time)
+        """
+        runtime_progress = None
+        if self.iterator_type in ('iter nvs', 'iter points'):
+            runtime_progress = self._runtime_progress()
+        if runtime_progress is None:
+            return super(ScriptIteratorB26, self).remaining_time
+
+        done, total = runtime_progress
+        elapsed_time = (datetime.datetime.now() - self.start_time).total_seconds()
+        return datetime.timedelta(seconds=estimate_remaining_time(total, elapsed_time, done / total))
@@ -0,0 +1,183 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+_UNKNOWN = object()  # value of a setting that is not known, e.g. because another script has changed the instrument
+
+
+def _flatten(settings, prefix=()):
+    """
+    Returns: dictionary {path: value} of nested settings, the path is the tuple of keys of the value
+    """
+    flat = {}
+    for key, value in settings.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + (key,)))
+        else:
+            flat[prefix + (key,)] = value
+    return flat
+
+
+def _nest(flat):
+    """
+    Returns: nested settings (in the format of Instrument.update) of the dictionary {path: value}
+    """
+    settings = {}
+    for path, value in flat.items():
+        level = settings
+        for key in path[:-1]:
+            level = level.setdefault(key, {})
+        level[path[-1]] = value
+    return settings
+
+
+def _read(settings, path):
+    """
+    Returns: the value of the setting at path or _UNKNOWN if the settings do not have it
+    """
+    for key in path:
+        try:
+            settings = settings[key]
+        except (KeyError, TypeError):
+            return _UNKNOWN
+    return settings
+
+
+class SettingPlanner(object):
+    """
+    Plans the instrument writes of a sweep over instrument settings (e.g. the microwave power of a 2D pulsed sweep), so
+    that the instruments are written as rarely as possible: every point of the sweep only writes the settings whose
+    value differs from the value that the instrument already has, all settings of an instrument are written with a
+    single update and restore writes the values that the settings had before the sweep back once at the end.
+
+    The planner keeps track of the values it has written. If something else changes an instrument in between (e.g.
+    an ESR that is run for tracking), call invalidate, then the next point writes all its settings of that instrument.
+
+    """
+
+    def __init__(self, instruments, points):
+        """
+        Args:
+            instruments: dictionary with the instrument instances by name
+            points: list with the settings of each point of the sweep, each a dictionary {instrument name: settings},
+                the settings are nested like the settings of the instrument, e.g. {'awg': {'default_waveform_ch1':
+                {'amplitude': 0.5}}}
+        """
+        self.instruments = instruments
+        self.points = [{name: _flatten(settings) for name, settings in point.items()} for point in points]
+        for point in self.points:
+            for name in point:
+                if name not in instruments:
+                    raise ValueError('the sweep changes the settings of {:s}, which is not an instrument'.format(name))
+
+        # the values of all settings that the sweep changes before the sweep, to restore them afterwards
+        self.initial = {}
+        for point in self.points:
+            for name, settings in point.items():
+                for path in settings:
+                    self.initial.setdefault(name, {})[path] = _read(instruments[name].settings, path)
+        self.state = {name: dict(settings) for name, settings in self.initial.items()}
+
+        self.num_writes = 0
+        self.num_skipped = 0
+
+    def __len__(self):
+        return len(self.points)
+
+    def changes(self, index):
+        """
+        Args:
+            index: index of the point
+
+        Returns: dictionary {instrument name: nested settings} with the settings that have to be written to go to the
+            point from the current state (instruments without changes are left out)
+
+        """
+        changes = {}
+        for name, settings in self.points[index].items():
+            changed = {path: value for path, value in settings.items() if self.state[name][path] != value}
+            if changed:
+                changes[name] = _nest(changed)
+        return changes
+
+    def plan(self):
+        """
+        Returns: the number of settings that are written to run all points from the current state (assuming that
+            nothing is invalidated in between) and the number of settings of all points
+        """
+        state = {name: dict(settings) for name, settings in self.state.items()}
+        num_writes, num_settings = 0, 0
+        for point in self.points:
+            for name, settings in point.items():
+                for path, value in settings.items():
+                    num_settings += 1
+                    if state[name][path] != value:
+                        state[name][path] = value
+                        num_writes += 1
+        return num_writes, num_settings
+
+    def apply(self, index):
+        """
+        writes the settings of a point that differ from the current state
+
+        Args:
+            index: index of the point
+
+        Returns: the number of settings that have been written
+
+        """
+        changes = self.changes(index)
+        num_written = 0
+        for name, settings in changes.items():
+            self.instruments[name].update(settings)
+            flat = _flatten(settings)
+            self.state[name].update(flat)
+            num_written += len(flat)
+        self.num_writes += num_written
+        self.num_skipped += sum(len(settings) for settings in self.points[index].values()) - num_written
+        return num_written
+
+    def invalidate(self, name=None):
+        """
+        forgets the values of the settings of an instrument, so that the next point writes all of them
+
+        Args:
+            name: name of the instrument, if None all instruments
+        """
+        for instrument_name, settings in self.state.items():
+            if name is None or instrument_name == name:
+                for path in settings:
+                    settings[path] = _UNKNOWN
+
+    def restore(self):
+        """
+        writes the values that the settings had before the sweep back to the instruments (settings whose initial value
+        is not known are left as they are)
+
+        Returns: the number of settings that have been written
+
+        """
+        num_written = 0
+        for name, initial in self.initial.items():
+            changed = {path: value for path, value in initial.items()
+                       if value is not _UNKNOWN and self.state[name][path] != value}
+            if changed:
+                self.instruments[name].update(_nest(changed))
+                self.state[name].update(changed)
+                num_written += len(changed)
+        self.num_writes += num_written
+        return num_written
@@ -0,0 +1,110 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+GOLDEN_RATIO_CONJUGATE = (np.sqrt(5.) - 1) / 2  # step of the low discrepancy sequence
+MAX_SEED = 2 ** 31 - 1
+
+
+class SweepOrder(object):
+    """
+    Seeded generator of the order in which the points of a sweep (the tau values of a pulsed experiment, the frequencies
+    of an ESR) are run in each average block. The order of a block only depends on the seed, the mode and the index of
+    the block, so the order of every block can be reproduced afterwards (e.g. to correlate a drift with the time at
+    which each point was measured) and a resumed experiment continues with the orders it would have had.
+
+    Modes:
+        sequential: the points in their order
+        shuffle: a random permutation of the points
+        stratified: the points are split into about sqrt(number of points) strata of neighbouring points and the block
+            is run in rounds that take one random point of each stratum in random order, so that every part of the
+            block covers the whole range of the sweep
+        low_discrepancy: the points are ordered by a randomly shifted golden ratio sequence, consecutive points are
+            far apart and every part of the block covers the range of the sweep evenly
+
+    """
+    MODES = ['shuffle', 'stratified', 'low_discrepancy', 'sequential']
+
+    def __init__(self, num_points, mode='shuffle', seed=None, num_strata=None):
+        """
+        Args:
+            num_points: number of points of the sweep
+            mode: one of SweepOrder.MODES
+            seed (optional): seed of the orders, if None (or 0) a new seed is drawn, it is kept in self.seed so that it
+                can be saved with the data
+            num_strata (optional): number of strata of the stratified mode, if None about sqrt(num_points)
+        """
+        if mode not in self.MODES:
+            raise ValueError('unknown sweep order {:s}, use one of {:s}'.format(str(mode), ', '.join(self.MODES)))
+        if not seed:
+            seed = np.random.randint(1, MAX_SEED)
+        self.num_points = int(num_points)
+        self.mode = mode
+        self.seed = int(seed)
+        if num_strata is None:
+            num_strata = int(round(np.sqrt(self.num_points)))
+        self.num_strata = min(max(num_strata, 1), max(self.num_points, 1))
+
+    def block(self, index):
+        """
+        Args:
+            index: index of the average block
+
+        Returns: array with the indices of the points in the order in which they are run in the block
+
+        """
+        num_points = self.num_points
+        if self.mode == 'sequential' or num_points < 2:
+            return np.arange(num_points, dtype=np.int64)
+
+        random_state = np.random.RandomState([self.seed, int(index)])
+        if self.mode == 'shuffle':
+            order = random_state.permutation(num_points)
+        elif self.mode == 'stratified':
+            stratum = np.arange(num_points) * self.num_strata // num_points
+            # rank of each point in its stratum in random order, the points with rank r are run in round r
+            by_stratum = np.lexsort((random_state.random_sample(num_points), stratum))
+            rank = np.empty(num_points, dtype=np.int64)
+            rank[by_stratum] = np.arange(num_points) - np.searchsorted(stratum, stratum[by_stratum])
+            # within a round every point is in another stratum, a random key shuffles the strata
+            order = np.lexsort((random_state.random_sample(num_points), rank))
+        else:
+            keys = (random_state.random_sample() + np.arange(num_points) * GOLDEN_RATIO_CONJUGATE) % 1.
+            order = np.argsort(keys, kind='stable')
+        return order.astype(np.int64)
+
+    def blocks(self, num_blocks, first=0):
+        """
+        Args:
+            num_blocks: number of average blocks
+            first: index of the first block
+
+        Returns: array (num_blocks, number of points) with the order of each block
+
+        """
+        orders = np.zeros((num_blocks, self.num_points), dtype=np.int64)
+        for row, index in enumerate(range(first, first + num_blocks)):
+            orders[row] = self.block(index)
+        return orders
+
+    def to_dict(self):
+        """
+        Returns: mode and seed, e.g. to store them with the data
+        """
+        return {'mode': self.mode, 'seed': self.seed, 'num_strata': self.num_strata}
@@ -0,0 +1,258 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# durations are histogrammed in logarithmic bins, BINS_PER_DECADE per decade from 1 us to 1000 s, the first and the last
+# bin also contain all shorter and longer durations
+BINS_PER_DECADE = 5
+MIN_DURATION = 1e-6
+NUM_BINS = 9 * BINS_PER_DECADE
+BIN_EDGES = MIN_DURATION * 10 ** (np.arange(NUM_BINS + 1) / float(BINS_PER_DECADE))
+
+
+class _NullSpan(object):
+    """
+    span of a disabled timer, does nothing
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    """
+    times the code in a with block and adds the duration to the timer
+    """
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.timer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.name, self.start, self.timer.clock() - self.start)
+        return False
+
+
+class Timer(object):
+    """
+    Records how long the phases of an experiment take (e.g. compiling a pulse sequence, arming the daq, acquiring).
+    A phase is timed with a span, either as context manager
+
+        with self.timer.span('acquire'):
+            ...
+
+    or as decorator of a method of an object that has a timer in self.timer
+
+        @timed('plot')
+        def _update_plot(self, axes_list):
+            ...
+
+    The timer aggregates the number of spans, the total, minimum and maximum duration and a histogram of the durations of
+    each phase and keeps the individual spans (up to max_events) for the export to a chrome trace (load the file in
+    chrome://tracing or https://ui.perfetto.dev), which shows when each phase ran in which thread and thereby the dead
+    time between them.
+
+    If the timer is disabled, span returns a shared object that does nothing, so that the instrumentation can stay in the
+    code.
+
+    """
+
+    def __init__(self, enabled=True, max_events=100000, clock=time.perf_counter):
+        """
+        Args:
+            enabled: if False, nothing is recorded
+            max_events: maximum number of spans that are kept for the chrome trace, the statistics include all spans
+            clock: function that returns the current time in s
+        """
+        self.enabled = enabled
+        self.max_events = max_events
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        deletes all recorded spans
+        """
+        with self._lock:
+            self.start_time = self.clock()
+            self.stats = OrderedDict()
+            self.events = []
+            self.dropped_events = 0
+
+    def span(self, name):
+        """
+        Args:
+            name: name of the phase
+
+        Returns: context manager that times the code in its with block
+
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name):
+        """
+        Returns: decorator that times every call of a function as span name
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add(self, name, start, duration):
+        """
+        adds a span, e.g. for phases that have been timed by other means
+
+        Args:
+            name: name of the phase
+            start: start time of the span (same clock as the timer)
+            duration: duration in s
+        """
+        if not self.enabled:
+            return
+        if duration > MIN_DURATION:
+            bin_index = min(int(math.log10(duration / MIN_DURATION) * BINS_PER_DECADE), NUM_BINS - 1)
+        else:
+            bin_index = 0
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {'count': 0, 'total': 0.0, 'min': duration, 'max': duration,
+                                            'histogram': np.zeros(NUM_BINS, dtype=np.int64)}
+            stats['count'] += 1
+            stats['total'] += duration
+            stats['min'] = min(stats['min'], duration)
+            stats['max'] = max(stats['max'], duration)
+            stats['histogram'][bin_index] += 1
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, duration, threading.current_thread().name))
+            else:
+                self.dropped_events += 1
+
+    def summary(self):
+        """
+        Returns: dictionary with one list entry per phase with the name of the phase, the number of spans, the total,
+            mean, minimum and maximum duration (in s) and the histogram of the durations (counts in the bins BIN_EDGES)
+
+        """
+        with self._lock:
+            summary = {'phase': [], 'count': [], 'total': [], 'mean': [], 'min': [], 'max': [], 'histogram': []}
+            for name, stats in self.stats.items():
+                summary['phase'].append(name)
+                summary['count'].append(stats['count'])
+                summary['total'].append(stats['total'])
+                summary['mean'].append(stats['total'] / stats['count'])
+                summary['min'].append(stats['min'])
+                summary['max'].append(stats['max'])
+                summary['histogram'].append(stats['histogram'].copy())
+        return summary
+
+    def to_chrome_trace(self, process_name='b26_toolkit'):
+        """
+        Returns: the spans in the chrome trace event format (a dictionary that can be written to a json file)
+        """
+        with self._lock:
+            events = list(self.events)
+        thread_ids = OrderedDict()
+        trace_events = []
+        for name, start, duration, thread_name in events:
+            thread_id = thread_ids.setdefault(thread_name, len(thread_ids))
+            # complete events with time stamp and duration in us
+            trace_events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': thread_id,
+                                 'ts': (start - self.start_time) * 1e6, 'dur': duration * 1e6})
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': 0, 'args': {'name': process_name}})
+        for thread_name, thread_id in thread_ids.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': thread_id,
+                                 'args': {'name': thread_name}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms',
+                'otherData': {'dropped_events': self.dropped_events}}
+
+    def save_chrome_trace(self, filename, process_name='b26_toolkit'):
+        """
+        writes the spans to a chrome trace json file
+
+        Args:
+            filename: name of the file, the directory is created if it does not exist
+            process_name: name of the process shown in the trace viewer
+        """
+        if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as trace_file:
+            json.dump(self.to_chrome_trace(process_name), trace_file)
+
+
+_DISABLED_TIMER = Timer(enabled=False)
+
+
+def timed(name):
+    """
+    decorator for methods that times every call as span name with the timer in self.timer (if the object has no timer
+    yet or the timer is disabled, the method is called without timing)
+
+    Args:
+        name: name of the phase
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            timer = getattr(self, 'timer', _DISABLED_TIMER)
+            if not timer.enabled:
+                return method(self, *args, **kwargs)
+            with timer.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def store_timing(script):
+    """
+    stores the summary of the timer of a script in script.data['timing'] and, if the script saves its data, writes the
+    chrome trace next to the data (file ending -trace.json)
+
+    Args:
+        script: script with a timer in script.timer
+    """
+    if not script.timer.enabled:
+        return
+    script.data['timing'] = script.timer.summary()
+    if script.settings['save']:
+        script.timer.save_chrome_trace(script.filename('-trace.json'), script.name)
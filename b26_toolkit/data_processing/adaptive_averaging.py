@@ -0,0 +1,345 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+
+def exponential_decay(tau, amplitude, time_constant, offset):
+    return amplitude * np.exp(-tau / time_constant) + offset
+
+
+def cosine(tau, amplitude, period, phase, offset):
+    return amplitude * np.cos(2 * np.pi * tau / period + phase) + offset
+
+
+def normalized_signal(counts):
+    """
+    Args:
+        counts: array (number of tau, number of readouts) with the counts or count rates of each readout
+
+    Returns: the first readout normalized to the second readout (if there is one)
+
+    """
+    if counts.shape[1] >= 2:
+        return counts[:, 0] / counts[:, 1]
+    return counts[:, 0]
+
+
+class AdaptiveAveraging(object):
+    """
+    Distributes the loops of an average block of a pulsed experiment over the tau values, such that they reduce the
+    uncertainty of the result most. The counts of every tau are modelled as poissonian, the signal is computed from the
+    count rates of the readouts by the signal function of the experiment (e.g. the live fit signal of the script), by
+    default the first readout normalized to the second readout.
+
+    Criteria:
+        variance: the loops go to the tau values where the variance of the mean signal is largest
+        exponential: the loops go to the tau values that reduce the variance of the time constant of an exponential
+            decay fit most (e.g. T1, T2)
+        cosine: the loops go to the tau values that reduce the variance of the period of a cosine fit most (e.g. Rabi)
+
+    The loops are allocated greedily in small chunks using the Fisher information of the fit parameters. If the fit
+    fails (e.g. there is no signal yet), the variance criterion is used.
+
+    """
+    CRITERIA = ['variance', 'exponential', 'cosine']
+    NUM_CHUNKS_PER_TAU = 10  # number of chunks per tau value in which the loops of a block are allocated
+
+    def __init__(self, tau, num_readouts, criterion='variance', uniform_fraction=0.2, max_loops=None,
+                 signal_function=None):
+        """
+        Args:
+            tau: tau values of the experiment
+            num_readouts: number of readouts per sequence
+            criterion: one of CRITERIA
+            uniform_fraction: fraction of the loops of every block that are distributed evenly over all tau values, so
+                that no tau value is left out completely
+            max_loops: maximum number of loops of a single tau value in a block (e.g. limited by the pulseblaster)
+            signal_function (optional): function that takes an array (number of tau, number of readouts) with the count
+                rates and returns the signal of each tau, by default normalized_signal
+        """
+        if criterion not in self.CRITERIA:
+            raise ValueError('criterion has to be one of {:s}'.format(', '.join(self.CRITERIA)))
+        self.tau = np.asarray(tau, dtype=float)
+        self.num_readouts = num_readouts
+        self.criterion = criterion
+        self.uniform_fraction = uniform_fraction
+        self.max_loops = max_loops
+        self.signal_function = signal_function if signal_function is not None else normalized_signal
+
+        self.counts = np.zeros((len(self.tau), num_readouts))
+        self.num_loops = np.zeros(len(self.tau), dtype=np.int64)
+        self.fit_params = None
+
+    def add_counts(self, counts, num_loops):
+        """
+        adds the counts of a block
+
+        Args:
+            counts: array (number of tau, number of readouts) with the counts of the block summed over the loops
+            num_loops: number of loops of every tau value in the block (single value or one value per tau)
+
+        """
+        self.counts += counts
+        self.num_loops += np.asarray(num_loops, dtype=np.int64)
+
+    def signal(self):
+        """
+        Returns: tuple (signal, variance), the mean signal of each tau and the variance of a single shot
+
+        """
+        rates = self.counts / np.maximum(self.num_loops, 1)[:, np.newaxis]
+        # avoid zero variance for tau values without any counts
+        rates = np.maximum(rates, 1.0 / np.maximum(self.num_loops, 1)[:, np.newaxis])
+        signal = np.asarray(self.signal_function(rates), dtype=float)
+        # error propagation of the poissonian counts of each readout (variance of a single shot = rate), with the
+        # derivatives of the signal function from central differences
+        variance = np.zeros(len(signal))
+        for readout in range(rates.shape[1]):
+            step = np.zeros_like(rates)
+            step[:, readout] = 1e-6 * rates[:, readout]
+            derivative = (np.asarray(self.signal_function(rates + step)) -
+                          np.asarray(self.signal_function(rates - step))) / (2 * step[:, readout])
+            variance += derivative ** 2 * rates[:, readout]
+        # readouts that the signal does not depend on have no variance
+        return signal, np.maximum(variance, np.finfo(float).tiny)
+
+    def fit(self):
+        """
+        fits the model of the criterion to the signal
+
+        Returns: tuple (parameters, covariance), or None if the criterion has no model or the fit failed
+
+        """
+        if self.criterion == 'variance' or np.any(self.num_loops == 0) or len(self.tau) < 5:
+            return None
+
+        signal, variance = self.signal()
+        sigma = np.sqrt(variance / self.num_loops)
+        tau_range = np.max(self.tau) - np.min(self.tau)
+        if self.criterion == 'exponential':
+            model = exponential_decay
+            first, last = np.argmin(self.tau), np.argmax(self.tau)
+            guess = [signal[first] - signal[last], tau_range / 3, signal[last]]
+            bounds = ([-np.inf, tau_range / 1000, -np.inf], [np.inf, tau_range * 100, np.inf])
+        else:
+            model = cosine
+            order = np.argsort(self.tau)
+            # the period is estimated from the strongest frequency component (assuming roughly equidistant tau)
+            spectrum = np.abs(np.fft.rfft(signal[order] - np.mean(signal)))
+            frequency = max(1, np.argmax(spectrum[1:]) + 1) / tau_range
+            guess = [(np.max(signal) - np.min(signal)) / 2, 1 / frequency, 0, np.mean(signal)]
+            bounds = ([0, tau_range / len(self.tau), -2 * np.pi, -np.inf], [np.inf, tau_range * 10, 2 * np.pi, np.inf])
+        if self.fit_params is not None:
+            # start from the previous fit, the allocated loops concentrate on few tau values which makes the fit less
+            # robust to a bad initial guess
+            guess = np.clip(self.fit_params, bounds[0], bounds[1])
+
+        try:
+            parameters, covariance = curve_fit(model, self.tau, signal, p0=guess, sigma=sigma, absolute_sigma=True,
+                                               bounds=bounds, max_nfev=1000)
+        except (RuntimeError, ValueError):
+            return None
+        if not np.all(np.isfinite(covariance)):
+            return None
+
+        self.fit_params = parameters
+        return parameters, covariance
+
+    def _jacobian(self, parameters):
+        """
+        Returns: array (number of tau, number of parameters) with the derivatives of the model at each tau
+        """
+        if self.criterion == 'exponential':
+            amplitude, time_constant, offset = parameters
+            decay = np.exp(-self.tau / time_constant)
+            return np.stack([decay, amplitude * self.tau / time_constant ** 2 * decay, np.ones(len(self.tau))], axis=1)
+        else:
+            amplitude, period, phase, offset = parameters
+            angle = 2 * np.pi * self.tau / period + phase
+            return np.stack([np.cos(angle), amplitude * np.sin(angle) * 2 * np.pi * self.tau / period ** 2,
+                             -amplitude * np.sin(angle), np.ones(len(self.tau))], axis=1)
+
+    def target_uncertainty(self, num_loops=None):
+        """
+        Args:
+            num_loops: number of loops of each tau, if None the loops that have been added so far
+
+        Returns: predicted standard deviation of the time constant (exponential) or period (cosine) or for the variance
+            criterion the largest standard deviation of the mean signal of a tau value
+
+        """
+        if num_loops is None:
+            num_loops = self.num_loops
+        signal, variance = self.signal()
+        if self.criterion == 'variance' or self.fit_params is None:
+            return np.sqrt(np.max(variance / np.maximum(num_loops, 1)))
+        regressors = self._jacobian(self.fit_params) / np.sqrt(variance)[:, np.newaxis]
+        information = np.dot(regressors.T * num_loops, regressors)
+        return np.sqrt(np.linalg.pinv(information)[1, 1])
+
+    def allocate(self, total_loops):
+        """
+        Distributes the loops of the next block over the tau values
+
+        Args:
+            total_loops: total number of loops of the block
+
+        Returns: array with the number of loops of each tau value (at least 1 for every tau value)
+
+        """
+        num_tau = len(self.tau)
+        uniform_loops = max(1, int(self.uniform_fraction * total_loops / num_tau))
+        if np.any(self.num_loops == 0):
+            # without any data, distribute all loops evenly
+            uniform_loops = max(1, total_loops // num_tau)
+        loops = np.full(num_tau, uniform_loops, dtype=np.int64)
+        remaining = int(total_loops - np.sum(loops))
+        if remaining <= 0:
+            return loops
+
+        max_loops = self.max_loops if self.max_loops is not None else np.inf
+        chunk = max(1, remaining // (self.NUM_CHUNKS_PER_TAU * num_tau))
+        signal, variance = self.signal()
+        total = (self.num_loops + loops).astype(float)
+
+        fit = self.fit()
+        if fit is not None:
+            # greedy c-optimal design: add each chunk where it reduces the variance of the target parameter most
+            regressors = self._jacobian(fit[0]) / np.sqrt(variance)[:, np.newaxis]
+            covariance = np.linalg.pinv(np.dot(regressors.T * total, regressors))
+            target = np.zeros(regressors.shape[1])
+            target[1] = 1
+
+        while remaining > 0:
+            size = min(chunk, remaining)
+            if fit is not None:
+                projection = np.dot(regressors, np.dot(covariance, target))
+                leverage = np.einsum('ij,jk,ik->i', regressors, covariance, regressors)
+                gain = size * projection ** 2 / (1 + size * leverage)
+            else:
+                gain = variance / total - variance / (total + size)
+            gain[loops + size > max_loops] = -np.inf
+            if np.all(np.isinf(gain)):
+                break
+            index = np.argmax(gain)
+            loops[index] += size
+            total[index] += size
+            remaining -= size
+            if fit is not None:
+                # Sherman-Morrison update of the covariance
+                vector = np.dot(covariance, regressors[index])
+                covariance -= size * np.outer(vector, vector) / (1 + size * np.dot(regressors[index], vector))
+
+        return loops
+
+
+def simulate_nv_counts(tau, num_loops, criterion='exponential', time_constant=1e6, period=200., contrast=0.3,
+                       rate=0.03, random_state=None):
+    """
+    Simulates the counts of a pulsed experiment on an NV with a signal and a reference readout
+
+    Args:
+        tau: tau values
+        num_loops: number of loops of each tau value
+        criterion: 'exponential' (e.g. T1) or 'cosine' (e.g. Rabi)
+        time_constant: time constant of the decay in ns
+        period: period of the oscillation in ns
+        contrast: fluorescence contrast between ms=0 and ms=1
+        rate: mean number of counts per readout of ms=0
+        random_state: numpy RandomState
+
+    Returns: array (number of tau, 2) with the counts of the signal and the reference readout summed over the loops
+
+    """
+    random_state = random_state or np.random
+    tau = np.asarray(tau, dtype=float)
+    if criterion == 'cosine':
+        population = 0.5 + 0.5 * np.cos(2 * np.pi * tau / period)
+    else:
+        population = np.exp(-tau / time_constant)
+    signal_rate = rate * (1 - contrast * (1 - population))
+    num_loops = np.asarray(num_loops, dtype=float) * np.ones(len(tau))
+    return np.stack([random_state.poisson(signal_rate * num_loops), random_state.poisson(rate * num_loops)], axis=1)
+
+
+def benchmark(criterion='exponential', num_blocks=10, loops_per_block=100000, num_trials=200, seed=0,
+              signal_function=None, num_resamples=1000, **nv_parameters):
+    """
+    Compares adaptive averaging to uniform averaging on a simulated NV: runs the same number of total loops with both
+    and compares the scatter of the fitted time constant (exponential) or period (cosine) over num_trials repetitions.
+    The scatter is itself estimated from num_trials values, its uncertainty is estimated by resampling the trials
+    (bootstrap), a ratio within two ratio_spread of 1 is not a significant gain ('significant' is False).
+
+    Args:
+        criterion: 'exponential' (T1 like) or 'cosine' (Rabi like)
+        num_blocks: number of average blocks
+        loops_per_block: number of loops per tau and block
+        num_trials: number of repetitions of the simulated experiment
+        seed: seed of the random numbers
+        signal_function (optional): signal function of the AdaptiveAveraging, for the counts of simulate_nv_counts
+        num_resamples: number of bootstrap resamples of the trials
+        **nv_parameters: parameters of simulate_nv_counts
+
+    Returns: dictionary with the standard deviation of the fitted parameter for 'uniform' and 'adaptive' averaging, the
+        'ratio' of the number of loops uniform averaging needs to reach the precision of adaptive averaging, the
+        standard deviation of the ratio over the bootstrap resamples ('ratio_spread') and whether the ratio is
+        significantly larger than 1 ('significant')
+
+    """
+    random_state = np.random.RandomState(seed)
+    if criterion == 'cosine':
+        tau = np.linspace(10, 500, 50)
+        nv_parameters.setdefault('period', 200.)
+        true_value = nv_parameters['period']
+    else:
+        tau = np.linspace(1e4, 5e6, 50)
+        nv_parameters.setdefault('time_constant', 1e6)
+        true_value = nv_parameters['time_constant']
+
+    results = {'uniform': [], 'adaptive': []}
+    for trial in range(num_trials):
+        for name in results:
+            scheduler = AdaptiveAveraging(tau, 2, criterion, signal_function=signal_function)
+            for block in range(num_blocks):
+                if name == 'uniform':
+                    num_loops = np.full(len(tau), loops_per_block, dtype=np.int64)
+                else:
+                    num_loops = scheduler.allocate(loops_per_block * len(tau))
+                scheduler.add_counts(simulate_nv_counts(tau, num_loops, criterion, random_state=random_state,
+                                                        **nv_parameters), num_loops)
+            fit = scheduler.fit()
+            results[name].append(fit[0][1] if fit is not None else np.nan)
+
+    uniform, adaptive = np.array(results['uniform']), np.array(results['adaptive'])
+    resamples = random_state.randint(0, num_trials, (num_resamples, num_trials))
+    ratios = (np.nanstd(uniform[resamples], axis=1) / np.nanstd(adaptive[resamples], axis=1)) ** 2
+    ratio = (np.nanstd(uniform) / np.nanstd(adaptive)) ** 2
+    return {'true_value': true_value, 'uniform': np.nanstd(uniform), 'adaptive': np.nanstd(adaptive),
+            'ratio': ratio, 'ratio_spread': np.std(ratios), 'significant': bool(ratio - 2 * np.std(ratios) > 1)}
+
+
+if __name__ == '__main__':
+    # the gain of the exponential criterion is small, with 200 trials it is not significant
+    for criterion, num_trials in [('exponential', 800), ('cosine', 200)]:
+        result = benchmark(criterion, num_trials=num_trials)
+        print('{:s}: std uniform = {:0.4g}, std adaptive = {:0.4g}, uniform averaging needs {:0.2f} +- {:0.2f}x more '
+              'loops ({:s})'.format(criterion, result['uniform'], result['adaptive'], result['ratio'],
+                                    result['ratio_spread'],
+                                    'significant gain' if result['significant'] else 'no significant gain'))
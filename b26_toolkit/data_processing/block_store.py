@@ -0,0 +1,198 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+class BlockStore(object):
+    """
+    On-disk store for the average blocks of a pulsed experiment. Every field is a memory mapped .npy file with one row
+    per block that is allocated when the store is created, so that a completed block is on disk as soon as it has been
+    appended. The number of completed blocks is kept in a small json file that is replaced atomically after the data of
+    a block has been flushed, so that a store is always consistent, even if the experiment crashes.
+
+    Loading is lazy: the fields are only mapped into memory when they are accessed and only the completed blocks are
+    returned, so that a store can be analyzed while the experiment is still appending to it.
+
+    Fields (n = number of blocks):
+        counts: (n, number of tau, number of readouts) counts of each readout summed over the loops of the block
+        order: (n, number of tau) order in which the sequences have been run in the block
+        time: (n, 2) start and end time of the block (seconds since the epoch)
+        num_loops: (n, number of tau) number of loops of each sequence in the block
+        mw_frequency: (n,) microwave carrier frequency during the block (Hz), nan if not known
+        nv_position: (n, 2) x and y of the NV position during the block, nan if not known
+
+    """
+    META_FILE = 'meta.json'
+    PROGRESS_FILE = 'progress.json'
+
+    def __init__(self, path):
+        """
+        opens an existing store, use BlockStore.create to create a new store
+
+        Args:
+            path: directory of the store
+        """
+        self.path = path
+        with open(os.path.join(path, self.META_FILE), 'r') as meta_file:
+            self.meta = json.load(meta_file)
+        self.tau = np.array(self.meta['tau'])
+        self.num_blocks = self.meta['num_blocks']
+        self.num_readouts = self.meta['num_readouts']
+        self._fields = {}
+
+    @staticmethod
+    def _field_layout(num_blocks, num_tau, num_readouts):
+        """
+        Returns: dictionary with the dtype and the shape of each field
+        """
+        return {
+            'counts': (np.float64, (num_blocks, num_tau, num_readouts)),
+            'order': (np.int64, (num_blocks, num_tau)),
+            'time': (np.float64, (num_blocks, 2)),
+            'num_loops': (np.int64, (num_blocks, num_tau)),
+            'mw_frequency': (np.float64, (num_blocks,)),
+            'nv_position': (np.float64, (num_blocks, 2))
+        }
+
+    @classmethod
+    def create(cls, path, tau, num_blocks, num_readouts, meta=None):
+        """
+        creates a new store and allocates the files for all blocks
+
+        Args:
+            path: directory of the store, is created if it does not exist
+            tau: list of the tau values of the experiment
+            num_blocks: number of average blocks of the experiment
+            num_readouts: number of daq reads per sequence
+            meta: optional dictionary with additional information (e.g. the settings of the script), has to be json
+                serializable
+
+        Returns: the new BlockStore
+
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if os.path.exists(os.path.join(path, cls.META_FILE)):
+            raise IOError('there already is a block store in {:s}'.format(path))
+
+        tau = np.asarray(tau)
+        for name, (dtype, shape) in cls._field_layout(num_blocks, len(tau), num_readouts).items():
+            field = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode='w+', dtype=dtype, shape=shape)
+            if np.issubdtype(dtype, np.floating):
+                field[:] = np.nan
+            field.flush()
+            del field
+
+        store_meta = dict(meta or {})
+        store_meta.update({'tau': tau.tolist(), 'num_blocks': int(num_blocks), 'num_readouts': int(num_readouts)})
+        with open(os.path.join(path, cls.META_FILE), 'w') as meta_file:
+            json.dump(store_meta, meta_file, indent=1)
+        cls._write_progress(path, 0)
+
+        return cls(path)
+
+    @classmethod
+    def _write_progress(cls, path, num_completed):
+        """
+        writes the number of completed blocks, the file is replaced atomically so that readers never see a partial file
+        """
+        temp_file_name = os.path.join(path, cls.PROGRESS_FILE + '.tmp')
+        with open(temp_file_name, 'w') as progress_file:
+            json.dump({'num_completed': int(num_completed)}, progress_file)
+        os.replace(temp_file_name, os.path.join(path, cls.PROGRESS_FILE))
+
+    @property
+    def num_completed(self):
+        """
+        number of completed blocks, this is read from disk on every access
+        """
+        with open(os.path.join(self.path, self.PROGRESS_FILE), 'r') as progress_file:
+            return json.load(progress_file)['num_completed']
+
+    def is_compatible(self, tau, num_blocks, num_readouts):
+        """
+        Returns: True if the store was created for an experiment with the same tau values, number of blocks and number
+            of readouts, i.e. if an experiment with these values can be resumed from this store
+        """
+        return (self.num_blocks == num_blocks and self.num_readouts == num_readouts and
+                len(self.tau) == len(tau) and np.allclose(self.tau, tau))
+
+    def _field(self, name, mode='r'):
+        """
+        Returns: memory map of the field, opened on first access
+        """
+        if name not in self._fields or (mode == 'r+' and self._fields[name].mode != 'r+'):
+            self._fields[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode=mode)
+        return self._fields[name]
+
+    def __getitem__(self, name):
+        """
+        Returns: the data of a field of all completed blocks (a read-only memory map, no data is copied)
+        """
+        if name not in self._field_layout(0, 0, 0):
+            raise KeyError('{:s} is not a field of the block store'.format(name))
+        return self._field(name)[:self.num_completed]
+
+    def keys(self):
+        return list(self._field_layout(0, 0, 0).keys())
+
+    def append(self, counts, order, start_time, end_time, num_loops, mw_frequency=np.nan, nv_position=(np.nan, np.nan)):
+        """
+        writes the data of the next block to disk and marks it as completed
+
+        Args:
+            counts: array (number of tau, number of readouts) with the counts of the block
+            order: order in which the sequences have been run
+            start_time: start time of the block (seconds since the epoch)
+            end_time: end time of the block (seconds since the epoch)
+            num_loops: number of loops of each sequence in the block (single value or one value per tau)
+            mw_frequency: microwave carrier frequency during the block (Hz)
+            nv_position: x and y of the NV position during the block
+
+        Returns: index of the block
+
+        """
+        index = self.num_completed
+        if index >= self.num_blocks:
+            raise IndexError('all {:d} blocks of the block store have been recorded'.format(self.num_blocks))
+
+        values = {'counts': counts, 'order': order, 'time': (start_time, end_time), 'num_loops': num_loops,
+                  'mw_frequency': mw_frequency, 'nv_position': nv_position}
+        for name, value in values.items():
+            field = self._field(name, 'r+')
+            field[index] = value
+            field.flush()
+        self._write_progress(self.path, index + 1)
+
+        return index
+
+    def total_counts(self):
+        """
+        Returns: array (number of tau, number of readouts) with the counts summed over all completed blocks
+        """
+        return np.sum(self['counts'], axis=0)
+
+    def total_loops(self):
+        """
+        Returns: array with the total number of loops of each sequence in the completed blocks
+        """
+        return np.sum(self['num_loops'], axis=0)
@@ -0,0 +1,212 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+import numpy as np
+from scipy import optimize
+
+from b26_toolkit.data_processing.fit_functions import exp_offset, cose_with_decay, estimate_exp_decay_parameters, \
+    guess_cose_parameter
+
+# fit models: function, names of the parameters and the parameter that is checked for the early stop (T1/T2 of the
+# exponential decay, angular frequency of the rabi oscillation)
+MODELS = {
+    'exp_decay': (exp_offset, ['amplitude', 'tau', 'offset'], 'tau'),
+    'rabi': (cose_with_decay, ['amplitude', 'angular_frequency', 'phase', 'offset', 'tau'], 'angular_frequency')
+}
+
+
+def _guess_parameters(model, x, y):
+    """
+    Returns: initial parameters of the fit if there is no previous fit to start from
+    """
+    if model == 'exp_decay':
+        return estimate_exp_decay_parameters(x, y, True)
+    else:
+        # the decay of the oscillation is started at the length of the sweep
+        return list(guess_cose_parameter(x, y)) + [np.max(x)]
+
+
+class FitWorker(object):
+    """
+    Fits the data of a running experiment in a background thread, so that the acquisition is not stalled by the fit.
+    Every fit is started from the parameters of the previous successful fit (warm start), which converges in a few
+    iterations once the data only changes by an average block. If the data is submitted faster than it can be fitted,
+    only the most recent data is fitted (the older requests are coalesced and counted in num_coalesced).
+
+    The result of the last fit is in self.result, a dictionary of lists with one entry per parameter of the model:
+    the name of the parameter, its value and its uncertainty (standard deviation from the covariance of the fit).
+
+    With a target relative uncertainty, converged becomes True once the relative uncertainty of the stop parameter of
+    the model (tau for exp_decay, the angular frequency for rabi) is below the target, which can be used to stop the
+    experiment early.
+
+    """
+
+    def __init__(self, model, target_uncertainty=None, callback=None):
+        """
+        Args:
+            model: one of MODELS
+            target_uncertainty (optional): target relative uncertainty of the stop parameter, if None the worker never
+                converges
+            callback (optional): function that is called from the worker thread with self.result after every fit
+        """
+        if model not in MODELS:
+            raise ValueError('model has to be one of {:s}'.format(', '.join(sorted(MODELS))))
+        self.model = model
+        self.function, self.parameter_names, self.stop_parameter = MODELS[model]
+        self.target_uncertainty = target_uncertainty
+        self.callback = callback
+
+        self.result = None
+        self.relative_uncertainty = np.inf
+        self.num_fits = 0
+        self.num_failed = 0
+        self.num_coalesced = 0
+
+        self._parameters = None
+        self._request = None
+        self._busy = False
+        self._stop = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @property
+    def converged(self):
+        """
+        True if the relative uncertainty of the last fit is below the target uncertainty
+        """
+        return self.target_uncertainty is not None and self.relative_uncertainty <= self.target_uncertainty
+
+    def reset(self):
+        """
+        starts a new data set (e.g. the next value of the outer axis of a 2D sweep), the next fit starts from the
+        parameters of the last fit, but converged stays False until a fit of the new data set reaches the target
+        """
+        self.relative_uncertainty = np.inf
+
+    def fit(self, x, y):
+        """
+        fits the data, starting from the parameters of the previous fit, and updates self.result
+
+        Args:
+            x: x data (e.g. tau)
+            y: y data, values that are not finite (e.g. tau values that have not been measured yet) are ignored
+
+        Returns: True if the fit succeeded
+
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        finite = np.isfinite(x) & np.isfinite(y)
+        x, y = x[finite], y[finite]
+        if len(x) <= len(self.parameter_names):
+            return False
+
+        initial_parameters = [self._parameters] if self._parameters is not None else []
+        success = False
+        for p0 in initial_parameters + [None]:
+            try:
+                if p0 is None:
+                    p0 = _guess_parameters(self.model, x, y)
+                parameters, covariance = optimize.curve_fit(self.function, x, y, p0=p0)
+                uncertainties = np.sqrt(np.diag(covariance))
+                success = np.all(np.isfinite(parameters)) and np.all(np.isfinite(uncertainties))
+            except (RuntimeError, ValueError, TypeError, np.linalg.LinAlgError):
+                success = False
+            if success:
+                break
+        self.num_fits += 1
+
+        if not success:
+            # start the next fit from the initial guess again and do not stop on the uncertainty of an older fit
+            self._parameters = None
+            self.relative_uncertainty = np.inf
+            self.num_failed += 1
+            return False
+
+        self._parameters = parameters
+        index = self.parameter_names.index(self.stop_parameter)
+        self.relative_uncertainty = uncertainties[index] / abs(parameters[index]) if parameters[index] != 0 else np.inf
+        self.result = {'parameter': list(self.parameter_names), 'value': parameters.tolist(),
+                       'uncertainty': uncertainties.tolist()}
+        return True
+
+    def start(self):
+        """
+        starts the worker thread
+        """
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, name='fit_worker', daemon=True)
+        self._thread.start()
+
+    def submit(self, x, y):
+        """
+        requests a fit of the data, the data is copied, so the caller can keep updating its arrays
+
+        Args:
+            x: x data (e.g. tau)
+            y: y data
+
+        """
+        with self._condition:
+            if self._request is not None:
+                self.num_coalesced += 1
+            self._request = (np.array(x, dtype=float), np.array(y, dtype=float))
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        waits until all submitted data has been fitted
+
+        Args:
+            timeout: maximum time to wait in s
+
+        Returns: True if all submitted data has been fitted
+
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._request is None and not self._busy, timeout)
+
+    def stop(self):
+        """
+        fits the data that is still pending and stops the worker thread
+        """
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._request is not None or self._stop)
+                if self._request is None:
+                    return
+                x, y = self._request
+                self._request = None
+                self._busy = True
+            try:
+                if self.fit(x, y) and self.callback is not None:
+                    self.callback(self.result)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
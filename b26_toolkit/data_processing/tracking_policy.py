@@ -0,0 +1,152 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+
+class TrackingPolicy(object):
+    """
+    Decides when to track to the NV from a stream of fluorescence values (e.g. the reference readout of every tau).
+    The values are compared to the reference fluorescence as relative deviation x = value / reference - 1 and a change
+    detector turns them into a statistic:
+
+        threshold: |x|, i.e. every single value is compared to the threshold (sensitive to shot noise)
+        ema: |m| with the exponential moving average m = (1 - ema_weight) * m + ema_weight * x
+        cusum: max(S+, S-) of the two sided CUSUM S+ = max(0, S+ + x - drift), S- = max(0, S- - x - drift), which
+            accumulates small but persistent deviations
+
+    The policy tracks if the statistic exceeds the alarm level. With hysteresis > 0, it then only tracks again after the
+    statistic has dropped below (1 - hysteresis) * alarm level, so that a deviation that is not fixed by tracking does
+    not trigger tracking over and over. The cusum statistic is reset after tracking. If tracking has used more than
+    max_time_fraction of the time since the start, the policy does not track (budget cap).
+
+    Every alarm is logged in self.log (a dictionary of lists, one entry per alarm) with the time since the start, the
+    index of the value (e.g. the tau index), the value, the statistic, whether it was tracked and the tracking duration.
+
+    """
+    DETECTORS = ['threshold', 'ema', 'cusum']
+
+    def __init__(self, reference, detector='cusum', threshold=0.85, ema_weight=0.1, cusum_drift=0.05, cusum_limit=0.3,
+                 hysteresis=0.5, max_time_fraction=1.0, clock=time.time):
+        """
+        Args:
+            reference: reference fluorescence (same units as the values, e.g. kcps)
+            detector: one of DETECTORS
+            threshold: for threshold and ema the alarm level is 1 - threshold, i.e. a value below threshold * reference
+                (or above (2 - threshold) * reference) triggers tracking
+            ema_weight: weight of a new value in the exponential moving average
+            cusum_drift: relative deviation that is tolerated by the cusum detector
+            cusum_limit: alarm level of the cusum detector
+            hysteresis: relative distance of the release level below the alarm level, 0 turns the hysteresis off
+            max_time_fraction: maximum fraction of the time since the start that is spent tracking
+            clock: function that returns the current time in s
+        """
+        if detector not in self.DETECTORS:
+            raise ValueError('detector has to be one of {:s}'.format(', '.join(self.DETECTORS)))
+        self.reference = float(reference)
+        self.detector = detector
+        self.ema_weight = ema_weight
+        self.cusum_drift = cusum_drift
+        self.alarm_level = cusum_limit if detector == 'cusum' else 1 - threshold
+        self.release_level = (1 - hysteresis) * self.alarm_level
+        self.hysteresis = hysteresis
+        self.max_time_fraction = max_time_fraction
+        self.clock = clock
+
+        self.start_time = clock()
+        self.tracking_time = 0.0
+        self.log = {'time': [], 'index': [], 'value': [], 'statistic': [], 'tracked': [], 'duration': []}
+        self.reset()
+
+    def reset(self):
+        """
+        resets the state of the change detector
+        """
+        self.statistic = 0.0
+        self._ema = 0.0
+        self._cusum_high, self._cusum_low = 0.0, 0.0
+        self._armed = True
+
+    def _update_statistic(self, value):
+        """
+        Returns: the statistic of the change detector after adding value
+        """
+        deviation = value / self.reference - 1
+        if self.detector == 'threshold':
+            return abs(deviation)
+        elif self.detector == 'ema':
+            self._ema = (1 - self.ema_weight) * self._ema + self.ema_weight * deviation
+            return abs(self._ema)
+        else:
+            self._cusum_high = max(0.0, self._cusum_high + deviation - self.cusum_drift)
+            self._cusum_low = max(0.0, self._cusum_low - deviation - self.cusum_drift)
+            return max(self._cusum_high, self._cusum_low)
+
+    @property
+    def time_fraction(self):
+        """
+        fraction of the time since the start that has been spent tracking
+        """
+        elapsed = self.clock() - self.start_time
+        return self.tracking_time / elapsed if elapsed > 0 else 0.0
+
+    def update(self, value, index=None):
+        """
+        adds a new fluorescence value
+
+        Args:
+            value: fluorescence value
+            index: optional index of the value that is logged (e.g. the index of tau)
+
+        Returns: True if we should track now, in this case call tracked(duration) after tracking
+
+        """
+        self.statistic = self._update_statistic(value)
+
+        if not self._armed:
+            if self.statistic < self.release_level:
+                self._armed = True
+            return False
+        if self.statistic <= self.alarm_level:
+            return False
+
+        track = self.time_fraction < self.max_time_fraction
+        self.log['time'].append(self.clock() - self.start_time)
+        self.log['index'].append(-1 if index is None else int(index))
+        self.log['value'].append(float(value))
+        self.log['statistic'].append(float(self.statistic))
+        self.log['tracked'].append(track)
+        self.log['duration'].append(0.0)
+        if self.hysteresis > 0:
+            self._armed = False
+
+        return track
+
+    def tracked(self, duration):
+        """
+        records that we tracked after the last alarm
+
+        Args:
+            duration: time it took to track in s
+
+        """
+        self.tracking_time += duration
+        if self.log['duration']:
+            self.log['duration'][-1] = duration
+        if self.detector == 'cusum':
+            self._cusum_high, self._cusum_low = 0.0, 0.0
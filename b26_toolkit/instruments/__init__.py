@@ -18,10 +18,10 @@
 
 from .gauge_controller import PressureGauge, PumpLinePressureGauge, ChamberPressureGauge
 from .spectrum_analyzer import SpectrumAnalyzer
-from .ni_daq import NI6259, NI9263, NI9402, NI9219
+from .ni_daq import NI6259, NI9263, NI9402, NI9219, SimulatedDAQmx, ConfocalModel, DAQStream
 from .piezo_controller import PiezoController, PiezoControllerCold
 from .zurich_instruments import ZIHF2
-from .pulse_blaster import B26PulseBlaster, Pulse
+from .pulse_blaster import B26PulseBlaster, Pulse, QuantizedPulse, PulseTable, SimulatedSpinAPI
 from .maestro import MaestroLightControl
 from .attocube import Attocube, AttocubeXY
 from .microwave_generator import MicrowaveGenerator
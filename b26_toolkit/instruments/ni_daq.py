@@ -22,11 +22,14 @@
 
 import ctypes
 import os
+import threading
+import time
 import numpy
 import warnings
 from pylabcontrol.core.read_write_functions import get_config_value
 
 from pylabcontrol.core import Instrument, Parameter
+from b26_toolkit.core.ring_buffer import RingBuffer
 import numpy as np
 
 ##############################
@@ -61,6 +64,634 @@ DAQmx_Val_Ticks = 10304  # specifies units as timebase ticks
 DAQmx_Val_ChanPerLine = 0  # One Channel For Each Line
 DAQmx_Val_ChanForAllLines = 1  # One Channel For All Lines
 
+# Task control constants
+DAQmx_Val_Task_Commit = 3  # reserves the resources and programs the hardware, a stopped task stays committed
+DAQmx_Val_Task_Unreserve = 5  # releases the resources
+
+
+# DAQmx error codes returned by the simulated library, see SimulatedDAQmx
+DAQmx_Err_InvalidTask = -200088
+DAQmx_Err_BufferTooSmall = -200229
+DAQmx_Err_ReadTimeout = -200284
+DAQmx_Err_WaitTimeout = -200560
+DAQmx_Err_Overflow = -200279
+DAQmx_Err_ResourceReserved = -50103
+
+
+class ConfocalModel(object):
+    """
+    Fluorescence of a sample with NV centers under a confocal microscope, used by SimulatedDAQmx to turn the analog
+    output voltages into APD counts: the voltages of the x and y galvo channels position the focus, the count rate is
+    the background plus a gaussian spot for every NV. If mw_frequency is set (e.g. by a script that simulates the
+    microwave generator), the NV fluorescence has a lorentzian dip at each ESR frequency.
+    """
+
+    def __init__(self, nv_positions=None, num_nvs=20, extent=0.4, x_channel='ao0', y_channel='ao1', peak_rate=60e3,
+                 background_rate=3e3, spot_size=0.004, esr_frequencies=(2.87e9,), esr_linewidth=8e6, esr_contrast=0.2,
+                 photodiode_gain=1e-4, seed=0):
+        """
+        Args:
+            nv_positions (optional): array (number of NVs, 2) with the x and y position of each NV in V, if None
+                num_nvs random positions within +- extent
+            num_nvs: number of random NVs
+            extent: range of the random NV positions in V
+            x_channel: analog output of the x galvo
+            y_channel: analog output of the y galvo
+            peak_rate: count rate in counts/s with the focus on an NV (above the background)
+            background_rate: count rate in counts/s away from the NVs
+            spot_size: standard deviation of the gaussian spot of an NV in V
+            esr_frequencies: frequencies of the ESR dips in Hz
+            esr_linewidth: full width at half maximum of the ESR dips in Hz
+            esr_contrast: relative depth of the ESR dips
+            photodiode_gain: voltage of the analog inputs per count/s (a photodiode that sees the same light)
+            seed: seed of the random NV positions
+        """
+        if nv_positions is None:
+            nv_positions = np.random.RandomState(seed).uniform(-extent, extent, (num_nvs, 2))
+        self.nv_positions = np.asarray(nv_positions, dtype=float).reshape(-1, 2)
+        self.x_channel = x_channel
+        self.y_channel = y_channel
+        self.peak_rate = peak_rate
+        self.background_rate = background_rate
+        self.spot_size = spot_size
+        self.esr_frequencies = np.asarray(esr_frequencies, dtype=float)
+        self.esr_linewidth = esr_linewidth
+        self.esr_contrast = esr_contrast
+        self.photodiode_gain = photodiode_gain
+        self.mw_frequency = None  # microwave frequency in Hz, None if the microwaves are off
+
+    def rate(self, x, y):
+        """
+        Args:
+            x: x voltage(s) of the galvo
+            y: y voltage(s) of the galvo
+
+        Returns: count rate(s) in counts/s
+
+        """
+        x = np.asarray(x, dtype=float)[..., np.newaxis]
+        y = np.asarray(y, dtype=float)[..., np.newaxis]
+        distance_squared = (x - self.nv_positions[:, 0]) ** 2 + (y - self.nv_positions[:, 1]) ** 2
+        nv_rate = self.peak_rate * np.sum(np.exp(-distance_squared / (2 * self.spot_size ** 2)), axis=-1)
+        if self.mw_frequency is not None:
+            detuning = self.mw_frequency - self.esr_frequencies
+            dip = self.esr_contrast * np.sum(1 / (1 + (2 * detuning / self.esr_linewidth) ** 2))
+            nv_rate = nv_rate * (1 - min(dip, 1.))
+        return self.background_rate + nv_rate
+
+    def count_rate(self, ao_voltages):
+        """
+        Args:
+            ao_voltages: dictionary {analog output channel: voltage or array of voltages}
+
+        Returns: count rate(s) in counts/s
+
+        """
+        return self.rate(ao_voltages.get(self.x_channel, 0.), ao_voltages.get(self.y_channel, 0.))
+
+    def analog_input(self, channel, ao_voltages):
+        """
+        Args:
+            channel: analog input channel (e.g. 'ai0')
+            ao_voltages: dictionary {analog output channel: voltage or array of voltages}
+
+        Returns: voltage(s) of the analog input without noise
+
+        """
+        return self.photodiode_gain * self.count_rate(ao_voltages)
+
+
+class _SimulatedTask(object):
+    """
+    state of a task of the SimulatedDAQmx
+    """
+
+    def __init__(self):
+        self.kind = None  # 'ci' (counter), 'gated' (gated counter), 'co' (clock), 'ai', 'ao' or 'do'
+        self.channels = []  # names of the physical channels, e.g. ['ao0', 'ao1']
+        self.resources = set()  # the physical channels with the device, e.g. {'dev1/ao0'}, reserved by the task
+        self.committed = False  # explicitly committed (DAQmxTaskControl), the resources stay reserved when stopped
+        self.sample_clock = None  # None: on demand, '': internal clock, otherwise terminal of an external clock
+        self.sample_rate = None
+        self.continuous = False
+        self.num_samples = 0  # number of samples of a finite task, buffer size of a continuous task
+        self.waveform = None  # array (number of channels, number of samples) of an ao task
+        self.started = False
+        self.start_time = None  # time at which the first sample is taken (the clock started)
+        self.clock = None  # the clock task that drives an externally clocked task
+        self.samples = np.zeros(0)  # samples that have been acquired and not yet read
+        self.num_generated = 0  # number of samples acquired since the start
+        self.num_read = 0
+        self.count = 0.  # counter value (the counter counts up from the start)
+
+
+class SimulatedDAQmx(object):
+    """
+    Hardware-free replacement for the NI-DAQmx library, that can be passed to a DAQ instead of the dll. It implements
+    the DAQmx functions that are used by the DAQ (tasks with counter, clock, analog and digital channels, sample clock
+    timing, reads and writes, start/stop/clear and error reporting) and simulates the data:
+
+        counters count Poisson distributed APD counts, the rate is given by the model (a ConfocalModel) for the analog
+            output voltages during each sample
+        gated counters count the APD counts during gate_width for every gate
+        analog inputs read the analog output voltages (internal channels _aoN_vs_aognd) or the voltage of the model
+            (e.g. a photodiode), with gaussian noise
+
+    The timing is realistic: a finite task is done num_samples / sample_rate after it has started and reads and
+    WaitUntilTaskDone block until then (a continuous counter only has the samples up to now). time_scale scales all
+    durations (0 returns all data immediately, e.g. for tests) and call_latency is added to every call. As on the
+    hardware, an externally clocked task (sample clock source other than '') is started by the clock: it is driven by
+    the next clock (a counter output task) that is started after it.
+
+    Tasks reserve their channels when they are started or committed (DAQmxTaskControl), another task that uses a
+    reserved channel fails as on the hardware. All functions accept ctypes values as well as python numbers and return
+    0 on success and a negative DAQmx error code on errors (see DAQmxGetExtendedErrorInfo). num_calls counts the calls of each function and num_samples_acquired
+    the samples of all reads, e.g. to benchmark the throughput of a script.
+    """
+
+    def __init__(self, model=None, time_scale=1.0, call_latency=0.0, gate_width=300e-9, gate_period=2e-6,
+                 ai_noise=1e-4, devices=('Dev1', 'cDAQ1', 'cDAQ1Mod1', 'cDAQ1Mod4'), seed=None):
+        """
+        Args:
+            model (optional): ConfocalModel that gives the count rate, if None a ConfocalModel with the default settings
+            time_scale: factor for the duration of the acquisitions, 1 is real time, 0 returns the data immediately
+            call_latency: time in s that every call takes (the overhead of the driver)
+            gate_width: duration in s of a gate of a gated counter
+            gate_period: time in s between the gates of a gated counter
+            ai_noise: standard deviation in V of the noise of the analog inputs
+            devices: names of the simulated devices
+            seed (optional): seed of the random numbers, to reproduce the data
+        """
+        self.model = model if model is not None else ConfocalModel()
+        self.time_scale = time_scale
+        self.call_latency = call_latency
+        self.gate_width = gate_width
+        self.gate_period = gate_period
+        self.ai_noise = ai_noise
+        self.devices = list(devices)
+        self.random_state = np.random.RandomState(seed)
+
+        self.tasks = {}
+        self._next_handle = 1
+        self.ao_voltages = {}  # current voltage of each analog output
+        self.digital_lines = {}  # current value of each digital line
+        self.error = ''
+        self.num_calls = {}
+        self.num_samples_acquired = 0
+
+    # ========== helpers ==========
+
+    @staticmethod
+    def _value(argument):
+        # arguments are either ctypes objects (or references to them) or python values
+        argument = getattr(argument, '_obj', argument)
+        value = getattr(argument, 'value', argument)
+        if isinstance(value, bytes):
+            value = value.decode('ascii')
+        return value
+
+    @staticmethod
+    def _set(reference, value):
+        # writes a value through a reference (ctypes.byref) or into a ctypes object, None is ignored
+        if reference is not None:
+            getattr(reference, '_obj', reference).value = value
+
+    @staticmethod
+    def _array(pointer, count, ctype=ctypes.c_double):
+        """
+        Returns: numpy view of count values of the buffer pointer points to (a ctypes.byref of a ctypes array or a
+            ctypes pointer)
+        """
+        buffer = getattr(pointer, '_obj', None)
+        if buffer is not None:
+            return np.frombuffer(buffer, dtype=np.dtype(ctype), count=count)
+        return np.ctypeslib.as_array(ctypes.cast(pointer, ctypes.POINTER(ctype)), shape=(count,))
+
+    @staticmethod
+    def _channels(channel_list):
+        # physical channel names of a channel list, e.g. b'Dev1/ao0,Dev1/ao1' -> ['ao0', 'ao1']
+        channel_list = SimulatedDAQmx._value(channel_list)
+        return [channel.strip().split('/')[-1] for channel in channel_list.split(',') if channel.strip()]
+
+    def _call(self, name):
+        self.num_calls[name] = self.num_calls.get(name, 0) + 1
+        if self.call_latency > 0:
+            time.sleep(self.call_latency)
+
+    def _fail(self, error_code, error):
+        self.error = error
+        return error_code
+
+    def _task(self, handle):
+        return self.tasks.get(int(self._value(handle)))
+
+    def _elapsed_samples(self, task, rate):
+        # number of samples the task has acquired until now
+        if self.time_scale <= 0:
+            return np.inf
+        return int((time.time() - task.start_time) / self.time_scale * rate)
+
+    def _wait(self, task, num_samples, rate, timeout):
+        """
+        blocks until the task has acquired num_samples
+
+        Returns: False if the timeout (in s, -1 for none) expires before
+        """
+        remaining = task.start_time + num_samples / float(rate) * self.time_scale - time.time()
+        if remaining <= 0:
+            return True
+        if 0 <= timeout < remaining:
+            time.sleep(timeout)
+            return False
+        time.sleep(remaining)
+        return True
+
+    def _rate(self, task):
+        # sample rate of a task, the rate of its clock if it is externally clocked
+        return task.clock.sample_rate if task.clock is not None else task.sample_rate
+
+    def _ao_voltages(self, task, first, last):
+        """
+        Returns: dictionary {analog output channel: array of the voltages during the samples first to last (excluded)}
+            of a task, the analog outputs on the clock of the task output their waveform (a sample is output at the
+            clock tick and held until the next tick), the others their current voltage
+        """
+        voltages = {channel: np.full(last - first, voltage) for channel, voltage in self.ao_voltages.items()}
+        if task.clock is None:
+            return voltages
+        # the interval before tick k has the output of tick k - 1
+        ticks = np.arange(first, last) - 1
+        for ao_task in self.tasks.values():
+            if ao_task.kind == 'ao' and ao_task.clock is task.clock and ao_task.waveform is not None:
+                num_ao_samples = ao_task.waveform.shape[1]
+                for channel, waveform in zip(ao_task.channels, ao_task.waveform):
+                    values = waveform[np.clip(ticks, 0, num_ao_samples - 1)]
+                    # before the first tick the output still has its previous voltage
+                    values[ticks < 0] = self.ao_voltages.get(channel, 0.)
+                    voltages[channel] = values
+        return voltages
+
+    def _acquire(self, task, num_samples):
+        """
+        acquires the next num_samples of a counter or analog input task and appends them to task.samples
+        """
+        first, last = task.num_generated, task.num_generated + num_samples
+        if task.kind in ('gated', 'ci'):
+            rate = np.broadcast_to(self.model.count_rate(self._ao_voltages(task, first, last)), (num_samples,))
+        if task.kind == 'gated':
+            samples = self.random_state.poisson(rate * self.gate_width).astype(float)
+        elif task.kind == 'ci':
+            duration = np.full(num_samples, 1. / self._rate(task))
+            if first == 0:
+                # the counter is armed at a random time before the first tick
+                duration[0] *= self.random_state.uniform()
+            samples = task.count + np.cumsum(self.random_state.poisson(rate * duration))
+            if num_samples > 0:
+                task.count = samples[-1]
+        else:
+            voltages = self._ao_voltages(task, first, last)
+            samples = []
+            for channel in task.channels:
+                if channel.startswith('_ao'):
+                    # internal channel that reads back an analog output, e.g. _ao0_vs_aognd
+                    values = voltages.get(channel[1:].split('_')[0], np.zeros(num_samples))
+                else:
+                    values = self.model.analog_input(channel, voltages) * np.ones(num_samples)
+                samples.append(values + self.random_state.normal(0, self.ai_noise, num_samples))
+            samples = np.concatenate(samples) if samples else np.zeros(0)
+            samples = samples.reshape(len(task.channels), num_samples)
+        if task.kind == 'ai':
+            task.samples = samples if task.samples.size == 0 else np.concatenate((task.samples, samples), axis=1)
+        else:
+            task.samples = np.concatenate((task.samples, samples))
+        task.num_generated = last
+        self.num_samples_acquired += num_samples
+
+    def _reserve(self, task):
+        # a task reserves its channels when it is committed or started, they can only be reserved by one task
+        for other_task in self.tasks.values():
+            if other_task is not task and (other_task.started or other_task.committed) \
+                    and other_task.resources & task.resources:
+                return self._fail(DAQmx_Err_ResourceReserved, 'the specified resource is reserved: {:s}'.format(
+                    ', '.join(sorted(other_task.resources & task.resources))))
+        return 0
+
+    def _start_acquisition(self, task, start_time):
+        task.start_time = start_time
+        if not task.continuous and task.kind in ('ci', 'gated', 'ai'):
+            # the data of a finite task only depends on the voltages at its start, it is simulated right away
+            self._acquire(task, task.num_samples)
+
+    def _finish_ao(self, task):
+        # the analog outputs keep the last voltage that has been output
+        if task.waveform is None or not task.started or task.start_time is None:
+            return
+        num_output = task.waveform.shape[1]
+        if self.time_scale > 0:
+            num_output = min(num_output, self._elapsed_samples(task, self._rate(task)) + 1)
+        for channel, waveform in zip(task.channels, task.waveform):
+            self.ao_voltages[channel] = float(waveform[max(num_output - 1, 0)])
+
+    # ========== DAQmx functions ==========
+
+    def DAQmxGetDevProductType(self, device, data, buffer_size):
+        self._call('DAQmxGetDevProductType')
+        if self._value(device) not in self.devices:
+            return self._fail(-200220, 'device identifier is invalid')
+        self._set(data, b'Simulated DAQmx'[:int(self._value(buffer_size)) - 1])
+        return 0
+
+    def DAQmxGetSysDevNames(self, data, buffer_size):
+        self._call('DAQmxGetSysDevNames')
+        self._set(data, ', '.join(self.devices).encode('ascii'))
+        return 0
+
+    def DAQmxGetExtendedErrorInfo(self, error_string, buffer_size):
+        self._set(error_string, self.error.encode('ascii')[:int(self._value(buffer_size)) - 1])
+        return 0
+
+    def DAQmxGetErrorString(self, error_code, error_string, buffer_size):
+        self._set(error_string, self.error.encode('ascii')[:int(self._value(buffer_size)) - 1])
+        return 0
+
+    def DAQmxCreateTask(self, task_name, task_handle):
+        self._call('DAQmxCreateTask')
+        handle = self._next_handle
+        self._next_handle += 1
+        self.tasks[handle] = _SimulatedTask()
+        self._set(task_handle, handle)
+        return 0
+
+    def _create_channel(self, name, task_handle, kind, channels):
+        self._call(name)
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        task.kind = kind
+        task.channels = self._channels(channels)
+        task.resources = {channel.strip().strip('/').lower() for channel in self._value(channels).split(',')
+                          if channel.strip() and not self._channels(channel)[0].startswith('_')}
+        return 0
+
+    def DAQmxCreateCICountEdgesChan(self, task_handle, counter, name, edge, initial_count, count_direction):
+        return self._create_channel('DAQmxCreateCICountEdgesChan', task_handle, 'ci', counter)
+
+    def DAQmxCreateCIPulseWidthChan(self, task_handle, counter, name, min_value, max_value, units, edge, scale):
+        return self._create_channel('DAQmxCreateCIPulseWidthChan', task_handle, 'gated', counter)
+
+    def DAQmxCreateCOPulseChanFreq(self, task_handle, counter, name, units, idle_state, initial_delay, frequency,
+                                   duty_cycle):
+        result = self._create_channel('DAQmxCreateCOPulseChanFreq', task_handle, 'co', counter)
+        if result == 0:
+            self._task(task_handle).sample_rate = float(self._value(frequency))
+        return result
+
+    def DAQmxCreateAIVoltageChan(self, task_handle, channels, name, terminal_config, min_value, max_value, units,
+                                 scale):
+        return self._create_channel('DAQmxCreateAIVoltageChan', task_handle, 'ai', channels)
+
+    def DAQmxCreateAOVoltageChan(self, task_handle, channels, name, min_value, max_value, units, scale):
+        return self._create_channel('DAQmxCreateAOVoltageChan', task_handle, 'ao', channels)
+
+    def DAQmxCreateDOChan(self, task_handle, lines, name, line_grouping):
+        return self._create_channel('DAQmxCreateDOChan', task_handle, 'do', lines)
+
+    def DAQmxCfgSampClkTiming(self, task_handle, source, rate, active_edge, sample_mode, samples_per_channel):
+        self._call('DAQmxCfgSampClkTiming')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        task.sample_clock = self._value(source) or ''
+        task.sample_rate = float(self._value(rate))
+        task.continuous = self._value(sample_mode) == DAQmx_Val_ContSamps
+        task.num_samples = int(self._value(samples_per_channel))
+        return 0
+
+    def DAQmxCfgImplicitTiming(self, task_handle, sample_mode, samples_per_channel):
+        self._call('DAQmxCfgImplicitTiming')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        task.continuous = self._value(sample_mode) == DAQmx_Val_ContSamps
+        task.num_samples = int(self._value(samples_per_channel))
+        if task.kind == 'gated':
+            # the gates come at the gate period of the pulse sequence
+            task.sample_clock = ''
+            task.sample_rate = 1. / self.gate_period
+        return 0
+
+    def DAQmxCfgInputBuffer(self, task_handle, num_samples):
+        self._call('DAQmxCfgInputBuffer')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        task.num_samples = int(self._value(num_samples))
+        return 0
+
+    def DAQmxSetCICtrTimebaseSrc(self, task_handle, channel, source):
+        self._call('DAQmxSetCICtrTimebaseSrc')
+        return 0
+
+    def DAQmxSetCIPulseWidthTerm(self, task_handle, channel, terminal):
+        self._call('DAQmxSetCIPulseWidthTerm')
+        return 0
+
+    def DAQmxSetCIDupCountPrevent(self, task_handle, channel, enable):
+        self._call('DAQmxSetCIDupCountPrevent')
+        return 0
+
+    def DAQmxStartTask(self, task_handle):
+        self._call('DAQmxStartTask')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        if task.started:
+            return 0
+        if not task.committed:
+            error = self._reserve(task)
+            if error:
+                return error
+        task.started = True
+        # a restarted task acquires from the beginning
+        task.start_time = None
+        task.clock = None
+        task.samples = np.zeros(0)
+        task.num_generated = task.num_read = 0
+        task.count = 0.
+        now = time.time()
+        if task.kind == 'co':
+            task.start_time = now
+            # the clock starts all tasks that wait for an external clock
+            for clocked_task in self.tasks.values():
+                if clocked_task.started and clocked_task.sample_clock and clocked_task.clock is None \
+                        and clocked_task.kind != 'co':
+                    clocked_task.clock = task
+            for clocked_task in self.tasks.values():
+                if clocked_task.clock is task and clocked_task.start_time is None:
+                    self._start_acquisition(clocked_task, now)
+        elif not task.sample_clock:
+            self._start_acquisition(task, now)
+        return 0
+
+    def DAQmxStopTask(self, task_handle):
+        self._call('DAQmxStopTask')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        if task.kind == 'ao':
+            self._finish_ao(task)
+        task.started = False
+        return 0
+
+    def DAQmxClearTask(self, task_handle):
+        self._call('DAQmxClearTask')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        if task.kind == 'ao' and task.started:
+            self._finish_ao(task)
+        del self.tasks[int(self._value(task_handle))]
+        return 0
+
+    def DAQmxTaskControl(self, task_handle, action):
+        self._call('DAQmxTaskControl')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        action = self._value(action)
+        if action == DAQmx_Val_Task_Commit and not task.committed:
+            error = self._reserve(task)
+            if error:
+                return error
+            task.committed = True
+        elif action == DAQmx_Val_Task_Unreserve:
+            task.committed = False
+        return 0
+
+    def DAQmxWaitUntilTaskDone(self, task_handle, timeout):
+        self._call('DAQmxWaitUntilTaskDone')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        timeout = float(self._value(timeout))
+        if task.kind == 'do' or task.sample_clock is None:
+            # on demand tasks are done right away
+            return 0
+        if task.kind == 'co' or task.continuous:
+            return self._fail(DAQmx_Err_WaitTimeout, 'a continuous task is never done')
+        if task.start_time is None:
+            if timeout >= 0:
+                time.sleep(timeout * self.time_scale)
+            return self._fail(DAQmx_Err_WaitTimeout, 'wait until done did not indicate that the task is done, the '
+                                                     'task waits for its sample clock')
+        num_samples = task.waveform.shape[1] if task.kind == 'ao' and task.waveform is not None else task.num_samples
+        if not self._wait(task, num_samples, self._rate(task), timeout):
+            return self._fail(DAQmx_Err_WaitTimeout, 'wait until done did not indicate that the task is done')
+        if task.kind == 'ao':
+            self._finish_ao(task)
+        return 0
+
+    def _read(self, name, task_handle, num_samples_per_channel, timeout, data, array_size, samples_read):
+        """
+        reads the samples of a counter or analog input task into data, see DAQmxReadCounterF64 and DAQmxReadAnalogF64
+        """
+        self._call(name)
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        num_samples = int(self._value(num_samples_per_channel))
+        array_size = int(self._value(array_size))
+        timeout = float(self._value(timeout))
+        num_channels = max(len(task.channels), 1) if task.kind == 'ai' else 1
+
+        if task.sample_clock is None:
+            # on demand task, e.g. reading the analog output voltages
+            task.start_time = time.time()
+            self._acquire(task, max(num_samples, 1))
+        elif task.start_time is None:
+            return self._fail(DAQmx_Err_ReadTimeout, 'wait until done did not indicate that the task is done, the '
+                                                     'task waits for its sample clock')
+        elif task.continuous:
+            elapsed = self._elapsed_samples(task, self._rate(task))
+            if 0 < task.num_samples < elapsed - task.num_read < np.inf:
+                return self._fail(DAQmx_Err_Overflow, 'samples were overwritten before they were read, the buffer of '
+                                                      '{:d} samples is too small'.format(task.num_samples))
+            available = min(elapsed - task.num_generated,
+                            array_size // num_channels if num_samples == -1 else num_samples)
+            if num_samples != -1 and available < num_samples:
+                # wait for the requested samples
+                if not self._wait(task, task.num_generated + num_samples, self._rate(task), timeout):
+                    return self._fail(DAQmx_Err_ReadTimeout, 'timeout expired before the samples were acquired')
+                available = num_samples
+            self._acquire(task, int(available))
+        else:
+            remaining = task.num_samples - task.num_read
+            if num_samples == -1 or num_samples > remaining:
+                num_samples = remaining
+            if not self._wait(task, task.num_read + num_samples, self._rate(task), timeout):
+                return self._fail(DAQmx_Err_ReadTimeout, 'timeout expired before the samples were acquired')
+
+        unread = task.samples.shape[-1]
+        if num_samples == -1 or num_samples > unread:
+            num_samples = unread
+        if num_samples * num_channels > array_size:
+            return self._fail(DAQmx_Err_BufferTooSmall, 'the buffer is too small for {:d} samples'.format(
+                num_samples * num_channels))
+        buffer = self._array(data, num_samples * num_channels)
+        if task.kind == 'ai':
+            # the samples are grouped by channel
+            buffer[:] = task.samples[:, :num_samples].reshape(-1)
+            task.samples = task.samples[:, num_samples:]
+        else:
+            buffer[:] = task.samples[:num_samples]
+            task.samples = task.samples[num_samples:]
+        task.num_read += num_samples
+        self._set(samples_read, num_samples)
+        return 0
+
+    def DAQmxReadCounterF64(self, task_handle, num_samples_per_channel, timeout, data, array_size, samples_read,
+                            reserved):
+        return self._read('DAQmxReadCounterF64', task_handle, num_samples_per_channel, timeout, data, array_size,
+                          samples_read)
+
+    def DAQmxReadAnalogF64(self, task_handle, num_samples_per_channel, timeout, fill_mode, data, array_size,
+                           samples_read, reserved):
+        return self._read('DAQmxReadAnalogF64', task_handle, num_samples_per_channel, timeout, data, array_size,
+                          samples_read)
+
+    def DAQmxWriteAnalogF64(self, task_handle, num_samples_per_channel, auto_start, timeout, data_layout, data,
+                            samples_written, reserved):
+        self._call('DAQmxWriteAnalogF64')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        num_samples = int(self._value(num_samples_per_channel))
+        # the data is grouped by channel
+        task.waveform = self._array(data, num_samples * len(task.channels)).reshape(len(task.channels),
+                                                                                   num_samples).copy()
+        self._set(samples_written, num_samples)
+        if task.sample_clock is None:
+            # on demand output
+            for channel, waveform in zip(task.channels, task.waveform):
+                self.ao_voltages[channel] = float(waveform[-1])
+        elif self._value(auto_start):
+            return self.DAQmxStartTask(task_handle)
+        return 0
+
+    def DAQmxWriteDigitalLines(self, task_handle, num_samples_per_channel, auto_start, timeout, data_layout, data,
+                               samples_written, reserved):
+        self._call('DAQmxWriteDigitalLines')
+        task = self._task(task_handle)
+        if task is None:
+            return self._fail(DAQmx_Err_InvalidTask, 'task specified is invalid or does not exist')
+        num_samples = int(self._value(num_samples_per_channel))
+        values = self._array(data, num_samples * len(task.channels), ctypes.c_uint8)
+        for channel, channel_values in zip(task.channels, values.reshape(len(task.channels), num_samples)):
+            self.digital_lines[channel] = bool(channel_values[-1])
+        self._set(samples_written, num_samples)
+        return 0
+
+
 
 # =============== NI DAQ 6259======= =======================
 # ==========================================================
@@ -95,7 +726,7 @@ class DAQ(Instrument):
             # checks for windows. If not on windows, check for your OS and add
             # the path to the DLL on your machine
             print('NI DAQ instrument is currently configured to only work on Windows. You must add your operating system.')
-            raise WindowsError
+            raise OSError
 
         if dll_path:
             nidaq = ctypes.WinDLL(dll_path)  # load the DLL
@@ -104,7 +735,7 @@ class DAQ(Instrument):
             warnings.warn("NI DAQmx DLL not found. If it should be present, check the path:")
             print(dll_path)
             dll_detected = False
-    except WindowsError:
+    except OSError:
         # make a fake DAQOut instrument
         dll_detected = False
     except:
@@ -112,6 +743,9 @@ class DAQ(Instrument):
 
     tasklist = {}
     tasknum = 0
+    # guards the tasklist (shared by all daqs) and the task pools, tasks can be set up in a worker thread while
+    # another thread runs and stops tasks (e.g. the pipelined pulsed experiments)
+    _tasklist_lock = threading.RLock()
 
     # currently includes four analog outputs, five analog inputs, and one digital counter input. Add
     # more as needed and your device allows
@@ -239,8 +873,19 @@ class DAQ(Instrument):
                   )
     ])
 
-    def __init__(self, name=None, settings=None):
-        if self.dll_detected:
+    def __init__(self, name=None, settings=None, nidaq=None):
+        """
+        Args:
+            name (optional): name of the instrument
+            settings (optional): settings of the instrument
+            nidaq (optional): DAQmx library to use instead of the dll, e.g. a SimulatedDAQmx to run without hardware
+        """
+        # pooled tasks by configuration, see setup_counter(..., pooled=True)
+        self._task_pool = {}
+        if nidaq is not None:
+            self.nidaq = nidaq
+            super(DAQ, self).__init__(name, settings)
+        elif self.dll_detected:
             # buf_size = 10
             # data = ctypes.create_string_buffer('\000' * buf_size)
             # try:
@@ -263,21 +908,128 @@ class DAQ(Instrument):
             settings: a settings dictionary in the standard form
         """
         super(DAQ, self).update(settings)
+        # the pooled tasks have been configured with the old settings (attributes that are not settings raise above)
+        self.clear_task_pool()
         for key, value in settings.items():
             if key == 'device':
                 if not (self.is_connected):
                     raise EnvironmentError('Device invalid, cannot connect to DAQ')
 
     def _add_to_tasklist(self, name, task):
-        matching = [x for x in self.tasklist if name in x]
-        if not matching:
-            task_name = name + '000'
-        else:
-            last_task = sorted(matching)[-1]
-            task_name = name + '{0:03d}'.format(int(last_task[-3:])+1)
-        self.tasklist.update({task_name: task})
+        with self._tasklist_lock:
+            matching = [x for x in self.tasklist if name in x]
+            if not matching:
+                task_name = name + '000'
+            else:
+                last_task = sorted(matching)[-1]
+                task_name = name + '{0:03d}'.format(int(last_task[-3:])+1)
+            self.tasklist.update({task_name: task})
         return task_name
 
+    def _pool_key(self, kind, channels, settings_group, *args):
+        """
+        Returns: key of a pooled task, the configuration of the task: its kind, the device, the channels and their
+            settings and any further arguments (e.g. number of samples, clock source)
+        """
+        channel_settings = tuple(tuple(sorted(self.settings[settings_group][channel].items())) for channel in channels)
+        return (kind, self.settings['device'], self.settings.get('module', ''), tuple(channels), channel_settings) + args
+
+    @staticmethod
+    def _task_handles(task):
+        # the counter task before its clock task
+        return [task[key] for key in ['task_handle_ctr', 'task_handle'] if key in task]
+
+    def _pool_entry(self, task):
+        # the pool entry of a task, None if the task is not (or no longer) pooled
+        for entry in self._task_pool.get(task.get('pool_key'), []):
+            if entry['task'] is task:
+                return entry
+        return None
+
+    def _unreserve_pooled(self, resources):
+        """
+        unreserves the pooled tasks that use any of the resources and are not running, so that another task can use
+        them (this includes tasks that have been set up for later and are committed again when they are started)
+
+        Args:
+            resources: physical channels (e.g. ['ao0', 'ctr1'])
+        """
+        with self._tasklist_lock:
+            for entries in self._task_pool.values():
+                for entry in entries:
+                    if entry['reserved'] and not entry['running'] and entry['resources'] & set(resources):
+                        for handle in self._task_handles(entry['task']):
+                            self._check_error(self.nidaq.DAQmxTaskControl(handle, DAQmx_Val_Task_Unreserve))
+                        entry['reserved'] = False
+
+    def _reserve_resources(self, task):
+        """
+        makes the resources of a task available right before it is started: unreserves the pooled tasks that share
+        them and are not running and commits the task again if it is pooled and has been unreserved. This is done when
+        the task is started and not when it is set up, since the next task can be set up while the previous one is
+        still running (e.g. the pipelined pulsed experiments). Has to be called with the _tasklist_lock held until the
+        task is started.
+
+        Args:
+            task: the task, its resources are recorded when it is set up
+        """
+        self._unreserve_pooled(task.get('resources', []))
+        entry = self._pool_entry(task)
+        if entry is not None:
+            if not entry['reserved']:
+                for handle in self._task_handles(task):
+                    self._check_error(self.nidaq.DAQmxTaskControl(handle, DAQmx_Val_Task_Commit))
+                entry['reserved'] = True
+            entry['running'] = True
+
+    def _take_from_pool(self, name, key):
+        """
+        Args:
+            name: name of the task in the tasklist (e.g. 'ctr')
+            key: key of the task, see _pool_key
+
+        Returns: name of the pooled task in the tasklist, None if there is no idle task with this configuration
+
+        """
+        with self._tasklist_lock:
+            idle = [entry for entry in self._task_pool.get(key, []) if not entry['in_use']]
+            if not idle:
+                return None
+            # a task that is still committed saves committing it again
+            entry = max(idle, key=lambda entry: entry['reserved'])
+            entry['in_use'] = True
+            return self._add_to_tasklist(name, entry['task'])
+
+    def _add_to_pool(self, key, task, resources):
+        """
+        adds a new task to the pool, it is committed when it is started (see _reserve_resources) and stop then keeps it
+        committed for the next task with the same key. There can be several tasks with the same key, e.g. when the next
+        task is set up while the previous one is still in use.
+
+        Args:
+            key: key of the task, see _pool_key
+            task: the task
+            resources: physical channels of the task
+
+        """
+        task['pool_key'] = key
+        with self._tasklist_lock:
+            self._task_pool.setdefault(key, []).append({'task': task, 'resources': set(resources), 'in_use': True,
+                                                        'reserved': False, 'running': False})
+
+    def clear_task_pool(self):
+        """
+        clears the idle pooled tasks, pooled tasks that are in use are cleared when they are stopped
+        """
+        with self._tasklist_lock:
+            for entries in self._task_pool.values():
+                for entry in entries:
+                    if not entry['in_use']:
+                        for handle in self._task_handles(entry['task']):
+                            self.nidaq.DAQmxClearTask(handle)
+            # cleared in place, setting an attribute of an instrument calls update
+            self._task_pool.clear()
+
     @property
     def _PROBES(self):
         return None
@@ -300,7 +1052,7 @@ class DAQ(Instrument):
         except RuntimeError:
             return False
 
-    def setup_counter(self, channel, sample_num, continuous_acquisition=False):
+    def setup_counter(self, channel, sample_num, continuous_acquisition=False, pooled=False):
         """
         Initializes a hardware-timed digital counter, bound to a hardware clock
         Args:
@@ -310,12 +1062,24 @@ class DAQ(Instrument):
             continuous_acquisition: run in continuous acquisition mode (ex for a continuous counter) or
                                     finite acquisition mode (ex for a scan, where the number of samples needed
                                     is known a priori)
+            pooled: keep the tasks configured when they are stopped and reuse them for the next counter with the
+                same configuration, which saves creating and clearing them for every acquisition (see clear_task_pool)
 
         Returns: source of clock that this method sets up, which can be given to another function to synch that
         input or output to the same clock
 
         """
 
+        if pooled:
+            key = self._pool_key('ctr', [channel], 'digital_input', sample_num, continuous_acquisition)
+            task_name = self._take_from_pool('ctr', key)
+            if task_name is not None:
+                # arm the counter, it waits for the clock
+                with self._tasklist_lock:
+                    self._reserve_resources(self.tasklist[task_name])
+                    self._check_error(self.nidaq.DAQmxStartTask(self.tasklist[task_name]['task_handle_ctr']))
+                return task_name
+
         # Note that for this counter, we have two tasks. The normal 'task_handle' corresponds to the clock, and this
         # is the task which is started when run is called. The second 'task_handle_ctr' corresponds to the counter,
         # and this waits for the clock and will be started simultaneously.
@@ -350,6 +1114,7 @@ class DAQ(Instrument):
         counter_out_str = (self.settings['device'] + '/ctr' + str(channel_settings['clock_counter_channel'])).encode('utf-8')
         task['task_handle_ctr'] = TaskHandle(0)
         task['task_handle'] = TaskHandle(1)
+        task['resources'] = [channel, 'ctr' + str(channel_settings['clock_counter_channel'])]
 
         # set up clock
         self._dig_pulse_train_cont(task, .5, counter_out_str)
@@ -372,7 +1137,11 @@ class DAQ(Instrument):
         #     self._check_error(self.nidaq.DAQmxCfgInputBuffer(self.DI_taskHandleCtr, uInt64(self.settings['override_buffer_size'])))
         # self._check_error(self.nidaq.DAQmxCfgInputBuffer(self.DI_taskHandleCtr, uInt64(sampleNum)))
 
-        self._check_error(self.nidaq.DAQmxStartTask(task['task_handle_ctr']))
+        if pooled:
+            self._add_to_pool(key, task, task['resources'])
+        with self._tasklist_lock:
+            self._reserve_resources(task)
+            self._check_error(self.nidaq.DAQmxStartTask(task['task_handle_ctr']))
 
         return task_name
 
@@ -408,6 +1177,7 @@ class DAQ(Instrument):
 
         task['task_handle'] = TaskHandle(0)
         channel_settings = self.settings['digital_input'][channel]
+        task['resources'] = ['ctr' + str(channel_settings['clock_counter_channel'])]
         counter_out_str = (self.settings['device'] + '/ctr' + str(channel_settings['clock_counter_channel'])).encode('utf-8')
         task['sample_num'] = sample_num
         task['sample_rate'] = float(channel_settings['sample_rate'])
@@ -416,13 +1186,15 @@ class DAQ(Instrument):
 
         return task_name
 
-    def setup_gated_counter(self, channel, num_samples):
+    def setup_gated_counter(self, channel, num_samples, pooled=False):
         """
         Initializes a gated digital input task. The gate acts as a clock for the counter, so if one has a fast ttl source
         this allows one to read the counter for a shorter time than would be allowed by the daq's internal clock.
         Args:
             channel: channel to use for counter input
             num_samples: number of samples to read on counter
+            pooled: keep the task configured when it is stopped and reuse it for the next gated counter with the same
+                configuration (see setup_counter)
         """
         if 'digital_input' not in list(self.settings.keys()):
             raise ValueError('This DAQ does not support digital input')
@@ -430,6 +1202,12 @@ class DAQ(Instrument):
             raise KeyError('This is not a valid digital input channel')
         channel_settings = self.settings['digital_input'][channel]
 
+        if pooled:
+            key = self._pool_key('gatedctr', [channel], 'digital_input', num_samples)
+            task_name = self._take_from_pool('gatedctr', key)
+            if task_name is not None:
+                return task_name
+
         task = {
             'task_handle': None,
             'sample_num': None,
@@ -451,6 +1229,7 @@ class DAQ(Instrument):
         task['num_samples_per_channel'] = num_samples
 
         task['task_handle'] = TaskHandle(0)
+        task['resources'] = [channel]
 
         self._check_error(self.nidaq.DAQmxCreateTask("", ctypes.byref(task['task_handle'])))
 
@@ -485,16 +1264,24 @@ class DAQ(Instrument):
         self._check_error(
             self.nidaq.DAQmxSetCIDupCountPrevent(task['task_handle'], input_channel_str_gated, bool32(True)))
 
+        if pooled:
+            self._add_to_pool(key, task, [channel])
         return task_name
 
     # read sampleNum previously generated values from a buffer, and return the
     # corresponding 1D array of ctypes.c_double values
-    def read_counter(self, task_name):
+    def read_counter(self, task_name, as_array=False, out=None):
         """
         read sampleNum previously generated values from a buffer, and return the
         corresponding 1D array of ctypes.c_double values
-        Returns: 1d array of ctypes.c_double values with the requested counts. Counts as given by the daq are a running
-            total, that is if you get 5 counts/s, the returned array will be [5,10,15,20...]
+        Args:
+            task_name: name of the counter task
+            as_array: if True, return a numpy view of the buffer (no copy) instead of the ctypes array
+            out: optional preallocated, contiguous numpy array of dtype float64 with at least sample_num elements, the
+                counts are read directly into this array, which is then returned (implies as_array)
+        Returns: 1d array of ctypes.c_double values (or a numpy array if as_array or out is given) with the requested
+            counts. Counts as given by the daq are a running total, that is if you get 5 counts/s, the returned array
+            will be [5,10,15,20...]
 
         """
         task = self.tasklist[task_name]
@@ -508,19 +1295,29 @@ class DAQ(Instrument):
             task_handle_ctr = task['task_handle']
 
         # initialize array and integer to pass as pointers
-        data = (float64 * task['sample_num'])()
+        if out is not None:
+            if out.dtype != np.float64 or not out.flags['C_CONTIGUOUS'] or out.size < task['sample_num']:
+                raise ValueError('out has to be a contiguous float64 array with at least {:d} elements'.format(
+                    task['sample_num']))
+            data = out.ctypes.data_as(ctypes.POINTER(float64))
+        else:
+            data = (float64 * task['sample_num'])()
         samplesPerChanRead = int32()
 
         self._check_error(self.nidaq.DAQmxReadCounterF64(task_handle_ctr,
                                                          int32(task['num_samples_per_channel']), float64(-1),
-                                                         ctypes.byref(data),
+                                                         data if out is not None else ctypes.byref(data),
                                                          uInt32(task['sample_num']),
                                                          ctypes.byref(samplesPerChanRead),
                                                          None))
 
+        if out is not None:
+            return out, samplesPerChanRead
+        elif as_array:
+            return np.frombuffer(data, dtype=np.float64), samplesPerChanRead
         return data, samplesPerChanRead
 
-    def setup_AO(self, channels, waveform, clk_source=""):
+    def setup_AO(self, channels, waveform, clk_source="", pooled=False):
         """
         Initializes a arbitrary number of analog output channels to output an arbitrary waveform
         Args:
@@ -530,6 +1327,8 @@ class DAQ(Instrument):
                 the column in the order given in channels
             clk_source: the PFI channel of the hardware clock to lock the output to, or "" to use the default
                 internal clock
+            pooled: keep the task configured when it is stopped and reuse it for the next waveform with the same
+                channels, number of samples and clock (see setup_counter), only the waveform is written again
         """
         if 'analog_output' not in list(self.settings.keys()):
             raise ValueError('This DAQ does not support analog output')
@@ -537,6 +1336,14 @@ class DAQ(Instrument):
             if not c in list(self.settings['analog_output'].keys()):
                 raise KeyError('This is not a valid analog output channel')
 
+        if pooled:
+            clk_terminal = self.tasklist[clk_source]['counter_out_PFI_str'] if clk_source != "" else ""
+            key = self._pool_key('ao', channels, 'analog_output', numpy.shape(waveform)[-1], clk_terminal)
+            task_name = self._take_from_pool('ao', key)
+            if task_name is not None:
+                self._write_AO(self.tasklist[task_name], numpy.ascontiguousarray(waveform, dtype=numpy.float64))
+                return task_name
+
         task = {
             'task_handle': None,
             'sample_num': None,
@@ -566,21 +1373,13 @@ class DAQ(Instrument):
             task['sample_num'] = len(waveform)
             numChannels = 1
         task['task_handle'] = TaskHandle(0)
-        # special case 1D waveform since length(waveform[0]) is undefined
-        # converts python array to ctypes array
-        if len(numpy.shape(waveform)) == 2:
-            data = numpy.zeros((numChannels, task['sample_num']), dtype=numpy.float64)
-            for i in range(numChannels):
-                for j in range(task['sample_num']):
-                    data[i, j] = waveform[i, j]
-        else:
-            data = numpy.zeros((task['sample_num']), dtype=numpy.float64)
-            for i in range(task['sample_num']):
-                data[i] = waveform[i]
+        # converts python array to a contiguous array (numChannels, sample_num), which is written to the task
+        data = numpy.array(waveform, dtype=numpy.float64).reshape(numChannels, task['sample_num'])
 
         if not (clk_source == ""):
             clk_source = self.tasklist[clk_source]['counter_out_PFI_str']
 
+        task['resources'] = channels
         self._check_error(self.nidaq.DAQmxCreateTask("",
                                                      ctypes.byref(task['task_handle'])))
         self._check_error(self.nidaq.DAQmxCreateAOVoltageChan(task['task_handle'],
@@ -596,6 +1395,19 @@ class DAQ(Instrument):
                                                            DAQmx_Val_Rising,
                                                            DAQmx_Val_FiniteSamps,
                                                            uInt64(task['sample_num'])))
+        self._write_AO(task, data)
+        if pooled:
+            self._add_to_pool(key, task, channels)
+
+        return task_name
+
+    def _write_AO(self, task, data):
+        """
+        writes the waveform of an analog output task
+        Args:
+            task: the task
+            data: contiguous float64 array with the waveform, see setup_AO
+        """
         self._check_error(self.nidaq.DAQmxWriteAnalogF64(task['task_handle'],
                                                          int32(task['sample_num']),
                                                          0,
@@ -605,8 +1417,6 @@ class DAQ(Instrument):
                                                          None,
                                                          None))
 
-        return task_name
-
     def setup_AI(self, channel, num_samples_to_acquire, continuous = False, clk_source=""):
         """
         Initializes an input channel to read on
@@ -738,6 +1548,36 @@ class DAQ(Instrument):
         return data, samples_per_channel_read
 
 
+    def read_samples(self, task_name, out, timeout=-1.):
+        """
+        Blocking read of a fixed number of samples of a continuous counter or analog input task, e.g. to stream its
+        data (see DAQStream)
+        Args:
+            task_name: name of the counter or analog input task
+            out: contiguous numpy array of dtype float64, out.size samples are read into it
+            timeout: time in s to wait for the samples, -1 to wait indefinitely
+
+        Returns: number of samples that have been read
+
+        """
+        if out.dtype != np.float64 or not out.flags['C_CONTIGUOUS']:
+            raise ValueError('out has to be a contiguous float64 array')
+        task = self.tasklist[task_name]
+        data = out.ctypes.data_as(ctypes.POINTER(float64))
+        samples_per_channel_read = int32()
+        if 'ctr' in task_name:
+            self._check_error(self.nidaq.DAQmxReadCounterF64(task.get('task_handle_ctr', task['task_handle']),
+                                                             int32(out.size), float64(timeout), data,
+                                                             uInt32(out.size), ctypes.byref(samples_per_channel_read),
+                                                             None))
+        elif 'ai' in task_name:
+            self._check_error(self.nidaq.DAQmxReadAnalogF64(task['task_handle'], int32(out.size), float64(timeout),
+                                                            DAQmx_Val_GroupByChannel, data, uInt32(out.size),
+                                                            ctypes.byref(samples_per_channel_read), None))
+        else:
+            raise ValueError('This task does not allow reads.')
+        return samples_per_channel_read.value
+
     # run the task specified by task_name
     # todo: AK - should this be threaded? original todo: is this actually blocking? Is the threading actually doing anything? see nidaq cookbook
     def run(self, task_name):
@@ -749,15 +1589,18 @@ class DAQ(Instrument):
             task_name: string identifying task
 
         """
-        #run list of tasks
-        if type(task_name) == list:
-            for name in task_name:
-                task = self.tasklist[name]
+        with self._tasklist_lock:
+            #run list of tasks
+            if type(task_name) == list:
+                for name in task_name:
+                    task = self.tasklist[name]
+                    self._reserve_resources(task)
+                    self._check_error(self.nidaq.DAQmxStartTask(task['task_handle']))
+            #run single task
+            else:
+                task = self.tasklist[task_name]
+                self._reserve_resources(task)
                 self._check_error(self.nidaq.DAQmxStartTask(task['task_handle']))
-        #run single task
-        else:
-            task = self.tasklist[task_name]
-            self._check_error(self.nidaq.DAQmxStartTask(task['task_handle']))
 
     def waitToFinish(self, task_name):
         """
@@ -771,9 +1614,18 @@ class DAQ(Instrument):
         self._check_error(self.nidaq.DAQmxWaitUntilTaskDone(task['task_handle'],
                                                             float64(task['sample_num'] / task['sample_rate'] * 4 + 1)))
 
-    def read(self, task_name):
+    def read(self, task_name, as_array=False, out=None):
+        """
+        Reads the data of a counter or analog input task
+
+        Args:
+            task_name: string identifying task
+            as_array: counter tasks only, return a numpy view of the data, see read_counter
+            out: counter tasks only, preallocated numpy array the data is read into, see read_counter
+
+        """
         if 'ctr' in task_name:
-            return(self.read_counter(task_name))
+            return(self.read_counter(task_name, as_array=as_array, out=out))
         elif 'ai' in task_name:
             return(self.read_AI(task_name))
         else:
@@ -786,8 +1638,17 @@ class DAQ(Instrument):
             raise ValueError('This task does not allow writes.')
 
     def stop(self, task_name):
-        #remove task to be cleared from tasklist
-        task = self.tasklist.pop(task_name)
+        with self._tasklist_lock:
+            #remove task to be cleared from tasklist
+            task = self.tasklist.pop(task_name)
+
+            # pooled tasks are only stopped, they stay committed for the next task with the same configuration
+            entry = self._pool_entry(task)
+            if entry is not None:
+                for handle in self._task_handles(task):
+                    self.nidaq.DAQmxStopTask(handle)
+                entry['in_use'] = entry['running'] = False
+                return
 
         #special case counters, which create two tasks that need to be cleared
         if 'task_handle_ctr' in list(task.keys()):
@@ -914,15 +1775,15 @@ class DAQ(Instrument):
             print('nidaq generated warning %d: %s' % (err, repr(buffer.value)))
 
 
-    @classmethod
-    def get_connected_devices(cls):
+    def get_connected_devices(self):
         """
-        Checks which devices are present in the system
+        Checks which devices are present in the system, as seen by the DAQmx library of this instrument (the dll or
+        e.g. a SimulatedDAQmx)
         Returns: A list of device names, as recognized by NI commands, that are currently connected
 
         """
         device_list = ctypes.create_string_buffer(1000)
-        cls.nidaq.DAQmxGetSysDevNames(device_list, 1000)
+        self.nidaq.DAQmxGetSysDevNames(device_list, 1000)
         device_list = device_list.value.decode('ascii').split(', ')
         # print(device_list)
         # product_type = ctypes.create_string_buffer(100)
@@ -932,6 +1793,136 @@ class DAQ(Instrument):
         return device_list
 
 
+class DAQStream(object):
+    """
+    Continuous acquisition of a counter and/or analog inputs into a RingBuffer (self.buffer). A reader thread does
+    blocking reads of the daq (see DAQ.read_samples) and writes every sample into the buffer, the columns of the buffer
+    are given by self.columns: 'counts' with the counts of the counter during each sample interval (the counter itself
+    returns the running total) followed by the voltages of the analog inputs, which are sampled on the clock of the
+    counter. Consumers subscribe to the buffer, at full rate (e.g. to save the data) or decimated (e.g. to plot it).
+
+    If the reads do not keep up and the buffer of the daq overflows, the tasks are restarted and the overflow is counted
+    in num_overflows, the samples in between are lost. Other errors stop the stream and are kept in self.error.
+
+    """
+
+    def __init__(self, daq, counter_channel=None, ai_channels=(), sample_rate=None, buffer_time=60., read_time=0.1):
+        """
+        Args:
+            daq: the DAQ
+            counter_channel (optional): channel of the counter (e.g. 'ctr0'), if None only the analog inputs are
+                acquired on their internal clock
+            ai_channels: analog input channels (e.g. ['ai2'])
+            sample_rate (optional): sample rate in Hz, if None the sample rate of the settings of the daq
+            buffer_time: time in s that the ring buffer holds
+            read_time: time in s of the data of every read of the daq
+        """
+        if counter_channel is None and not ai_channels:
+            raise ValueError('a stream needs a counter or analog input channel')
+        self.daq = daq
+        self.counter_channel = counter_channel
+        self.ai_channels = list(ai_channels)
+        if counter_channel is not None:
+            channel_settings = daq.settings['digital_input'][counter_channel]
+        else:
+            channel_settings = daq.settings['analog_input'][self.ai_channels[0]]
+        if sample_rate is not None:
+            channel_settings['sample_rate'] = float(sample_rate)
+            for channel in self.ai_channels:
+                daq.settings['analog_input'][channel]['sample_rate'] = float(sample_rate)
+        self.sample_rate = float(channel_settings['sample_rate'])
+
+        self.columns = (['counts'] if counter_channel is not None else []) + self.ai_channels
+        self.read_size = max(int(round(read_time * self.sample_rate)), 1)
+        self.buffer = RingBuffer(max(int(buffer_time * self.sample_rate), self.read_size), len(self.columns))
+        self.num_overflows = 0
+        self.error = None
+
+        self._tasks = []
+        self._last_count = None
+        self._stop = False
+        self._thread = None
+
+    def subscribe(self, decimation=1):
+        """
+        Args:
+            decimation: number of samples that are averaged into one sample of the subscriber
+
+        Returns: a RingBufferSubscriber that reads the samples acquired after the call
+
+        """
+        return self.buffer.subscribe(decimation)
+
+    def start(self):
+        """
+        starts the tasks and the reader thread
+        """
+        self._stop = False
+        self._start_tasks()
+        self._thread = threading.Thread(target=self._run, name='daq_stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        stops the reader thread and the tasks
+        """
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop_tasks()
+        self.buffer.close()
+
+    def _start_tasks(self):
+        # the daq buffers several reads, so that a late read does not overflow right away
+        daq_buffer_size = 10 * self.read_size
+        counter_task = ''
+        if self.counter_channel is not None:
+            counter_task = self.daq.setup_counter(self.counter_channel, daq_buffer_size, continuous_acquisition=True)
+        ai_tasks = [self.daq.setup_AI(channel, daq_buffer_size, continuous=True, clk_source=counter_task)
+                    for channel in self.ai_channels]
+        # the analog inputs have to wait for the clock of the counter before it starts
+        for task in ai_tasks:
+            self.daq.run(task)
+        if counter_task:
+            self.daq.run(counter_task)
+        self._tasks = ([counter_task] if counter_task else []) + ai_tasks
+        self._last_count = None
+
+    def _stop_tasks(self):
+        for task in reversed(self._tasks):
+            self.daq.stop(task)
+        self._tasks = []
+
+    def _run(self):
+        chunk = np.zeros((len(self.columns), self.read_size))
+        timeout = 2 * self.read_size / self.sample_rate + 1
+        while not self._stop:
+            try:
+                for row, task in zip(chunk, self._tasks):
+                    self.daq.read_samples(task, row, timeout)
+            except RuntimeError as error:
+                if 'error {:d}'.format(DAQmx_Err_Overflow) not in str(error):
+                    self.error = str(error)
+                    break
+                self.num_overflows += 1
+                self._stop_tasks()
+                self._start_tasks()
+                continue
+
+            samples = chunk.T.copy()
+            if self.counter_channel is not None:
+                if self._last_count is None:
+                    # the first sample counts from the start of the task to the first clock tick, it is dropped
+                    samples[1:, 0] = np.diff(chunk[0])
+                    samples = samples[1:]
+                else:
+                    samples[:, 0] = np.diff(chunk[0], prepend=self._last_count)
+                self._last_count = chunk[0, -1]
+            self.buffer.write(samples)
+        self.buffer.close()
+
+
 class NI6259(DAQ):
     """
     This class implements the NI6259 DAQ, which includes 32 AI, 4 AO, and 24 DI/DO channels and inherits basic
@@ -1154,7 +2145,7 @@ class NI9402(DAQ):
                   ),
     ])
 
-    def setup_counter(self, channel, sample_num, continuous_acquisition=False):
+    def setup_counter(self, channel, sample_num, continuous_acquisition=False, pooled=False):
         """
         Initializes a hardware-timed digital counter, bound to a hardware clock
         Args:
@@ -1164,12 +2155,24 @@ class NI9402(DAQ):
             continuous_acquisition: run in continuous acquisition mode (ex for a continuous counter) or
                                     finite acquisition mode (ex for a scan, where the number of samples needed
                                     is known a priori)
+            pooled: keep the tasks configured when they are stopped and reuse them for the next counter with the
+                same configuration, which saves creating and clearing them for every acquisition (see clear_task_pool)
 
         Returns: source of clock that this method sets up, which can be given to another function to synch that
         input or output to the same clock
 
         """
 
+        if pooled:
+            key = self._pool_key('ctr', [channel], 'digital_input', sample_num, continuous_acquisition)
+            task_name = self._take_from_pool('ctr', key)
+            if task_name is not None:
+                # arm the counter, it waits for the clock
+                with self._tasklist_lock:
+                    self._reserve_resources(self.tasklist[task_name])
+                    self._check_error(self.nidaq.DAQmxStartTask(self.tasklist[task_name]['task_handle_ctr']))
+                return task_name
+
         # Note that for this counter, we have two tasks. The normal 'task_handle' corresponds to the clock, and this
         # is the task which is started when run is called. The second 'task_handle_ctr' corresponds to the counter,
         # and this waits for the clock and will be started simultaneously.
@@ -1204,6 +2207,7 @@ class NI9402(DAQ):
         counter_out_str = (self.settings['device'] + self.settings['module'] + '/ctr' + str(channel_settings['clock_counter_channel'])).encode('ascii')
         task['task_handle_ctr'] = TaskHandle(0)
         task['task_handle'] = TaskHandle(1)
+        task['resources'] = [channel, 'ctr' + str(channel_settings['clock_counter_channel'])]
 
         # set up clock
         self._dig_pulse_train_cont(task, .5, counter_out_str)
@@ -1225,18 +2229,24 @@ class NI9402(DAQ):
         #     self._check_error(self.nidaq.DAQmxCfgInputBuffer(self.DI_taskHandleCtr, uInt64(self.settings['override_buffer_size'])))
         # self._check_error(self.nidaq.DAQmxCfgInputBuffer(self.DI_taskHandleCtr, uInt64(sampleNum)))
 
-        self._check_error(self.nidaq.DAQmxStartTask(task['task_handle_ctr']))
+        if pooled:
+            self._add_to_pool(key, task, task['resources'])
+        with self._tasklist_lock:
+            self._reserve_resources(task)
+            self._check_error(self.nidaq.DAQmxStartTask(task['task_handle_ctr']))
 
 
         return task_name
 
-    def setup_gated_counter(self, channel, num_samples):
+    def setup_gated_counter(self, channel, num_samples, pooled=False):
         """
         Initializes a gated digital input task. The gate acts as a clock for the counter, so if one has a fast ttl source
         this allows one to read the counter for a shorter time than would be allowed by the daq's internal clock.
         Args:
             channel: channel to use for counter input
             num_samples: number of samples to read on counter
+            pooled: keep the task configured when it is stopped and reuse it for the next gated counter with the same
+                configuration (see setup_counter)
         """
         if 'digital_input' not in list(self.settings.keys()):
             raise ValueError('This DAQ does not support digital input')
@@ -1244,6 +2254,12 @@ class NI9402(DAQ):
             raise KeyError('This is not a valid digital input channel')
         channel_settings = self.settings['digital_input'][channel]
 
+        if pooled:
+            key = self._pool_key('gatedctr', [channel], 'digital_input', num_samples)
+            task_name = self._take_from_pool('gatedctr', key)
+            if task_name is not None:
+                return task_name
+
         task = {
             'task_handle': None,
             'sample_num': None,
@@ -1267,6 +2283,7 @@ class NI9402(DAQ):
         task['num_samples_per_channel'] = num_samples
 
         task['task_handle'] = TaskHandle(0)
+        task['resources'] = [channel]
 
         self._check_error(self.nidaq.DAQmxCreateTask("", ctypes.byref(task['task_handle'])))
 
@@ -1303,6 +2320,8 @@ class NI9402(DAQ):
         self._check_error(
             self.nidaq.DAQmxSetCIDupCountPrevent(task['task_handle'], input_channel_str_gated, bool32(True)))
 
+        if pooled:
+            self._add_to_pool(key, task, [channel])
         return task_name
 
 class NI9219(DAQ):
@@ -1389,7 +2408,7 @@ if __name__ == '__main__':
 if __name__ == '__main__':
     # pass
     # daq, failed = Instrument.load_and_append({'daq': NI9263, 'daq_in': NI6259})
-    NI9402.get_connected_devices()
+    NI9402().get_connected_devices()
     # print('FAILED', failed)
     # print(daq['daq'].settings)
     #
@@ -17,9 +17,9 @@
 """
 
 from pylabcontrol.core import Instrument, Parameter
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import numpy as np
-import itertools, ctypes, datetime, time, warnings
+import itertools, ctypes, datetime, time, warnings, hashlib, heapq
 from pylabcontrol.core.read_write_functions import get_config_value
 import os
 
@@ -101,6 +101,27 @@ class Pulse(object):
         self._end_time = end_time
         self._duration = end_time - self.start_time
 
+    @classmethod
+    def from_arrays(cls, channel_ids, start_times, durations):
+        """
+        creates many pulses at once, without the checks of the constructor, i.e. all durations have to be positive
+
+        Args:
+            channel_ids: list with the channel name of each pulse
+            start_times: list with the start time of each pulse in ns
+            durations: list with the duration of each pulse in ns
+
+        Returns: list of Pulse objects
+
+        """
+        pulses = []
+        for channel_id, start_time, duration in zip(channel_ids, start_times, durations):
+            pulse = cls.__new__(cls)
+            pulse.__dict__.update({'channel_id': channel_id, 'start_time': start_time, '_duration': duration,
+                                   '_end_time': start_time + duration})
+            pulses.append(pulse)
+        return pulses
+
     @staticmethod
     def is_overlapping(pulse1, pulse2, dead_time = 0):
         """
@@ -125,6 +146,464 @@ class Pulse(object):
         return is_overlapping
 
 
+class QuantizedPulse(object):
+    """
+    immutable pulse that stores its start time and duration as integer clock ticks of the pulseblaster
+
+    A QuantizedPulse provides the same read-only interface as Pulse (channel_id, start_time, duration, end_time in ns)
+    so that it can be used wherever a list of Pulse objects is expected (e.g. create_physical_pulse_seq, plot_pulses).
+    Since it uses __slots__ and is immutable it needs considerably less memory than a Pulse and can be compared,
+    hashed and used as a key of a dictionary or in a set.
+
+    """
+    __slots__ = ('channel_id', 'start_tick', 'duration_ticks', 'clock_period', 'amplitude')
+
+    def __init__(self, channel_id, start_tick, duration_ticks, clock_period=2.5, amplitude=None):
+        """
+        Args:
+            channel_id: name of the channel, e.g. 'laser'
+            start_tick: start time of the pulse in clock ticks
+            duration_ticks: duration of the pulse in clock ticks
+            clock_period: duration of a clock tick in ns
+            amplitude: optional amplitude of the pulse in V
+        """
+        start_tick, duration_ticks = int(start_tick), int(duration_ticks)
+        assert duration_ticks > 0, 'pulse duration has to be of finite duration but is {:d} ticks'.format(duration_ticks)
+
+        setattr_ = object.__setattr__
+        setattr_(self, 'channel_id', channel_id)
+        setattr_(self, 'start_tick', start_tick)
+        setattr_(self, 'duration_ticks', duration_ticks)
+        setattr_(self, 'clock_period', float(clock_period))
+        setattr_(self, 'amplitude', amplitude)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('QuantizedPulse is immutable, use to_pulse() to get a mutable Pulse')
+
+    def __delattr__(self, name):
+        raise AttributeError('QuantizedPulse is immutable, use to_pulse() to get a mutable Pulse')
+
+    def __eq__(self, other):
+        if not isinstance(other, QuantizedPulse):
+            return NotImplemented
+        return (self.start_tick == other.start_tick and
+                self.duration_ticks == other.duration_ticks and self.channel_id == other.channel_id and
+                self.clock_period == other.clock_period and self.amplitude == other.amplitude)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash((self.channel_id, self.start_tick, self.duration_ticks, self.clock_period))
+
+    def __reduce__(self):
+        return (QuantizedPulse, (self.channel_id, self.start_tick, self.duration_ticks, self.clock_period,
+                                 self.amplitude))
+
+    def __str__(self):
+        return self.to_pulse().__str__()
+
+    def __repr__(self):
+        return 'QuantizedPulse(id = {:s}, start = {:d}, duration = {:d} ticks of {:0.1f}ns)'.format(
+            self.channel_id, self.start_tick, self.duration_ticks, self.clock_period)
+
+    @property
+    def end_tick(self):
+        return self.start_tick + self.duration_ticks
+
+    @property
+    def start_time(self):
+        return self.start_tick * self.clock_period
+
+    @property
+    def duration(self):
+        return self.duration_ticks * self.clock_period
+
+    @property
+    def end_time(self):
+        return self.end_tick * self.clock_period
+
+    @classmethod
+    def from_pulse(cls, pulse, clock_period=2.5):
+        """
+        Args:
+            pulse: Pulse object, start time and duration are rounded to the nearest clock tick
+            clock_period: duration of a clock tick in ns
+
+        Returns: the QuantizedPulse corresponding to pulse
+
+        """
+        return cls(pulse.channel_id, np.round(pulse.start_time / clock_period), np.round(pulse.duration / clock_period),
+                   clock_period, getattr(pulse, 'amplitude', None))
+
+    @classmethod
+    def from_arrays(cls, channel_ids, start_times, durations, clock_period=2.5):
+        """
+        creates many pulses at once, the times are quantized in a single vectorized operation
+
+        Args:
+            channel_ids: array or list with the channel name of each pulse
+            start_times: array with the start time of each pulse in ns
+            durations: array with the duration of each pulse in ns
+            clock_period: duration of a clock tick in ns
+
+        Returns: list of QuantizedPulse objects
+
+        """
+        start_ticks = np.round(np.asarray(start_times, dtype=float) / clock_period).astype(np.int64)
+        duration_ticks = np.round(np.asarray(durations, dtype=float) / clock_period).astype(np.int64)
+        assert len(channel_ids) == len(start_ticks) == len(duration_ticks), \
+            'channel_ids, start_times and durations need to have the same length'
+        assert np.all(duration_ticks > 0), 'all pulses have to be at least one clock tick long'
+
+        return [cls(channel_id, start_tick, duration_tick, clock_period) for channel_id, start_tick, duration_tick in
+                zip(channel_ids, start_ticks.tolist(), duration_ticks.tolist())]
+
+    def to_pulse(self):
+        """
+        Returns: a (mutable) Pulse object with the same channel, start time and duration in ns
+        """
+        return Pulse(self.channel_id, self.start_time, self.duration, amplitude=self.amplitude)
+
+
+class PulseTable(object):
+    """
+    columnar (numpy backed) representation of one or more physical pulse sequences, i.e. pulses that have already been
+    shifted by the channel delays and quantized to the clock of the pulseblaster
+
+    Each pulse is one row with the bit of its channel (1 << channel), its start tick and its end tick. The
+    sequence_index column tells to which sequence of a sweep (e.g. which tau) the pulse belongs, the rows are ordered by
+    sequence_index.
+
+    """
+    def __init__(self, channel_bits, start, end, sequence_index=None, clock_period=2.5, num_sequences=None):
+        """
+        Args:
+            channel_bits: array with the bit (1 << channel) of each pulse
+            start: array with the start time of each pulse in clock ticks
+            end: array with the end time of each pulse in clock ticks
+            sequence_index: array with the index of the sequence to which the pulse belongs, if None all pulses belong
+                to a single sequence
+            clock_period: duration of a clock tick in ns
+            num_sequences: number of sequences, only required if there are sequences without pulses at the end
+        """
+        self.channel_bits = np.asarray(channel_bits, dtype=np.int64)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+        if sequence_index is None:
+            sequence_index = np.zeros(len(self.start), dtype=np.int64)
+        self.sequence_index = np.asarray(sequence_index, dtype=np.int64)
+        self.clock_period = clock_period
+        if num_sequences is None:
+            num_sequences = int(self.sequence_index[-1]) + 1 if len(self.sequence_index) else 0
+        self.num_sequences = num_sequences
+
+        assert len(self.channel_bits) == len(self.start) == len(self.end) == len(self.sequence_index), \
+            'all columns of a pulse table need to have the same length'
+
+    def __len__(self):
+        return len(self.start)
+
+    def __repr__(self):
+        return 'PulseTable({:d} pulses in {:d} sequences, clock period = {:0.1f}ns)'.format(
+            len(self), self.num_sequences, self.clock_period)
+
+    @property
+    def sequence_offsets(self):
+        """
+        Returns: array of length num_sequences + 1, the rows of sequence i are sequence_offsets[i]:sequence_offsets[i+1]
+        """
+        return np.searchsorted(self.sequence_index, np.arange(self.num_sequences + 1))
+
+    def sequence(self, index):
+        """
+        Returns: a PulseTable that only contains the pulses of the sequence with the given index
+        """
+        offsets = self.sequence_offsets
+        rows = slice(offsets[index], offsets[index + 1])
+        return PulseTable(self.channel_bits[rows], self.start[rows], self.end[rows], clock_period=self.clock_period)
+
+    def end_times(self):
+        """
+        Returns: array with the time (in ns) of the last falling edge of each sequence
+        """
+        offsets = self.sequence_offsets
+        return np.maximum.reduceat(self.end, offsets[:-1]) * self.clock_period
+
+
+class PBInstructionTable(object):
+    """
+    columnar representation of compiled pulseblaster programs, one program per sequence of a PulseTable
+
+    The instructions of all programs are stored back to back, the instructions of program i are the rows
+    offsets[i]:offsets[i+1]. The command column holds the opcodes of PulseBlaster.PB_INSTRUCTIONS.
+
+    """
+    def __init__(self, channel_bits, duration, command, command_arg, offsets):
+        self.channel_bits = channel_bits
+        self.duration = duration
+        self.command = command
+        self.command_arg = command_arg
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def num_commands(self, index=None):
+        """
+        Returns: the number of instructions of program index, or an array with the number of instructions of all
+        programs if index is None
+        """
+        if index is None:
+            return np.diff(self.offsets)
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def instructions(self, index):
+        """
+        Returns: the instructions of program index as a list of (channel_bits, command, command_arg, duration) tuples
+        of python types, i.e. the arguments of pb_inst_pbonly
+        """
+        rows = slice(self.offsets[index], self.offsets[index + 1])
+        return list(zip(self.channel_bits[rows].tolist(), self.command[rows].tolist(),
+                        self.command_arg[rows].tolist(), self.duration[rows].tolist()))
+
+    def get_commands(self, index):
+        """
+        Returns: the instructions of program index as a list of PulseBlaster.PBCommand, i.e. the same output as
+        PulseBlaster.create_commands
+        """
+        command_names = {value.value: key for key, value in PulseBlaster.PB_INSTRUCTIONS.items()}
+        return [PulseBlaster.PBCommand(channel_bits, duration, command_names[command], command_arg)
+                for channel_bits, command, command_arg, duration in self.instructions(index)]
+
+
+class SimulatedSpinAPI(object):
+    """
+    Hardware-free replacement for the spinapi library, that can be passed to the PulseBlaster instead of the dll. It
+    implements the functions of spinapi that are used by the PulseBlaster, records the instructions that are
+    programmed and executes them (LOOP/END_LOOP/LONG_DELAY/BRANCH) to render the outputs of each channel.
+
+    All spinapi functions accept ctypes values as well as python numbers and return values like the dll (0 or the
+    address of the instruction on success, negative values on errors).
+    """
+    MAX_INSTRUCTIONS = 4096  # size of the instruction memory
+    MAX_LOOP_NESTING = 8
+    MIN_INSTRUCTION_CYCLES = 5  # shortest instruction in clock cycles
+    CHANNEL_MASK = 0x1FFFFF  # the output channels, the bits above are the short pulse flags (0xE00000)
+
+    # opcodes, see PulseBlaster.PB_INSTRUCTIONS
+    CONTINUE, STOP, LOOP, END_LOOP, BRANCH, LONG_DELAY = 0, 1, 2, 3, 6, 7
+
+    def __init__(self):
+        self.clock_speed = 400.0  # MHz
+        self.instructions = []  # list of (flags, inst, inst_data, length) with length in ns
+        self.is_open = False
+        self.is_programming = False
+        self.is_running = False
+        self.num_instructions_written = 0  # total number of pb_inst_pbonly calls, e.g. to measure throughput
+        self.error = ''
+
+    @staticmethod
+    def _value(argument):
+        # arguments are either ctypes objects or python numbers
+        return getattr(argument, 'value', argument)
+
+    def _fail(self, error):
+        self.error = error
+        return -1
+
+    def pb_get_version(self):
+        return b'simulated'
+
+    def pb_get_error(self):
+        return self.error.encode('ascii')
+
+    def pb_count_boards(self):
+        return 1
+
+    def pb_select_board(self, board):
+        return 0
+
+    def pb_set_debug(self, debug):
+        return 0
+
+    def pb_set_defaults(self):
+        return 0
+
+    def pb_write_register(self, address, value):
+        return 0
+
+    def pb_init(self):
+        self.is_open = True
+        return 0
+
+    def pb_close(self):
+        # like the hardware, the board keeps running the program after the connection is closed
+        self.is_open = False
+        return 0
+
+    def pb_core_clock(self, clock_speed):
+        self.clock_speed = float(self._value(clock_speed))
+        return 0
+
+    def pb_start_programming(self, device):
+        if not self.is_open:
+            return self._fail('board not initialized')
+        self.instructions = []
+        self.is_programming = True
+        return 0
+
+    def pb_inst_pbonly(self, flags, inst, inst_data, length):
+        if not self.is_programming:
+            return self._fail('not in programming mode')
+        if len(self.instructions) >= self.MAX_INSTRUCTIONS:
+            return self._fail('program too long')
+
+        length = float(self._value(length))
+        if length < self.MIN_INSTRUCTION_CYCLES * 1.0e3 / self.clock_speed:
+            return self._fail('instruction length too short')
+
+        self.instructions.append((int(self._value(flags)), int(self._value(inst)), int(self._value(inst_data)),
+                                  length))
+        self.num_instructions_written += 1
+        return len(self.instructions) - 1
+
+    def pb_stop_programming(self):
+        self.is_programming = False
+        return 0
+
+    def pb_start(self):
+        if not self.instructions:
+            return self._fail('no program')
+        self.is_running = True
+        return 0
+
+    def pb_stop(self):
+        self.is_running = False
+        return 0
+
+    def pb_reset(self):
+        self.is_running = False
+        return 0
+
+    def pb_read_status(self):
+        # bit 0: stopped, bit 2: running
+        return 0b100 if self.is_running else 0b001
+
+    def get_timeline(self, max_states=10000000):
+        """
+        Executes the programmed instructions, starting at address 0, until the first BRANCH or STOP. Since all
+        programs of the PulseBlaster end in a BRANCH to themselves, this is the output until the board has reached its
+        steady state. The BRANCH (or STOP) instruction itself is included.
+
+        Args:
+            max_states: maximum number of executed instructions, raises a ValueError for longer programs (e.g. a
+                sequence that is looped 1E5 times) to not run out of memory
+
+        Returns: tuple (start_times, durations, channel_bits) of numpy arrays with one entry per state, where
+            consecutive instructions with the same outputs are merged into a single state. Times are in ns.
+
+        """
+        durations, flags, __ = self._execute(0, 0, max_states)
+        channel_bits = flags & self.CHANNEL_MASK
+
+        if len(durations) == 0:
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+
+        is_new = np.ones(len(channel_bits), dtype=bool)
+        is_new[1:] = channel_bits[1:] != channel_bits[:-1]
+        start_times = np.concatenate(([0.], np.cumsum(durations)[:-1]))[is_new]
+        durations = np.add.reduceat(durations, np.flatnonzero(is_new))
+
+        return start_times, durations, channel_bits[is_new]
+
+    def get_edges(self, channels=None, max_states=10000000):
+        """
+        Renders the edges of the outputs, see get_timeline
+
+        Args:
+            channels: list of channel numbers, if None all channels that are high at some point are returned
+            max_states: maximum number of executed instructions, see get_timeline
+
+        Returns: dictionary {channel: (rising_times, falling_times)} of numpy arrays of the times (ns) at which the
+            channel is switched on and off. A channel that is high at time 0 has a rising edge at 0, a channel that is
+            still high when the program ends has no final falling edge.
+
+        """
+        start_times, durations, channel_bits = self.get_timeline(max_states)
+
+        if channels is None:
+            used_bits = np.bitwise_or.reduce(channel_bits) if len(channel_bits) else 0
+            channels = [channel for channel in range(self.CHANNEL_MASK.bit_length()) if used_bits >> channel & 1]
+
+        edges = {}
+        for channel in channels:
+            level = (channel_bits >> channel) & 1
+            change = np.diff(np.concatenate(([0], level)))
+            edges[channel] = (start_times[change == 1], start_times[change == -1])
+
+        return edges
+
+    def _execute(self, address, depth, max_states):
+        """
+        Executes the instructions starting at address until the END_LOOP of the current loop (depth > 0) or a BRANCH
+        or STOP (depth 0). Loops are executed by executing their body once and repeating the result.
+
+        Args:
+            address: address of the first instruction
+            depth: number of loops that enclose the instructions
+            max_states: maximum number of executed instructions
+
+        Returns: tuple (durations, flags, next_address) with the durations and flags of the executed instructions and
+            the address of the instruction after the last executed one
+
+        """
+        durations, flags = [], []
+        while True:
+            if address >= len(self.instructions):
+                raise RuntimeError('program ran past the last instruction at address {:d}'.format(address))
+
+            flag, inst, inst_data, length = self.instructions[address]
+
+            if inst == self.LOOP:
+                if depth >= self.MAX_LOOP_NESTING:
+                    raise RuntimeError('too many nested loops at address {:d}'.format(address))
+                # the LOOP instruction is part of the loop body, the END_LOOP instruction as well
+                body_durations, body_flags, end_address = self._execute(address + 1, depth + 1, max_states)
+                end_loop = self.instructions[end_address - 1]
+                if end_loop[2] != address:
+                    raise RuntimeError('END_LOOP at address {:d} does not jump to the LOOP at address {:d}'.format(
+                        end_address - 1, address))
+                if (len(body_durations) + 1) * inst_data > max_states:
+                    raise ValueError('program executes more than {:d} instructions'.format(max_states))
+                durations.append(np.tile(np.concatenate(([length], body_durations)), inst_data))
+                flags.append(np.tile(np.concatenate(([flag], body_flags)), inst_data))
+                address = end_address
+                continue
+
+            if inst == self.LONG_DELAY:
+                if inst_data < 2:
+                    raise RuntimeError('LONG_DELAY with less than 2 repetitions at address {:d}'.format(address))
+                length = length * inst_data
+            elif inst not in (self.CONTINUE, self.STOP, self.END_LOOP, self.BRANCH):
+                raise NotImplementedError('instruction {:d} at address {:d} is not simulated'.format(inst, address))
+
+            durations.append(np.array([length]))
+            flags.append(np.array([flag], dtype=np.int64))
+            address += 1
+
+            if inst == self.END_LOOP:
+                if depth == 0:
+                    raise RuntimeError('END_LOOP without LOOP at address {:d}'.format(address - 1))
+                break
+            if inst in (self.BRANCH, self.STOP):
+                if depth > 0:
+                    raise RuntimeError('program ends inside a loop at address {:d}'.format(address - 1))
+                break
+
+        return np.concatenate(durations), np.concatenate(flags).astype(np.int64), address
+
 
 class PulseBlaster(Instrument):
     """
@@ -168,6 +647,9 @@ class PulseBlaster(Instrument):
 
     PULSE_PROGRAM = ctypes.c_int(0)
     LONG_DELAY_THRESHOLD = 640
+    PROGRAM_CACHE_SIZE = 1000  # number of compiled programs that are kept in memory
+    MAX_LOOP_NESTING = 8  # maximum number of nested LOOP/END_LOOP levels supported by the pulseblaster
+    SEQUENCE_SEPARATION_TIME = 500  # time (ns) in the steady state between the sequences of a sweep program
 
     PB_INSTRUCTIONS = {
         'CONTINUE': ctypes.c_int(0),
@@ -178,24 +660,38 @@ class PulseBlaster(Instrument):
         'LONG_DELAY': ctypes.c_int(7)
     }
 
-    def __init__(self, name=None, settings=None):
-        try:
-            self.dll_path = get_config_value('PULSEBLASTER_DLL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt'))
-        except IOError:
-            warnings.warn("Pulseblaster DLL not found. If it should be present, check the path.")
-            dll_path = None
-            print(('Expected dll_path: ', self.dll_path))
-            self.is_conneted = False
-        try:
-          #  self.pb = ctypes.windll.LoadLibrary(dll_path) commented AS and ER 20180503
-            self.pb = ctypes.CDLL('spinapi64')
-            self.prepare_function_calls()
-        except WindowsError:
-            self.is_conneted = False
-            warnings.warn("Pulseblaster DLL not found. If it should be present, check the path:")
-            print(('Expected dll_path: ', dll_path))
+    def __init__(self, name=None, settings=None, spinapi=None):
+        """
+        Args:
+            name (optional): name of the instrument
+            settings (optional): settings of the instrument
+            spinapi (optional): object that replaces the spinapi dll, e.g. a SimulatedSpinAPI to run without hardware
+        """
+        if spinapi is not None:
+            self.pb = spinapi
+        else:
+            try:
+                self.dll_path = get_config_value('PULSEBLASTER_DLL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt'))
+            except IOError:
+                warnings.warn("Pulseblaster DLL not found. If it should be present, check the path.")
+                self.dll_path = None
+                print(('Expected dll_path: ', self.dll_path))
+                self.is_conneted = False
+            try:
+              #  self.pb = ctypes.windll.LoadLibrary(dll_path) commented AS and ER 20180503
+                self.pb = ctypes.CDLL('spinapi64')
+                self.prepare_function_calls()
+            except OSError:
+                self.is_conneted = False
+                warnings.warn("Pulseblaster DLL not found. If it should be present, check the path:")
+                print(('Expected dll_path: ', self.dll_path))
         self.is_conneted = False
 
+        # cache of compiled programs, see get_program
+        self._program_cache = OrderedDict()
+        self.program_cache_hits = 0
+        self.program_cache_misses = 0
+
         super(PulseBlaster, self).__init__(name, settings)
         self.estimated_runtime = None
         self.sequence_start_time = None
@@ -307,14 +803,18 @@ class PulseBlaster(Instrument):
         raise AttributeError('Could not find delay of channel name or number: {0}'.format(str(channel_id)))
 
     @staticmethod
-    def find_overlapping_pulses(pulses, combine_channels=None):
+    def find_overlapping_pulses(pulses, combine_channels=None, dead_time=0):
         """
         Finds all overlapping pulses in a collection of pulses, and returns the clashing pulses.
 
+        The pulses of each channel are swept in order of their start time while keeping a heap of the pulses that are
+        still on, so this takes O(n log n) (plus the number of overlaps) instead of comparing all pairs of pulses.
+
         Args:
             pulses: An iterable collection of Pulse objects
             combine_channels: list of *two* channels that should not be overlapping, if empty list only pulses
                 with the same channel_id can be overlapping.
+            dead_time: pulses that are closer than dead_time are also considered overlapping (see Pulse.is_overlapping)
 
         Returns:
             A list of length-2 tuples of overlapping pulses. Each pair of pulses has the earlier pulse in the first
@@ -325,43 +825,98 @@ class PulseBlaster(Instrument):
         if combine_channels is None:
             combine_channels = set()
 
-        def get_overlapping_pulses(pulse1, pulse2):
-            """
-            Returns overlapping pulses as a tuple if time pulse 1 and 2 overlap in time
+        # group the pulses that can not overlap, i.e. the combined channels and each of the other channels
+        pulse_groups = {}
+        for index, pulse in enumerate(pulses):
+            group = None if pulse.channel_id in combine_channels else pulse.channel_id
+            pulse_groups.setdefault(group, []).append((pulse.start_time, index, pulse))
 
-            Args:
-                pulse1: pulse 1 (Pulse object)
-                pulse2: pulse 2 (Pulse object)
+        overlapping_pulses = []
+        for pulse_group in pulse_groups.values():
+            pulse_group.sort(key=lambda item: item[:2])
+            active_pulses = []  # heap of (end_time, index, pulse) of the pulses that might still overlap
+            for start_time, index, pulse in pulse_group:
+                # pulses that end (including the dead time) before this one starts can not overlap with any later pulse
+                while active_pulses and active_pulses[0][0] + dead_time <= start_time:
+                    heapq.heappop(active_pulses)
+                for _, _, active_pulse in sorted(active_pulses, key=lambda item: item[1]):
+                    overlapping_pulses.append((active_pulse, pulse))
+                heapq.heappush(active_pulses, (pulse.start_time + pulse.duration, index, pulse))
 
-            Returns:
-                overlapping pulses as a tuple if time intervals 1 and 2 overlap in time
+        return overlapping_pulses
 
-            """
+    @staticmethod
+    def has_overlapping_pulses(pulse_sequences, combine_channels=None, dead_time=0):
+        """
+        Checks many pulse sequences at once for overlapping pulses (see find_overlapping_pulses). All pulses are sorted
+        by sequence, channel and start time in a single pass and a pulse overlaps with an earlier one if it starts
+        before the latest end time (plus dead time) of the earlier pulses of the same sequence and channel.
 
-            if Pulse.is_overlapping(pulse1, pulse2):
-                overlapping_pulses = [tuple(sorted([pulse1, pulse2], key=lambda pulse: pulse.start_time))]
-            else:
-                overlapping_pulses = []
+        Args:
+            pulse_sequences: a list of pulse sequences (each a list of Pulse objects)
+            combine_channels: list of *two* channels that should not be overlapping, if empty list only pulses
+                with the same channel_id can be overlapping.
+            dead_time: pulses that are closer than dead_time are also considered overlapping
 
-            return overlapping_pulses
+        Returns: boolean array, True for each sequence that contains overlapping pulses
 
-        overlapping_pulses = []
-        channel_ids = set([p.channel_id for p in pulses])  # get all channel ids as a list
+        """
+        if combine_channels is None:
+            combine_channels = set()
 
-        # check for overlapping pulses in the combined channels
-        pulse_list = [p for p in pulses if p.channel_id in combine_channels]  # get all the pulses with any of the channel id
-        for pulse1, pulse2 in itertools.combinations(pulse_list, 2):
-            if Pulse.is_overlapping(pulse1, pulse2):
-                overlapping_pulses.append(tuple(sorted([pulse1, pulse2], key=lambda pulse: pulse.start_time)))
+        channel_groups = {}
+        group_ids, start_times, end_times, lengths = [], [], [], []
+        for pulse_sequence in pulse_sequences:
+            lengths.append(len(pulse_sequence))
+            for pulse in pulse_sequence:
+                group = None if pulse.channel_id in combine_channels else pulse.channel_id
+                group_ids.append(channel_groups.setdefault(group, len(channel_groups)))
+                start_times.append(pulse.start_time)
+                end_times.append(pulse.start_time + pulse.duration)
+
+        has_overlaps = np.zeros(len(lengths), dtype=bool)
+        if len(start_times) < 2:
+            return has_overlaps
+
+        sequence_index = np.repeat(np.arange(len(lengths)), lengths)
+        segment = sequence_index * len(channel_groups) + np.array(group_ids)
+        start_times = np.array(start_times, dtype=float)
+        end_times = np.array(end_times, dtype=float)
+
+        order = np.lexsort((start_times, segment))
+        segment, start_times, end_times = segment[order], start_times[order], end_times[order]
+
+        # shift each (sequence, channel) segment by a multiple of the total time span so that the running maximum of
+        # the end times never reaches into the next segment
+        span = np.max(end_times) - np.min(start_times) + abs(dead_time) + 1
+        segment_rank = np.cumsum(np.concatenate(([0], np.diff(segment) != 0)))
+        first_start_time = np.min(start_times)
+        start_times = start_times - first_start_time + segment_rank * span
+        end_times = end_times - first_start_time + segment_rank * span
+
+        previous_end = np.concatenate(([-np.inf], np.maximum.accumulate(end_times)[:-1]))
+        is_overlapping = start_times < previous_end + dead_time
+        has_overlaps[sequence_index[order][is_overlapping]] = True
+
+        return has_overlaps
+
+    def quantize_pulses(self, pulse_collection):
+        """
+        Converts a collection of pulses into QuantizedPulse objects on the clock of the pulseblaster (the delays are
+        not added, use create_physical_pulse_seq for that)
 
-        # check for overlapping pulses in the each of the channels that are not combined
-        for channel_id in (channel_ids - set(combine_channels)):
-            pulse_list = [pulse for pulse in pulses if pulse.channel_id == channel_id]  # get all the pulses with channel id
-            for pulse1, pulse2 in itertools.combinations(pulse_list, 2):
-                if Pulse.is_overlapping(pulse1, pulse2):
-                    overlapping_pulses.append(tuple(sorted([pulse1, pulse2], key=lambda pulse: pulse.start_time)))
+        Args:
+            pulse_collection: An iterable collection of Pulse objects
 
-        return overlapping_pulses
+        Returns:
+            A list of QuantizedPulse objects
+
+        """
+        clock_T = 1.0e3 / self.settings['clock_speed']  # clock period in ns
+        pulse_collection = list(pulse_collection)
+        return QuantizedPulse.from_arrays([pulse.channel_id for pulse in pulse_collection],
+                                          [pulse.start_time for pulse in pulse_collection],
+                                          [pulse.duration for pulse in pulse_collection], clock_T)
 
     def create_physical_pulse_seq(self, pulse_collection):
         """
@@ -595,6 +1150,331 @@ class PulseBlaster(Instrument):
 
         return pb_commands
 
+    def create_pulse_table(self, pulse_sequences):
+        """
+        Creates the physical pulse sequences of a whole sweep as a single PulseTable. This is the columnar equivalent of
+        calling create_physical_pulse_seq on every sequence, i.e. it adds the channel delays, quantizes to the clock
+        and makes sure the delayed sequences start at the same time as the ideal sequences.
+
+        Args:
+            pulse_sequences: a list of pulse sequences (each a list of Pulse objects), e.g. one for each value of tau
+
+        Returns: a PulseTable with the physical pulses of all sequences
+
+        """
+        clock_T = 1.0e3 / self.settings['clock_speed']  # clock period in ns
+
+        # look up the channel and the delay only once for each channel id
+        channel_info = {}
+        channel_ids, start_times, durations, lengths = [], [], [], []
+        for pulse_sequence in pulse_sequences:
+            lengths.append(len(pulse_sequence))
+            for pulse in pulse_sequence:
+                channel_ids.append(pulse.channel_id)
+                start_times.append(pulse.start_time)
+                durations.append(pulse.duration)
+
+        for channel_id in set(channel_ids):
+            channel_info[channel_id] = (1 << self._get_channel(channel_id), self.get_delay(channel_id))
+
+        channel_bits = np.array([channel_info[channel_id][0] for channel_id in channel_ids], dtype=np.int64)
+        delays = np.array([channel_info[channel_id][1] for channel_id in channel_ids], dtype=float)
+        start_times = np.array(start_times, dtype=float)
+        durations = np.array(durations, dtype=float)
+        lengths = np.array(lengths, dtype=np.int64)
+        sequence_index = np.repeat(np.arange(len(lengths)), lengths)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+        if len(start_times) == 0:
+            return PulseTable(channel_bits, start_times, start_times, sequence_index, clock_T, len(lengths))
+
+        non_empty = lengths > 0
+        min_pulse_time = np.zeros(len(lengths))
+        min_pulse_time[non_empty] = np.minimum.reduceat(start_times, offsets[:-1][non_empty])
+        assert np.all(min_pulse_time >= 0), 'pulse with negative start time detected, that is not a valid pulse'
+
+        # add delays to each pulse, this uses the same arithmetic as create_physical_pulse_seq so that both give
+        # exactly the same result
+        start_ticks = np.round((start_times - delays) / clock_T)
+        duration_ticks = np.round(durations / clock_T)
+
+        # make sure the pulses start at same time as min_pulse_time
+        delayed_min_pulse_time = np.zeros(len(lengths))
+        delayed_min_pulse_time[non_empty] = np.minimum.reduceat(start_ticks * clock_T, offsets[:-1][non_empty])
+        shift = (delayed_min_pulse_time < min_pulse_time)[sequence_index]
+        start_ticks[shift] = np.round((start_ticks[shift] * clock_T - delayed_min_pulse_time[sequence_index][shift] +
+                                       min_pulse_time[sequence_index][shift]) / clock_T)
+
+        start_ticks = start_ticks.astype(np.int64)
+        return PulseTable(channel_bits, start_ticks, start_ticks + duration_ticks.astype(np.int64), sequence_index,
+                          clock_T, len(lengths))
+
+    def compile_pulse_table(self, pulse_table, num_loops=1, compress_loops=False):
+        """
+        Compiles all sequences of a PulseTable into pulseblaster programs in a single vectorized pass. The result is
+        identical to calling generate_pb_sequence and create_commands on every sequence, but avoids the python level
+        loops over pulses and commands.
+
+        Args:
+            pulse_table: a PulseTable with physical (i.e. delayed) pulses
+            num_loops: number of times each sequence is looped, either a single value or one value per sequence
+            compress_loops: if True, repeated blocks of states (e.g. the XY8 block of an XY8-k sequence) are programmed
+                once inside a LOOP/END_LOOP instead of being unrolled, see _find_repeated_states
+
+        Returns: a PBInstructionTable with one program per sequence
+
+        """
+        clock_T = pulse_table.clock_period
+        num_sequences = pulse_table.num_sequences
+        num_loops = np.broadcast_to(np.asarray(num_loops, dtype=np.int64), (num_sequences,))
+
+        # every pulse toggles its channel at its start and at its end, in addition we need an edge at time 0 for every
+        # sequence (with no channel toggled) so that every program starts at time 0
+        edge_sequence = np.concatenate((pulse_table.sequence_index, pulse_table.sequence_index,
+                                        np.arange(num_sequences)))
+        edge_time = np.concatenate((pulse_table.start, pulse_table.end, np.zeros(num_sequences, dtype=np.int64)))
+        edge_bits = np.concatenate((pulse_table.channel_bits, pulse_table.channel_bits,
+                                    np.zeros(num_sequences, dtype=np.int64)))
+
+        order = np.lexsort((edge_time, edge_sequence))
+        edge_sequence, edge_time, edge_bits = edge_sequence[order], edge_time[order], edge_bits[order]
+
+        # merge all edges of a sequence that happen at the same time into a single toggle bitstring
+        is_new = np.ones(len(edge_time), dtype=bool)
+        is_new[1:] = (np.diff(edge_time) != 0) | (np.diff(edge_sequence) != 0)
+        group_start = np.flatnonzero(is_new)
+        toggle_bits = np.bitwise_xor.reduceat(edge_bits, group_start)
+        change_time = edge_time[group_start]
+        change_sequence = edge_sequence[group_start]
+
+        # drop times at which nothing changes (e.g. a pulse ends when the next one on the same channel starts)
+        keep = (toggle_bits != 0) | (change_time == 0)
+        toggle_bits, change_time, change_sequence = toggle_bits[keep], change_time[keep], change_sequence[keep]
+
+        # the state of the outputs is the cumulative xor of the toggles within each sequence
+        change_offsets = np.searchsorted(change_sequence, np.arange(num_sequences + 1))
+        state_bits = np.bitwise_xor.accumulate(toggle_bits)
+        state_before_sequence = np.concatenate(([0], state_bits))[change_offsets[:-1]]
+        state_bits = state_bits ^ state_before_sequence[change_sequence]
+
+        # every state lasts until the next change, the last change of a sequence only marks its end
+        is_last = np.zeros(len(change_time), dtype=bool)
+        is_last[change_offsets[1:] - 1] = True
+        state_duration = (np.diff(change_time, append=0) * clock_T)[~is_last]
+        state_bits = state_bits[~is_last]
+        state_sequence = change_sequence[~is_last]
+
+        inner_loops = None
+        if compress_loops:
+            keep, inner_loops = self._find_repeated_states(state_bits, state_duration, state_sequence, num_sequences)
+            # the loops refer to the states before dropping the repetitions
+            new_index = np.cumsum(keep) - 1
+            inner_loops = (new_index[inner_loops[0]], new_index[inner_loops[1]], inner_loops[2])
+            state_bits, state_duration, state_sequence = state_bits[keep], state_duration[keep], state_sequence[keep]
+
+        return self._create_instruction_table(state_bits, state_duration, state_sequence, num_loops, inner_loops)
+
+    def _find_repeated_states(self, state_bits, state_duration, state_sequence, num_sequences):
+        """
+        Finds blocks of states that are repeated back to back within a sequence, e.g. the eight pi pulses of an XY8
+        block in an XY8-k sequence. Within each sequence the block with the largest number of redundant states is
+        chosen first, then the states before and after the repetitions and inside the block (for nested loops) are
+        searched recursively. The first and the last state of each sequence (and of each block) are excluded, because
+        they carry the LOOP and END_LOOP of the enclosing loop.
+
+        Args:
+            state_bits: channel bits of each state
+            state_duration: duration of each state in ns
+            state_sequence: index of the sequence to which each state belongs (non decreasing)
+            num_sequences: number of sequences
+
+        Returns: tuple (keep, inner_loops)
+            keep: boolean array that is False for the states that are repetitions of a block
+            inner_loops: tuple of arrays (loop_start, loop_end, loop_count) with the index of the first and the last
+                state of each block and the number of times it is repeated
+
+        """
+        keep = np.ones(len(state_bits), dtype=bool)
+        loops = []
+
+        if len(state_bits) == 0:
+            return keep, (np.zeros(0, dtype=np.int64),) * 3
+
+        # label every distinct state, so that comparing blocks of states only compares integers
+        __, state_id = np.unique(np.stack((state_bits.astype(float), state_duration)), axis=1, return_inverse=True)
+        state_id = state_id.ravel()
+
+        def find_repeats(lo, hi, depth):
+            if depth >= self.MAX_LOOP_NESTING or hi - lo < 4:
+                return
+
+            segment = state_id[lo:hi]
+            best_savings, best = 0, None
+            for block_length in range(2, len(segment) // 2 + 1):
+                # a run of m states that are equal to the state block_length later is m // block_length + 1 blocks
+                is_repeated = segment[:-block_length] == segment[block_length:]
+                if np.count_nonzero(is_repeated) < block_length:
+                    continue
+                edges = np.diff(np.concatenate(([0], is_repeated.view(np.int8), [0])))
+                run_start = np.flatnonzero(edges == 1)
+                run_length = np.flatnonzero(edges == -1) - run_start
+                savings = run_length // block_length * block_length
+                i = np.argmax(savings)
+                if savings[i] > best_savings:
+                    best_savings = savings[i]
+                    best = (lo + run_start[i], block_length, run_length[i] // block_length + 1)
+
+            if best is None:
+                return
+
+            start, block_length, count = best
+            loops.append((start, start + block_length - 1, count))
+            keep[start + block_length:start + count * block_length] = False
+            find_repeats(lo, start, depth)
+            find_repeats(start + 1, start + block_length - 1, depth + 1)
+            find_repeats(start + count * block_length, hi, depth)
+
+        state_offsets = np.searchsorted(state_sequence, np.arange(num_sequences + 1))
+        for index in range(num_sequences):
+            # the outer loop over the whole sequence is the first level of nesting
+            find_repeats(state_offsets[index] + 1, state_offsets[index + 1] - 1, 1)
+
+        if len(loops) == 0:
+            return keep, (np.zeros(0, dtype=np.int64),) * 3
+
+        loop_start, loop_end, loop_count = (np.array(column, dtype=np.int64) for column in zip(*loops))
+        return keep, (loop_start, loop_end, loop_count)
+
+    def _create_instruction_table(self, state_bits, state_duration, state_sequence, num_loops, inner_loops=None):
+        """
+        Vectorized version of create_commands (including the LONG_DELAY breakdown of _get_long_delay_breakdown) for
+        the state changes of many sequences at once.
+
+        Args:
+            state_bits: channel bits of each state
+            state_duration: duration of each state in ns
+            state_sequence: index of the sequence to which each state belongs (non decreasing)
+            num_loops: array with the number of loops of each sequence
+            inner_loops (optional): tuple of arrays (loop_start, loop_end, loop_count) with the first and last state of
+                loops inside the sequences, the first state is programmed with LOOP and the last with END_LOOP
+
+        Returns: PBInstructionTable
+
+        """
+        num_sequences = len(num_loops)
+        state_offsets = np.searchsorted(state_sequence, np.arange(num_sequences + 1))
+        num_states = np.diff(state_offsets)
+
+        # the first state of a sequence opens the LOOP, the last closes it with END_LOOP. If a sequence only has a
+        # single state, it is used for both
+        first = state_offsets[:-1][num_states > 0]
+        last = state_offsets[1:][num_states > 0] - 1
+        repeats = np.ones(len(state_bits), dtype=np.int64)
+        repeats[first[first == last]] = 2
+        rows = np.repeat(np.arange(len(state_bits)), repeats)
+        row_is_first = np.zeros(len(rows), dtype=bool)
+        row_is_first[np.searchsorted(rows, first)] = True
+        row_is_last = np.zeros(len(rows), dtype=bool)
+        row_is_last[np.searchsorted(rows, last, side='right') - 1] = True
+
+        opcode = {name: value.value for name, value in self.PB_INSTRUCTIONS.items()}
+        row_command = np.full(len(rows), opcode['CONTINUE'], dtype=np.int64)
+        row_command[row_is_first] = opcode['LOOP']
+        row_command[row_is_last] = opcode['END_LOOP']
+        row_arg = np.where(row_is_first, num_loops[state_sequence[rows]], 0)
+        # for every END_LOOP, the row that holds the corresponding LOOP
+        row_loop_start = np.full(len(rows), -1, dtype=np.int64)
+        row_loop_start[row_is_last] = np.flatnonzero(row_is_first)
+
+        if inner_loops is not None and len(inner_loops[0]) > 0:
+            # states with inner loops are never the only state of a sequence, so they map to a single row
+            loop_start_row = np.searchsorted(rows, inner_loops[0])
+            loop_end_row = np.searchsorted(rows, inner_loops[1])
+            row_command[loop_start_row] = opcode['LOOP']
+            row_arg[loop_start_row] = inner_loops[2]
+            row_command[loop_end_row] = opcode['END_LOOP']
+            row_loop_start[loop_end_row] = loop_start_row
+
+        row_duration = state_duration[rows]
+        # the breakdown of every state but the ones that end a loop is programmed in reverse order, such that a LOOP
+        # command is the first and an END_LOOP command the last of the breakdown, see create_commands
+        row_reversed = row_command != opcode['END_LOOP']
+
+        # the LONG_DELAY breakdown, see _get_long_delay_breakdown. Each state is mapped onto one of the following
+        # patterns. Slot types: 0 = final command (duration t), 1 = final command (duration remainder),
+        # 2 = final command (duration half threshold + remainder), 3 = CONTINUE of half the threshold,
+        # 4 = LONG_DELAY with num_long_delays, 5 = LONG_DELAY with num_long_delays - 1
+        patterns = np.array([[0, -1, -1, -1],  # shorter than the threshold
+                             [5, 3, 2, -1],  # remainder too short, more than two long delays
+                             [3, 3, 3, 2],  # remainder too short, two long delays
+                             [3, 2, -1, -1],  # remainder too short, a single long delay
+                             [3, 3, 1, -1],  # a single long delay
+                             [4, 1, -1, -1]])  # long delays followed by the remainder
+        threshold = self.LONG_DELAY_THRESHOLD
+        num_long_delays, remainder = np.divmod(row_duration, threshold)
+        short_remainder = remainder < self.settings['min_pulse_dur']
+        case = np.select([row_duration < threshold,
+                          short_remainder & (num_long_delays > 2),
+                          short_remainder & (num_long_delays == 2),
+                          short_remainder & (num_long_delays == 1),
+                          num_long_delays == 1],
+                         [0, 1, 2, 3, 4], default=5)
+        slots_per_case = np.sum(patterns >= 0, axis=1)
+
+        num_slots = slots_per_case[case]
+
+        # END_LOOP jumps back to the address (relative to the start of the program) of its LOOP command, which is the
+        # first command of the row that starts the loop
+        row_first_command = np.cumsum(num_slots) - num_slots
+        is_loop_end = row_loop_start >= 0
+        program_start = row_first_command[np.searchsorted(rows, state_offsets[:-1])[state_sequence[rows]]]
+        row_arg[is_loop_end] = (row_first_command[row_loop_start[is_loop_end]] - program_start[is_loop_end])
+
+        cmd_rows = np.repeat(np.arange(len(rows)), num_slots)
+        slot = np.arange(len(cmd_rows)) - np.repeat(np.cumsum(num_slots) - num_slots, num_slots)
+        slot = np.where(row_reversed[cmd_rows], num_slots[cmd_rows] - 1 - slot, slot)
+        slot_type = patterns[case[cmd_rows], slot]
+
+        t = row_duration[cmd_rows]
+        n = num_long_delays[cmd_rows]
+        r = remainder[cmd_rows]
+        duration = np.choose(slot_type, [t, r, threshold / 2 + r, np.full(len(t), threshold / 2),
+                                         np.full(len(t), float(threshold)), np.full(len(t), float(threshold))])
+        command = np.choose(np.array([0, 0, 0, 1, 2, 2])[slot_type],
+                            [row_command[cmd_rows], opcode['CONTINUE'], opcode['LONG_DELAY']])
+        command_arg = np.choose(slot_type, [row_arg[cmd_rows], row_arg[cmd_rows], row_arg[cmd_rows],
+                                            np.zeros(len(t), dtype=np.int64), n.astype(np.int64),
+                                            n.astype(np.int64) - 1])
+        channel_bits = state_bits[rows][cmd_rows]
+
+        # close every program with a BRANCH to the steady-state settings, its argument is its own address
+        cmd_sequence = state_sequence[rows][cmd_rows]
+        num_commands = np.bincount(cmd_sequence, minlength=num_sequences)
+        has_commands = num_commands > 0
+        insert_at = np.cumsum(num_commands)[has_commands]
+        channel_bits = np.insert(channel_bits, insert_at, self.settings2bits())
+        duration = np.insert(duration, insert_at, 100)
+        command = np.insert(command, insert_at, opcode['BRANCH'])
+        command_arg = np.insert(command_arg, insert_at, num_commands[has_commands])
+        offsets = np.concatenate(([0], np.cumsum(num_commands + has_commands)))
+
+        return PBInstructionTable(channel_bits, duration, command, command_arg, offsets)
+
+    def compile_sweep(self, pulse_sequences, num_loops=1, compress_loops=False):
+        """
+        Compiles the pulse sequences of a whole sweep (e.g. all values of tau) into pulseblaster programs, this is the
+        vectorized equivalent of create_physical_pulse_seq -> generate_pb_sequence -> create_commands for each sequence
+
+        Args:
+            pulse_sequences: a list of pulse sequences (each a list of Pulse objects)
+            num_loops: number of times each sequence is looped, either a single value or one value per sequence
+            compress_loops: if True, repeated blocks are programmed as loops, see compile_pulse_table
+
+        Returns: a PBInstructionTable with one program per sequence
+
+        """
+        return self.compile_pulse_table(self.create_pulse_table(pulse_sequences), num_loops, compress_loops)
+
     @staticmethod
     def estimate_runtime(pulses, num_loops=1):
         """
@@ -609,21 +1489,141 @@ class PulseBlaster(Instrument):
         """
         return float(num_loops * max([pulse.start_time + pulse.duration for pulse in pulses])) / 1E6
 
-    def program_pb(self, pulse_collection, num_loops=1):
+    def _get_program_key(self, pulse_collection, num_loops):
         """
-        programs the pulseblaster to perform the pulses in the given pulse_collection on the next time start_pulse_seq()
-        is called. The pulse collection must contain at least 2 pulses. Currently, we do not support time resolution below
-        15 ns.
+        Computes a stable hash of everything that determines the compiled program of a pulse collection, i.e. the
+        pulses, the channel settings (channel number, delay and steady-state status), the clock speed, the minimum
+        pulse duration and the number of loops
 
         Args:
             pulse_collection: A collection of Pulse objects
             num_loops: The number of times to perform the given pulse collection
 
-        Returns:
+        Returns: hex digest (string) that identifies the compiled program
 
         """
+        channel_settings = sorted((key, value['channel'], float(value['delay_time']), bool(value['status']))
+                                  for key, value in self.settings.items()
+                                  if isinstance(value, dict) and 'channel' in value)
+        key = (tuple((pulse.channel_id, float(pulse.start_time), float(pulse.duration)) for pulse in pulse_collection),
+               tuple(channel_settings), float(self.settings['clock_speed']), float(self.settings['min_pulse_dur']),
+               int(num_loops))
 
-        # check for errors in the given pulse_collection
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get_program(self, pulse_collection, num_loops=1):
+        """
+        Returns the compiled program for the given pulse collection. Compiled programs are kept in a least recently
+        used cache, so that a pulse collection that has been programmed before (e.g. the same tau on the next average
+        block) is not checked and compiled again.
+
+        Args:
+            pulse_collection: A collection of Pulse objects
+            num_loops: The number of times to perform the given pulse collection
+
+        Returns: tuple (instructions, estimated_runtime), where instructions is a list of the arguments for
+            pb_inst_pbonly (channel_bits, command, command_arg, duration) and estimated_runtime is in ms
+
+        """
+        key = self._get_program_key(pulse_collection, num_loops)
+
+        if key in self._program_cache:
+            self.program_cache_hits += 1
+            self._program_cache.move_to_end(key)
+            return self._program_cache[key]
+
+        self.program_cache_misses += 1
+
+        self._check_pulse_collection(pulse_collection, num_loops)
+
+        # process the pulse collection into a format that is designed to deal with the low-level spincore API
+        pulse_table = self.create_pulse_table([pulse_collection])
+        estimated_runtime = float(num_loops * pulse_table.end_times()[0]) / 1E6
+        instruction_table = self.compile_pulse_table(pulse_table, num_loops, compress_loops=True)
+
+        assert instruction_table.num_commands(0) < 4096, "Generated a number of commands too long for the pulseblaster!"
+
+        if np.any(instruction_table.duration < 15):
+            raise RuntimeError("Detected command with duration <15ns.")
+
+        program = (instruction_table.instructions(0), estimated_runtime)
+        self._add_to_program_cache(key, program)
+
+        return program
+
+    def get_sweep_program(self, pulse_sequences, num_loops=1):
+        """
+        Returns a single program that runs all the given pulse sequences one after the other, each looped num_loops
+        times. The sequences are separated by SEQUENCE_SEPARATION_TIME in the steady state (the state the pulseblaster
+        is in between two programs), so each sequence sees the same conditions as if it was programmed on its own.
+        Since every sequence has the same number of apd readouts, the counts of a single gated counter acquisition can
+        be assigned to the sequences by their order. Like get_program, the compiled programs are cached.
+
+        Args:
+            pulse_sequences: a list of pulse sequences (each a list of Pulse objects), in the order they are run
+            num_loops: number of times each sequence is looped, either a single value or one value per sequence
+
+        Returns: tuple (instructions, estimated_runtime), see get_program
+
+        """
+        num_loops = np.broadcast_to(np.asarray(num_loops, dtype=np.int64), (len(pulse_sequences),))
+        key = hashlib.sha1(repr(tuple(self._get_program_key(pulse_collection, loops)
+                                      for pulse_collection, loops in zip(pulse_sequences, num_loops))).encode('utf-8'))
+        key = 'sweep_' + key.hexdigest()
+
+        if key in self._program_cache:
+            self.program_cache_hits += 1
+            self._program_cache.move_to_end(key)
+            return self._program_cache[key]
+
+        self.program_cache_misses += 1
+
+        for pulse_collection, loops in zip(pulse_sequences, num_loops):
+            self._check_pulse_collection(pulse_collection, loops)
+
+        pulse_table = self.create_pulse_table(pulse_sequences)
+        instruction_table = self.compile_pulse_table(pulse_table, num_loops, compress_loops=True)
+
+        # every sequence ends with a BRANCH to the steady state, all but the last one are replaced by a separator in the
+        # steady state. Since the BRANCH and the separator are a single command each, the sequences keep their
+        # addresses and only the END_LOOP addresses have to be moved by the start of their sequence
+        opcode = {name: value.value for name, value in self.PB_INSTRUCTIONS.items()}
+        command_sequence = np.repeat(np.arange(len(pulse_sequences)), instruction_table.num_commands())
+        command = instruction_table.command.copy()
+        command_arg = instruction_table.command_arg.copy()
+        duration = instruction_table.duration.copy()
+        is_end_loop = command == opcode['END_LOOP']
+        command_arg[is_end_loop] += instruction_table.offsets[command_sequence[is_end_loop]]
+
+        separator = instruction_table.offsets[1:-1] - 1
+        command[separator] = opcode['CONTINUE']
+        command_arg[separator] = 0
+        duration[separator] = self.SEQUENCE_SEPARATION_TIME
+        command_arg[-1] = len(command) - 1
+
+        assert len(command) < 4096, "Generated a number of commands too long for the pulseblaster!"
+
+        if np.any(duration < 15):
+            raise RuntimeError("Detected command with duration <15ns.")
+
+        estimated_runtime = float(np.sum(num_loops * pulse_table.end_times()) +
+                                  self.SEQUENCE_SEPARATION_TIME * (len(pulse_sequences) - 1)) / 1E6
+        program = (PBInstructionTable(instruction_table.channel_bits, duration, command, command_arg,
+                                      np.array([0, len(command)])).instructions(0), estimated_runtime)
+        self._add_to_program_cache(key, program)
+
+        return program
+
+    def _check_pulse_collection(self, pulse_collection, num_loops):
+        """
+        Checks a pulse collection for errors before it is compiled, raises an AssertionError or AttributeError if the
+        pulse collection can not be programmed
+
+        Args:
+            pulse_collection: A collection of Pulse objects
+            num_loops: The number of times to perform the given pulse collection
+
+        """
         assert len(pulse_collection) > 1, 'pulse program must have at least 2 pulses'
         assert num_loops < (1 << 20), 'cannot have more than 2^20 (approx 1 million) loop iterations'
         if self.find_overlapping_pulses(pulse_collection):
@@ -636,31 +1636,91 @@ class PulseBlaster(Instrument):
             assert pulse.duration > 1, \
                 'found a pulse duration less than 1. Remember durations are in nanoseconds, and you can\'t have a 0 duration pulse'
 
-        # process the pulse collection into a format that is designed to deal with the low-level spincore API
-        delayed_pulse_collection = self.create_physical_pulse_seq(pulse_collection)
-        self.estimated_runtime = self.estimate_runtime(delayed_pulse_collection, num_loops)
-        pb_state_changes = self.generate_pb_sequence(delayed_pulse_collection)
-        pb_commands = self.create_commands(pb_state_changes, num_loops)
-        # print(pb_commands)
+    def _add_to_program_cache(self, key, program):
+        """
+        Adds a compiled program to the cache and removes the least recently used program if the cache is full
 
-        assert len(pb_commands) < 4096, "Generated a number of commands too long for the pulseblaster!"
+        Args:
+            key: key of the program, see _get_program_key
+            program: tuple (instructions, estimated_runtime)
 
-        for command in pb_commands:
-            if command.duration < 15:
-                raise RuntimeError("Detected command with duration <15ns.")
+        """
+        self._program_cache[key] = program
+        if len(self._program_cache) > self.PROGRAM_CACHE_SIZE:
+            self._program_cache.popitem(last=False)
 
+    def clear_program_cache(self):
+        """
+        Removes all compiled programs from the cache and resets the hit and miss counters
+        """
+        self._program_cache.clear()
+        self.program_cache_hits = 0
+        self.program_cache_misses = 0
+
+    def program_pb(self, pulse_collection, num_loops=1):
+        """
+        programs the pulseblaster to perform the pulses in the given pulse_collection on the next time start_pulse_seq()
+        is called. The pulse collection must contain at least 2 pulses. Currently, we do not support time resolution below
+        15 ns.
+
+        Args:
+            pulse_collection: A collection of Pulse objects
+            num_loops: The number of times to perform the given pulse collection
+
+        Returns:
+
+        """
+
+        self.load_program(self.get_program(pulse_collection, num_loops))
+
+    def program_pb_sweep(self, pulse_sequences, num_loops=1):
+        """
+        programs the pulseblaster to run all given pulse sequences one after the other, each num_loops times, on the next
+        time start_pulse_seq() is called, see get_sweep_program
+
+        Args:
+            pulse_sequences: a list of pulse sequences (each a list of Pulse objects), in the order they are run
+            num_loops: number of times each sequence is looped, either a single value or one value per sequence
+
+        Returns:
+
+        """
+        self.load_program(self.get_sweep_program(pulse_sequences, num_loops))
+
+    def load_program(self, program):
+        """
+        programs the pulseblaster with a program that has already been compiled with get_program or get_sweep_program,
+        this allows to compile the next program (e.g. in a separate thread) while the pulseblaster is still running
+
+        Args:
+            program: tuple (instructions, estimated_runtime)
+
+        Returns:
+
+        """
+        instructions, self.estimated_runtime = program
+        self._write_program(instructions)
+
+    def _write_program(self, instructions):
+        """
+        writes the instructions of a compiled program to the pulseblaster
+
+        Args:
+            instructions: list of the arguments for pb_inst_pbonly (channel_bits, command, command_arg, duration)
+
+        """
         # begin programming the pulseblaster
         assert self.pb.pb_init() == 0, 'Could not initialize the pulseblsater on pb_init() command.'
         self.pb.pb_core_clock(ctypes.c_double(self.settings['clock_speed']))
         self.pb.pb_start_programming(self.PULSE_PROGRAM)
 
-        for pb_instruction in pb_commands:
+        for channel_bits, command, command_arg, duration in instructions:
             # note that change types to the appropriate c type, as well as set certain bits in the channel bits to 1 in
             # order to properly output the signal
-            return_value = self.pb.pb_inst_pbonly(ctypes.c_int(pb_instruction.channel_bits | 0xE00000),
-                                                  self.PB_INSTRUCTIONS[pb_instruction.command],
-                                                  ctypes.c_int(int(pb_instruction.command_arg)),
-                                                  ctypes.c_double(pb_instruction.duration))
+            return_value = self.pb.pb_inst_pbonly(ctypes.c_int(channel_bits | 0xE00000),
+                                                  ctypes.c_int(command),
+                                                  ctypes.c_int(command_arg),
+                                                  ctypes.c_double(duration))
 
             assert return_value >=0, 'There was an error while programming the pulseblaster'
         self.pb.pb_stop_programming()
@@ -754,9 +1814,9 @@ class B26PulseBlaster(PulseBlaster):
 
     _PROBES = {}
 
-    def __init__(self, name=None, settings=None):
+    def __init__(self, name=None, settings=None, spinapi=None):
         #COMMENT_ME
-        super(B26PulseBlaster, self).__init__(name, settings)
+        super(B26PulseBlaster, self).__init__(name, settings, spinapi)
 
 
     def update(self, settings):
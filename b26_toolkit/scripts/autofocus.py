@@ -22,6 +22,7 @@ from copy import deepcopy
 import numpy as np
 import scipy as sp
 from PyQt5.QtCore import pyqtSlot
+from b26_toolkit.core.timing import Timer, timed, store_timing
 from b26_toolkit.instruments import PiezoController, MaestroLightControl, OptotuneLens, PiezoControllerCold
 
 try:
@@ -53,7 +54,8 @@ Autofocus: Takes images at different piezo voltages and uses a heuristic to figu
         Parameter('use_current_z_axis_position', False, bool, 'Overrides z axis center position and instead uses the current piezo voltage as the center of the range'),
         Parameter('center_on_current_location', False, bool, 'Check to use current galvo location rather than center point in take_image'),
         Parameter('galvo_return_to_initial', False, bool, 'Check to return galvo location to initial value (before calling autofocus)'),
-        Parameter('reverse_scan', False, bool, 'If true, scans from highest value to lowest')
+        Parameter('reverse_scan', False, bool, 'If true, scans from highest value to lowest'),
+        Parameter('timing', False, bool, 'check to record the time spent in each phase (piezo, take_image, save_images, fit, plot) in data[\'timing\'] and save a chrome trace (-trace.json) with the data')
         # Parameter('galvo_position', 'take_image_pta', ['take_image', 'current_location', 'last_run'], 'select galvo location (center point in acquire_image, current location of galvo or location from previous run)')
     ]
 
@@ -64,6 +66,9 @@ Autofocus: Takes images at different piezo voltages and uses a heuristic to figu
 
     _INSTRUMENTS = {}
 
+    # replaced in _function by a timer that is enabled by the timing setting
+    timer = Timer(enabled=False)
+
     def __init__(self, scripts, instruments = None, name = None, settings = None, log_function = None, data_path = None):
         """
         Example of a script that emits a QT signal for the gui
@@ -142,12 +147,14 @@ Autofocus: Takes images at different piezo voltages and uses a heuristic to figu
                 self.init_image()
 
                 # set the voltage on the piezo
-                self._step_piezo(voltage, self.settings['wait_time'])
+                with self.timer.span('piezo'):
+                    self._step_piezo(voltage, self.settings['wait_time'])
                 self.log('take scan, position {:0.2f}'.format(voltage))
                 # update the tag of the suvbscript to reflect the current z position
                 self.scripts['take_image'].settings['tag'] = '{:s}_{:0.2f}'.format(take_image_tag, voltage)
                 # take a galvo scan
-                self.scripts['take_image'].run()
+                with self.timer.span('take_image'):
+                    self.scripts['take_image'].run()
                 self.data['current_image'] = deepcopy(self.scripts['take_image'].data['image_data'])
 
                 # calculate focusing function for this sweep
@@ -156,16 +163,19 @@ Autofocus: Takes images at different piezo voltages and uses a heuristic to figu
 
                 # save image if the user requests it
                 if self.settings['save_images']:
-                    self.scripts['take_image'].save_image_to_disk(
-                        '{:s}\\image_{:03d}.jpg'.format(self.filename_image, index))
-                    self.scripts['take_image'].save_data('{:s}\\image_{:03d}.csv'.format(self.filename_image, index),
-                                                         'image_data')
+                    with self.timer.span('save_images'):
+                        self.scripts['take_image'].save_image_to_disk(
+                            '{:s}\\image_{:03d}.jpg'.format(self.filename_image, index))
+                        self.scripts['take_image'].save_data('{:s}\\image_{:03d}.csv'.format(self.filename_image, index),
+                                                             'image_data')
 
                 self.progress = 100. * index / len(sweep_voltages)
                 self.updateProgress.emit(self.progress if self.progress < 100 else 99)
 
             self.scripts['take_image'].settings['tag'] = take_image_tag
 
+        self.timer = Timer(self.settings['timing'])
+
 
         if self.settings['save'] or self.settings['save_images']:
             self.filename_image = '{:s}\\image'.format(self.filename())
@@ -194,15 +204,19 @@ Autofocus: Takes images at different piezo voltages and uses a heuristic to figu
 
         autofocus_loop(sweep_voltages)
 
-        piezo_voltage, self.data['fit_parameters'] = self.fit_focus()
+        with self.timer.span('fit'):
+            piezo_voltage, self.data['fit_parameters'] = self.fit_focus()
 
         # set piezo value to the fit value if this is within the bounds of the piezo
         if piezo_voltage and piezo_voltage>0 and piezo_voltage<100:
             # set the voltage on the piezo
-            self._step_piezo(piezo_voltage, self.settings['wait_time'])
+            with self.timer.span('piezo'):
+                self._step_piezo(piezo_voltage, self.settings['wait_time'])
 
         self.log('autofocus fit result: {:s} V'.format(str(piezo_voltage)))
 
+        store_timing(self)
+
 
         # self._step_piezo(piezo_voltage, self.settings['wait_time'])
 
@@ -279,6 +293,7 @@ Autofocus: Takes images at different piezo voltages and uses a heuristic to figu
         """
         raise NotImplementedError
 
+    @timed('plot')
     def _plot(self, axes_list, data = None):
         # fit the data and set piezo to focus spot
         if data is None:
@@ -325,6 +340,7 @@ Autofocus: Takes images at different piezo voltages and uses a heuristic to figu
         axis_focus.set_ylabel(ylabel)
         axis_focus.set_title('Autofocusing Routine')
 
+    @timed('plot')
     def _update_plot(self, axes_list):
         # fit the data and set piezo to focus spot
 
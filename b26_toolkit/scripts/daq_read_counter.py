@@ -16,11 +16,9 @@
     along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import time
-from collections import deque
 import numpy as np
 
-from b26_toolkit.instruments import NI6259, NI9402
+from b26_toolkit.instruments import NI6259, NI9402, DAQStream
 from b26_toolkit.plotting.plots_1d import plot_counts, update_1d_simple, update_counts_vs_pos
 from pylabcontrol.core import Parameter, Script
 
@@ -35,7 +33,8 @@ If you want to use it make sure that the right instrument is defined in _INSTRUM
 
     """
     _DEFAULT_SETTINGS = [
-        Parameter('integration_time', .25, float, 'Time per data point (s)'),
+        Parameter('integration_time', .25, float, 'Time per data point of the plot (s)'),
+        Parameter('sample_rate', 100., float, 'Rate at which the counter is sampled and the counts are saved (Hz)'),
         Parameter('counter_channel', 'ctr0', ['ctr0', 'ctr1'], 'Daq channel used for counter'),
         Parameter('total_int_time', 3.0, float, 'Total time to integrate (s) (if -1 then it will go indefinitely)'), # added by ER 20180606
         Parameter('track_laser_power_photodiode1',
@@ -68,8 +67,8 @@ If you want to use it make sure that the right instrument is defined in _INSTRUM
         Script.__init__(self, name, settings=settings, scripts=scripts, instruments=instruments,
                         log_function=log_function, data_path=data_path)
 
-        self.data = {'counts': deque(), 'laser_power': deque(), 'normalized_counts': deque(), 'laser_power2': deque()}
-
+        self.data = {'counts': [], 'laser_power': [], 'normalized_counts': [], 'laser_power2': [], 'binned_counts': [],
+                     'binned_laser_power': []}
 
     def _function(self):
         """
@@ -81,102 +80,80 @@ If you want to use it make sure that the right instrument is defined in _INSTRUM
             print('cant use both photodiodes at the same time - only use one AI channel at a time, unfortunately :-(')
             return
 
-        sample_rate = float(2) / self.settings['integration_time']
-        normalization = self.settings['integration_time']/.001
-        self.instruments['daq']['instance'].settings['digital_input'][self.settings['counter_channel']]['sample_rate'] = sample_rate
-        self.data = {'counts': deque(), 'laser_power': deque(), 'normalized_counts': deque(), 'laser_power2': deque()}
-        self.last_value = 0
-        sample_num = 2
-
-        task = self.instruments['daq']['instance'].setup_counter("ctr0", sample_num, continuous_acquisition=True)
-
-        if self.settings['track_laser_power_photodiode1']['on/off'] == True:
-            aitask = self.instruments['daq']['instance'].setup_AI(self.settings['track_laser_power_photodiode1']['ai_channel'], sample_num,
-                                          continuous=True, # continuous sampling still reads every clock tick, here set to the clock of the counter
-                                          clk_source=task)
-
-        if self.settings['track_laser_power_photodiode2']['on/off'] == True:
-            aitask2 = self.instruments['daq']['instance'].setup_AI(self.settings['track_laser_power_photodiode2']['ai_channel'], sample_num,
-                                          continuous=True, # continuous sampling still reads every clock tick, here set to the clock of the counter
-                                          clk_source=task)
-            print('aitask2: ', aitask2)
+        daq = self.instruments['daq']['instance']
+        sample_rate = self.settings['sample_rate']
+        self.data = {'counts': [], 'laser_power': [], 'normalized_counts': [], 'laser_power2': [], 'binned_counts': [],
+                     'binned_laser_power': []}
+
+        ai_channels = []
+        laser_power_key = None
+        if self.settings['track_laser_power_photodiode1']['on/off']:
+            # continuous sampling still reads every clock tick, here set to the clock of the counter
+            ai_channels = [self.settings['track_laser_power_photodiode1']['ai_channel']]
+            laser_power_key = 'laser_power'
+        elif self.settings['track_laser_power_photodiode2']['on/off']:
+            ai_channels = [self.settings['track_laser_power_photodiode2']['ai_channel']]
+            laser_power_key = 'laser_power2'
+
+        # the counts are saved at the full rate and averaged over the integration time for the plot
+        stream = DAQStream(daq, self.settings['counter_channel'], ai_channels, sample_rate=sample_rate)
+        full_rate = stream.subscribe()
+        binned = stream.subscribe(decimation=max(int(round(self.settings['integration_time'] * sample_rate)), 1))
 
         # maximum number of samples if total_int_time > 0
         if self.settings['total_int_time'] > 0:
-            max_samples = np.floor(self.settings['total_int_time']/self.settings['integration_time'])
-
-        # start counter and scanning sequence
-        if (self.settings['track_laser_power_photodiode1']['on/off'] and not self.settings['track_laser_power_photodiode2']['on/off']):
-            self.instruments['daq']['instance'].run(aitask)
-        elif (self.settings['track_laser_power_photodiode2']['on/off'] and not self.settings['track_laser_power_photodiode1']['on/off']):
-            self.instruments['daq']['instance'].run(aitask2)
-
-        self.instruments['daq']['instance'].run(task)
-
-        # ER 20180827 wait for at least one clock tick to go by to start with a full clock tick of acquisition time for the first bin
-        time.sleep(self.settings['integration_time'])
-
-        sample_index = 0 # keep track of samples made to know when to stop if finite integration time
-
-        while True:
-            if self._abort:
-                break
-
-            # TODO: this is currently a nonblocking read so we add a time.sleep at the end so it doesn't read faster
-            # than it acquires, this should be replaced with a blocking read in the future
-            if self.settings['track_laser_power_photodiode1']['on/off'] == True:
-                raw_data_laser, num_read_laser = self.instruments['daq']['instance'].read(aitask)
-            if self.settings['track_laser_power_photodiode2']['on/off'] == True:
-                raw_data_laser2, num_read_laser2 = self.instruments['daq']['instance'].read(aitask2)
-
-            raw_data, num_read = self.instruments['daq']['instance'].read(task)
-            #skip first read, which gives an anomolous value
-            if num_read.value == 1:
-                self.last_value = raw_data[0] #update running value to last measured value to prevent count spikes
-                time.sleep(2.0 / sample_rate)
-                continue
-
-            tmp_count = 0
-            for value in raw_data:
-                new_val = ((float(value) - self.last_value) / normalization)
-                self.data['counts'].append(new_val)
-                self.last_value = value
-                if self.settings['track_laser_power_photodiode1']['on/off'] == True:
-                    self.data['laser_power'].append(raw_data_laser[tmp_count])
-                if self.settings['track_laser_power_photodiode2']['on/off'] == True:
-                    self.data['laser_power2'].append(raw_data_laser2[tmp_count])
-
-                tmp_count = tmp_count + 1
+            max_samples = int(np.floor(self.settings['total_int_time'] * sample_rate))
+
+        stream.start()
+        while not self._abort and stream.error is None:
+            samples = full_rate.read(timeout=self.settings['integration_time'])
+            # counts per sample interval in kcounts/s
+            self.data['counts'].extend((samples[:, 0] * sample_rate / 1000).tolist())
+            if laser_power_key is not None:
+                self.data[laser_power_key].extend(samples[:, 1].tolist())
+
+            binned_samples = binned.read()
+            self.data['binned_counts'].extend((binned_samples[:, 0] * sample_rate / 1000).tolist())
+            if laser_power_key is not None:
+                self.data['binned_laser_power'].extend(binned_samples[:, 1].tolist())
 
             if self.settings['total_int_time'] > 0:
-                self.progress = sample_index/max_samples
+                self.progress = 100. * len(self.data['counts']) / max_samples
+                if len(self.data['counts']) >= max_samples:  # if the maximum integration time is hit
+                    break
             else:
                 self.progress = 50.
-            self.updateProgress.emit(int(self.progress))
-
-            time.sleep(2.0 / sample_rate)
-            sample_index = sample_index + 1
-            if self.settings['total_int_time'] > 0. and sample_index >= max_samples: # if the maximum integration time is hit
-                self._abort = True # tell the script to abort
+            self.updateProgress.emit(int(min(self.progress, 99)))
 
         # clean up APD tasks
-        self.instruments['daq']['instance'].stop(task)
-        if self.settings['track_laser_power_photodiode1']['on/off'] == True:
-            self.instruments['daq']['instance'].stop(aitask)
-        if self.settings['track_laser_power_photodiode2']['on/off'] == True:
-            self.instruments['daq']['instance'].stop(aitask2)
+        stream.stop()
+        if stream.error is not None:
+            self.log('daq stream stopped: {:s}'.format(stream.error))
+        if stream.num_overflows > 0 or full_rate.num_lost > 0:
+            self.log('daq buffer overflowed {:d} times, {:d} samples were lost'.format(stream.num_overflows,
+                                                                                    full_rate.num_lost))
 
-        self.data['counts'] = list(self.data['counts'])
+        if self.settings['total_int_time'] > 0:
+            self.data['counts'] = self.data['counts'][:max_samples]
+            if laser_power_key is not None:
+                self.data[laser_power_key] = self.data[laser_power_key][:max_samples]
 
         if self.settings['track_laser_power_photodiode1']['on/off'] == True:
-            self.data['laser_power'] = list(self.data['laser_power'])
             self.data['normalized_counts'] = list(np.divide(np.multiply(self.data['counts'], np.mean(self.data['laser_power'])), self.data['laser_power']))
-        if self.settings['track_laser_power_photodiode2']['on/off'] == True:
-            self.data['laser_power2'] = list(self.data['laser_power2'])
 
     def plot(self, figure_list):
         super(Daq_Read_Counter, self).plot([figure_list[1]])
 
+    def _counts_to_plot(self, data):
+        """
+        Returns: the counts averaged over the integration time, normalized to the laser power if it is tracked
+        """
+        counts = np.array(data.get('binned_counts', data['counts']))
+        laser_power = np.array(data.get('binned_laser_power', []))
+        if self.settings['track_laser_power_photodiode1']['on/off'] == True and len(laser_power) == len(counts):
+            counts = counts * np.mean(laser_power) / laser_power
+        return counts
+
     def _plot(self, axes_list, data = None):
         # COMMENT_ME
 
@@ -184,23 +161,14 @@ If you want to use it make sure that the right instrument is defined in _INSTRUM
             data = self.data
 
         if len(data['counts']) > 0:
-            if self.settings['track_laser_power_photodiode1']['on/off'] == True:
-                array_to_plot = np.delete(np.divide(np.multiply(self.data['counts'], np.mean(self.data['laser_power'])), self.data['laser_power']),0)
-            else:
-                array_to_plot = np.delete(data['counts'], 0)
-
-            plot_counts(axes_list[0], array_to_plot)
+            plot_counts(axes_list[0], self._counts_to_plot(data))
 
     def _update_plot(self, axes_list, data = None):
         if data is None:
             data = self.data
 
         if data:
-            if self.settings['track_laser_power_photodiode1']['on/off'] == True:
-                array_to_plot = np.delete(np.divide(np.multiply(self.data['counts'], np.mean(self.data['laser_power'])), self.data['laser_power']), 0)
-            else:
-                array_to_plot = np.delete(data['counts'], 0)
-
+            array_to_plot = self._counts_to_plot(data)
             update_counts_vs_pos(axes_list[0], array_to_plot, np.linspace(0, len(array_to_plot), len(array_to_plot)))
 
 
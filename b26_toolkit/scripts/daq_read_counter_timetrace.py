@@ -16,12 +16,9 @@
     along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import time
-from collections import deque
 import numpy as np
-from copy import deepcopy
 
-from b26_toolkit.instruments import NI6259, NI9402, NI9219
+from b26_toolkit.instruments import NI6259, NI9402, NI9219, DAQStream
 from b26_toolkit.plotting.plots_1d import plot_counts, update_counts,  plot_psd
 from pylabcontrol.core import Parameter, Script
 from pylabcontrol.data_processing.signal_processing import power_spectral_density
@@ -56,13 +53,6 @@ This script reads the Counter input from the DAQ for a give duration and plots t
         self.data = {'counts':[]}
 
 
-    def get_daq_task(self, number_of_samples):
-
-        # initialize APD thread
-        ctrtask = self.daq.setup_counter(
-            self.settings['counter_channel'], number_of_samples + 1)
-        return ctrtask
-
     def _function(self):
         """
         This is the actual function that will be executed. It uses only information that is provided in the settings property
@@ -74,10 +64,7 @@ This script reads the Counter input from the DAQ for a give duration and plots t
         elif self.settings['daq_type'] == 'cDAQ':
             self.daq = self.instruments['NI9402']['instance']
 
-
         sample_rate = float(1) / self.settings['integration_time']
-        # normalization = self.settings['integration_time']/.001
-        self.daq.settings['digital_input'][self.settings['counter_channel']]['sample_rate'] = sample_rate
 
         # maximum number of samples if total_int_time > 0
         if self.settings['total_int_time'] > 0:
@@ -86,19 +73,23 @@ This script reads the Counter input from the DAQ for a give duration and plots t
             self.log('total measurement time must be positive. Abort script')
             return
 
-        self.progress = 50
-        self.updateProgress.emit(self.progress)
-
-        daq_task = self.get_daq_task(number_of_samples)
-        # start counter and scanning sequence
-        self.daq.run(daq_task)
-
-        data, _ = self.daq.read(daq_task)
-
-        self.daq.stop(daq_task)
-        counts = np.diff(data)  # counter gives the accumulated counts, thus the diff gives the counts per interval
-
-        self.data['counts'] = counts * sample_rate/1000  # multiply by the sample rate to get kcounts /second
+        # the counts are streamed, so that the progress and the plot follow the acquisition
+        stream = DAQStream(self.daq, self.settings['counter_channel'], sample_rate=sample_rate,
+                           buffer_time=max(self.settings['total_int_time'], 1.))
+        subscriber = stream.subscribe()
+        self.data = {'counts': []}
+        stream.start()
+        while len(self.data['counts']) < number_of_samples and not self._abort and stream.error is None:
+            counts = subscriber.read(timeout=self.settings['integration_time'],
+                                     max_samples=number_of_samples - len(self.data['counts']))[:, 0]
+            self.data['counts'].extend(counts * sample_rate / 1000)  # multiply by the sample rate to get kcounts /second
+            self.progress = 100. * len(self.data['counts']) / number_of_samples
+            self.updateProgress.emit(int(min(self.progress, 99)))
+        stream.stop()
+        if stream.error is not None:
+            self.log('daq stream stopped: {:s}'.format(stream.error))
+
+        self.data['counts'] = np.array(self.data['counts'])
 
     def plot(self, figure_list):
         super(Daq_Read_Counter_TimeTrace, self).plot(figure_list)
@@ -21,7 +21,7 @@ import time
 import numpy as np
 
 
-from b26_toolkit.instruments import NI6259,PiezoController
+from b26_toolkit.instruments import NI6259, PiezoController, DAQStream
 from pylabcontrol.core import Parameter, Script
 from b26_toolkit.plotting.plots_1d import plot_1d_simple_timetrace_ns, update_1d_simple
 
@@ -148,29 +148,27 @@ SimplePiezoSweep: Reads analog input (e.g. from photodiode) at different piezo v
         This is the actual function that will be executed. It uses only information that is provided in the settings property
         will be overwritten in the __init__
         """
-        self.data['times'] = np.linspace(0, self.settings['acquisition_time']*1e9, self.settings['acquisition_time']*self.settings['sample_rate'])
-        self.data['voltages'] = []
-
         sample_rate = self.settings['sample_rate']
         channel = self.settings['ai_channel']
-        self.instruments['daq']['instance'].settings['analog_input'][channel]['sample_rate'] = sample_rate
-
-        task = self.instruments['daq']['instance'].setup_AI(channel, 1000, continuous = True)
-        self.instruments['daq']['instance'].run(task)
-
-        start_time = time.time()
-        while ((time.time() - start_time) < self.settings['acquisition_time']):
-            if self._abort:
-                break
-
-            raw_data, num_read = self.instruments['daq']['instance'].read(task)
-            self.data['voltages'] = self.data['voltages'] + list(raw_data)
-
-            self.progress = 50.
-            self.updateProgress.emit(int(self.progress))
+        number_of_samples = int(self.settings['acquisition_time'] * sample_rate)
+        self.data['times'] = np.linspace(0, self.settings['acquisition_time']*1e9, number_of_samples)
+        self.data['voltages'] = []
 
-        # clean up APD tasks
-        self.instruments['daq']['instance'].stop(task)
+        # the voltages are streamed into a ring buffer by a reader thread and collected here at full rate
+        stream = DAQStream(self.instruments['daq']['instance'], ai_channels=[channel], sample_rate=sample_rate)
+        subscriber = stream.subscribe()
+        stream.start()
+        while len(self.data['voltages']) < number_of_samples and not self._abort and stream.error is None:
+            voltages = subscriber.read(timeout=1., max_samples=number_of_samples - len(self.data['voltages']))
+            self.data['voltages'].extend(voltages[:, 0].tolist())
+
+            self.progress = 100. * len(self.data['voltages']) / number_of_samples
+            self.updateProgress.emit(int(min(self.progress, 99)))
+
+        # clean up AI task
+        stream.stop()
+        if stream.error is not None:
+            self.log('daq stream stopped: {:s}'.format(stream.error))
 
 
     def _plot(self, axes_list, data = None):
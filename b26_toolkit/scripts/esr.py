@@ -26,6 +26,8 @@ from b26_toolkit.plotting.plots_1d import plot_esr
 
 # from b26_toolkit.plotting.plots_1d import plot_diff_freq_vs_freq
 from b26_toolkit.data_processing.esr_signal_processing import fit_esr
+from b26_toolkit.core.timing import Timer, timed, store_timing
+from b26_toolkit.core.sweep_order import SweepOrder
 import time
 import random
 
@@ -141,8 +143,8 @@ class ESR_DAQ_FM(Script):
 
             time.sleep(self.settings['mw_generator_switching_time'])
 
-            ctrtask = self.daq_in.setup_counter("ctr0", len(freq_voltage_array) + 1)
-            aotask = self.daq_out.setup_AO(["ao2"], freq_voltage_array, ctrtask)
+            ctrtask = self.daq_in.setup_counter("ctr0", len(freq_voltage_array) + 1, pooled=True)
+            aotask = self.daq_out.setup_AO(["ao2"], freq_voltage_array, ctrtask, pooled=True)
 
             if self.settings['track_laser_power']['on/off'] == True and self.settings['daq_type'] == 'PCI':
                 aitask = self.daq_in.setup_AI(self.settings['track_laser_power']['ai_channel'], len(freq_voltage_array), continuous=False, clk_source=ctrtask) # for optional arguments spell out every one if there are multiple
@@ -370,8 +372,13 @@ class ESR_simple(Script):
                       Parameter('contrast_factor', 1.5, float, 'minimum contrast for an ESR to not be considered noise')
                   ]),
         Parameter('randomize', True, bool, 'check to randomize esr frequencies'),
+        Parameter('sweep_order', [
+            Parameter('mode', 'shuffle', SweepOrder.MODES, 'order of the frequencies in each average if randomize is checked: shuffle (random permutation), stratified (rounds that take one frequency of each part of the range) or low_discrepancy (golden ratio sequence, consecutive frequencies are far apart)'),
+            Parameter('seed', 0, int, 'seed of the orders, 0 draws a new seed (the seed is saved in data[\'sweep_order_seed\'], the orders in data[\'index_data\'])')
+        ]),
         Parameter('save_timetrace', True, bool,
-                  'check to save the measured fluorescence over time. This is identical to the full esr when the freq. are not randomized')
+                  'check to save the measured fluorescence over time. This is identical to the full esr when the freq. are not randomized'),
+        Parameter('timing', False, bool, 'check to record the time spent in each phase (mw_frequency, daq_arm, acquire, readback, fit, plot) in data[\'timing\'] and save a chrome trace (-trace.json) with the data')
     ]
 
     _INSTRUMENTS = {
@@ -458,11 +465,16 @@ class ESR_simple(Script):
 
         return freq_values, freq_range
 
-    def run_sweep(self, freq_values, time_tracking=False):
+    def run_sweep(self, freq_values, order=None):
         '''
 
         Actually runs the ESR sweep, for a single average.
 
+        Args:
+            freq_values: frequencies of the sweep
+            order (optional): indices of the frequencies in the order in which they are measured (see SweepOrder), if
+                None a new random order (or their order if randomize is unchecked)
+
         Returns:
             esr_data
             laser_data
@@ -470,9 +482,6 @@ class ESR_simple(Script):
 
         '''
 
-        if time_tracking:
-            start_run_sweep = time.time()
-
         num_samps = self.settings[
                         'num_samps_per_pt'] + 1  # acquire this many samples per point. The counter starts in the middle of a
         # clock tick, so throw out the first sample and take num_samps_per_pt + 1 samples
@@ -480,42 +489,30 @@ class ESR_simple(Script):
         # initialize data arrays
         single_sweep_data = np.zeros(len(freq_values))
 
-        indeces = list(range(len(freq_values)))
-        if self.settings['randomize']:
-            random.shuffle(indeces)
+        if order is None:
+            order = SweepOrder(len(freq_values), 'shuffle' if self.settings['randomize'] else 'sequential').block(0)
+        indeces = order
 
         for freq_index in indeces:
 
-            single_freq_start_t = time.time()
-
             if self._abort:
                 break
 
             freq = freq_values[freq_index]
 
             # change MW frequency
-            self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
-            time.sleep(self.settings['mw_generator_switching_time'])
-
-            if time_tracking:
-                print('time for a single SRS frequency change: ' + str(time.time() - single_freq_start_t) + ' s')
+            with self.timer.span('mw_frequency'):
+                self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
+                time.sleep(self.settings['mw_generator_switching_time'])
 
             single_sweep_data[freq_index] = self.measure_signal(num_samps)
 
-            if time_tracking:
-                print('time for a single frequency data point: ' + str(time.time() - single_freq_start_t) + ' s')
-
         # normalize  single sweep data to kcounts/sec
         single_sweep_data = single_sweep_data * (.001 / self.settings['integration_time'])
 
-        end_run_sweep = time.time()
-
-        if time_tracking:
-            print('run sweep took: ' + str(end_run_sweep - start_run_sweep) + ' s')
-
         return single_sweep_data, indeces
 
-    def measure_signal(self, num_samps, time_tracking=False):
+    def measure_signal(self, num_samps):
         """
 
         measure the signal with the APD
@@ -526,39 +523,21 @@ class ESR_simple(Script):
         Returns:
 
         """
-        if time_tracking:
-            start_meas = time.time()
-
         # setup the tasks
-        ctrtask = self.daq_in.setup_counter("ctr0", num_samps)
-
-        if time_tracking:
-            t2 = time.time() - start_meas
-            print('time to setup the task: ' + str(t2) + ' s')
-
-        self.daq_in.run(ctrtask)  # the counter clock turns on and starts the AI task
-
-        time.sleep(self.settings['integration_time'])
+        with self.timer.span('daq_arm'):
+            ctrtask = self.daq_in.setup_counter("ctr0", num_samps, pooled=True)
+            self.daq_in.run(ctrtask)  # the counter clock turns on and starts the AI task
 
-        if time_tracking:
-            t4 = time.time() - start_meas
-            print('time elapsed up to sleep: ' + str(t4) + ' s')
+        with self.timer.span('acquire'):
+            time.sleep(self.settings['integration_time'])
 
         # read the data
-        raw_data, _ = self.daq_in.read_counter(ctrtask)
-
-        signal = np.sum(np.diff(raw_data))  # take the total counts, neglecting the first element
+        with self.timer.span('readback'):
+            raw_data, _ = self.daq_in.read_counter(ctrtask)
 
-        self.daq_in.stop(ctrtask)  # stop the clock task last
+            signal = np.sum(np.diff(raw_data))  # take the total counts, neglecting the first element
 
-        if time_tracking:
-            t6 = time.time() - start_meas
-            print('time elapsed up to stopping the task: ' + str(t6) + ' s')
-            print('diff-ing all times: ')
-            print('setup: ', t2)
-            print('running: ', t4 - t2)
-            print('stopping: ', t6 - t4)
-            print('total time: ', time.time() - start_meas)
+            self.daq_in.stop(ctrtask)  # stop the clock task last
 
         return signal
 
@@ -571,6 +550,7 @@ class ESR_simple(Script):
         self.lines = []
 
         start_time = time.time()
+        self.timer = Timer(self.settings['timing'])
 
         # setup the daq
         self.setup_daq()
@@ -584,6 +564,11 @@ class ESR_simple(Script):
         # get the frequencices of the sweep
         freq_values, freq_range = self.get_freq_array()
         self.data.update({'frequency': freq_values})
+        # the order of the frequencies in every average, see SweepOrder
+        mode = self.settings['sweep_order']['mode'] if self.settings['randomize'] else 'sequential'
+        sweep_order = SweepOrder(len(freq_values), mode, self.settings['sweep_order']['seed'])
+        orders = sweep_order.blocks(self.settings['esr_avg'])
+        self.data.update({'sweep_order_seed': sweep_order.seed})
         # initialize data arrays
         esr_data = np.zeros((self.settings['esr_avg'], len(freq_values)))  # for the raw esr data
 
@@ -601,7 +586,7 @@ class ESR_simple(Script):
                 np.round(time.time() - start_time, 1)) + 's')
 
             # get the data for a single sweep. These are raw data.
-            single_sweep_data, indeces = self.run_sweep(freq_values)
+            single_sweep_data, indeces = self.run_sweep(freq_values, orders[scan_num])
 
             # save the single sweep data
             esr_data[scan_num] = single_sweep_data
@@ -613,8 +598,9 @@ class ESR_simple(Script):
             esr_avg = np.mean(esr_data[0:(scan_num + 1)], axis=0)
 
             # fit to the data
-            fit_params = fit_esr(freq_values, esr_avg, min_counts=self.settings['fit_constants']['minimum_counts'],
-                                 contrast_factor=self.settings['fit_constants']['contrast_factor'])
+            with self.timer.span('fit'):
+                fit_params = fit_esr(freq_values, esr_avg, min_counts=self.settings['fit_constants']['minimum_counts'],
+                                     contrast_factor=self.settings['fit_constants']['contrast_factor'])
 
             self.data.update({'data': esr_avg, 'fit_params': fit_params})
 
@@ -632,6 +618,8 @@ class ESR_simple(Script):
         if self.settings['turn_off_after']:
             self.instruments['microwave_generator']['instance'].update({'enable_output': False})
 
+        store_timing(self)
+
     def _calc_progress(self, scan_num):
         # COMMENT_ME
 
@@ -639,6 +627,7 @@ class ESR_simple(Script):
         self.progress = progress
         return int(progress)
 
+    @timed('plot')
     def _plot(self, axes_list, data=None):
         """
         plotting function for esr
@@ -700,6 +689,7 @@ class ESR(Script):
                       Parameter('ai_channel', 'ai4', ['ai0', 'ai1', 'ai2', 'ai3', 'ai4'], 'channel to use for analog input, to which the photodiode is connected')
                   ]),
         Parameter('randomize', True, bool, 'check to randomize esr frequencies'),
+        Parameter('timing', False, bool, 'check to record the time spent in each phase (mw_frequency, daq_arm, acquire, readback, fit, plot) in data[\'timing\'] and save a chrome trace (-trace.json) with the data')
     ]
 
     _INSTRUMENTS = {
@@ -826,35 +816,39 @@ class ESR(Script):
             freq = freq_values[freq_index]
 
             # change MW frequency
-            self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
-            time.sleep(self.settings['mw_generator_switching_time'])
+            with self.timer.span('mw_frequency'):
+                self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
+                time.sleep(self.settings['mw_generator_switching_time'])
 
             # setup the tasks
-            ctrtask = self.daq_in.setup_counter("ctr0", num_samps)
-            if self.settings['track_laser_power']['on/off']:
-                aitask = self.daq_in.setup_AI(self.settings['track_laser_power']['ai_channel'], num_samps,
-                                              continuous=False, clk_source=ctrtask)
-
-            if self.settings['track_laser_power']['on/off']:
-                self.daq_in.run(aitask) # AI is actually tied to the clock, when this runs the clock actually starts
-
-            self.daq_in.run(ctrtask) # the counter clock turns on and starts the AI task
-            time.sleep(self.settings['integration_time'])
+            with self.timer.span('daq_arm'):
+                ctrtask = self.daq_in.setup_counter("ctr0", num_samps, pooled=True)
+                if self.settings['track_laser_power']['on/off']:
+                    aitask = self.daq_in.setup_AI(self.settings['track_laser_power']['ai_channel'], num_samps,
+                                                  continuous=False, clk_source=ctrtask)
+
+                if self.settings['track_laser_power']['on/off']:
+                    self.daq_in.run(aitask) # AI is actually tied to the clock, when this runs the clock actually starts
+
+                self.daq_in.run(ctrtask) # the counter clock turns on and starts the AI task
+            with self.timer.span('acquire'):
+                time.sleep(self.settings['integration_time'])
            # if self.settings['track_laser_power']['on/off']:
            #     self.daq_out.waitToFinish(aitask) # wait for the tasks to be done
 
             # read the data
-            raw_data, _ = self.daq_in.read_counter(ctrtask)
-            single_sweep_data[freq_index] = np.sum(np.diff(raw_data)) # take the total counts, neglecting the first element
+            with self.timer.span('readback'):
+                raw_data, _ = self.daq_in.read_counter(ctrtask)
+                single_sweep_data[freq_index] = np.sum(np.diff(raw_data)) # take the total counts, neglecting the first element
 
-            if self.settings['track_laser_power']['on/off']:
-                raw_data_laser, _ = self.daq_in.read(aitask)
-                single_sweep_laser_data[freq_index] = np.mean(raw_data_laser)
+                if self.settings['track_laser_power']['on/off']:
+                    raw_data_laser, _ = self.daq_in.read(aitask)
+                    single_sweep_laser_data[freq_index] = np.mean(raw_data_laser)
 
-            # clean up APD tasks
-            if self.settings['track_laser_power']['on/off']:
-                self.daq_in.stop(aitask)  # only stop teh ai task when you've extracted the data you need!!
-            self.daq_in.stop(ctrtask)  # stop the clock task last
+                # clean up APD tasks
+                if self.settings['track_laser_power']['on/off']:
+                    self.daq_in.stop(aitask)  # only stop teh ai task when you've extracted the data you need!!
+                self.daq_in.stop(ctrtask)  # stop the clock task last
 
         return single_sweep_data, single_sweep_laser_data
 
@@ -865,6 +859,7 @@ class ESR(Script):
         """
 
         start_time = time.time()
+        self.timer = Timer(self.settings['timing'])
 
         # if tracking laser power drifts, check for PCI daq
         if self.settings['track_laser_power']['on/off'] and not self.settings['daq_type'] == 'PCI':
@@ -931,12 +926,14 @@ class ESR(Script):
 
             if not self.settings['track_laser_power']['on/off']:
                 # fit to the data
-                fit_params = fit_esr(freq_values, esr_avg, min_counts = self.settings['fit_constants']['minimum_counts'],
-                                    contrast_factor=self.settings['fit_constants']['contrast_factor'])
+                with self.timer.span('fit'):
+                    fit_params = fit_esr(freq_values, esr_avg, min_counts = self.settings['fit_constants']['minimum_counts'],
+                                        contrast_factor=self.settings['fit_constants']['contrast_factor'])
             elif self.settings['track_laser_power']['on/off']:
                 # fit to the data
-                fit_params = fit_esr(freq_values, data_laser_norm, min_counts = self.settings['fit_constants']['minimum_counts'],
-                                    contrast_factor=self.settings['fit_constants']['contrast_factor'])
+                with self.timer.span('fit'):
+                    fit_params = fit_esr(freq_values, data_laser_norm, min_counts = self.settings['fit_constants']['minimum_counts'],
+                                        contrast_factor=self.settings['fit_constants']['contrast_factor'])
 
                 # save the data
                 self.data.update({'laser_data': laser_data})
@@ -958,6 +955,8 @@ class ESR(Script):
         if self.settings['turn_off_after']:
             self.instruments['microwave_generator']['instance'].update({'enable_output': False})
 
+        store_timing(self)
+
     def _calc_progress(self, scan_num):
         #COMMENT_ME
 
@@ -965,6 +964,7 @@ class ESR(Script):
         self.progress = progress
         return int(progress)
 
+    @timed('plot')
     def _plot(self, axes_list, data = None):
         """
         plotting function for esr
@@ -1024,7 +1024,12 @@ class ESR_simple(Script):
                       Parameter('contrast_factor', 1.5, float, 'minimum contrast for an ESR to not be considered noise')
                   ]),
         Parameter('randomize', True, bool, 'check to randomize esr frequencies'),
-        Parameter('save_timetrace', True, bool, 'check to save the measured fluorescence over time. This is identical to the full esr when the freq. are not randomized')
+        Parameter('sweep_order', [
+            Parameter('mode', 'shuffle', SweepOrder.MODES, 'order of the frequencies in each average if randomize is checked: shuffle (random permutation), stratified (rounds that take one frequency of each part of the range) or low_discrepancy (golden ratio sequence, consecutive frequencies are far apart)'),
+            Parameter('seed', 0, int, 'seed of the orders, 0 draws a new seed (the seed is saved in data[\'sweep_order_seed\'], the orders in data[\'index_data\'])')
+        ]),
+        Parameter('save_timetrace', True, bool, 'check to save the measured fluorescence over time. This is identical to the full esr when the freq. are not randomized'),
+        Parameter('timing', False, bool, 'check to record the time spent in each phase (mw_frequency, daq_arm, acquire, readback, fit, plot) in data[\'timing\'] and save a chrome trace (-trace.json) with the data')
     ]
 
     _INSTRUMENTS = {
@@ -1106,11 +1111,16 @@ class ESR_simple(Script):
 
         return freq_values, freq_range
 
-    def run_sweep(self, freq_values):
+    def run_sweep(self, freq_values, order=None):
         '''
 
         Actually runs the ESR sweep, for a single average.
 
+        Args:
+            freq_values: frequencies of the sweep
+            order (optional): indices of the frequencies in the order in which they are measured (see SweepOrder), if
+                None a new random order (or their order if randomize is unchecked)
+
         Returns:
             esr_data
             laser_data
@@ -1118,44 +1128,33 @@ class ESR_simple(Script):
 
         '''
 
-        start_run_sweep = time.time()
-
         num_samps = self.settings['num_samps_per_pt'] + 1 # acquire this many samples per point. The counter starts in the middle of a
                                                           # clock tick, so throw out the first sample and take num_samps_per_pt + 1 samples
 
         # initialize data arrays
         single_sweep_data = np.zeros(len(freq_values))
 
-        indeces = list(range(len(freq_values)))
-        if self.settings['randomize']:
-            random.shuffle(indeces)
+        if order is None:
+            order = SweepOrder(len(freq_values), 'shuffle' if self.settings['randomize'] else 'sequential').block(0)
+        indeces = order
 
         for freq_index in indeces:
 
-            single_freq_start_t = time.time()
-
             if self._abort:
                 break
 
             freq = freq_values[freq_index]
 
             # change MW frequency
-            self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
-            time.sleep(self.settings['mw_generator_switching_time'])
-
-            print('time for a single SRS frequency change: ' + str(time.time() - single_freq_start_t) + ' s')
+            with self.timer.span('mw_frequency'):
+                self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
+                time.sleep(self.settings['mw_generator_switching_time'])
 
             single_sweep_data[freq_index] = self.measure_signal(num_samps)
 
-            print('time for a single frequency data point: ' + str(time.time() - single_freq_start_t) + ' s')
-
         # normalize  single sweep data to kcounts/sec
         single_sweep_data = single_sweep_data * (.001 / self.settings['integration_time'])
 
-        end_run_sweep = time.time()
-
-        print('run sweep took: ' + str(end_run_sweep-start_run_sweep) + ' s')
-
         return single_sweep_data, indeces
 
     def measure_signal(self, num_samps):
@@ -1169,43 +1168,21 @@ class ESR_simple(Script):
         Returns:
 
         """
-
-        start_meas = time.time()
-
         # setup the tasks
-        ctrtask = self.daq_in.setup_counter("ctr0", num_samps)
-
-        t2 = time.time()-start_meas
-        print('time to setup the task: ' + str(t2) + ' s')
-
-        self.daq_in.run(ctrtask)  # the counter clock turns on and starts the AI task
+        with self.timer.span('daq_arm'):
+            ctrtask = self.daq_in.setup_counter("ctr0", num_samps, pooled=True)
+            self.daq_in.run(ctrtask)  # the counter clock turns on and starts the AI task
 
-     #   t3 = time.time()-t2
-     #   print('time to run the task: ' + str(t3) + ' s')
-
-        time.sleep(self.settings['integration_time'])
-
-        t4 = time.time()-start_meas
-        print('time elapsed up to sleep: ' + str(t4) + ' s')
+        with self.timer.span('acquire'):
+            time.sleep(self.settings['integration_time'])
 
         # read the data
-        raw_data, _ = self.daq_in.read_counter(ctrtask)
-
-      #  t5 = time.time()-t4
-     #   print('time taken to read the signal: ' + str(t5) + ' s')
-
-        signal = np.sum(np.diff(raw_data))  # take the total counts, neglecting the first element
-
-        self.daq_in.stop(ctrtask)  # stop the clock task last
+        with self.timer.span('readback'):
+            raw_data, _ = self.daq_in.read_counter(ctrtask)
 
-        t6 = time.time() - start_meas
-        print('time elapsed up to stopping the task: ' + str(t6) + ' s')
+            signal = np.sum(np.diff(raw_data))  # take the total counts, neglecting the first element
 
-        print('diff-ing all times: ')
-        print('setup: ', t2)
-        print('running: ', t4-t2)
-        print('stopping: ', t6-t4)
-        print('total time: ', time.time() - start_meas)
+            self.daq_in.stop(ctrtask)  # stop the clock task last
 
         return signal
 
@@ -1219,6 +1196,7 @@ class ESR_simple(Script):
         self.lines = []
 
         start_time = time.time()
+        self.timer = Timer(self.settings['timing'])
 
         # setup the daq
         self.setup_daq()
@@ -1232,6 +1210,11 @@ class ESR_simple(Script):
         # get the frequencices of the sweep
         freq_values, freq_range = self.get_freq_array()
         self.data.update({'frequency': freq_values})
+        # the order of the frequencies in every average, see SweepOrder
+        mode = self.settings['sweep_order']['mode'] if self.settings['randomize'] else 'sequential'
+        sweep_order = SweepOrder(len(freq_values), mode, self.settings['sweep_order']['seed'])
+        orders = sweep_order.blocks(self.settings['esr_avg'])
+        self.data.update({'sweep_order_seed': sweep_order.seed})
         # initialize data arrays
         esr_data = np.zeros((self.settings['esr_avg'], len(freq_values))) # for the raw esr data
 
@@ -1249,7 +1232,7 @@ class ESR_simple(Script):
             self.log('starting average ' + str(scan_num) + ', time elapsed: ' + str(np.round(time.time()-start_time, 1)) + 's')
 
             # get the data for a single sweep. These are raw data.
-            single_sweep_data, indeces = self.run_sweep(freq_values)
+            single_sweep_data, indeces = self.run_sweep(freq_values, orders[scan_num])
 
             # save the single sweep data
             esr_data[scan_num] = single_sweep_data
@@ -1261,8 +1244,9 @@ class ESR_simple(Script):
             esr_avg = np.mean(esr_data[0:(scan_num + 1)], axis=0)
 
             # fit to the data
-            fit_params = fit_esr(freq_values, esr_avg, min_counts = self.settings['fit_constants']['minimum_counts'],
-                                contrast_factor=self.settings['fit_constants']['contrast_factor'])
+            with self.timer.span('fit'):
+                fit_params = fit_esr(freq_values, esr_avg, min_counts = self.settings['fit_constants']['minimum_counts'],
+                                    contrast_factor=self.settings['fit_constants']['contrast_factor'])
 
             self.data.update({'data': esr_avg, 'fit_params': fit_params})
 
@@ -1281,6 +1265,8 @@ class ESR_simple(Script):
         if self.settings['turn_off_after']:
             self.instruments['microwave_generator']['instance'].update({'enable_output': False})
 
+        store_timing(self)
+
     def _calc_progress(self, scan_num):
         #COMMENT_ME
 
@@ -1288,6 +1274,7 @@ class ESR_simple(Script):
         self.progress = progress
         return int(progress)
 
+    @timed('plot')
     def _plot(self, axes_list, data = None):
         """
         plotting function for esr
@@ -1361,33 +1348,37 @@ class ESR_2(ESR):
             freq = freq_values[freq_index]
 
             # change MW frequency
-            self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
-            time.sleep(self.settings['mw_generator_switching_time'])
+            with self.timer.span('mw_frequency'):
+                self.instruments['microwave_generator']['instance'].update({'frequency': float(freq)})
+                time.sleep(self.settings['mw_generator_switching_time'])
 
             # setup the tasks
-            ctrtask = self.daq_in.setup_counter("ctr0", num_samps)
-            if self.settings['track_laser_power']['on/off']:
-                aitask = self.daq_in.setup_AI(self.settings['track_laser_power']['ai_channel'], num_samps,
-                                              continuous=False, clk_source=ctrtask)
+            with self.timer.span('daq_arm'):
+                ctrtask = self.daq_in.setup_counter("ctr0", num_samps, pooled=True)
+                if self.settings['track_laser_power']['on/off']:
+                    aitask = self.daq_in.setup_AI(self.settings['track_laser_power']['ai_channel'], num_samps,
+                                                  continuous=False, clk_source=ctrtask)
 
-            if self.settings['track_laser_power']['on/off']:
-                self.daq_in.run(aitask) # AI is actually tied to the clock, when this runs the clock actually starts
+                if self.settings['track_laser_power']['on/off']:
+                    self.daq_in.run(aitask) # AI is actually tied to the clock, when this runs the clock actually starts
 
-            self.daq_in.run(ctrtask) # the counter clock turns on and starts the AI task
-            time.sleep(self.settings['integration_time'])
+                self.daq_in.run(ctrtask) # the counter clock turns on and starts the AI task
+            with self.timer.span('acquire'):
+                time.sleep(self.settings['integration_time'])
 
             # read the data
-            raw_data, _ = self.daq_in.read_counter(ctrtask)
-            single_sweep_data[freq_index] = np.sum(np.diff(raw_data)) # take the total counts, neglecting the first element
+            with self.timer.span('readback'):
+                raw_data, _ = self.daq_in.read_counter(ctrtask)
+                single_sweep_data[freq_index] = np.sum(np.diff(raw_data)) # take the total counts, neglecting the first element
 
-            if self.settings['track_laser_power']['on/off']:
-                raw_data_laser, _ = self.daq_in.read(aitask)
-                single_sweep_laser_data[freq_index] = np.mean(raw_data_laser)
+                if self.settings['track_laser_power']['on/off']:
+                    raw_data_laser, _ = self.daq_in.read(aitask)
+                    single_sweep_laser_data[freq_index] = np.mean(raw_data_laser)
 
-            # clean up APD tasks
-            if self.settings['track_laser_power']['on/off']:
-                self.daq_in.stop(aitask)  # only stop teh ai task when you've extracted the data you need!!
-            self.daq_in.stop(ctrtask)  # stop the clock task last
+                # clean up APD tasks
+                if self.settings['track_laser_power']['on/off']:
+                    self.daq_in.stop(aitask)  # only stop teh ai task when you've extracted the data you need!!
+                self.daq_in.stop(ctrtask)  # stop the clock task last
 
         return single_sweep_data, single_sweep_laser_data
 
@@ -1533,7 +1524,7 @@ class ESR_Spec_Ana(Script):
             time.sleep(self.settings['mw_generator_switching_time'])
 
             # setup the tasks
-            ctrtask = self.daq_in.setup_counter("ctr0", num_samps)
+            ctrtask = self.daq_in.setup_counter("ctr0", num_samps, pooled=True)
             if self.settings['track_laser_power']['on/off']:
                 aitask = self.daq_in.setup_AI(self.settings['track_laser_power']['ai_channel'], num_samps,
                                               continuous=False, clk_source=ctrtask)
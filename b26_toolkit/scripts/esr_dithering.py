@@ -134,8 +134,9 @@ class ESR_FM_Dither(Script):
 
             time.sleep(self.settings['mw_generator_switching_time'])
 
-            ctrtask = self.daq_in.setup_counter("ctr0", len(freq_voltage_array) + 1)
-            aotask = self.daq_out.setup_AO([self.settings['FM_channel']], freq_voltage_array, ctrtask)
+            ctrtask = self.daq_in.setup_counter("ctr0", len(freq_voltage_array) + 1, pooled=True)
+            aotask = self.daq_out.setup_AO([self.settings['FM_channel']], freq_voltage_array, ctrtask,
+                                           pooled=True)
 
             if self.settings['track_laser_power']['on/off'] == True and self.settings['daq_type'] == 'PCI':
                 aitask = self.daq_in.setup_AI(self.settings['track_laser_power']['ai_channel'], len(freq_voltage_array), continuous=False, clk_source=ctrtask) # for optional arguments spell out every one if there are multiple
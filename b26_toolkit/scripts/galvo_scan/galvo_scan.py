@@ -50,13 +50,26 @@ class GalvoScan(GalvoScanGeneric):
                     Parameter('counter_channel', 'ctr0', ['ctr0', 'ctr1', 'ctr2', 'ctr3'], 'Daq channel used for counter')
                   ]),
         Parameter('ending_behavior', 'return_to_start', ['return_to_start', 'return_to_origin', 'leave_at_corner'], 'return to the corn'),
-        Parameter('daq_type', 'PCI', ['PCI', 'cDAQ'], 'Type of daq to use for scan')
+        Parameter('daq_type', 'PCI', ['PCI', 'cDAQ'], 'Type of daq to use for scan'),
+        Parameter('scan_mode', 'frame', ['frame', 'line'], 'frame: the whole image is scanned with a single waveform and counter task\n \
+                                                           line: the tasks are set up and the galvo is moved for every line'),
+        Parameter('flyback_time', .001, float, 'time in s to move the galvo back to the start of the next line in frame mode, followed by a settle time of one point'),
+        Parameter('scan_pattern', 'raster', ['raster', 'serpentine'], 'raster: every line is scanned in the same direction\n \
+                                                           serpentine: every other line is scanned backwards, which saves the flyback, the lag of the galvo between the directions is corrected'),
+        Parameter('timing', False, bool, 'check to record the time spent in each phase (setup, read_line, daq_arm, acquire, readback, move, plot) in data[\'timing\'] and save a chrome trace (-trace.json) with the data')
     ]
 
     _INSTRUMENTS = {'NI6259':  NI6259, 'NI9263': NI9263, 'NI9402': NI9402}
 
     _SCRIPTS = {}
 
+    # time in s of the samples that are read at once in frame mode, i.e. how often the plot is updated
+    _FRAME_READ_TIME = 0.1
+
+    @property
+    def _ACQ_TYPE(self):
+        return self.settings['scan_mode']
+
     def __init__(self, instruments, name=None, settings=None, log_function=None, data_path=None):
         '''
         Initializes GalvoScan script for use in gui
@@ -72,7 +85,7 @@ class GalvoScan(GalvoScanGeneric):
         Script.__init__(self, name, settings=settings, instruments=instruments, log_function=log_function,
                         data_path=data_path)
 
-        device_list = NI6259.get_connected_devices()
+        device_list = self.instruments['NI6259']['instance'].get_connected_devices()
         if not (self.instruments['NI6259']['instance'].settings['device'] in device_list):
             self.settings['daq_type'] = 'cDAQ'
         # # defines which daqs contain the input and output based on user selection of daq interface
@@ -103,12 +116,13 @@ class GalvoScan(GalvoScanGeneric):
             self.daq_out = self.instruments['NI9263']['instance']
 
         #checks that requested daqs are actually physically present in the system
-        device_list = NI6259.get_connected_devices()
+        device_list = self.daq_in.get_connected_devices()
         if not(self.daq_in.settings['device'] in device_list):
             self.log('The requested input daq ' + self.daq_in.settings['device'] + ' is not connected to this computer. Possible daqs are '
                      + str(device_list) + '. Please choose one of these and try again.')
             raise AttributeError
 
+        device_list = self.daq_out.get_connected_devices()
         if not (self.daq_out.settings['device'] in device_list):
             self.log('The requested output daq ' + self.daq_out.settings[
                 'device'] + ' is not connected to this computer. Possible daqs are '
@@ -135,19 +149,23 @@ class GalvoScan(GalvoScanGeneric):
              self.settings['DAQ_channels']['y_ao_channel']: self.initPt[1]})
 
         # initialize APD thread
-        ctrtask = self.daq_in.setup_counter(
-            self.settings['DAQ_channels']['counter_channel'],
-            len(self.x_array) + 1)
-        aotask = self.daq_out.setup_AO([self.settings['DAQ_channels']['x_ao_channel']],
-                                       self.x_array, ctrtask)
+        with self.timer.span('daq_arm'):
+            # the tasks are the same for every line, they are configured once and restarted from the pool
+            ctrtask = self.daq_in.setup_counter(
+                self.settings['DAQ_channels']['counter_channel'],
+                len(self.x_array) + 1, pooled=True)
+            aotask = self.daq_out.setup_AO([self.settings['DAQ_channels']['x_ao_channel']],
+                                           self.x_array, ctrtask, pooled=True)
 
         # start counter and scanning sequence
-        self.daq_out.run(aotask)
-        self.daq_in.run(ctrtask)
-        self.daq_out.waitToFinish(aotask)
-        self.daq_out.stop(aotask)
-        xLineData, _ = self.daq_in.read(ctrtask)
-        self.daq_in.stop(ctrtask)
+        with self.timer.span('acquire'):
+            self.daq_out.run(aotask)
+            self.daq_in.run(ctrtask)
+            self.daq_out.waitToFinish(aotask)
+            self.daq_out.stop(aotask)
+        with self.timer.span('readback'):
+            xLineData, _ = self.daq_in.read(ctrtask)
+            self.daq_in.stop(ctrtask)
         diffData = np.diff(xLineData)
 
         summedData = np.zeros(int(len(self.x_array) / self.clockAdjust))
@@ -157,6 +175,114 @@ class GalvoScan(GalvoScanGeneric):
         # also normalizing to kcounts/sec
         return(summedData * (.001 / self.settings['time_per_pt']))
 
+    @staticmethod
+    def raster_waveform(x_array, y_array, samples_per_pt, num_flyback, num_settle, serpentine=False):
+        """
+        waveform of a raster scan of the whole image, every line starts with a flyback, where the galvo moves linearly
+        from the end of the previous line (the start of the first line for the first line) to the start of the line,
+        and a settle time at the start of the line, followed by samples_per_pt samples for each point of the line
+
+        Args:
+            x_array: x voltages of the points of a line
+            y_array: y voltages of the lines
+            samples_per_pt: number of samples of each point (see clockAdjust)
+            num_flyback: number of samples of the flyback
+            num_settle: number of samples of the settle time
+            serpentine: if True the odd lines are scanned backwards, so that each line starts where the previous one
+                ended and the flyback only moves to the next y position
+
+        Returns: the waveform, array (2, number of samples) with the x and y voltage of each sample, and the index of the
+            pixel (in the flattened image) that is measured during each sample, -1 for samples that are not counted
+
+        """
+        x_array, y_array = np.asarray(x_array, dtype=float), np.asarray(y_array, dtype=float)
+        num_x, num_y = len(x_array), len(y_array)
+        line_start = num_flyback + num_settle
+        line_length = line_start + num_x * samples_per_pt
+
+        # index of the point that is scanned at each position of the line
+        points = np.tile(np.arange(num_x), (num_y, 1))
+        if serpentine:
+            points[1::2] = points[1::2, ::-1]
+        start_x = x_array[points[:, 0]]
+        ramp = np.arange(1, num_flyback + 1) / float(max(num_flyback, 1))
+        previous_x = np.concatenate(([start_x[0]], x_array[points[:-1, -1]]))
+        previous_y = np.concatenate(([y_array[0]], y_array[:-1]))
+
+        waveform = np.zeros((2, num_y, line_length))
+        waveform[0, :, :num_flyback] = previous_x[:, None] + (start_x - previous_x)[:, None] * ramp
+        waveform[1, :, :num_flyback] = previous_y[:, None] + (y_array - previous_y)[:, None] * ramp
+        waveform[0, :, num_flyback:line_start] = start_x[:, None]
+        waveform[0, :, line_start:] = np.repeat(x_array[points], samples_per_pt, axis=1)
+        waveform[1, :, num_flyback:] = y_array[:, None]
+
+        # as in read_line, the first and last sample of each point are not counted, the galvo settles in the first
+        pixels = np.full((num_y, num_x, samples_per_pt), -1, dtype=np.int64)
+        pixels[:, :, 1:samples_per_pt - 1] = (points + num_x * np.arange(num_y)[:, None])[:, :, None]
+        pixel_of_sample = np.full((num_y, line_length), -1, dtype=np.int64)
+        pixel_of_sample[:, line_start:] = pixels.reshape(num_y, -1)
+
+        return waveform.reshape(2, -1), pixel_of_sample.reshape(-1)
+
+    def read_frame(self):
+        num_x, num_y = len(self.x_array) // self.clockAdjust, len(self.y_array)
+        serpentine = self.settings['scan_pattern'] == 'serpentine'
+        if serpentine:
+            # the next line starts where the previous one ended, the galvo only steps to the next y position
+            num_flyback = 0
+        else:
+            num_flyback = max(int(np.ceil(self.settings['flyback_time'] / self.settings['settle_time'])), 1)
+        waveform, pixel_of_sample = self.raster_waveform(self.x_array[::self.clockAdjust], self.y_array,
+                                                         self.clockAdjust, num_flyback, self.clockAdjust, serpentine)
+        num_samples = len(pixel_of_sample)
+        # sample after which each pixel is complete
+        last_sample = np.zeros(num_x * num_y, dtype=np.int64)
+        last_sample[pixel_of_sample[pixel_of_sample >= 0]] = np.nonzero(pixel_of_sample >= 0)[0]
+        pixel_data = np.zeros(num_x * num_y)
+
+        self.daq_out.set_analog_voltages(
+            {self.settings['DAQ_channels']['x_ao_channel']: waveform[0, 0],
+             self.settings['DAQ_channels']['y_ao_channel']: waveform[1, 0]})
+        with self.timer.span('daq_arm'):
+            ctrtask = self.daq_in.setup_counter(self.settings['DAQ_channels']['counter_channel'], num_samples + 1,
+                                                pooled=True)
+            aotask = self.daq_out.setup_AO([self.settings['DAQ_channels']['x_ao_channel'],
+                                            self.settings['DAQ_channels']['y_ao_channel']], waveform, ctrtask,
+                                           pooled=True)
+
+        counts = np.zeros(num_samples + 1)
+        pixel_counts = np.zeros(num_x * num_y)
+        chunk_size = max(int(self._FRAME_READ_TIME / self.settings['settle_time']), 1)
+        timeout = 4 * self._FRAME_READ_TIME + 1
+        try:
+            self.daq_out.run(aotask)
+            self.daq_in.run(ctrtask)
+            num_read = 0
+            while num_read < num_samples + 1:
+                with self.timer.span('acquire'):
+                    stop = min(num_read + chunk_size, num_samples + 1)
+                    self.daq_in.read_samples(ctrtask, counts[num_read:stop], timeout)
+                with self.timer.span('readback'):
+                    # the counts are a running total, sample i is counted between the clock edges i and i + 1
+                    diff_counts = np.diff(counts[max(num_read - 1, 0):stop])
+                    first_sample = max(num_read - 1, 0)
+                    pixels = pixel_of_sample[first_sample:first_sample + len(diff_counts)]
+                    counted = pixels >= 0
+                    pixel_counts += np.bincount(pixels[counted], weights=diff_counts[counted],
+                                                minlength=len(pixel_counts))
+                    completed = np.nonzero((last_sample >= first_sample) & (last_sample < stop - 1))[0]
+                    num_read = stop
+                if len(completed) > 0:
+                    # also normalizing to kcounts/sec
+                    pixel_data[completed] = pixel_counts[completed] * (.001 / self.settings['time_per_pt'])
+                    # the backward lines of serpentine scans are completed from the end, the block also contains the
+                    # pixels between the completed ones, which have not been acquired yet
+                    first_pixel, last_pixel = completed[0], completed[-1]
+                    yield first_pixel, pixel_data[first_pixel:last_pixel + 1]
+        finally:
+            self.daq_out.stop(aotask)
+            self.daq_in.stop(ctrtask)
+
     def get_galvo_location(self):
         """
         Returns the current position of the galvo. Requires a daq with analog inputs internally routed to the analog
@@ -18,6 +18,7 @@
 
 import numpy as np
 import time
+from b26_toolkit.core.timing import Timer, timed, store_timing
 from b26_toolkit.instruments import NI6259
 from b26_toolkit.plotting.plots_2d import plot_fluorescence_new, update_fluorescence
 from pylabcontrol.core import Script, Parameter
@@ -52,13 +53,27 @@ class GalvoScanGeneric(Script):
         #             Parameter('y_ao_channel', 'ao3', ['ao0', 'ao1', 'ao2', 'ao3'], 'Daq channel used for y voltage analog output'),
         #             Parameter('counter_channel', 'ctr0', ['ctr0', 'ctr1'], 'Daq channel used for counter')
         #           ]),
-        Parameter('ending_behavior', 'return_to_start', ['return_to_start', 'return_to_origin', 'leave_at_corner'], 'return to the corn')
+        Parameter('ending_behavior', 'return_to_start', ['return_to_start', 'return_to_origin', 'leave_at_corner'], 'return to the corn'),
+        Parameter('scan_pattern', 'raster', ['raster', 'serpentine'], 'raster: every line is scanned in the same direction\n \
+                                                           serpentine: every other line is scanned backwards, the lag of the galvo between the directions is corrected'),
+        Parameter('timing', False, bool, 'check to record the time spent in each phase (setup, read_line/read_point, move, plot) in data[\'timing\'] and save a chrome trace (-trace.json) with the data')
     ]
 
     _INSTRUMENTS = {}
     _SCRIPTS = {}
 
-    _ACQ_TYPE = 'line' #this defines if the galvo acquisition is line by line or point by point, the default is line
+    _ACQ_TYPE = 'line' #this defines if the galvo acquisition is frame by frame, line by line or point by point, the default is line
+
+    # shift in V between the lines that are scanned forwards and backwards in serpentine scans, by the speed (in V/s)
+    # and range (in V) of the lines, which is used if the shift can not be estimated from an image
+    _line_shifts = {}
+
+    # minimum correlation between forward and backward lines for the shift that is estimated from an image to be used
+    _MIN_LINE_CORRELATION = 0.5
+
+    # replaced in _function by a timer that is enabled by the timing setting (subclasses that define their own settings
+    # without timing are not timed)
+    timer = Timer(enabled=False)
 
     def __init__(self, instruments, name=None, settings=None, log_function=None, data_path=None):
         '''
@@ -89,9 +104,7 @@ class GalvoScanGeneric(Script):
         """
         Executes threaded galvo scan
         """
-
-
-
+        self.timer = Timer(self.settings.get('timing', False))
 
         self.data = {'image_data': np.zeros((self.settings['num_points']['y'], self.settings['num_points']['x']))}
         self.data['extent'] = self.pts_to_extent(self.settings['point_a'], self.settings['point_b'], self.settings['RoI_mode'])
@@ -105,7 +118,8 @@ class GalvoScanGeneric(Script):
 
         #error is raised in setup_scan if requested daq is not connected. This then ends the script.
         try:
-            self.setup_scan()
+            with self.timer.span('setup'):
+                self.setup_scan()
         except AttributeError:
             return
 
@@ -116,14 +130,34 @@ class GalvoScanGeneric(Script):
             self.settings['ending_behavior'] = 'leave_at_corner'
 
         Nx, Ny = self.settings['num_points']['x'], self.settings['num_points']['y']
+        serpentine = self.settings.get('scan_pattern', 'raster') == 'serpentine' and self._ACQ_TYPE != 'point'
+        x_forward = self.x_array
+
+        if self._ACQ_TYPE == 'frame':
+            # flattened view of the image, the pixels are filled in as they arrive
+            image_pixels = self.data['image_data'].reshape(-1)
+            frame = self.read_frame()
+            try:
+                for first_pixel, pixel_data in frame:
+                    image_pixels[first_pixel:first_pixel + len(pixel_data)] = pixel_data
+                    self.progress = float(first_pixel + len(pixel_data)) / (Nx * Ny) * 100
+                    self.updateProgress.emit(int(self.progress))
+                    if self._abort:
+                        break
+            finally:
+                # stops the acquisition if the scan has been aborted
+                frame.close()
 
         for yNum in range(0, Ny):
 
             if self._ACQ_TYPE == 'line':
                 if self._abort:
                     break
-                line_data = self.read_line(self.y_array[yNum])
-                self.data['image_data'][yNum] = line_data
+                backwards = serpentine and yNum % 2 == 1
+                self.x_array = x_forward[::-1] if backwards else x_forward
+                with self.timer.span('read_line'):
+                    line_data = self.read_line(self.y_array[yNum])
+                self.data['image_data'][yNum] = line_data[::-1] if backwards else line_data
                 self.progress = float(yNum + 1) / Ny * 100
                 self.updateProgress.emit(int(self.progress))
 
@@ -132,7 +166,8 @@ class GalvoScanGeneric(Script):
                     if self._abort:
                         break
 
-                    point_data = self.read_point(self.x_array[xNum], self.y_array[yNum])
+                    with self.timer.span('read_point'):
+                        point_data = self.read_point(self.x_array[xNum], self.y_array[yNum])
                     self.data['image_data'][yNum, xNum] = np.mean(point_data)
 
                     self.data['point_data'].append(point_data)
@@ -147,13 +182,117 @@ class GalvoScanGeneric(Script):
                 if yNum<Ny:
                     self.data['image_data'][yNum + 1:, :] = np.mean(self.data['image_data'][0:yNum, :].flatten())
 
-        #set point after scan based on ending_behavior setting
-        if self.settings['ending_behavior'] == 'leave_at_corner':
-            return
-        elif self.settings['ending_behavior'] == 'return_to_start':
-            self.set_galvo_location(initial_position)
-        elif self.settings['ending_behavior'] == 'return_to_origin':
-            self.set_galvo_location([0,0])
+        self.x_array = x_forward
+        if serpentine and not self._abort:
+            with self.timer.span('line_shift'):
+                self.correct_serpentine()
+
+        #set point after scan based on ending_behavior setting (leave_at_corner: do nothing)
+        with self.timer.span('move'):
+            if self.settings['ending_behavior'] == 'return_to_start':
+                self.set_galvo_location(initial_position)
+            elif self.settings['ending_behavior'] == 'return_to_origin':
+                self.set_galvo_location([0,0])
+
+        store_timing(self)
+
+    def correct_serpentine(self):
+        """
+        corrects the shift between the lines of a serpentine scan that are scanned forwards and backwards: the shift is
+        estimated from the image, or taken from the last scans with the same speed and range if the image does not
+        show enough structure (e.g. no NV in the field of view). The shift in pixels is stored in data['line_shift']
+        """
+        image = self.data['image_data']
+        [xVmin, xVmax, _, _] = self.data['extent']
+        num_x = image.shape[1]
+        pixel_size = (xVmax - xVmin) / max(num_x - 1, 1)
+        line_time = num_x * self.settings['time_per_pt']
+        key = (round((xVmax - xVmin) / line_time, 6), round(xVmax - xVmin, 6))
+
+        shift, correlation = self.estimate_line_shift(image)
+        if correlation >= self._MIN_LINE_CORRELATION:
+            GalvoScanGeneric._line_shifts[key] = shift * pixel_size
+        elif key in self._line_shifts and pixel_size > 0:
+            shift = self._line_shifts[key] / pixel_size
+        else:
+            shift = 0.
+
+        self.data['line_shift'] = shift
+        self.data['image_data'] = self.correct_line_shift(image, shift)
+
+    @staticmethod
+    def estimate_line_shift(image, max_shift=None):
+        """
+        estimates the shift between the even lines, which are scanned forwards, and the odd lines, which are scanned
+        backwards, of a serpentine scan from the cross-correlation of adjacent lines
+
+        Args:
+            image: image (number of lines, number of points)
+            max_shift: maximum shift in pixels, by default a quarter of a line
+
+        Returns: shift in pixels (sub-pixel, from a parabola through the maximum of the correlation), i.e. the backward
+            lines show the point that the forward lines show at pixel i + shift at pixel i, and the correlation
+            coefficient at the shift
+
+        """
+        image = np.asarray(image, dtype=float)
+        num_y, num_x = image.shape
+        if num_y < 2 or num_x < 3:
+            return 0., 0.
+        if max_shift is None:
+            max_shift = num_x // 4
+        max_shift = int(min(max(max_shift, 1), num_x - 2))
+
+        # every pair of adjacent lines, with the forward line first
+        forward_first = (np.arange(num_y - 1) % 2 == 0)[:, None]
+        forward = np.where(forward_first, image[:-1], image[1:])
+        backward = np.where(forward_first, image[1:], image[:-1])
+        forward = forward - forward.mean(axis=1, keepdims=True)
+        backward = backward - backward.mean(axis=1, keepdims=True)
+        norm = np.sqrt(np.sum(forward ** 2) * np.sum(backward ** 2))
+        if norm == 0:
+            return 0., 0.
+
+        # correlation[k] = sum over the pairs and i of forward[i] * backward[i + k], zero padded to avoid wrapping
+        size = 2 * num_x
+        spectrum = np.sum(np.conj(np.fft.rfft(forward, size)) * np.fft.rfft(backward, size), axis=0)
+        correlation = np.fft.irfft(spectrum, size)
+        offsets = np.arange(-max_shift, max_shift + 1)
+        correlation = correlation[offsets % size] / norm
+
+        peak = int(np.argmax(correlation))
+        offset = float(offsets[peak])
+        if 0 < peak < len(offsets) - 1:
+            left, center, right = correlation[peak - 1:peak + 2]
+            curvature = left - 2 * center + right
+            if curvature < 0:
+                offset += 0.5 * (left - right) / curvature
+        # backward[i + k] matches forward[i], so backward[i] shows forward[i + shift] with shift = -k
+        return -offset, float(correlation[peak])
+
+    @staticmethod
+    def correct_line_shift(image, shift):
+        """
+        shifts the even (forward) and odd (backward) lines by half the shift in opposite directions, with linear
+        interpolation between the pixels
+
+        Args:
+            image: image (number of lines, number of points)
+            shift: shift in pixels as returned by estimate_line_shift
+
+        Returns: corrected image, the points outside of the line take the value of the first or last point
+
+        """
+        image = np.asarray(image, dtype=float)
+        num_y, num_x = image.shape
+        if num_x < 2 or shift == 0:
+            return image.copy()
+        half_shift = np.where(np.arange(num_y) % 2 == 0, 0.5, -0.5)[:, None] * shift
+        positions = np.clip(np.arange(num_x) + half_shift, 0, num_x - 1)
+        lower = np.minimum(np.floor(positions).astype(int), num_x - 2)
+        fraction = positions - lower
+        lines = np.arange(num_y)[:, None]
+        return image[lines, lower] * (1 - fraction) + image[lines, lower + 1] * fraction
 
     def get_galvo_location(self):
         """
@@ -181,6 +320,17 @@ class GalvoScanGeneric(Script):
         """
         raise NotImplementedError
 
+    def read_frame(self):
+        """
+        reads the whole image in a single acquisition, this function is used if _ACQ_TYPE = 'frame'
+
+        Returns: generator that yields the index of the first pixel (in the flattened image) and the data of a block of
+            pixels that contains the pixels that have been acquired since the last yield, so that partial rows are
+            plotted as they arrive
+
+        """
+        raise NotImplementedError
+
     def read_point(self, x_pos, y_pos):
         """
         reads a line of data from the DAQ, this function is used if _ACQ_TYPE = 'point'
@@ -218,6 +368,7 @@ class GalvoScanGeneric(Script):
             yVmax = pta['y'] + float(ptb['y']) / 2.
         return [xVmin, xVmax, yVmax, yVmin]
 
+    @timed('plot')
     def _plot(self, axes_list, data = None):
         """
         Plots the galvo scan image
@@ -231,6 +382,7 @@ class GalvoScanGeneric(Script):
 
         plot_fluorescence_new(data['image_data'], data['extent'], axes_list[0], max_counts=self.settings['max_counts_plot'])
 
+    @timed('plot')
     def _update_plot(self, axes_list):
         """
         updates the galvo scan image
@@ -66,7 +66,9 @@ class GalvoScanPhotodiode(GalvoScanGeneric): # ER 20181221
                     Parameter('ai_channel', 'ai2', ['ai0', 'ai1', 'ai2', 'ai3'], 'Daq channel used for photodiode voltage')
                   ]),
         Parameter('ending_behavior', 'return_to_start', ['return_to_start', 'return_to_origin', 'leave_at_corner'], 'return to the corn'),
-        Parameter('daq_type', 'PCI', ['PCI', 'cDAQ'], 'Type of daq to use for scan')
+        Parameter('daq_type', 'PCI', ['PCI', 'cDAQ'], 'Type of daq to use for scan'),
+        Parameter('scan_pattern', 'raster', ['raster', 'serpentine'], 'raster: every line is scanned in the same direction\n \
+                                                           serpentine: every other line is scanned backwards, the lag of the galvo between the directions is corrected')
     ]
 
    # _INSTRUMENTS = {'NI6259':  NI6259, 'NI9263': NI9263, 'NI9402': NI9402} when pulse_blaster_base_script uses 'daq' as the key for daq, we can't use these settings
@@ -122,12 +124,13 @@ class GalvoScanPhotodiode(GalvoScanGeneric): # ER 20181221
             self.daq_out = self.instruments['NI9263']['instance']
 
         #checks that requested daqs are actually physically present in the system
-        device_list = NI6259.get_connected_devices()
+        device_list = self.daq_in.get_connected_devices()
         if not(self.daq_in.settings['device'] in device_list):
             self.log('The requested input daq ' + self.daq_in.settings['device'] + ' is not connected to this computer. Possible daqs are '
                      + str(device_list) + '. Please choose one of these and try again.')
             raise AttributeError
 
+        device_list = self.daq_out.get_connected_devices()
         if not (self.daq_out.settings['device'] in device_list):
             self.log('The requested output daq ' + self.daq_out.settings[
                 'device'] + ' is not connected to this computer. Possible daqs are '
@@ -16,6 +16,7 @@
     along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
 """
 from b26_toolkit.scripts.pulse_sequences.pulsed_experiment_base_script import PulsedExperimentBaseScript
+from b26_toolkit.scripts.pulse_sequences.sequence_template import SequenceTemplate, TAU
 from b26_toolkit.instruments import NI6259, NI9402, B26PulseBlaster, MicrowaveGenerator, Pulse
 from pylabcontrol.core import Parameter
 from b26_toolkit.data_processing.fit_functions import fit_exp_decay, exp_offset
@@ -75,19 +76,12 @@ To symmetrize the sequence between the 0 and +/-1 state we reinitialize every ti
             self.data['fits'] = None
             self.log('t2 fit failed')
 
-    def _create_pulse_sequences(self):
+    def _create_tau_list(self):
         '''
 
-        Returns: pulse_sequences, num_averages, tau_list, meas_time
-            pulse_sequences: a list of pulse sequences, each corresponding to a different time 'tau' that is to be
-            scanned over. Each pulse sequence is a list of pulse objects containing the desired pulses. Each pulse
-            sequence must have the same number of daq read pulses
-            num_averages: the number of times to repeat each pulse sequence
-            tau_list: the list of times tau, with each value corresponding to a pulse sequence in pulse_sequences
-            meas_time: the width (in ns) of the daq measurement
+        Returns: tau_list, the list of times tau that are scanned over
 
         '''
-        pulse_sequences = []
         # tau_list = range(int(max(15, self.settings['tau_times']['time_step'])), int(self.settings['tau_times']['max_time'] + 15),
         #                  self.settings['tau_times']['time_step'])
         # JG 16-08-25 changed (15ns min spacing is taken care of later):
@@ -96,6 +90,15 @@ To symmetrize the sequence between the 0 and +/-1 state we reinitialize every ti
         # ignore the sequence if the mw-pulse is shorter than 15ns (0 is ok because there is no mw pulse!)
         tau_list = [x for x in tau_list if x == 0 or x >= 15]
 
+        return tau_list
+
+    def _create_sequence_template(self):
+        '''
+
+        Returns: template of the pulse sequences
+
+        '''
+        tau = TAU
         nv_reset_time = self.settings['read_out']['nv_reset_time']
         delay_readout = self.settings['read_out']['delay_readout']
         microwave_channel = 'microwave_' + self.settings['mw_pulses']['microwave_channel']
@@ -108,62 +111,37 @@ To symmetrize the sequence between the 0 and +/-1 state we reinitialize every ti
         meas_time = self.settings['read_out']['meas_time']
         delay_mw_readout = self.settings['read_out']['delay_mw_readout']
 
-        for tau in tau_list:
-            pulse_sequence = \
-            [
-                Pulse(microwave_channel_pi2, laser_off_time, pi_half_time),
-                Pulse(microwave_channel, laser_off_time + pi_half_time/2. + tau/2 - pi_time/2., pi_time)
-            ]
-
-            next_pi_t =  laser_off_time + pi_half_time/2. + tau/2 - pi_time/2. + tau
-            N = self.settings['mw_pulses']['Number of pi pulses N']
-
-            for ind in range(0, N-1):
-                pulse_sequence += [
-                    Pulse(microwave_channel, next_pi_t, pi_time)
-                ]
-                next_pi_t = next_pi_t + tau
-
-            pulse_sequence += [
-                Pulse(microwave_channel_pi2, next_pi_t - tau + pi_time/2. + tau/2 - pi_half_time/2., pi_half_time)
-                ]
-            end_of_first_CPMG = next_pi_t - tau + pi_time/2. + tau/2 - pi_half_time/2. + pi_half_time
-
-            pulse_sequence += \
-                [
-                 Pulse('laser', end_of_first_CPMG + delay_mw_readout, nv_reset_time),
-                 Pulse('apd_readout', end_of_first_CPMG + delay_mw_readout + delay_readout, meas_time)
-                ]
-
-            start_of_second_CPMG = end_of_first_CPMG + delay_mw_readout + nv_reset_time + laser_off_time
-
-            pulse_sequence += \
-            [
-                Pulse(microwave_channel_pi2, start_of_second_CPMG, pi_half_time),
-                Pulse(microwave_channel, start_of_second_CPMG + pi_half_time/2. + tau/2 - pi_time/2., pi_time)
-            ]
-            next_pi_t =  start_of_second_CPMG + pi_half_time/2. + tau/2 - pi_time/2. + tau
-            for ind in range(0, N-1):
-                pulse_sequence += [
-                    Pulse(microwave_channel, next_pi_t, pi_time)
-                    ]
-                next_pi_t = next_pi_t + tau
-
-            pulse_sequence += [
-                Pulse(microwave_channel_pi2, next_pi_t - tau + pi_time/2. + tau/2 - three_pi_half_time/2., three_pi_half_time)
-                ]
-
-            end_of_second_CPMG = next_pi_t - tau + pi_time/2. + tau/2 - three_pi_half_time/2. + three_pi_half_time
-
-            pulse_sequence += [
-                Pulse('laser', end_of_second_CPMG + delay_mw_readout, nv_reset_time),
-                Pulse('apd_readout', end_of_second_CPMG + delay_mw_readout + delay_readout, meas_time)
-            ]
-            # ignore the sequence is the mw is shorter than 15ns (0 is ok because there is no mw pulse!)
-            # if tau == 0 or tau>=15:
-            pulse_sequences.append(pulse_sequence)
-
-        return pulse_sequences, tau_list, meas_time
+        # there is always at least one pi pulse
+        N = max(self.settings['mw_pulses']['Number of pi pulses N'], 1)
+
+        template = SequenceTemplate()
+        template.add(microwave_channel_pi2, laser_off_time, pi_half_time)
+        # the train of N pi pulses, spaced by tau
+        first_pi_t = laser_off_time + pi_half_time/2. + tau/2 - pi_time/2.
+        template.add(microwave_channel, first_pi_t, pi_time, repeat=N, period=tau)
+        next_pi_t = first_pi_t + N * tau
+
+        template.add(microwave_channel_pi2, next_pi_t - tau + pi_time/2. + tau/2 - pi_half_time/2., pi_half_time)
+        end_of_first_CPMG = next_pi_t - tau + pi_time/2. + tau/2 - pi_half_time/2. + pi_half_time
+
+        template.add('laser', end_of_first_CPMG + delay_mw_readout, nv_reset_time)
+        template.add('apd_readout', end_of_first_CPMG + delay_mw_readout + delay_readout, meas_time)
+
+        start_of_second_CPMG = end_of_first_CPMG + delay_mw_readout + nv_reset_time + laser_off_time
+
+        template.add(microwave_channel_pi2, start_of_second_CPMG, pi_half_time)
+        first_pi_t = start_of_second_CPMG + pi_half_time/2. + tau/2 - pi_time/2.
+        template.add(microwave_channel, first_pi_t, pi_time, repeat=N, period=tau)
+        next_pi_t = first_pi_t + N * tau
+
+        template.add(microwave_channel_pi2, next_pi_t - tau + pi_time/2. + tau/2 - three_pi_half_time/2., three_pi_half_time)
+
+        end_of_second_CPMG = next_pi_t - tau + pi_time/2. + tau/2 - three_pi_half_time/2. + three_pi_half_time
+
+        template.add('laser', end_of_second_CPMG + delay_mw_readout, nv_reset_time)
+        template.add('apd_readout', end_of_second_CPMG + delay_mw_readout + delay_readout, meas_time)
+
+        return template
 
 
 
@@ -0,0 +1,249 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from b26_toolkit.scripts import FindNV, ESR
+from b26_toolkit.scripts.pulse_sequences.pulsed_experiment_base_script import PulsedExperimentBaseScript
+from b26_toolkit.scripts.pulse_sequences.rabi import Rabi
+from b26_toolkit.scripts.pulse_sequences.t1 import T1
+from b26_toolkit.scripts.pulse_sequences.hahn_echo import HahnEcho
+from b26_toolkit.scripts.pulse_sequences.xy import XY8_k
+from b26_toolkit.instruments import NI6259, NI9402, B26PulseBlaster, MicrowaveGenerator, Pulse
+from b26_toolkit.core.timing import timed
+from b26_toolkit.plotting.plots_1d import plot_pulses, update_pulse_plot
+from pylabcontrol.core import Parameter
+
+REFERENCE = 'reference'  # name of the shared reference sequences in the sequence map
+
+
+class InterleavedPulsedExperiment(PulsedExperimentBaseScript):
+    """
+This script runs the pulse sequences of several pulsed experiments (the subscripts rabi, t1, hahn_echo and xy8) in a
+single randomized sweep, so that the setup (finding the NV, compiling and validating, tracking) is done once per NV
+instead of once per experiment. The experiments are configured in the settings of their subscripts.
+In addition to the readouts of the experiments, num_sequences shared reference sequences are interleaved with the
+experiment sequences: readout 0 measures |0> and the other readouts measure |1> (after a pi pulse) or, if pi_time is 0,
+also |0>. They give all experiments the same normalization, e.g. for hahn_echo and xy8 which have no reference readout
+of their own.
+The sequences of the experiments are run unchanged: the base script reads the same number of gates for every sequence,
+and the |0> readouts of rabi and t1 are taken during the laser pulse that initializes the NV anyway, so leaving them out
+would not shorten their sequences. Therefore the acquisition time is NOT reduced compared to running the experiments
+one after the other, the shared reference sequences even add to it. The time that is saved is the setup that is done
+once instead of once per experiment (finding the NV, compiling and validating, tracking, ESR tracking).
+All experiments use the mw carrier set in mw_pulses.
+After every average block the counts are routed back into data['tau'] and data['counts'] of each subscript (in kcps)
+and the shared reference (in kcps, one value per readout) is stored in data['reference'] of each subscript. The data of
+this script contains the same arrays with the name of the experiment as prefix (e.g. rabi_tau, rabi_counts).
+    """
+    _DEFAULT_SETTINGS = [
+        Parameter('experiments', [
+            Parameter('rabi', True, bool, 'check to include the sequences of the rabi subscript'),
+            Parameter('t1', True, bool, 'check to include the sequences of the t1 subscript'),
+            Parameter('hahn_echo', True, bool, 'check to include the sequences of the hahn_echo subscript'),
+            Parameter('xy8', False, bool, 'check to include the sequences of the xy8 subscript')
+        ]),
+        Parameter('mw_pulses', [
+            Parameter('mw_power', -45.0, float, 'microwave power in dB'),
+            Parameter('mw_frequency', 2.87e9, float, 'microwave frequency in Hz'),
+            Parameter('microwave_channel', 'i', ['i', 'q'], 'Channel to use for the pi pulse of the reference'),
+            Parameter('pi_time', 0., float, 'pi time of the |1> reference in ns, if 0 all readouts of the reference measure |0>')
+        ]),
+        Parameter('reference', [
+            Parameter('num_sequences', 5, int, 'number of shared reference sequences that are interleaved with the sequences of the experiments (they add to the acquisition time)')
+        ]),
+        Parameter('read_out', [
+            Parameter('meas_time', 250, float, 'measurement time of the reference readouts (in ns)'),
+            Parameter('nv_reset_time', 1750, int, 'time with laser on to reset state'),
+            Parameter('laser_off_time', 1000, int, 'minimum laser off time before taking measurements (ns)'),
+            Parameter('delay_mw_readout', 100, int, 'delay between mw and readout (in ns)'),
+            Parameter('delay_readout', 30, int, 'delay between laser on and readout (given by spontaneous decay rate)')
+        ]),
+        Parameter('num_averages', 100000, int, 'number of averages'),
+    ]
+
+    _INSTRUMENTS = {'NI6259': NI6259, 'NI9402': NI9402, 'PB': B26PulseBlaster, 'mw_gen': MicrowaveGenerator}
+
+    _SCRIPTS = {'find_nv': FindNV, 'esr': ESR, 'rabi': Rabi, 't1': T1, 'hahn_echo': HahnEcho, 'xy8': XY8_k}
+
+    def _function(self):
+        self.instruments['mw_gen']['instance'].update({'modulation_type': 'IQ'})
+        self.instruments['mw_gen']['instance'].update({'enable_modulation': True})
+        self.instruments['mw_gen']['instance'].update({'amplitude': self.settings['mw_pulses']['mw_power']})
+        self.instruments['mw_gen']['instance'].update({'frequency': self.settings['mw_pulses']['mw_frequency']})
+
+        for name in self._experiment_names():
+            mw_settings = self.scripts[name].settings.get('mw_pulses', self.scripts[name].settings.get('mw_pulse'))
+            if mw_settings is not None and (mw_settings['mw_frequency'] != self.settings['mw_pulses']['mw_frequency'] or
+                                            mw_settings['mw_power'] != self.settings['mw_pulses']['mw_power']):
+                self.log('{:s} is run with the mw carrier of {:s}, its mw_power and mw_frequency are '
+                         'ignored'.format(name, self.name))
+
+        super(InterleavedPulsedExperiment, self)._function()
+
+    def _experiment_names(self):
+        """
+        Returns: the names of the subscripts whose sequences are included
+        """
+        return [name for name in ['rabi', 't1', 'hahn_echo', 'xy8'] if self.settings['experiments'][name]]
+
+    def _create_pulse_sequences(self):
+        '''
+        Concatenates the pulse sequences of the experiments and the shared reference sequences. Since the base script
+        sweeps over a single list of sequences, tau_list is the index of each sequence in this list; the experiment and
+        the value of tau of each sequence are kept in self.sequence_map, so that the counts can be routed back even if
+        invalid sequences are removed.
+
+        Returns: pulse_sequences, tau_list, measurement_gate_width (see PulsedExperimentBaseScript)
+
+        '''
+        pulse_sequences = []
+        self.sequence_map = {'experiment': [], 'tau': []}
+        self.gate_widths = {}
+        for name in self._experiment_names():
+            sequences, tau_list, gate_width = self.scripts[name]._create_pulse_sequences()
+            pulse_sequences += list(sequences)
+            self.sequence_map['experiment'] += [name] * len(sequences)
+            self.sequence_map['tau'] += list(tau_list)
+            self.gate_widths[name] = gate_width
+
+        count_readouts = lambda sequence: len([pulse for pulse in sequence if pulse.channel_id == 'apd_readout'])
+        num_readouts = count_readouts(pulse_sequences[0]) if pulse_sequences else 2
+        reference_sequence = self._create_reference_sequence(num_readouts)
+        pulse_sequences += [reference_sequence] * self.settings['reference']['num_sequences']
+        self.sequence_map['experiment'] += [REFERENCE] * self.settings['reference']['num_sequences']
+        self.sequence_map['tau'] += [0] * self.settings['reference']['num_sequences']
+        self.gate_widths[REFERENCE] = self.settings['read_out']['meas_time']
+
+        self.sequence_map = {key: np.array(value) for key, value in self.sequence_map.items()}
+
+        # the base script reads the same number of gates for every sequence
+        for name in self._experiment_names():
+            sequence = pulse_sequences[int(np.argmax(self.sequence_map['experiment'] == name))]
+            if count_readouts(sequence) != num_readouts:
+                raise ValueError('all experiments have to read out the same number of gates per sequence, '
+                                 '{:s} does not'.format(name))
+
+        return pulse_sequences, list(range(len(pulse_sequences))), self.gate_widths[REFERENCE]
+
+    def _create_reference_sequence(self, num_readouts):
+        '''
+        Args:
+            num_readouts: number of readouts of the sequence
+
+        Returns: reference sequence, the first readout measures |0>, the others |1> (or |0> if pi_time is 0)
+
+        '''
+        nv_reset_time = self.settings['read_out']['nv_reset_time']
+        delay_readout = self.settings['read_out']['delay_readout']
+        laser_off_time = self.settings['read_out']['laser_off_time']
+        delay_mw_readout = self.settings['read_out']['delay_mw_readout']
+        meas_time = self.settings['read_out']['meas_time']
+        microwave_channel = 'microwave_' + self.settings['mw_pulses']['microwave_channel']
+        pi_time = self.settings['mw_pulses']['pi_time']
+
+        pulse_sequence = []
+        start_time = laser_off_time
+        for readout in range(num_readouts):
+            if readout > 0 and pi_time > 0:
+                pulse_sequence.append(Pulse(microwave_channel, start_time, pi_time))
+                start_time += pi_time + delay_mw_readout
+            pulse_sequence += [Pulse('laser', start_time, nv_reset_time),
+                               Pulse('apd_readout', start_time + delay_readout, meas_time)]
+            start_time += nv_reset_time + laser_off_time
+
+        return pulse_sequence
+
+    def _log_validation(self, report, tau_list):
+        # log the experiment and the value of tau of the invalid sequences instead of their index
+        labels = np.array(['{:s} {:s}'.format(experiment, str(tau)) for experiment, tau in
+                           zip(self.sequence_map['experiment'], self.sequence_map['tau'])])
+        super(InterleavedPulsedExperiment, self)._log_validation(report, labels[tau_list.astype(int)])
+
+    def _run_block(self, num_loops, num_daq_reads, mw_frequency):
+        super(InterleavedPulsedExperiment, self)._run_block(num_loops, num_daq_reads, mw_frequency)
+        self._route_counts()
+
+    def _route_counts(self):
+        """
+        Routes the counts of the last block into data['tau'], data['counts'] and data['reference'] of the subscripts
+        and into the data of this script
+        """
+        # row i of the count data is the sequence self.tau_list[i], sequences that have been skipped because they are
+        # invalid (lazy_sequences) are nan
+        sequence_index = np.array(self.tau_list, dtype=int)
+        experiment = self.sequence_map['experiment'][sequence_index]
+        measured = np.all(np.isfinite(self.data['counts']), axis=1) & (self.loops_per_tau > 0)
+
+        rows = measured & (experiment == REFERENCE)
+        reference = self._normalize_to_kCounts(np.sum(self.count_data[rows], axis=0), self.gate_widths[REFERENCE],
+                                               max(np.sum(self.loops_per_tau[rows]), 1))
+        self.data['reference'] = reference
+
+        for name in self._experiment_names():
+            rows = measured & (experiment == name)
+            data = self.scripts[name].data
+            data['tau'] = self.sequence_map['tau'][sequence_index[rows]]
+            data['counts'] = self._normalize_to_kCounts(self.count_data[rows], self.gate_widths[name],
+                                                        self.loops_per_tau[rows, np.newaxis])
+            data['reference'] = reference
+            self.data[name + '_tau'] = data['tau']
+            self.data[name + '_counts'] = data['counts']
+
+    def _plot_experiments(self, axis, data):
+        """
+        plots the counts of the first readout of each experiment normalized to the |0> reference versus tau
+        """
+        axis.clear()
+        if 'reference' not in data:
+            return
+        for name in ['rabi', 't1', 'hahn_echo', 'xy8']:
+            if name + '_counts' in data and len(data[name + '_tau']) > 0:
+                axis.plot(data[name + '_tau'], data[name + '_counts'][:, 0] / data['reference'][0], '.-', label=name)
+        axis.set_xscale('log')
+        axis.set_xlabel('tau [ns]')
+        axis.set_ylabel('fluorescence / |0> reference')
+        axis.legend(fontsize=8)
+
+    @timed('plot')
+    def _plot(self, axes_list, data=None):
+        '''
+        Plot 1: the counts of the first readout of each experiment normalized to the |0> reference versus tau (log scale,
+        since the experiments sweep tau over different ranges)
+        Plot 2: the pulse sequence performed at the current time (or if plotted statically, the last pulse sequence
+        performed
+
+        Args:
+            axes_list: list of axes to write plots to (uses first 2)
+            data (optional) dataset to plot, if not provided use self.data
+        '''
+        if data is None:
+            data = self.data
+
+        self._plot_experiments(axes_list[0], data)
+        plot_pulses(axes_list[1], self.pulse_sequences[self.sequence_index])
+
+    @timed('plot')
+    def _update_plot(self, axes_list):
+        '''
+        Updates plots specified in _plot above
+        Args:
+            axes_list: list of axes to write plots to (uses first 2)
+
+        '''
+        self._plot_experiments(axes_list[0], self.data)
+        update_pulse_plot(axes_list[1], self.pulse_sequences[self.sequence_index])
@@ -17,6 +17,7 @@
 """
 
 from b26_toolkit.scripts.pulse_sequences.pulsed_experiment_base_script import PulsedExperimentBaseScript
+from b26_toolkit.scripts.pulse_sequences.sequence_template import SequenceTemplate, TAU
 from b26_toolkit.instruments import NI6259, NI9402, B26PulseBlaster, MicrowaveGenerator, Pulse
 from pylabcontrol.core import Parameter, Script
 
@@ -73,27 +74,25 @@ todo(emma): (make double_init sheme)
         super(PDD, self)._function()
 
 
-    def _create_pulse_sequences(self):
+    def _create_tau_list(self):
         '''
-        creates the pulse sequence for the Hahn echo /
-        Returns: pulse_sequences, num_averages, tau_list
-            pulse_sequences: a list of pulse sequences, each corresponding to a different time 'tau' that is to be
-            scanned over. Each pulse sequence is a list of pulse objects containing the desired pulses. Each pulse
-            sequence must have the same number of daq read pulses
-            num_averages: the number of times to repeat each pulse sequence
-            tau_list: the list of times tau, with each value corresponding to a pulse sequence in pulse_sequences
-            meas_time: the width (in ns) of the daq measurement
-
-        '''
-        pulse_sequences = []
 
+        Returns: tau_list, the list of times tau that are scanned over
 
+        '''
         tau_list = list(range(int(self.settings['tau_times']['min_time']),
                          int(self.settings['tau_times']['max_time'] + self.settings['tau_times']['time_step']),
                          self.settings['tau_times']['time_step']))
 
+        return tau_list
+
+    def _create_sequence_template(self):
+        '''
 
+        Returns: template of the pulse sequences
 
+        '''
+        tau = TAU
         reset_time = self.settings['read_out']['nv_reset_time']
         pi_time = self.settings['mw_pulses']['pi_pulse_time']
         pi_half_time = pi_time/2.0
@@ -104,72 +103,22 @@ todo(emma): (make double_init sheme)
         delay_mw_readout = self.settings['read_out']['delay_mw_readout']
         number_of_pi_pulses = self.settings['mw_pulses']['number_of_pi_pulses']
 
+        template = SequenceTemplate()
+        template.add('laser', 0, reset_time - ref_meas_off_time - 15 - meas_time)
+        template.add('apd_readout', reset_time - 15 - meas_time, meas_time)
+        template.add('laser', reset_time - 15 - meas_time, meas_time)
+        template.add('microwave_i', reset_time + delay_mw_init - pi_half_time/2, pi_half_time)
+
+        # the pi pulses are centered at tau/2, 3 tau/2, ... after the center of the pi/2 pulse
+        next_pi_pulse_time = reset_time + delay_mw_init
+        template.add('microwave_q', next_pi_pulse_time + tau/2 - pi_time/2, pi_time, repeat=number_of_pi_pulses, period=tau)
+        next_pi_pulse_time += number_of_pi_pulses * tau
+
+        if number_of_pi_pulses == 0:
+            next_pi_pulse_time += tau
+
+        template.add('microwave_i', next_pi_pulse_time - pi_half_time/2, pi_half_time)
+        template.add('laser', next_pi_pulse_time + pi_half_time + delay_mw_readout, meas_time)
+        template.add('apd_readout', next_pi_pulse_time + pi_half_time + delay_mw_readout, meas_time)
 
-        for tau in tau_list:
-
-            # pulse_sequence = [Pulse('laser', 0, reset_time - ref_meas_off_time - 15 - meas_time),
-            #                   Pulse('apd_readout', reset_time - 15 - meas_time, meas_time),
-            #                   Pulse('laser', reset_time - 15 - meas_time, meas_time),
-            #                   Pulse('microwave_i', reset_time + delay_mw_init, pi_half_time)
-            #                   ]
-            # # 16-08-25 JG: changed :
-            pulse_sequence = [Pulse('laser', 0, reset_time - ref_meas_off_time - 15 - meas_time),
-                              Pulse('apd_readout', reset_time - 15 - meas_time, meas_time),
-                              Pulse('laser', reset_time - 15 - meas_time, meas_time),
-                              Pulse('microwave_i', reset_time + delay_mw_init-pi_half_time/2, pi_half_time)
-                              ]
-
-
-            # next_pi_pulse_time = reset_time + delay_mw_init + pi_half_time + tau
-            # # 16-08-19 JG: changed :
-            next_pi_pulse_time = reset_time + delay_mw_init
-            # # 16-08-25 JG: changed :
-            # next_pi_pulse_time = reset_time + delay_mw_init - pi_half_time / 2 + tau / 2
-
-            for n in range(1, number_of_pi_pulses + 1):
-                next_pi_pulse_time += tau/2
-                pulse_sequence.extend([Pulse('microwave_q', next_pi_pulse_time - pi_time/2, pi_time)])
-                # next_pi_pulse_time += tau*2 + pi_time
-                # 16-08-19 JG: changed:
-                # next_pi_pulse_time += tau
-                # 16 - 08 -24 JG: changed
-                next_pi_pulse_time += tau/2
-
-            if number_of_pi_pulses == 0:
-                next_pi_pulse_time += tau
-
-            # pulse_sequence.extend([Pulse('microwave_i', next_pi_pulse_time-tau, pi_half_time),
-            #                         Pulse('laser', next_pi_pulse_time-tau + delay_mw_readout + pi_half_time, meas_time),
-            #                         Pulse('apd_readout',next_pi_pulse_time-tau + delay_mw_readout + pi_half_time, meas_time)
-            #                         ])
-            # 16-08-19 JG: changed:
-            # pulse_sequence.extend([Pulse('microwave_i', next_pi_pulse_time-tau/2 + pi_half_time, pi_half_time),
-            #                         Pulse('laser',      next_pi_pulse_time-tau/2 + pi_time + delay_mw_readout, meas_time),
-            #                         Pulse('apd_readout',next_pi_pulse_time-tau/2 + pi_time + delay_mw_readout, meas_time)
-            #                         ])
-            # pulse_sequences.append(pulse_sequence)
-            # 16 - 08 -24 JG: changed
-            # pulse_sequence.extend([Pulse('microwave_i', next_pi_pulse_time + pi_half_time, pi_half_time),
-            #                        Pulse('laser', next_pi_pulse_time + pi_time + delay_mw_readout, meas_time),
-            #                        Pulse('apd_readout', next_pi_pulse_time + pi_time + delay_mw_readout,
-            #                              meas_time)
-            #                        ])
-
-            # # 16-08-25 JG: changed :
-            pulse_sequence.extend([Pulse('microwave_i', next_pi_pulse_time - pi_half_time/2, pi_half_time),
-                                   Pulse('laser', next_pi_pulse_time + pi_half_time + delay_mw_readout, meas_time),
-                                   Pulse('apd_readout', next_pi_pulse_time + pi_half_time + delay_mw_readout, meas_time)
-                                   ])
-
-            pulse_sequences.append(pulse_sequence)
-
-        # TEMPORATTY: THIS IS TO SEE IF THE OVERALL TIME OF A SEQUENCE SHOULD ALWAYS BE THE SAME
-        # IF WE WANT TO KEEP THIS ADD ADDITIONAL PARAMETER TO THE SCRIPT SETTINGS
-        # end_time_max = 0
-        # for pulse_sequence in pulse_sequences:
-        #     for pulse in pulse_sequence:
-        #         end_time_max = max(end_time_max, pulse.start_time + pulse.duration)
-        # for pulse_sequence in pulse_sequences:
-        #     pulse_sequence.append(Pulse('laser', end_time_max + 1850, 15))
-
-        return pulse_sequences, tau_list, meas_time
+        return template
@@ -16,19 +16,158 @@
     along with pylabcontrol.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import itertools
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 from copy import deepcopy
 
 import numpy as np
 
+from b26_toolkit.core.runtime_model import RuntimeModel, estimate_remaining_time
+from b26_toolkit.core.setting_planner import SettingPlanner
+from b26_toolkit.core.sweep_order import SweepOrder
+from b26_toolkit.core.timing import Timer, timed, store_timing
 from b26_toolkit.scripts import FindNV, ESR
 from b26_toolkit.instruments import NI6259, NI9402, B26PulseBlaster, Pulse, MicrowaveGenerator
+from b26_toolkit.data_processing.adaptive_averaging import AdaptiveAveraging
+from b26_toolkit.data_processing.block_store import BlockStore
+from b26_toolkit.data_processing.fit_worker import FitWorker
+from b26_toolkit.data_processing.tracking_policy import TrackingPolicy
+from b26_toolkit.scripts.pulse_sequences.sequence_template import PulseArrays
 from b26_toolkit.plotting.plots_1d import plot_1d_simple_timetrace_ns, plot_pulses, update_pulse_plot, update_1d_simple
 from pylabcontrol.core import Script, Parameter
-import random
 
 MAX_AVERAGES_PER_SCAN = 100000  # 1E5, the max number of loops per point allowed at one time (true max is ~4E6 since
                                  #pulseblaster stores this value in 22 bits in its register
+MAX_SAMPLES_PER_PROGRAM = 4000000  # max number of daq samples read at once when running several sequences in a program
+MAX_LOOPS_PER_SEQUENCE = 1000000  # max number of loops of a single sequence in a block with adaptive averaging, has to
+                                  # stay below the ~4E6 loops the pulseblaster can store
+PIPELINE_PHASES = ['prepare', 'load', 'acquire', 'reduce', 'tracking', 'wall']  # phases timed by the pipelined runner
+RUNTIME_MODEL_FILENAME = 'runtime_model.json'  # runtime models of the experiments, in the data path (settings['path'])
+# instrument settings that can be swept on the outer axis of a 2D sweep: name of the instrument and path of the setting
+SWEEP_2D_SETTINGS = OrderedDict([
+    ('mw_frequency', ('microwave_generator', ('frequency',))),
+    ('mw_amplitude', ('microwave_generator', ('amplitude',))),
+    ('awg_amplitude_ch1', ('awg', ('default_waveform_ch1', 'amplitude'))),
+    ('awg_amplitude_ch2', ('awg', ('default_waveform_ch2', 'amplitude')))
+])
+
+
+class PulseSequenceSet(object):
+    """
+    Lazy collection of the pulse sequences of a sweep. The number of sequences is known up front, but each sequence is
+    only created when it is accessed and then cached. The sequences are validated in chunks, either in a background
+    thread (see start_validation) or on demand when the validity of a sequence is requested, so that the first
+    sequences can run while the remaining ones are still prepared.
+    """
+
+    def __init__(self, tau_list, create_sequence, validate=None, chunk_size=100, cache_size=None):
+        """
+        Args:
+            tau_list: the values of tau, one for each sequence
+            create_sequence: function that takes the index of a sequence and returns the pulse sequence
+            validate (optional): function that takes a list of pulse sequences and the corresponding values of tau and
+                returns a dictionary of arrays with one entry per sequence, which contains at least the key 'valid',
+                e.g. PulsedExperimentBaseScript.validate_pulse_sequences. If None, all sequences are valid
+            chunk_size: number of sequences that are validated at once
+            cache_size (optional): maximum number of sequences that are kept in memory, if None all are kept
+        """
+        self.tau_list = list(tau_list)
+        self._create_sequence = create_sequence
+        self._validate = validate
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+
+        self._sequences = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._validation_lock = threading.Lock()
+        self._is_validated = np.zeros(int(np.ceil(len(self.tau_list) / float(chunk_size))), dtype=bool)
+        self.report = {'valid': np.ones(len(self.tau_list), dtype=bool)}
+        self._validation_thread = None
+
+    def __len__(self):
+        return len(self.tau_list)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('pulse sequence index out of range')
+
+        with self._cache_lock:
+            if index in self._sequences:
+                self._sequences.move_to_end(index)
+                return self._sequences[index]
+
+        pulse_sequence = self._create_sequence(index)
+
+        with self._cache_lock:
+            self._sequences[index] = pulse_sequence
+            if self.cache_size is not None and len(self._sequences) > self.cache_size:
+                self._sequences.popitem(last=False)
+
+        return pulse_sequence
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def _validate_chunk(self, chunk):
+        """
+        Validates the sequences of a chunk, if this has not been done already
+        """
+        with self._validation_lock:
+            if self._is_validated[chunk]:
+                return
+
+            if self._validate is not None:
+                indices = range(chunk * self.chunk_size, min((chunk + 1) * self.chunk_size, len(self)))
+                report = self._validate([self[index] for index in indices], [self.tau_list[index] for index in indices])
+                for key, value in report.items():
+                    if key == 'tau':
+                        continue
+                    if key not in self.report:
+                        self.report[key] = np.zeros(len(self), dtype=np.asarray(value).dtype)
+                    self.report[key][indices.start:indices.stop] = value
+
+            self._is_validated[chunk] = True
+
+    def start_validation(self):
+        """
+        Starts to validate all sequences in a background thread
+        """
+        if self._validation_thread is None:
+            self._validation_thread = threading.Thread(target=self.wait_for_validation)
+            self._validation_thread.daemon = True
+            self._validation_thread.start()
+
+    def is_valid(self, index):
+        """
+        Args:
+            index: index of a sequence
+
+        Returns: True if the sequence is valid, validates the chunk of the sequence first if necessary
+        """
+        if index < 0:
+            index += len(self)
+        self._validate_chunk(index // self.chunk_size)
+        return bool(self.report['valid'][index])
+
+    def wait_for_validation(self):
+        """
+        Validates all sequences that have not been validated yet
+
+        Returns: boolean array that is True for the valid sequences
+        """
+        for chunk in range(len(self._is_validated)):
+            self._validate_chunk(chunk)
+        return self.report['valid']
 
 
 class PulsedExperimentBaseScript(Script):
@@ -43,8 +182,15 @@ for a given experiment
     _DEFAULT_SETTINGS = [
         Parameter('Tracking', [
             Parameter('on/off', True, bool, 'used to turn on tracking'),
-            Parameter('threshold', 0.85, float, 'threshold for tracking'),
-            Parameter('init_fluor', 20., float, 'initial fluorescence of the NV to compare to, in kcps')
+            Parameter('threshold', 0.85, float, 'threshold for tracking (threshold and ema detector)'),
+            Parameter('init_fluor', 20., float, 'initial fluorescence of the NV to compare to, in kcps'),
+            Parameter('detector', 'cusum', TrackingPolicy.DETECTORS, 'change detector that decides when to track: threshold compares every value to the threshold, ema its moving average and cusum accumulates persistent deviations'),
+            Parameter('readout', 'reference', ['signal', 'reference'], 'readout that is used for tracking (reference is the tau independent |0> readout of the script, signal the last readout of the sequence)'),
+            Parameter('ema_weight', 0.1, float, 'weight of a new value in the moving average of the ema detector'),
+            Parameter('cusum_drift', 0.05, float, 'relative deviation from init_fluor that is tolerated by the cusum detector'),
+            Parameter('cusum_limit', 0.3, float, 'alarm level of the cusum detector'),
+            Parameter('hysteresis', 0.5, float, 'after tracking, only track again once the statistic has dropped below (1 - hysteresis) times the alarm level (0 turns it off)'),
+            Parameter('max_time_fraction', 0.2, float, 'maximum fraction of the runtime that is spent tracking')
         ]),
         Parameter('ESR_Tracking', [
             Parameter('on/off', False, bool, 'turn on to track NV ESR'),
@@ -52,6 +198,14 @@ for a given experiment
             Parameter('allowed_delta_freq', 2., float, 'do not change the mw carrier frequency if the new ESR is different by more than this amount (MHz) (protects against bad fits)')
         ]),
         Parameter('randomize', True, bool, 'check to randomize runs of the pulse sequence'),
+        Parameter('sweep_order', [
+            Parameter('mode', 'shuffle', SweepOrder.MODES, 'order of the pulse sequences in each average block if randomize is checked: shuffle (random permutation), stratified (rounds that run one sequence of each part of the tau range) or low_discrepancy (golden ratio sequence, consecutive sequences are far apart in tau)'),
+            Parameter('seed', 0, int, 'seed of the orders, 0 draws a new seed (the seed and the order of every block are saved in data[\'sweep_order_seed\'] and data[\'sweep_order\'])')
+        ]),
+        Parameter('single_program', False, bool, 'check to run all pulse sequences of an average block in a single pulseblaster program with a single daq acquisition (reduces the overhead per sequence)'),
+        Parameter('lazy_sequences', False, bool, 'check to create and validate the pulse sequences while the experiment is running instead of all of them before it starts'),
+        Parameter('keep_raw_counts', False, bool, 'check to keep the counts of every gate of the last average block in data[\'raw_counts\'] (e.g. for a shot noise analysis)'),
+        Parameter('pipelined', False, bool, 'check to compile the next pulse sequence, set up its daq task and process the counts of the previous one in the background while a sequence is running (ignored if single_program is checked)'),
         Parameter('mw_switch', [
             Parameter('add', True, bool,  'check to add mw switch to every i and q pulse and to use switch to carve out pulses. note that iq pulses become longer by 2*extra-time'),
             Parameter('extra_time', 50, int, 'extra time that is added before and after the time of the i/q pulses in ns'),
@@ -59,11 +213,38 @@ for a given experiment
             Parameter('no_iq_overlap', True, bool,'Toggle to check for overlapping i q output. In general i and q channels should not be on simultaneously.')
         ]),
         Parameter('daq_type', 'PCI', ['PCI', 'cDAQ'], 'daq to be used for pulse sequence'),
+        Parameter('adaptive_averaging', [
+            Parameter('on/off', False, bool, 'check to distribute the loops of each average block over the tau values where they reduce the uncertainty most, instead of running every tau equally often'),
+            Parameter('criterion', 'variance', ['variance', 'exponential', 'cosine'], 'variance: tau values with the largest uncertainty of the signal, exponential/cosine: tau values that are most informative about the time constant/period of an exponential decay (T1, T2)/oscillation (Rabi)'),
+            Parameter('uniform_fraction', 0.2, float, 'fraction of the loops of each block that is distributed evenly over all tau values')
+        ]),
+        Parameter('record_blocks', [
+            Parameter('on/off', False, bool, 'check to write the counts of every average block to disk as soon as the block is completed'),
+            Parameter('store', '', str, 'directory of the block store, if empty a new directory next to the data of this run is used'),
+            Parameter('resume', False, bool, 'check to continue the experiment after the last completed block of the block store in store')
+        ]),
+        Parameter('live_fit', [
+            Parameter('on/off', False, bool, 'check to refit the data in the background after every average block and publish the fit in data[\'live_fit\'] (only scripts with a fit model, e.g. Rabi, T1, HahnEcho)'),
+            Parameter('early_stop', False, bool, 'check to stop the experiment once the relative uncertainty of T1/T2 (decays) or of the rabi frequency is below target_uncertainty'),
+            Parameter('target_uncertainty', 0.05, float, 'relative uncertainty at which the experiment is stopped')
+        ]),
+        Parameter('sweep_2d', [
+            Parameter('on/off', False, bool, 'check to run the experiment for every value of an instrument setting (outer axis), the pulse sequences are created and compiled and find_nv is run only once for all values'),
+            Parameter('setting', 'mw_amplitude', list(SWEEP_2D_SETTINGS.keys()), 'instrument setting of the outer axis (the awg settings require a script with an awg instrument)'),
+            Parameter('min_value', -20.0, float, 'first value of the outer axis (Hz, dBm or Vpp)'),
+            Parameter('max_value', -10.0, float, 'last value of the outer axis'),
+            Parameter('num_points', 11, int, 'number of values of the outer axis'),
+            Parameter('settle_time', 0.0, float, 'time in s to wait after the setting has been changed')
+        ]),
+        Parameter('timing', False, bool, 'check to record the time spent in each phase (compile, program, daq_arm, acquire, readback, tracking, plot) in data[\'timing\'] and save a chrome trace (-trace.json) with the data'),
     ]
     _INSTRUMENTS = {'NI6259': NI6259, 'NI9402': NI9402, 'PB': B26PulseBlaster}
 
     _SCRIPTS = {'find_nv': FindNV, 'esr': ESR}
 
+    _LIVE_FIT_MODEL = None  # model of the live fit (see fit_worker.MODELS), None if the script has no live fit
+    _REFERENCE_READOUT = 0  # index of the readout that measures the |0> reference, used for tracking
+
     def __init__(self, instruments, scripts, name=None, settings=None, log_function=None, data_path=None):
         """
         Standard script initialization
@@ -76,6 +257,9 @@ for a given experiment
         Script.__init__(self, name, settings=settings, scripts=scripts, instruments=instruments,
                         log_function=log_function, data_path=data_path)
 
+        # predicted runtime of each phase of the running experiment, see estimate_runtime
+        self.runtime_estimate = None
+
     def _calc_progress(self, index):
         # progress of inner loop (in _run_sweep)
         progress_inner = index / len(self.pulse_sequences)
@@ -88,6 +272,10 @@ for a given experiment
             # therefore the progress of the inner loop equals the outer loop
             progress = progress_inner
 
+        if self.counts_2d is not None:
+            # progress of the outer axis of a 2D sweep
+            progress = (self.sweep_2d_index + progress) / len(self.counts_2d)
+
         self.progress = 100.0 * progress
         return int(round(self.progress))
 
@@ -108,6 +296,9 @@ for a given experiment
 
         """
 
+        self.timer = Timer(self.settings['timing'])
+        self.runtime_estimate = None
+
         # Set DAQ
         if self.settings['daq_type'] == 'PCI':
             self._daq = self.instruments['NI6259']['instance']
@@ -117,18 +308,27 @@ for a given experiment
         # make sure the microwave_switch is turned off so that we don't burn any steel cables. ER 20181017
         self.instruments['PB']['instance'].update({'microwave_switch': {'status': False}})
 
-        # retrieve initial mw carrier frequency to protect against bad fits in NV ESR tracking
-        last_mw = self.scripts['esr'].instruments['microwave_generator']['instance'].frequency
-        pulse_ampl = self.scripts['esr'].instruments['microwave_generator']['instance'].amplitude
-
-        # ER 20181214 retrieve modulation on or off for main experiment
-        mod_flag = self.scripts['esr'].instruments['microwave_generator']['instance'].enable_modulation
+        # retrieve initial mw carrier frequency to protect against bad fits in NV ESR tracking, ESR tracking sets the
+        # amplitude and modulation of the experiment again after the ESR
+        self._mw_settings = {
+            'frequency': self.scripts['esr'].instruments['microwave_generator']['instance'].frequency,
+            'amplitude': self.scripts['esr'].instruments['microwave_generator']['instance'].amplitude,
+            # ER 20181214 retrieve modulation on or off for main experiment
+            'enable_modulation': self.scripts['esr'].instruments['microwave_generator']['instance'].enable_modulation
+        }
 
         # Keeps track of index of current pulse sequence for plotting
         self.sequence_index = 0
 
+        # counts of a 2D sweep for each value of the outer axis, tau and readout (see _run_sweep_2d)
+        self.counts_2d = None
+
         # self.is_valid and create pulses
-        self.pulse_sequences, self.tau_list, self.measurement_gate_width = self.create_pulse_sequences()
+        if self.settings['lazy_sequences']:
+            self.pulse_sequences, self.tau_list, self.measurement_gate_width = self.create_pulse_sequence_set()
+            self.pulse_sequences.start_validation()
+        else:
+            self.pulse_sequences, self.tau_list, self.measurement_gate_width = self.create_pulse_sequences()
         self.num_averages = self.settings['num_averages']
 
         if in_data is None:
@@ -145,24 +345,168 @@ for a given experiment
         signal = [0.0]
         norms = np.repeat([0.0], (num_daq_reads - 1))
         self.count_data = np.repeat([np.append(signal, norms)], len(self.pulse_sequences), axis=0)
+        # number of pulseblaster commands of each (sequence, loops), see _run_sweep_single_program
+        self._command_counts = {}
         self.data = in_data
         self.data['tau'] = np.array(self.tau_list)
         self.data['counts'] = deepcopy(self.count_data)
+        if self.settings['pipelined'] and not self.settings['single_program']:
+            # time spent in each phase of the pipelined runner (in s) and the fraction of time spent acquiring
+            self.data['phase_times'] = OrderedDict([(phase, 0.0) for phase in PIPELINE_PHASES])
+            self.data['duty_cycle'] = 0.0
 
         # divides the total number of averages requested into a number of slices of MAX_AVERAGES_PER_SCAN and a remainder.
         # This is required because the pulseblaster won't accept more than ~4E6 loops (22 bits available to store loop
         # number) so need to break it up into smaller chunks (use 1E6 so initial results display faster)
         (num_1E5_avg_pb_programs, remainder) = divmod(self.num_averages, MAX_AVERAGES_PER_SCAN)
+
+        # total number of loops of each sequence, with adaptive averaging this is different for each tau
+        self.loops_per_tau = np.zeros(len(self.pulse_sequences), dtype=np.int64)
+        self.adaptive_averaging = None
+        if self.settings['adaptive_averaging']['on/off']:
+            self.adaptive_averaging = AdaptiveAveraging(self.tau_list, num_daq_reads,
+                                                        self.settings['adaptive_averaging']['criterion'],
+                                                        self.settings['adaptive_averaging']['uniform_fraction'],
+                                                        MAX_LOOPS_PER_SEQUENCE, self._live_fit_signal)
+            self.data['loops'] = self.loops_per_tau
+
+        # the predicted runtime is the starting point of the remaining time, the acquisition time of the sequences that
+        # have been run is compared to the measured one when the runtime model is updated
+        if isinstance(self.pulse_sequences, PulseSequenceSet):
+            self._durations = self._sequence_durations() if self._uses_sequence_template() else None
+        else:
+            self._durations = np.array([max([pulse.start_time + pulse.duration for pulse in pulse_sequence] + [0])
+                                        for pulse_sequence in self.pulse_sequences])
+        self._predicted_acquire = 0.0
+        if self._durations is not None:
+            self.runtime_estimate = self.estimate_runtime(sequence_durations=self._durations)
+            self.data['runtime_estimate'] = self.runtime_estimate
+            self.log('estimated runtime: {:s} ({:s} acquiring)'.format(
+                str(datetime.timedelta(seconds=int(sum(self.runtime_estimate['time'])))),
+                str(datetime.timedelta(seconds=int(self.runtime_estimate['time'][0])))))
+
+        # the order of the sequences in every average block, a resumed experiment continues with the orders of its
+        # block store
+        mode = self.settings['sweep_order']['mode'] if self.settings['randomize'] else 'sequential'
+        self.sweep_order = SweepOrder(len(self.pulse_sequences), mode, self.settings['sweep_order']['seed'])
+
+        # every completed average block is appended to the block store, when resuming we start after the last one
+        self._block_store, first_block = None, 0
+        if self.settings['record_blocks']['on/off'] and self.settings['sweep_2d']['on/off']:
+            self.log('the average blocks of a 2D sweep are not recorded in a block store')
+        elif self.settings['record_blocks']['on/off']:
+            num_blocks = int(num_1E5_avg_pb_programs) + (1 if remainder != 0 else 0)
+            self._block_store = self._open_block_store(num_blocks, num_daq_reads)
+            if self._block_store is None:
+                self._abort = True
+                return
+            first_block = self._block_store.num_completed
+
+        num_blocks = int(num_1E5_avg_pb_programs) + (1 if remainder != 0 else 0)
+        if self.settings['sweep_2d']['on/off']:
+            num_blocks *= self.settings['sweep_2d']['num_points']
+        self.data['sweep_order'] = self.sweep_order.blocks(num_blocks)
+        self.data['sweep_order_seed'] = self.sweep_order.seed
+        self._block_index = first_block
+
+        # compiled programs are cached by the pulseblaster, so each sequence is only compiled on the first block
+        cache_hits = self.instruments['PB']['instance'].program_cache_hits
+        cache_misses = self.instruments['PB']['instance'].program_cache_misses
+
         # run find_nv if tracking is on ER 5/30/2017
+        self.tracking_policy = None
         if self.settings['Tracking']['on/off']:
-            self.scripts['find_nv'].run()
+            with self.timer.span('find_nv'):
+                self.scripts['find_nv'].run()
             if self.scripts['find_nv'].data['fluorescence'] == 0.0: # if it doesn't find an NV, abort the experiment
                 self.log('Could not find an NV in FindNV.')
                 self._abort = True
                 return  # exit function in case no NV is found
+            tracking_settings = self.settings['Tracking']
+            self.tracking_policy = TrackingPolicy(tracking_settings['init_fluor'], tracking_settings['detector'],
+                                                  tracking_settings['threshold'], tracking_settings['ema_weight'],
+                                                  tracking_settings['cusum_drift'], tracking_settings['cusum_limit'],
+                                                  tracking_settings['hysteresis'],
+                                                  tracking_settings['max_time_fraction'])
+            # every tracking decision, see TrackingPolicy
+            self.data['tracking'] = self.tracking_policy.log
+            self.data['tracking_time_fraction'] = 0.0
+
+        # refit the data in the background after every block
+        self.fit_worker = None
+        if self.settings['live_fit']['on/off'] and self._LIVE_FIT_MODEL is not None:
+            target_uncertainty = None
+            if self.settings['live_fit']['early_stop']:
+                target_uncertainty = self.settings['live_fit']['target_uncertainty']
+            self.fit_worker = FitWorker(self._LIVE_FIT_MODEL, target_uncertainty, callback=self._publish_live_fit)
+            self.fit_worker.start()
+
+        self._esr_tracking = self.settings['ESR_Tracking']['on/off']
+        self._setting_planner = None
+        if self.settings['sweep_2d']['on/off']:
+            self._run_sweep_2d(num_daq_reads)
+        else:
+            self._run_average_blocks(num_daq_reads, first_block)
+
+        if self.fit_worker is not None:
+            # fit the data of the last block
+            self.fit_worker.stop()
+            self.log('live fit: {:d} fits ({:d} failed, {:d} coalesced), relative uncertainty of {:s}: {:0.3g}'.format(
+                self.fit_worker.num_fits, self.fit_worker.num_failed, self.fit_worker.num_coalesced,
+                self.fit_worker.stop_parameter, self.fit_worker.relative_uncertainty))
+
+        self.log('compiled {:d} pulseblaster programs, reused {:d} compiled programs'.format(
+            self.instruments['PB']['instance'].program_cache_misses - cache_misses,
+            self.instruments['PB']['instance'].program_cache_hits - cache_hits))
+
+        if isinstance(self.pulse_sequences, PulseSequenceSet):
+            # the invalid sequences have been skipped, now that all sequences are validated remove them from the data
+            valid = self.pulse_sequences.wait_for_validation()
+            self._log_validation(self.pulse_sequences.report, np.array(self.tau_list))
+            self.count_data = self.count_data[valid]
+            self.data['tau'] = self.data['tau'][valid]
+            self.data['counts'] = self.data['counts'][valid]
+            if 'raw_counts' in self.data:
+                self.data['raw_counts'] = self.data['raw_counts'][valid]
+            if 'loops' in self.data:
+                self.data['loops'] = self.data['loops'][valid]
+            if self.counts_2d is not None:
+                self.counts_2d = self.counts_2d[:, valid]
+                self._publish_counts_2d()
+
+        if (len(self.data['counts'][0]) == 1) and not self._abort:
+            self.data['counts'] = np.array([item for sublist in self.data['counts'] for item in sublist])
+
+        self._update_runtime_model()
+        store_timing(self)
+
+        # save data on the fly so that we can start to analyze it while the experiment is running!
+        if self.settings['save']:
+        #     self.save_b26()
+            self.save_data()
+        #     self.save_log()
+        #     self.save_image_to_disk()
+
+    def _run_average_blocks(self, num_daq_reads, first_block=0):
+        """
+        Runs the average blocks of the experiment (see _run_block), tracks the ESR every track_every_N blocks if ESR
+        tracking is on and stops early once the live fit has reached the target uncertainty
+
+        Args:
+            num_daq_reads: number of daq reads per sequence
+            first_block: index of the first block that is run, the blocks before it have been loaded from the block store
+
+        """
+        (num_1E5_avg_pb_programs, remainder) = divmod(self.num_averages, MAX_AVERAGES_PER_SCAN)
+        stopped_early = False
 
         self.log("Averaging over {0} blocks of 1e5".format(num_1E5_avg_pb_programs))
         for average_loop in range(int(num_1E5_avg_pb_programs)):
+            if average_loop < first_block:
+                continue
+            if self._stop_early():
+                stopped_early = True
+                break
             self.log("Running average block {0} of {1}".format(average_loop+1, int(num_1E5_avg_pb_programs)))
             if self._abort:
                 self.instruments['PB']['instance'].update({'microwave_switch': {'status': False}})
@@ -170,8 +514,12 @@ for a given experiment
                 break
 
             # ER 20181028
-            if self.settings['ESR_Tracking']['on/off'] and average_loop % self.settings['ESR_Tracking']['track_every_N']==0:
-                self.scripts['esr'].run()
+            if self._esr_tracking and average_loop % self.settings['ESR_Tracking']['track_every_N']==0:
+                with self.timer.span('esr_tracking'):
+                    self.scripts['esr'].run()
+                if self._setting_planner is not None:
+                    # the esr has changed the settings of the microwave generator
+                    self._setting_planner.invalidate('microwave_generator')
 
                 # retrieve the new mw frequency: if there are two frequencies in the fit, pick the one closest to the old frequency
                 fit_params = self.scripts['esr'].data['fit_params']
@@ -182,7 +530,7 @@ for a given experiment
                 if fit_params is not None and len(fit_params) and fit_params[0] != -1:  # check if fit valid
                     if len(fit_params) == 4:
                         # single peak
-                        if (fit_params[2] - last_mw)**2 < (self.settings['ESR_Tracking']['allowed_delta_freq']*1e6)**2: # check if new value is within range allowed
+                        if (fit_params[2] - self._mw_settings['frequency'])**2 < (self.settings['ESR_Tracking']['allowed_delta_freq']*1e6)**2: # check if new value is within range allowed
                             update_mw = True
                         new_mw = fit_params[2]
                     elif len(fit_params) == 6:
@@ -193,38 +541,365 @@ for a given experiment
                     #self.instruments['mw_gen'].update({'frequency': new_mw})
                     self.scripts['esr'].instruments['microwave_generator']['instance'].update({'frequency': float(new_mw)})
                     self.log('updated mw carrier frequency to: {}'.format(new_mw))
-                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'amplitude': float(pulse_ampl)})
-                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'enable_modulation': bool(mod_flag)})
+                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'amplitude': float(self._mw_settings['amplitude'])})
+                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'enable_modulation': bool(self._mw_settings['enable_modulation'])})
 
-                    last_mw = new_mw
+                    self._mw_settings['frequency'] = float(new_mw)
                 else:
                     #self.instruments['mw_gen'].update({'frequency': last_mw})
-                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'frequency': float(last_mw)})
-                    self.log('not updating the mw carrier frequency. SRS carrier frequency kept at {0} Hz'.format(last_mw))
-                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'amplitude': float(pulse_ampl)})
-                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'enable_modulation': bool(mod_flag)})
+                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'frequency': float(self._mw_settings['frequency'])})
+                    self.log('not updating the mw carrier frequency. SRS carrier frequency kept at {0} Hz'.format(self._mw_settings['frequency']))
+                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'amplitude': float(self._mw_settings['amplitude'])})
+                    self.scripts['esr'].instruments['microwave_generator']['instance'].update({'enable_modulation': bool(self._mw_settings['enable_modulation'])})
 
             self.current_averages = (average_loop + 1) * MAX_AVERAGES_PER_SCAN
         #    print('tau sequences running: ', self.tau_list)
-            self._run_sweep(self.pulse_sequences, MAX_AVERAGES_PER_SCAN, num_daq_reads)
+            self._run_block(MAX_AVERAGES_PER_SCAN, num_daq_reads, self._mw_settings['frequency'])
 
+        if remainder != 0 and not self._abort and first_block <= num_1E5_avg_pb_programs and not stopped_early \
+                and not self._stop_early():
+            self.current_averages = self.num_averages
+            self._run_block(remainder, num_daq_reads, self._mw_settings['frequency'])
 
+    def _run_sweep_2d(self, num_daq_reads):
+        """
+        Runs the experiment (all its average blocks) for every value of the instrument setting of the outer axis (see
+        settings sweep_2d). All values share the pulse sequences, the compiled pulseblaster programs and the find_nv at
+        the start, and only the settings that change are written to the instruments (see SettingPlanner). After the
+        sweep the setting is set back to its value before the sweep.
 
+        Args:
+            num_daq_reads: number of daq reads per sequence
 
-        if remainder != 0 and not self._abort:
-            self.current_averages = self.num_averages
-            self._run_sweep(self.pulse_sequences, remainder, num_daq_reads)
+        Poststate: self.data['sweep_values'] contains the values of the outer axis and self.data['counts_2d'] the counts
+            (in kcps) of the first readout for each value and tau (self.data['counts_2d_1'], ... the other readouts).
+            The row of the current value is updated after every average block, values that have not been measured
+            are nan. self.data['counts'] contains the counts of the last value.
 
-        if (len(self.data['counts'][0]) == 1) and not self._abort:
-            self.data['counts'] = np.array([item for sublist in self.data['counts'] for item in sublist])
+        """
+        sweep_settings = self.settings['sweep_2d']
+        instrument_name, path = SWEEP_2D_SETTINGS[sweep_settings['setting']]
+        values = np.linspace(sweep_settings['min_value'], sweep_settings['max_value'], sweep_settings['num_points'])
+
+        instruments = {'microwave_generator': self.scripts['esr'].instruments['microwave_generator']['instance']}
+        if 'awg' in self.instruments:
+            instruments['awg'] = self.instruments['awg']['instance']
+        if instrument_name not in instruments:
+            self.log('{:s} can not be swept, {:s} does not have an {:s}'.format(
+                sweep_settings['setting'], self.__class__.__name__, instrument_name))
+            self._abort = True
+            return
+
+        points = []
+        for value in values:
+            setting = float(value)
+            for key in reversed(path):
+                setting = {key: setting}
+            points.append({instrument_name: setting})
+        planner = SettingPlanner(instruments, points)
+
+        if sweep_settings['setting'] == 'mw_frequency' and self._esr_tracking:
+            self.log('ESR tracking is turned off, the microwave frequency is swept')
+            self._esr_tracking = False
+
+        num_writes, num_settings = planner.plan()
+        self.log('2D sweep over {:d} values of {:s}, {:d} of {:d} settings have to be written'.format(
+            len(values), sweep_settings['setting'], num_writes, num_settings))
+
+        self.data['sweep_values'] = values
+        self.counts_2d = np.full((len(values),) + self.count_data.shape, np.nan)
+        self._publish_counts_2d()
+
+        # ESR tracking changes the microwave generator, then the planner has to write its settings again
+        self._setting_planner = planner
+        try:
+            for index, value in enumerate(values):
+                if self._abort:
+                    break
+                self.sweep_2d_index = index
+                if index > 0:
+                    self._reset_averages()
+                if planner.apply(index) > 0 and sweep_settings['settle_time'] > 0:
+                    time.sleep(sweep_settings['settle_time'])
+                if instrument_name == 'microwave_generator':
+                    # ESR tracking sets the swept value again after the ESR
+                    self._mw_settings[path[-1]] = float(value)
+                self.log('2D sweep: {:s} = {:g} ({:d} of {:d})'.format(sweep_settings['setting'], value, index + 1,
+                                                                      len(values)))
+                self._run_average_blocks(num_daq_reads)
+        finally:
+            self._setting_planner = None
+            planner.restore()
+        self.log('2D sweep: wrote {:d} settings, skipped {:d} settings that did not change'.format(
+            planner.num_writes, planner.num_skipped))
+
+    def _reset_averages(self):
+        """
+        Resets the counts and the averaging for the next value of the outer axis of a 2D sweep
+        """
+        self.count_data = np.zeros_like(self.count_data)
+        self.data['counts'] = deepcopy(self.count_data)
+        self.loops_per_tau[:] = 0
+        if self.adaptive_averaging is not None:
+            self.adaptive_averaging = AdaptiveAveraging(self.tau_list, self.count_data.shape[1],
+                                                        self.settings['adaptive_averaging']['criterion'],
+                                                        self.settings['adaptive_averaging']['uniform_fraction'],
+                                                        MAX_LOOPS_PER_SEQUENCE, self._live_fit_signal)
+        if self.fit_worker is not None:
+            # the fit of the next value starts from the fit of the last value
+            self.fit_worker.wait()
+            self.fit_worker.reset()
+
+    def _publish_counts_2d(self):
+        # the counts of each readout of a 2D sweep as separate 2D array, so that they can be saved as csv
+        for readout in range(self.counts_2d.shape[2]):
+            key = 'counts_2d' if readout == 0 else 'counts_2d_{:d}'.format(readout)
+            self.data[key] = self.counts_2d[:, :, readout]
+
+    def _sequence_durations(self, tau_list=None):
+        """
+        Args:
+            tau_list (optional): values of tau, if None the values of the settings (scripts that create all their
+                pulse sequences at once only support their own values)
 
-        # save data on the fly so that we can start to analyze it while the experiment is running!
-        if self.settings['save']:
-        #     self.save_b26()
-            self.save_data()
-        #     self.save_log()
-        #     self.save_image_to_disk()
+        Returns: array with the duration of one loop of each pulse sequence in ns (without the microwave switch)
+
+        """
+        if self._uses_sequence_template() and self._creates_single_pulse_sequences():
+            if tau_list is None:
+                tau_list = self._create_tau_list()
+            return self._create_sequence_template().materialize(tau_list).end_times()
+
+        if tau_list is None:
+            pulse_sequences = self._create_pulse_sequences()[0]
+        elif self._creates_single_pulse_sequences():
+            pulse_sequences = [self._create_pulse_sequence(tau) for tau in tau_list]
+        else:
+            raise ValueError('{:s} creates all its pulse sequences at once, its runtime can only be estimated for the '
+                             'tau values of its settings'.format(self.__class__.__name__))
+        return np.array([max([pulse.start_time + pulse.duration for pulse in pulse_sequence] + [0])
+                         for pulse_sequence in pulse_sequences])
+
+    def _runtime_model_name(self):
+        # the overhead depends on how the sequences are run, so each mode has its own runtime model
+        if self.settings['single_program']:
+            mode = 'single_program'
+        elif self.settings['pipelined']:
+            mode = 'pipelined'
+        else:
+            mode = 'sequence'
+        return '{:s}/{:s}'.format(self.__class__.__name__, mode)
+
+    def _runtime_model_filename(self):
+        # the runtime models are kept in the data path, None if there is none
+        if not self.settings['path'] or not os.path.isdir(self.settings['path']):
+            return None
+        return os.path.join(self.settings['path'], RUNTIME_MODEL_FILENAME)
+
+    def runtime_model(self):
+        """
+        Returns: the runtime model of the experiment (see RuntimeModel), learned from the previous runs with timing
+        """
+        filename = self._runtime_model_filename()
+        if filename is None:
+            return RuntimeModel()
+        return RuntimeModel.load(filename, self._runtime_model_name())
+
+    def estimate_runtime(self, num_averages=None, tau_list=None, sequence_durations=None):
+        """
+        Predicts the runtime of the experiment with its runtime model, from the durations of the pulse sequences, the
+        overhead of each phase measured in previous runs (with the setting timing on) and the tracking settings.
+        num_averages and tau_list can be different from the settings to plan an experiment (what-if).
+
+        Args:
+            num_averages (optional): number of averages, if None the value of the settings
+            tau_list (optional): values of tau, if None the values of the settings
+            sequence_durations (optional): duration of one loop of each pulse sequence in ns, if given tau_list is
+                ignored
+
+        Returns: dictionary with the phase, the number of times it is run and the predicted time in s as lists, the
+            first phase is the acquisition
+
+        """
+        if num_averages is None:
+            num_averages = self.settings['num_averages']
+        if sequence_durations is None:
+            sequence_durations = self._sequence_durations(tau_list)
+
+        esr_every_n = 0
+        if self.settings['ESR_Tracking']['on/off'] and not (self.settings['sweep_2d']['on/off'] and
+                                                            self.settings['sweep_2d']['setting'] == 'mw_frequency'):
+            esr_every_n = self.settings['ESR_Tracking']['track_every_N']
+        num_outer, settle_time = 1, 0.
+        if self.settings['sweep_2d']['on/off']:
+            num_outer = self.settings['sweep_2d']['num_points']
+            settle_time = self.settings['sweep_2d']['settle_time']
+
+        return self.runtime_model().estimate(sequence_durations, num_averages, MAX_AVERAGES_PER_SCAN,
+                                             tracking=self.settings['Tracking']['on/off'], esr_every_n=esr_every_n,
+                                             single_program=self.settings['single_program'],
+                                             pipelined=self.settings['pipelined'], num_outer=num_outer,
+                                             settle_time=settle_time,
+                                             sequence_separation=B26PulseBlaster.SEQUENCE_SEPARATION_TIME)
+
+    def _update_runtime_model(self):
+        """
+        Updates the runtime model with the phases timed in this run and saves it in the data path
+        """
+        filename = self._runtime_model_filename()
+        if not self.timer.enabled or filename is None or self._abort:
+            return
+        model = RuntimeModel.load(filename, self._runtime_model_name())
+        model.update(self.timer.summary(), self._predicted_acquire, self.settings['Tracking']['on/off'])
+        model.save(filename, self._runtime_model_name())
+
+    def _fraction_done(self):
+        # fraction of all loops of the experiment (of all values of the outer axis of a 2D sweep) that have been run
+        num_loops = self.num_averages * len(self.loops_per_tau)
+        if self.counts_2d is not None:
+            return (self.sweep_2d_index * num_loops + np.sum(self.loops_per_tau)) / float(num_loops * len(self.counts_2d))
+        return np.sum(self.loops_per_tau) / float(num_loops)
+
+    @property
+    def remaining_time(self):
+        """
+        estimates the time remaining until the experiment is finished: at the start from the runtime estimate, then the
+        more of the experiment has been run the more from the observed rate (see estimate_remaining_time)
+        """
+        if not self.is_running or self.runtime_estimate is None:
+            return super(PulsedExperimentBaseScript, self).remaining_time
+
+        elapsed_time = (datetime.datetime.now() - self.start_time).total_seconds()
+        return datetime.timedelta(seconds=estimate_remaining_time(sum(self.runtime_estimate['time']), elapsed_time,
+                                                                  self._fraction_done()))
+
+    def _open_block_store(self, num_blocks, num_daq_reads):
+        """
+        Opens the block store of the experiment: the store given in the settings if the experiment is resumed, otherwise
+        a new store. When resuming, the counts of the completed blocks are loaded into self.count_data.
+
+        Args:
+            num_blocks: number of average blocks of the experiment
+            num_daq_reads: number of daq reads per sequence
+
+        Returns: the BlockStore or None if the experiment can not be resumed from the given store
+
+        """
+        path = self.settings['record_blocks']['store']
+
+        if self.settings['record_blocks']['resume']:
+            try:
+                block_store = BlockStore(path)
+            except (IOError, OSError, ValueError) as e:
+                self.log('could not open block store {:s} to resume the experiment: {:s}'.format(path, str(e)))
+                return None
+            if not block_store.is_compatible(self.tau_list, num_blocks, num_daq_reads):
+                self.log('could not resume the experiment, block store {:s} was recorded with different tau values or '
+                         'number of averages'.format(path))
+                return None
+
+            if 'sweep_order' in block_store.meta:
+                self.sweep_order = SweepOrder(len(self.pulse_sequences), **block_store.meta['sweep_order'])
+            self.count_data = self.count_data + block_store.total_counts()
+            self.loops_per_tau += block_store.total_loops()
+            if self.adaptive_averaging is not None:
+                self.adaptive_averaging.add_counts(block_store.total_counts(), block_store.total_loops())
+            if block_store.num_completed > 0:
+                self.data['counts'] = self._normalize_to_kCounts(self.count_data, self.measurement_gate_width,
+                                                                 self.loops_per_tau[:, np.newaxis])
+            self.log('resuming experiment after block {:d} of {:d}'.format(block_store.num_completed, num_blocks))
+            return block_store
+
+        if path == '':
+            # use a new directory for every call, _function can be called several times in a run (e.g. for a power sweep)
+            index = 0
+            while os.path.exists(self.filename('-blocks{:03d}'.format(index))):
+                index += 1
+            path = self.filename('-blocks{:03d}'.format(index))
+        meta = {'script': self.__class__.__name__, 'gate_width': self.measurement_gate_width,
+                'num_averages': self.num_averages, 'sweep_order': self.sweep_order.to_dict()}
+        block_store = BlockStore.create(path, self.tau_list, num_blocks, num_daq_reads, meta)
+        self.log('recording average blocks in {:s}'.format(path))
+        return block_store
+
+    def _run_block(self, num_loops, num_daq_reads, mw_frequency):
+        """
+        Runs an average block, i.e. every pulse sequence num_loops times, or with adaptive averaging num_loops times on
+        average with the loops distributed over the tau values by self.adaptive_averaging, and records it in the block
+        store
+
+        Args:
+            num_loops: number of loops of each sequence
+            num_daq_reads: number of daq reads per sequence
+            mw_frequency: microwave carrier frequency during the block
 
+        """
+        if self.adaptive_averaging is not None:
+            num_loops = self.adaptive_averaging.allocate(num_loops * len(self.pulse_sequences))
+        self.loops_per_tau += num_loops
+        if self._durations is not None:
+            self._predicted_acquire += float(np.sum(num_loops * self._durations)) * 1e-9
+            if self.settings['single_program']:
+                # the sequences of a program are separated in the steady state (assuming a single program per block)
+                self._predicted_acquire += (len(self._durations) - 1) * B26PulseBlaster.SEQUENCE_SEPARATION_TIME * 1e-9
+
+        start_time, start_counts = time.time(), self.count_data.copy()
+        order = self.data['sweep_order'][self._block_index]
+        self._block_index += 1
+        self._run_sweep(self.pulse_sequences, num_loops, num_daq_reads, order=order)
+        if self.adaptive_averaging is not None and not self._abort:
+            self.adaptive_averaging.add_counts(self.count_data - start_counts, num_loops)
+        self._record_block(start_time, start_counts, num_loops, mw_frequency)
+        if self.counts_2d is not None:
+            self.counts_2d[self.sweep_2d_index] = self.data['counts']
+            self._publish_counts_2d()
+        if self.fit_worker is not None and not self._abort:
+            self.fit_worker.submit(self.data['tau'], self._live_fit_signal(self.data['counts']))
+
+    def _live_fit_signal(self, counts):
+        """
+        Args:
+            counts: array with the counts of each readout (data['counts'])
+
+        Returns: the signal that is fitted by the live fit, scripts with a live fit model overwrite this
+
+        """
+        return counts[:, 0]
+
+    def _publish_live_fit(self, result):
+        # called from the fit worker after every successful fit
+        self.data['live_fit'] = result
+
+    def _stop_early(self):
+        """
+        Returns: True if the live fit has reached the target uncertainty, then the remaining average blocks are skipped
+        """
+        if self.fit_worker is None or not self.fit_worker.converged:
+            return False
+        self.log('relative uncertainty of {:s} is {:0.3g}, stopping after {:d} of {:d} averages'.format(
+            self.fit_worker.stop_parameter, self.fit_worker.relative_uncertainty, self.current_averages,
+            self.num_averages))
+        return True
+
+    def _record_block(self, start_time, start_counts, num_loops, mw_frequency):
+        """
+        Appends the last average block to the block store, blocks that have been aborted are not recorded
+
+        Args:
+            start_time: time at which the block was started
+            start_counts: self.count_data before the block was run
+            num_loops: number of loops of each sequence in the block (single value or one value per sequence)
+            mw_frequency: microwave carrier frequency during the block
+
+        """
+        if self._block_store is None or self._abort:
+            return
+
+        nv_position = self.scripts['find_nv'].settings['initial_point']
+        self._block_store.append(self.count_data - start_counts, self._sequence_order, start_time, time.time(),
+                                 num_loops, mw_frequency, (nv_position['x'], nv_position['y']))
+
+    @timed('plot')
     def _plot(self, axes_list, data=None):
         """
         Plot 1: self.data['tau'], the list of times specified for a given experiment, verses self.data['counts'], the data
@@ -253,6 +928,7 @@ for a given experiment
             plot_1d_simple_timetrace_ns(axes_list[0], data['tau'], [data['counts']])
             plot_pulses(axes_list[1], self.pulse_sequences[self.sequence_index])
 
+    @timed('plot')
     def _update_plot(self, axes_list):
         '''
         Updates plots specified in _plot above
@@ -271,15 +947,18 @@ for a given experiment
         axis2 = axes_list[1]
         update_pulse_plot(axis2, self.pulse_sequences[self.sequence_index])
 
-    def _run_sweep(self, pulse_sequences, num_loops_sweep, num_daq_reads, verbose=False):
+    def _run_sweep(self, pulse_sequences, num_loops_sweep, num_daq_reads, verbose=False, order=None):
         """
         Each pulse sequence specified in pulse_sequences is run num_loops_sweep consecutive times.
 
         Args:
             pulse_sequences: a list of pulse sequences to run, each corresponding to a different value of tau. Each
                              sequence is a list of Pulse objects specifying a given pulse sequence
-            num_loops_sweep: number of times to repeat each sequence before moving on to the next one
+            num_loops_sweep: number of times to repeat each sequence before moving on to the next one, either a single
+                             value or one value per sequence (adaptive averaging)
             num_daq_reads: number of times the daq must read for each sequence (generally 1, 2, or 3)
+            order (optional): array with the indices of the sequences in the order in which they are run (see
+                SweepOrder), if None a new random order (or their order if randomize is unchecked)
 
         Poststate: self.data['counts'] is updated with the acquired data
 
@@ -287,47 +966,405 @@ for a given experiment
         # ER 20180731 set init_fluor to zero
      #   self.data['init_fluor'] = 0.
 
-        rand_indexes = list(range(len(pulse_sequences)))
-
-        if self.settings['randomize']:
-            random.shuffle(rand_indexes)
+        if order is None:
+            order = SweepOrder(len(pulse_sequences), 'shuffle' if self.settings['randomize'] else 'sequential').block(0)
+        rand_indexes = np.asarray(order, dtype=np.int64)
+        self._sequence_order = rand_indexes
         if verbose:
             print(('_run_sweep number of pulse sequences', len(pulse_sequences)))
+        num_loops_sweep = np.broadcast_to(np.asarray(num_loops_sweep, dtype=np.int64), (len(pulse_sequences),))
+
+        if self.settings['keep_raw_counts']:
+            # the counts of each gate of a sequence in the order loop, readout, the daq reads directly into this array
+            # (rows of sequences with less loops are padded with nan). It is allocated on the first block of the run and
+            # only reallocated if a block has more loops, the other blocks overwrite it
+            num_gates = int(np.max(num_loops_sweep)) * num_daq_reads
+            raw_counts = self.data.get('raw_counts')
+            if raw_counts is None or raw_counts.shape[0] != len(pulse_sequences) or raw_counts.shape[1] < num_gates:
+                self.data['raw_counts'] = np.full((len(pulse_sequences), num_gates), np.nan)
+            else:
+                raw_counts.fill(np.nan)
+
+        if self.settings['single_program']:
+            self._run_sweep_single_program(pulse_sequences, rand_indexes, num_loops_sweep, num_daq_reads)
+            return
+        if self.settings['pipelined']:
+            self._run_sweep_pipelined(pulse_sequences, rand_indexes, num_loops_sweep, num_daq_reads)
+            return
 
-        for index, sequence in enumerate(pulse_sequences):
+        for index, rand_index in enumerate(rand_indexes):
             if verbose:
                 print(('_run_sweep index', index, len(pulse_sequences)))
 
-            rand_index = rand_indexes[index]
             if self._abort:
                 self.instruments['PB']['instance'].update({'microwave_switch': {'status': False}})
                 break
-            result = self._run_single_sequence(pulse_sequences[rand_index], num_loops_sweep, num_daq_reads)  # keep entire array
-            self.count_data[rand_index] = self.count_data[rand_index] + result
-
-            counts_to_check = self._normalize_to_kCounts(np.array(result), self.measurement_gate_width, num_loops_sweep)
-            self.data['counts'][rand_index] = self._normalize_to_kCounts(self.count_data[rand_index], self.measurement_gate_width,
-                                                                    self.current_averages)
+            if isinstance(pulse_sequences, PulseSequenceSet) and not pulse_sequences.is_valid(rand_index):
+                self.data['counts'][rand_index] = np.nan
+                continue
+            num_loops = int(num_loops_sweep[rand_index])
+            raw_counts = None
+            if self.settings['keep_raw_counts']:
+                raw_counts = self.data['raw_counts'][rand_index][:num_loops * num_daq_reads]
+            result = self._run_single_sequence(pulse_sequences[rand_index], num_loops, num_daq_reads, raw_counts)
 
             self.sequence_index = index
-            counts_temp = counts_to_check[0]
             # track to the NV if necessary ER 5/31/17
-            if self.settings['Tracking']['on/off']:
-                if (1+(1-self.settings['Tracking']['threshold']))*self.settings['Tracking']['init_fluor'] < counts_temp or \
-                        self.settings['Tracking']['threshold']*self.settings['Tracking']['init_fluor'] > counts_temp:
-                    if verbose:
-                        print('TRACKING TO NV...')
-                    self.scripts['find_nv'].run()
-                    self.scripts['find_nv'].settings['initial_point'] = self.scripts['find_nv'].data['maximum_point']
+            if self._add_counts(rand_index, result, num_loops):
+                if verbose:
+                    print('TRACKING TO NV...')
+                self._track()
             self.updateProgress.emit(self._calc_progress(index))
 
-    def _run_single_sequence(self, pulse_sequence, num_loops, num_daq_reads):
+    def _run_sweep_single_program(self, pulse_sequences, sequence_order, num_loops_sweep, num_daq_reads):
+        """
+        Runs all pulse sequences in a single pulseblaster program (see B26PulseBlaster.get_sweep_program), each sequence
+        num_loops_sweep consecutive times. The counts of all sequences are read with a single gated counter acquisition
+        and then split up by sequence and readout. If the program would have too many commands for the pulseblaster or
+        too many samples for a single daq read, the sequences are split up into several programs. The number of
+        commands of each sequence is only compiled on the first block (for each number of loops) and then reused.
+
+        The sequences of a program are separated by B26PulseBlaster.SEQUENCE_SEPARATION_TIME (500 ns) in the steady
+        state, during which no counts are acquired. This time is part of the acquisition time and of the runtime
+        estimate (see estimate_runtime).
+
+        Args:
+            pulse_sequences: a list of pulse sequences to run, each corresponding to a different value of tau
+            sequence_order: the order in which the pulse sequences are run
+            num_loops_sweep: array with the number of times to repeat each sequence before moving on to the next one
+            num_daq_reads: number of times the daq must read for each sequence (generally 1, 2, or 3)
+
+        Poststate: self.data['counts'] is updated with the acquired data
+
+        """
+        pulse_blaster = self.instruments['PB']['instance']
+
+        if isinstance(pulse_sequences, PulseSequenceSet):
+            valid = np.array([pulse_sequences.is_valid(index) for index in sequence_order], dtype=bool)
+            self.data['counts'][sequence_order[~valid]] = np.nan
+            sequence_order = sequence_order[valid]
+
+        # split up the sweep into programs that fit into the pulseblaster and the daq buffer, only the sequences that are
+        # run are compiled (a lazy PulseSequenceSet only creates these and invalid sequences can not be compiled)
+        keys = [(int(index), int(num_loops_sweep[index])) for index in sequence_order]
+        missing = [key for key in keys if key not in self._command_counts]
+        if missing:
+            with self.timer.span('compile'):
+                instruction_table = pulse_blaster.compile_sweep([pulse_sequences[index] for index, _ in missing],
+                                                                [loops for _, loops in missing], compress_loops=True)
+            self._command_counts.update(zip(missing, instruction_table.num_commands()))
+        num_commands = {index: self._command_counts[(index, loops)] for index, loops in keys}
+        num_samples = num_loops_sweep * num_daq_reads
+        programs = [[]]
+        program_commands, program_samples = 0, 0
+        for index in sequence_order:
+            if programs[-1] and (program_commands + num_commands[index] >= 4096 or
+                                 program_samples + num_samples[index] > MAX_SAMPLES_PER_PROGRAM):
+                programs.append([])
+                program_commands, program_samples = 0, 0
+            programs[-1].append(index)
+            program_commands += num_commands[index]
+            program_samples += num_samples[index]
+        programs = [program for program in programs if program]
+
+        num_done = 0
+        for program in programs:
+            if self._abort:
+                pulse_blaster.update({'microwave_switch': {'status': False}})
+                break
+
+            program_loops = num_loops_sweep[program]
+            with self.timer.span('compile'):
+                sweep_program = pulse_blaster.get_sweep_program([pulse_sequences[index] for index in program],
+                                                                num_loops=program_loops)
+            with self.timer.span('program'):
+                pulse_blaster.load_program(sweep_program)
+
+            if num_daq_reads != 0:
+                with self.timer.span('daq_arm'):
+                    task = self._daq.setup_gated_counter('ctr0', int(np.sum(program_loops) * num_daq_reads),
+                                                         pooled=True)
+                    self._daq.run(task)
+
+            with self.timer.span('acquire'):
+                pulse_blaster.start_pulse_seq()
+                result = np.zeros((len(program), num_daq_reads))
+                if num_daq_reads != 0:
+                    result_array, temp = self._daq.read(task, as_array=True)
+            if num_daq_reads != 0:
+                with self.timer.span('readback'):
+                    result = self._sum_gates(result_array, program_loops, num_daq_reads)
+                    if self.settings['keep_raw_counts']:
+                        first_loops = np.concatenate(([0], np.cumsum(program_loops)[:-1]))
+                        for index, first_loop, loops in zip(program, first_loops, program_loops):
+                            self.data['raw_counts'][index][:loops * num_daq_reads] = \
+                                result_array[first_loop * num_daq_reads:(first_loop + loops) * num_daq_reads]
+                    self._daq.stop(task)
+
+            if pulse_blaster.settings['PB_type'] == 'USB':
+                pulse_blaster.stop_pulse_seq()
+
+            # scatter the counts of the program into the data of its sequences
+            needs_tracking = self._add_counts(program, result, program_loops)
+
+            num_done += len(program)
+            self.sequence_index = num_done - 1
+
+            # track to the NV if necessary, at most once per program
+            if needs_tracking:
+                self._track()
+            self.updateProgress.emit(self._calc_progress(num_done))
+
+    def _run_sweep_pipelined(self, pulse_sequences, sequence_order, num_loops_sweep, num_daq_reads):
+        """
+        Runs each pulse sequence num_loops_sweep consecutive times like _run_sweep, but pipelined: while the pulseblaster
+        runs a sequence, a worker thread compiles the next sequence and sets up its daq task, and releases the daq task
+        and sums up the counts of the previous sequence. Only loading the program and the acquisition run in this
+        thread. The worker does not touch self.data or self.count_data, the summed counts are added to the data in this
+        thread once the next sequence has been started, so tracking is triggered by the counts of the previous sequence.
+
+        The time spent in each phase is accumulated in self.data['phase_times'] (in s) and the fraction of the wall time
+        during which the pulseblaster runs is stored in self.data['duty_cycle'].
+
+        Args:
+            pulse_sequences: a list of pulse sequences to run, each corresponding to a different value of tau
+            sequence_order: the order in which the pulse sequences are run
+            num_loops_sweep: array with the number of times to repeat each sequence before moving on to the next one
+            num_daq_reads: number of times the daq must read for each sequence (generally 1, 2, or 3)
+
+        Poststate: self.data['counts'] is updated with the acquired data
+
+        """
+        pulse_blaster = self.instruments['PB']['instance']
+        phase_times = self.data['phase_times']
+        sweep_start_time = time.time()
+        # the worker accumulates its phase times here, they are added to phase_times once it has been shut down
+        self._worker_phase_times = {'prepare': 0.0, 'reduce': 0.0}
+
+        # a single worker, so that the jobs (and all changes of the daq tasklist) are executed in the order submitted
+        worker = ThreadPoolExecutor(max_workers=1)
+        next_sequence = worker.submit(self._prepare_sequence, pulse_sequences, sequence_order[0],
+                                      int(num_loops_sweep[sequence_order[0]]), num_daq_reads)
+        # reduced_counts is the job that sums up the counts of the sequence reduced_index
+        released_task, reduced_counts, reduced_index = None, None, None
+        try:
+            for index, rand_index in enumerate(sequence_order):
+                if self._abort:
+                    pulse_blaster.update({'microwave_switch': {'status': False}})
+                    break
+
+                prepared_sequence = next_sequence.result()
+                next_sequence = None
+                if index + 1 < len(sequence_order):
+                    next_index = sequence_order[index + 1]
+                    next_sequence = worker.submit(self._prepare_sequence, pulse_sequences, next_index,
+                                                  int(num_loops_sweep[next_index]), num_daq_reads)
+                if prepared_sequence is None:
+                    self.data['counts'][rand_index] = np.nan
+                    continue
+                program, task = prepared_sequence
+
+                # the counter of the previous sequence has to be released before the next one can start
+                start_time = time.time()
+                if released_task is not None:
+                    released_task.result()
+                with self.timer.span('program'):
+                    pulse_blaster.load_program(program)
+                if num_daq_reads != 0:
+                    with self.timer.span('daq_arm'):
+                        self._daq.run(task)
+                phase_times['load'] += time.time() - start_time
+
+                start_time = time.time()
+                with self.timer.span('acquire'):
+                    pulse_blaster.start_pulse_seq()
+                    result_array = None
+                    if num_daq_reads != 0:
+                        # thread waits on DAQ getting the right number of gates
+                        raw_counts = None
+                        if self.settings['keep_raw_counts']:
+                            raw_counts = self.data['raw_counts'][rand_index][:num_loops_sweep[rand_index] * num_daq_reads]
+                        result_array, temp = self._daq.read(task, as_array=True, out=raw_counts)
+                    if pulse_blaster.settings['PB_type'] == 'USB':
+                        pulse_blaster.stop_pulse_seq()
+                phase_times['acquire'] += time.time() - start_time
+
+                if num_daq_reads != 0:
+                    released_task = worker.submit(self._daq.stop, task)
+
+                # the counts of the previous sequence have been summed up while this sequence was running
+                if reduced_counts is not None and self._add_counts(reduced_index, reduced_counts.result(),
+                                                                   num_loops_sweep[reduced_index]):
+                    # find_nv sets up its own daq tasks, so the worker must be done with the tasklist (setting up the
+                    # next sequence and releasing this one) before we track
+                    wait([job for job in [next_sequence, released_task] if job is not None])
+                    self._track()
+                reduced_counts, reduced_index = None, None
+                if num_daq_reads != 0:
+                    reduced_counts = worker.submit(self._reduce_counts, result_array, num_loops_sweep[rand_index],
+                                                   num_daq_reads)
+                    reduced_index = rand_index
+
+                self.sequence_index = index
+                self.updateProgress.emit(self._calc_progress(index))
+        finally:
+            # release the daq task of a sequence that has been prepared but not run (e.g. after an abort)
+            if next_sequence is not None and next_sequence.exception() is None and next_sequence.result() is not None:
+                program, task = next_sequence.result()
+                if task is not None:
+                    worker.submit(self._daq.stop, task)
+            worker.shutdown(wait=True)
+            for phase, duration in self._worker_phase_times.items():
+                phase_times[phase] += duration
+
+        # the counts of the last sequence that has been run are added even after an abort
+        if reduced_counts is not None and self._add_counts(reduced_index, reduced_counts.result(),
+                                                           num_loops_sweep[reduced_index]) and not self._abort:
+            self._track()
+
+        phase_times['wall'] += time.time() - sweep_start_time
+        self.data['duty_cycle'] = phase_times['acquire'] / phase_times['wall']
+
+    def _prepare_sequence(self, pulse_sequences, index, num_loops, num_daq_reads):
+        """
+        Compiles a pulse sequence and sets up the daq task to read it, this is the part of _run_single_sequence that
+        does not require the pulseblaster or the counter and can run while the previous sequence is running
+
+        Args:
+            pulse_sequences: a list of pulse sequences
+            index: index of the pulse sequence to prepare
+            num_loops: number of times to repeat the pulse sequence
+            num_daq_reads: number of daq reads per sequence
+
+        Returns: tuple (program, task) with the compiled program and the name of the daq task (None if there are no
+            daq reads) or None if the pulse sequence is not valid
+
+        """
+        start_time = time.time()
+        if isinstance(pulse_sequences, PulseSequenceSet) and not pulse_sequences.is_valid(index):
+            return None
+
+        with self.timer.span('compile'):
+            program = self.instruments['PB']['instance'].get_program(pulse_sequences[index], num_loops)
+        task = None
+        if num_daq_reads != 0:
+            with self.timer.span('daq_arm'):
+                task = self._daq.setup_gated_counter('ctr0', int(num_loops * num_daq_reads), pooled=True)
+        self._worker_phase_times['prepare'] += time.time() - start_time
+
+        return program, task
+
+    def _reduce_counts(self, result_array, num_loops, num_daq_reads):
+        """
+        Sums up the counts read from the daq for each readout of a sequence (see _sum_gates), this runs in the worker
+        thread of _run_sweep_pipelined and therefore only returns the sums, which are added to the data by _add_counts
+
+        Args:
+            result_array: numpy array with the counts of all gates of the sequence
+            num_loops: number of times the pulse sequence was repeated
+            num_daq_reads: number of daq reads per sequence
+
+        Returns: numpy array (1, num_daq_reads) with the summed counts of each readout
+
+        """
+        start_time = time.time()
+        with self.timer.span('readback'):
+            result = self._sum_gates(result_array, num_loops, num_daq_reads)
+        self._worker_phase_times['reduce'] += time.time() - start_time
+
+        return result
+
+    @staticmethod
+    def _sum_gates(result_array, num_loops, num_daq_reads):
+        """
+        Sums up the counts of every gate for each sequence and readout, the gates are in the order sequence, loop,
+        readout (a single sequence or several sequences that have been run one after the other in a single program)
+
+        Args:
+            result_array: numpy array with the counts of all gates
+            num_loops: number of loops of each sequence, a single value or an array with one value per sequence
+            num_daq_reads: number of daq reads per sequence
+
+        Returns: numpy array (number of sequences, num_daq_reads) with the summed counts
+
+        """
+        num_loops = np.atleast_1d(np.asarray(num_loops, dtype=np.int64))
+        first_loops = np.concatenate(([0], np.cumsum(num_loops)[:-1]))
+        gates = result_array[:np.sum(num_loops) * num_daq_reads].reshape(-1, num_daq_reads)
+        return np.add.reduceat(gates, first_loops, axis=0)
+
+    def _add_counts(self, indices, result, num_loops):
+        """
+        Adds the summed counts of one or several sequences to self.count_data, updates self.data['counts'] and passes
+        the counts of every sequence to the tracking policy. All runners reduce their counts with _sum_gates and
+        _add_counts.
+
+        Args:
+            indices: index of the pulse sequence or array with the indices of the pulse sequences the counts belong to
+            result: numpy array (number of sequences, number of readouts) with the summed counts, or a single row
+            num_loops: number of times each pulse sequence was repeated to acquire result, a single value or an array
+
+        Returns: True if the counts of any of the sequences indicate that we have to track to the NV
+
+        """
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        result = np.reshape(result, (len(indices), -1))
+        num_loops = np.broadcast_to(np.asarray(num_loops), (len(indices),))[:, np.newaxis]
+
+        np.add.at(self.count_data, indices, result)
+        self.data['counts'][indices] = self._normalize_to_kCounts(self.count_data[indices], self.measurement_gate_width,
+                                                                  self.loops_per_tau[indices][:, np.newaxis])
+        counts_temp = self._normalize_to_kCounts(result, self.measurement_gate_width, num_loops)
+
+        # every value is passed to the tracking policy, so that its detector sees the whole stream
+        needs_tracking = False
+        for index, sequence_counts in zip(indices, counts_temp):
+            needs_tracking = self._needs_tracking(sequence_counts, index) or needs_tracking
+        return needs_tracking
+
+    def _needs_tracking(self, counts, index=None):
+        """
+        passes the counts of the tracking readout to the tracking policy
+
+        Args:
+            counts: counts of all readouts of a sequence in kcps
+            index: index of the pulse sequence the counts belong to
+
+        Returns: True if tracking is on and the tracking policy decides that we have to track to the NV
+
+        """
+        if self.tracking_policy is None or len(counts) == 0:
+            return False
+        if self.settings['Tracking']['readout'] == 'reference':
+            readout = min(self._REFERENCE_READOUT, len(counts) - 1)
+        else:
+            readout = len(counts) - 1
+        return self.tracking_policy.update(counts[readout], index)
+
+    def _track(self):
+        """
+        tracks to the NV with find_nv, uses the new position as starting point for the next tracking and records the
+        time it took in the tracking policy
+        """
+        start_time = time.time()
+        with self.timer.span('find_nv'):
+            self.scripts['find_nv'].run()
+        self.scripts['find_nv'].settings['initial_point'] = self.scripts['find_nv'].data['maximum_point']
+        duration = time.time() - start_time
+        self.tracking_policy.tracked(duration)
+        self.data['tracking_time_fraction'] = self.tracking_policy.time_fraction
+        if 'phase_times' in self.data:
+            self.data['phase_times']['tracking'] += duration
+
+    def _run_single_sequence(self, pulse_sequence, num_loops, num_daq_reads, raw_counts=None):
         '''
         Runs a single pulse sequence, num_loops consecutive times
         Args:
             pulse_sequence: a list of Pulse objects specifying a pulse sequence
             num_loops: number of times to repeat the pulse sequence
             num_daq_reads: number of times sequence requires that the
+            raw_counts: optional preallocated array of length num_loops * num_daq_reads, the daq reads the counts of
+                every gate directly into this array
 
         Returns: a list containing, 1, 2, or 3 values depending on the pulse sequence
         counts, the second is the number of
@@ -335,23 +1372,29 @@ for a given experiment
         '''
 
 
-        self.instruments['PB']['instance'].program_pb(pulse_sequence, num_loops=num_loops)
+        with self.timer.span('compile'):
+            program = self.instruments['PB']['instance'].get_program(pulse_sequence, num_loops)
+        with self.timer.span('program'):
+            self.instruments['PB']['instance'].load_program(program)
         # TODO(AK): figure out if timeout is actually needed
         timeout = 2 * self.instruments['PB']['instance'].estimated_runtime
 
         if num_daq_reads != 0:
-            task = self._daq.setup_gated_counter('ctr0', int(num_loops * num_daq_reads))
-            self._daq.run(task)
-
-        self.instruments['PB']['instance'].start_pulse_seq()
-        result = []
-        if num_daq_reads != 0:
-            result_array, temp = self._daq.read(task)  # thread waits on DAQ getting the right number of gates
-            for i in range(num_daq_reads):
-                result.append(sum(itertools.islice(result_array, i, None, num_daq_reads)))
-        # clean up APD tasks
+            with self.timer.span('daq_arm'):
+                task = self._daq.setup_gated_counter('ctr0', int(num_loops * num_daq_reads), pooled=True)
+                self._daq.run(task)
+
+        with self.timer.span('acquire'):
+            self.instruments['PB']['instance'].start_pulse_seq()
+            result = []
+            if num_daq_reads != 0:
+                # thread waits on DAQ getting the right number of gates
+                result_array, temp = self._daq.read(task, as_array=True, out=raw_counts)
         if num_daq_reads != 0:
-            self._daq.stop(task)
+            with self.timer.span('readback'):
+                result = self._sum_gates(result_array, num_loops, num_daq_reads)[0]
+                # clean up APD tasks
+                self._daq.stop(task)
 
         if self.instruments['PB']['instance'].settings['PB_type'] == 'USB':
             self.instruments['PB']['instance'].stop_pulse_seq()
@@ -360,7 +1403,10 @@ for a given experiment
     # MUST BE IMPLEMENTED IN INHERITING SCRIPT
     def _create_pulse_sequences(self):
         '''
-        A function to create the pulse sequence. This must be overwritten in scripts inheriting from this script
+        A function to create the pulse sequence. This must be overwritten in scripts inheriting from this script, unless
+        the script implements _create_tau_list and _create_pulse_sequence, which allows to create the pulse sequences
+        one at a time (see create_pulse_sequence_set), or _create_tau_list and _create_sequence_template, which allows to
+        create all pulse sequences at once
 
         The pulse sequences are pulse-blaster friendly opposed to the settings which are human-readable!!
 
@@ -372,6 +1418,46 @@ for a given experiment
             tau_list: the list of times tau, with each value corresponding to a pulse sequence in pulse_sequences
 
 
+        '''
+        tau_list = self._create_tau_list()
+        if self._uses_sequence_template():
+            pulse_sequences = self._create_sequence_template().create_pulse_sequences(tau_list)
+        else:
+            pulse_sequences = [self._create_pulse_sequence(tau) for tau in tau_list]
+
+        return pulse_sequences, tau_list, self.settings['read_out']['meas_time']
+
+    def _create_tau_list(self):
+        '''
+        A function to create the values of tau, needs to be implemented together with _create_pulse_sequence if the
+        script does not overwrite _create_pulse_sequences
+
+        Returns: the list of times tau
+
+        '''
+        raise NotImplementedError
+
+    def _create_pulse_sequence(self, tau):
+        '''
+        A function to create the pulse sequence for a single value of tau, see _create_tau_list
+
+        Args:
+            tau: the value of tau
+
+        Returns: a list of Pulse objects
+
+        '''
+        if self._uses_sequence_template():
+            return self._create_sequence_template().create_pulse_sequences([tau])[0]
+        raise NotImplementedError
+
+    def _create_sequence_template(self):
+        '''
+        A function to create the pulse sequences of all values of tau at once, can be implemented together with
+        _create_tau_list instead of _create_pulse_sequence if the times of all pulses are affine functions of tau
+
+        Returns: a SequenceTemplate
+
         '''
         raise NotImplementedError
 
@@ -422,11 +1508,83 @@ for a given experiment
         if pulse_sequences is None:
             pulse_sequences, __, __ = self.create_pulse_sequences()
 
-        for pulse_sequence in pulse_sequences:
-            if self._is_bad_pulse_sequence(pulse_sequence):
-                return False
+        return bool(np.all(self.validate_pulse_sequences(pulse_sequences)['valid']))
 
-        return True
+    def validate_pulse_sequences(self, pulse_sequences, tau_list=None):
+        """
+        Checks all pulse sequences of a sweep at once for the constraints of the pulseblaster (see
+        _is_bad_pulse_sequence). Instead of compiling and checking each sequence on its own, the overlap check is a
+        single sort over all pulses and all sequences are compiled together with the vectorized compiler of the
+        pulseblaster.
+
+        Args:
+            pulse_sequences: a list of pulse sequences, each a list of Pulse objects
+            tau_list (optional): the values of tau corresponding to the pulse sequences
+
+        Returns:
+            dictionary of arrays with one entry per pulse sequence
+                'tau': the values of tau (index of the sequence if no tau_list is given)
+                'overlapping_pulses': True if the sequence has overlapping pulses
+                'commands_too_short': True if the sequence compiles to commands shorter than min_pulse_dur
+                'bad_start_time': True if the sequence has pulses with a negative start time, a start time between 0
+                    and 1 or times that are not multiples of the clock period
+                'too_many_commands': True if the sequence compiles to 4096 or more commands
+                'valid': True if the sequence passed all checks
+        """
+        pulse_blaster = self.instruments['PB']['instance']
+        clock_period = 1.e9 / (1.0e6 * pulse_blaster.settings['clock_speed'])
+        num_sequences = len(pulse_sequences)
+
+        if tau_list is None:
+            tau_list = np.arange(num_sequences)
+
+        report = {
+            'tau': np.array(tau_list),
+            'overlapping_pulses': np.zeros(num_sequences, dtype=bool),
+            'commands_too_short': np.zeros(num_sequences, dtype=bool),
+            'bad_start_time': np.zeros(num_sequences, dtype=bool),
+            'too_many_commands': np.zeros(num_sequences, dtype=bool),
+            'valid': np.zeros(num_sequences, dtype=bool)
+        }
+
+        if num_sequences == 0:
+            return report
+
+        if self.settings['mw_switch']['no_iq_overlap']:
+            report['overlapping_pulses'] = B26PulseBlaster.has_overlapping_pulses(
+                pulse_sequences, combine_channels=['microwave_i', 'microwave_q'])
+        else:
+            report['overlapping_pulses'] = B26PulseBlaster.has_overlapping_pulses(pulse_sequences)
+
+        lengths = np.array([len(pulse_sequence) for pulse_sequence in pulse_sequences])
+        sequence_index = np.repeat(np.arange(num_sequences), lengths)
+        start_times = np.array([pulse.start_time for pulse_sequence in pulse_sequences for pulse in pulse_sequence],
+                               dtype=float)
+        end_times = start_times + np.array([pulse.duration for pulse_sequence in pulse_sequences
+                                            for pulse in pulse_sequence], dtype=float)
+
+        is_bad_pulse = (start_times < 0) | ((0 < start_times) & (start_times < 1)) | \
+                       (np.mod(start_times, clock_period) != 0) | (np.mod(end_times, clock_period) != 0)
+        report['bad_start_time'][sequence_index[is_bad_pulse]] = True
+
+        # sequences with negative start times can not be compiled, all others are compiled in one go
+        compilable = np.flatnonzero(np.bincount(sequence_index[start_times < 0], minlength=num_sequences) == 0)
+        if len(compilable) > 0:
+            instruction_table = pulse_blaster.compile_sweep([pulse_sequences[i] for i in compilable],
+                                                            self.settings['num_averages'], compress_loops=True)
+            num_commands = instruction_table.num_commands()
+            min_duration = np.full(len(compilable), np.inf)
+            has_commands = num_commands > 0
+            min_duration[has_commands] = np.minimum.reduceat(instruction_table.duration,
+                                                             instruction_table.offsets[:-1][has_commands])
+
+            report['commands_too_short'][compilable] = min_duration < pulse_blaster.settings['min_pulse_dur']
+            report['too_many_commands'][compilable] = num_commands >= 4096
+
+        report['valid'] = ~(report['overlapping_pulses'] | report['commands_too_short'] | report['bad_start_time'] |
+                            report['too_many_commands'])
+
+        return report
 
     def _get_overlapping_pulses(self, pulse_sequence, verbose=False):
         """
@@ -517,11 +1675,11 @@ for a given experiment
 
         """
         pulse_blaster = self.instruments['PB']['instance']
-        delayed_pulse_collection = pulse_blaster.create_physical_pulse_seq(pulse_sequence) # ER 20181027 don't have time to debug why these delays are giving errors today
-        pb_state_changes = pulse_blaster.generate_pb_sequence(delayed_pulse_collection)
-        pb_commands = pulse_blaster.create_commands(pb_state_changes, self.settings['num_averages'])
+        # repeated blocks are programmed as loops (see PulseBlaster.compile_pulse_table), so count the compressed program
+        instruction_table = pulse_blaster.compile_sweep([pulse_sequence], self.settings['num_averages'],
+                                                        compress_loops=True)
 
-        if len(pb_commands) < 4096:
+        if instruction_table.num_commands(0) < 4096:
             return False
         else:
             if verbose:
@@ -570,93 +1728,23 @@ for a given experiment
 
         """
 
-        # split the sequence in the channels that we want to combine and the ones that we keep
-        sequence_id = [pulse for pulse in pulse_sequence if
-                       pulse.channel_id == channel_id]  # the sequences belonging to channel_id
-        sequence_remainder = [pulse for pulse in pulse_sequence if
-                              pulse.channel_id != channel_id]  # the sequences not belonging to channel_id
-
-        # sort
-        sequence_id = sorted(sequence_id, key=lambda pulse: pulse.start_time)
-
-        # since the length of sequence_id shrinks over time we check on every iteration if we reached the end of the list
-        # instead of doing a for index in range(len(sequence_id)) loop
-        index = 0
-        while True:
-            if index >= len(sequence_id) - 1:
-                break
-            first_pulse = sequence_id[index]
-            second_pulse = sequence_id[index + 1]
-            if ((second_pulse.start_time) - (first_pulse.start_time + first_pulse.duration)) < overlap_window:
-
-                # the combined pulse duration is the max of either the first pulse duration or
-                # the differnence between the end of the second pulse and the start of the first pulse
-                # the first case seems a bit unusual but can happen, for mw switch pulses where both
-                # the I and Q channel are mapped onto the same channel (mw_switch)
-                combined_pulse_duration = max(
-                    first_pulse.duration,
-                    (second_pulse.start_time - first_pulse.start_time) + second_pulse.duration
-                )
-
-                combined_pulse = Pulse(channel_id, first_pulse.start_time, combined_pulse_duration)
-                sequence_id.remove(first_pulse)
-                sequence_id.remove(second_pulse)
-                sequence_id.insert(index, combined_pulse)
-            else:
-                index += 1
-
-        # "adding" list in python concatenates them!
-        return sequence_id + sequence_remainder
+        # the pulses are combined as union of their intervals (see PulseArrays.combine), the combined pulses come first
+        return PulseArrays.from_sequences([pulse_sequence]).combine(channel_id, overlap_window).to_sequences()[0]
 
     def _add_mw_switch_to_sequences(self, pulse_sequences):
         """
         Adds the microwave switch to a sequence by toggling it on/off for every microwave_i or microwave_q pulse,
         with a buffer given by mw_switch_extra_time
         Args:
-            pulse_sequences: Pulse sequence without mw switch
-        Returns: Pulse sequence with mw switch added in appropriate places
+            pulse_sequences: Pulse sequences without mw switch, a list of lists of Pulse objects or PulseArrays
+        Returns: Pulse sequences with mw switch added in appropriate places (of the same type as pulse_sequences)
         """
-        gating = self.settings['mw_switch']['gating']
-        mw_switch_time = self.settings['mw_switch']['extra_time']
-
-        pulse_sequences_with_mw_switch = []
-        for pulse_sequence in pulse_sequences:
-            mw_switch_pulses = []
-            # add a switch pulse for each microwave pulse, pulses are carved with i and q channels and wide mw switch pulses are added to surpress leakage
-            if gating == 'mw_iq':
-                for pulse in pulse_sequence:
-                    if pulse.channel_id in ['microwave_i', 'microwave_q']:
-                        mw_switch_pulses.append(Pulse('microwave_switch', pulse.start_time - mw_switch_time, pulse.duration + 2 * mw_switch_time))
-
-                # add the mw switch pulses to the pulse sequences
-                pulse_sequence.extend(mw_switch_pulses)
-
-                # combine overlapping pulses and those that are within 2*mw_switch_extra_time
-                pulse_sequence = self._combine_pulses(pulse_sequence, channel_id='microwave_switch', overlap_window= 2 * mw_switch_time)
-
-
-            elif gating == 'mw_switch':
-                # in the case gating == 'mw_switch', the pulse is carved with the mw switch
-                # thus, we extend the duration of the i and q pulses by mw_switch_time before and after
-
-                for index, pulse in enumerate(pulse_sequence):
-                    if pulse.channel_id in ['microwave_i', 'microwave_q']:
-                        mw_switch_pulses.append(Pulse('microwave_switch', pulse.start_time, pulse.duration))
-
-                        # replace the i and q pulses with wider pulses
-                        new_pulse = Pulse(pulse.channel_id, pulse.start_time - mw_switch_time, pulse.duration + 2 * mw_switch_time)
-                        pulse_sequence.remove(pulse)
-                        pulse_sequence.insert(index, new_pulse)
-
-                # add the mw switch pulses to the pulse sequences
-                pulse_sequence.extend(mw_switch_pulses)
-
-                # combine overlapping pulses and those that are within 2*mw_switch_extra_time
-                pulse_sequence = self._combine_pulses(pulse_sequence, channel_id='microwave_i', overlap_window= 2 * mw_switch_time)
-                pulse_sequence = self._combine_pulses(pulse_sequence, channel_id='microwave_q', overlap_window=2 * mw_switch_time)
-            pulse_sequences_with_mw_switch.append(pulse_sequence)
-
-        return pulse_sequences_with_mw_switch
+        # all sequences are handled at once in array form, see PulseArrays.add_mw_switch
+        if isinstance(pulse_sequences, PulseArrays):
+            return pulse_sequences.add_mw_switch(self.settings['mw_switch']['gating'],
+                                                 self.settings['mw_switch']['extra_time'])
+        return PulseArrays.from_sequences(pulse_sequences).add_mw_switch(
+            self.settings['mw_switch']['gating'], self.settings['mw_switch']['extra_time']).to_sequences()
 
     def _plot_validate(self, axes_list):
         """
@@ -670,7 +1758,13 @@ for a given experiment
         axis0 = axes_list[0]
         axis1 = axes_list[1]
 
-        pulse_sequences, tau_list, _ = self.create_pulse_sequences(logging=False)
+        if self.settings['lazy_sequences']:
+            # only create the two sequences that are plotted
+            pulse_sequences, tau_list, _ = self.create_pulse_sequence_set()
+            if pulse_sequences and not (pulse_sequences.is_valid(0) and pulse_sequences.is_valid(-1)):
+                print('first or last pulse sequence did not pass validation!!!')
+        else:
+            pulse_sequences, tau_list, _ = self.create_pulse_sequences(logging=False)
 
       #  if pulse_sequences[0]:
         if pulse_sequences:
@@ -695,38 +1789,98 @@ for a given experiment
             measurement_gate_width: measurement window time
         """
 
-        pulse_sequences, tau_list, measurement_gate_width = self._create_pulse_sequences()
+        if self._uses_sequence_template() and self._creates_single_pulse_sequences():
+            # all sequences are created at once and stay in array form until the microwave switch has been added
+            tau_list = self._create_tau_list()
+            pulse_sequences = self._create_sequence_template().materialize(tau_list)
+            measurement_gate_width = self.settings['read_out']['meas_time']
+        else:
+            pulse_sequences, tau_list, measurement_gate_width = self._create_pulse_sequences()
 
         # Adding microwave switch
         if self.settings['mw_switch']['add']:
             if logging:
                 self.log('Adding microwave switch to pulse sequences')
             pulse_sequences = self._add_mw_switch_to_sequences(pulse_sequences)
+        if isinstance(pulse_sequences, PulseArrays):
+            pulse_sequences = pulse_sequences.to_sequences()
 
         # look for bad pulses, i.e. that don't comply with the requirements, e.g. given the pulse-blaster specs or
         # requiring that pulses don't overlap
+        report = self.validate_pulse_sequences(pulse_sequences, tau_list)
 
-        valid_pulse_sequences = []
-        valid_tau_list = []
-        invalid_tau_list = []
-        for pulse_sequence, tau in zip(pulse_sequences, tau_list):
-            if not self._is_bad_pulse_sequence(pulse_sequence):
-                valid_pulse_sequences.append(pulse_sequence)
-                valid_tau_list.append(tau)
-            else:
-                invalid_tau_list.append(tau)
-                print('invalid sequence is: ', pulse_sequence)
+        valid_pulse_sequences = [pulse_sequence for pulse_sequence, valid in zip(pulse_sequences, report['valid']) if valid]
+        valid_tau_list = [tau for tau, valid in zip(tau_list, report['valid']) if valid]
 
         if logging:
-            if invalid_tau_list:
-                self.log("The pulse sequences corresponding to the following tau's were *invalid*, thus will not be "
-                         "included when running this experiment: " + str(invalid_tau_list))
+            self._log_validation(report, np.array(tau_list))
+
+        return valid_pulse_sequences, valid_tau_list, measurement_gate_width
+
+    def _log_validation(self, report, tau_list):
+        """
+        Logs the tau values of the invalid pulse sequences and why they are invalid
+
+        Args:
+            report: dictionary of arrays as returned by validate_pulse_sequences
+            tau_list: array with the values of tau of all pulse sequences
+
+        """
+        invalid_tau_list = tau_list[~report['valid']].tolist()
+        if invalid_tau_list:
+            self.log("The pulse sequences corresponding to the following tau's were *invalid*, thus will not be "
+                     "included when running this experiment: " + str(invalid_tau_list))
+            for check in ['overlapping_pulses', 'commands_too_short', 'bad_start_time', 'too_many_commands']:
+                if np.any(report[check]):
+                    self.log("{:s}: tau = {:s}".format(check, str(tau_list[report[check]].tolist())))
+        else:
+            self.log("All generated pulse sequences are valid. No tau times will be skipped in this experiment.")
+
+        self.log("{:d} different tau times have passed validation".format(int(np.sum(report['valid']))))
+
+    def create_pulse_sequence_set(self):
+        """
+        Lazy version of create_pulse_sequences. The pulse sequences are only created (including the microwave switch)
+        when they are accessed and validated in chunks, see PulseSequenceSet. Invalid sequences are not removed, instead
+        PulseSequenceSet.is_valid has to be checked before running a sequence.
+
+        If the script implements _create_tau_list and _create_pulse_sequence (instead of overwriting
+        _create_pulse_sequences) a pulse sequence is only created when it is accessed, otherwise all sequences are
+        created up front and only adding the microwave switch and the validation are done on demand.
+
+        Returns:
+            pulse_sequences: a PulseSequenceSet with one pulse sequence for each value of tau
+            tau_list: the list of tau times we vary
+            measurement_gate_width: measurement window time
+        """
+        if self._creates_single_pulse_sequences():
+            tau_list = self._create_tau_list()
+            measurement_gate_width = self.settings['read_out']['meas_time']
+            if self._uses_sequence_template():
+                template = self._create_sequence_template()
+                create_raw_sequence = lambda index: template.create_pulse_sequences([tau_list[index]])[0]
             else:
-                self.log("All generated pulse sequences are valid. No tau times will be skipped in this experiment.")
+                create_raw_sequence = lambda index: self._create_pulse_sequence(tau_list[index])
+        else:
+            pulse_sequences, tau_list, measurement_gate_width = self._create_pulse_sequences()
+            create_raw_sequence = lambda index: pulse_sequences[index]
+
+        if self.settings['mw_switch']['add']:
+            create_sequence = lambda index: self._add_mw_switch_to_sequences([create_raw_sequence(index)])[0]
+        else:
+            create_sequence = create_raw_sequence
 
-            self.log("{:d} different tau times have passed validation".format(len(valid_tau_list)))
+        pulse_sequence_set = PulseSequenceSet(tau_list, create_sequence, validate=self.validate_pulse_sequences)
 
-        return valid_pulse_sequences, valid_tau_list, measurement_gate_width
+        return pulse_sequence_set, pulse_sequence_set.tau_list, measurement_gate_width
+
+    def _creates_single_pulse_sequences(self):
+        # True if the script implements _create_tau_list and _create_pulse_sequence instead of _create_pulse_sequences
+        return type(self)._create_pulse_sequences == PulsedExperimentBaseScript._create_pulse_sequences
+
+    def _uses_sequence_template(self):
+        # True if the script implements _create_sequence_template
+        return type(self)._create_sequence_template != PulsedExperimentBaseScript._create_sequence_template
 
     def stop(self):
         """
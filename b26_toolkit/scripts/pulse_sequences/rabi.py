@@ -18,6 +18,7 @@
 
 import numpy as np
 from b26_toolkit.scripts.pulse_sequences.pulsed_experiment_base_script import PulsedExperimentBaseScript
+from b26_toolkit.scripts.pulse_sequences.sequence_template import SequenceTemplate, TAU
 from b26_toolkit.instruments import NI6259, NI9402, B26PulseBlaster, MicrowaveGenerator, Pulse
 from b26_toolkit.plotting.plots_1d import plot_pulses, update_pulse_plot, plot_1d_simple_timetrace_ns, update_1d_simple
 from pylabcontrol.core import Parameter
@@ -52,6 +53,7 @@ Uses a double_init scheme
     ]
 
     _INSTRUMENTS = {'NI6259': NI6259, 'NI9402': NI9402, 'PB': B26PulseBlaster, 'mw_gen': MicrowaveGenerator}
+    _LIVE_FIT_MODEL = 'rabi'
 
     def _function(self):
         #COMMENT_ME
@@ -74,19 +76,16 @@ Uses a double_init scheme
                 self.data['fits'] = None
                 self.log('rabi fit failed')
 
-    def _create_pulse_sequences(self):
-        """
+    def _live_fit_signal(self, counts):
+        # signal of the live fit: the rabi oscillation (signal normalized to the reference readout)
+        return counts[:, 1] / counts[:, 0]
 
-        Returns: pulse_sequences, num_averages, tau_list, meas_time
-            pulse_sequences: a list of pulse sequences, each corresponding to a different time 'tau' that is to be
-            scanned over. Each pulse sequence is a list of pulse objects containing the desired pulses. Each pulse
-            sequence must have the same number of daq read pulses
-            num_averages: the number of times to repeat each pulse sequence
-            tau_list: the list of times tau, with each value corresponding to a pulse sequence in pulse_sequences
-            meas_time: the width (in ns) of the daq measurement
+    def _create_tau_list(self):
+        '''
 
-        """
-        pulse_sequences = []
+        Returns: tau_list, the list of times tau that are scanned over
+
+        '''
         # tau_list = range(int(max(15, self.settings['tau_times']['time_step'])), int(self.settings['tau_times']['max_time'] + 15),
         #                  self.settings['tau_times']['time_step'])
         # JG 16-08-25 changed (15ns min spacing is taken care of later):
@@ -100,6 +99,15 @@ Uses a double_init scheme
         # ignore the sequence if the mw-pulse is shorter than 15ns (0 is ok because there is no mw pulse!)
         tau_list = [x for x in tau_list if x == 0 or x >= 15]
 
+        return tau_list
+
+    def _create_sequence_template(self):
+        '''
+
+        Returns: template of the pulse sequences, the mw pulse has the duration tau (i.e. there is no mw pulse for tau = 0)
+
+        '''
+        tau = TAU
         nv_reset_time = self.settings['read_out']['nv_reset_time']
         delay_readout = self.settings['read_out']['delay_readout']
         microwave_channel = 'microwave_' + self.settings['mw_pulses']['microwave_channel']
@@ -108,27 +116,20 @@ Uses a double_init scheme
         meas_time = self.settings['read_out']['meas_time']
         delay_mw_readout = self.settings['read_out']['delay_mw_readout']
 
-        for tau in tau_list:
-            pulse_sequence = [Pulse('laser', laser_off_time + tau + 2*40, nv_reset_time),
-                              Pulse('apd_readout', laser_off_time + tau + 2*40 + delay_readout, meas_time)]
-
-            # if tau is 0 there is actually no mw pulse
-            if tau > 0:
-                pulse_sequence.append(Pulse(microwave_channel,
-                                            laser_off_time + tau + 2*40 + nv_reset_time + laser_off_time,
-                                            tau))
-
-            pulse_sequence.append(Pulse('laser',
-                                        laser_off_time + tau + 2*40 + nv_reset_time + laser_off_time + tau + 2*40 + delay_mw_readout,
-                                        nv_reset_time))
-            pulse_sequence.append(Pulse('apd_readout',
-                                        laser_off_time + tau + 2*40 + nv_reset_time + laser_off_time + tau + 2*40 + delay_mw_readout + delay_readout,
-                                        meas_time))
-            # ignore the sequence is the mw is shorter than 15ns (0 is ok because there is no mw pulse!)
-            # if tau == 0 or tau>=15:
-            pulse_sequences.append(pulse_sequence)
-
-        return pulse_sequences, tau_list, meas_time
+        template = SequenceTemplate()
+        template.add('laser', laser_off_time + tau + 2*40, nv_reset_time)
+        template.add('apd_readout', laser_off_time + tau + 2*40 + delay_readout, meas_time)
+
+        # if tau is 0 there is actually no mw pulse (pulses without duration are left out)
+        template.add(microwave_channel, laser_off_time + tau + 2*40 + nv_reset_time + laser_off_time, tau)
+
+        template.add('laser', laser_off_time + tau + 2*40 + nv_reset_time + laser_off_time + tau + 2*40 + delay_mw_readout,
+                     nv_reset_time)
+        template.add('apd_readout',
+                     laser_off_time + tau + 2*40 + nv_reset_time + laser_off_time + tau + 2*40 + delay_mw_readout + delay_readout,
+                     meas_time)
+
+        return template
 
     def _plot(self, axislist, data = None):
         '''
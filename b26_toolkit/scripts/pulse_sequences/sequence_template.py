@@ -0,0 +1,343 @@
+"""
+    This file is part of b26_toolkit, a pylabcontrol add-on for experiments in Harvard LISE B26.
+    Copyright (C) <2016>  Arthur Safira, Jan Gieseler, Aaron Kabcenell
+
+    b26_toolkit is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    b26_toolkit is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with b26_toolkit.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from b26_toolkit.instruments import Pulse
+
+
+class Affine(object):
+    """
+    time that is an affine function of tau, offset + slope * tau (in ns)
+
+    Affine times can be added and subtracted and multiplied or divided by numbers, so that the times of a pulse sequence
+    can be written with TAU in place of the value of tau, e.g. laser_off_time + TAU / 2 - pi_time / 2.
+    """
+    __slots__ = ('offset', 'slope')
+
+    def __init__(self, offset=0.0, slope=0.0):
+        self.offset = float(offset)
+        self.slope = float(slope)
+
+    def __call__(self, tau):
+        """
+        Returns: the time for the value (or array of values) tau
+        """
+        return self.offset + self.slope * tau
+
+    def __add__(self, other):
+        other = affine(other)
+        return Affine(self.offset + other.offset, self.slope + other.slope)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        other = affine(other)
+        return Affine(self.offset - other.offset, self.slope - other.slope)
+
+    def __rsub__(self, other):
+        return affine(other) - self
+
+    def __neg__(self):
+        return Affine(-self.offset, -self.slope)
+
+    def __mul__(self, factor):
+        if isinstance(factor, Affine):
+            raise TypeError('the product of two affine times is not affine')
+        return Affine(self.offset * factor, self.slope * factor)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, divisor):
+        return Affine(self.offset / divisor, self.slope / divisor)
+
+    def __repr__(self):
+        return 'Affine({:g} + {:g} * tau)'.format(self.offset, self.slope)
+
+
+TAU = Affine(0.0, 1.0)  # the time tau
+
+
+def affine(value):
+    """
+    Returns: value as Affine time, numbers are constant times
+    """
+    return value if isinstance(value, Affine) else Affine(value, 0.0)
+
+
+class PulseArrays(object):
+    """
+    columnar (numpy backed) representation of the pulse sequences of a sweep as the scripts create them, i.e. in ns
+    and before the channel delays are applied (compare PulseTable, which holds the physical pulses)
+
+    Each pulse is one row with the index of its channel in channel_ids, its start time, its duration and the index of
+    the sequence to which it belongs. The rows are ordered by sequence_index, within a sequence the rows keep the order
+    of the pulses.
+
+    """
+    def __init__(self, channel_ids, channel, start, duration, sequence_index, num_sequences):
+        """
+        Args:
+            channel_ids: list with the names of the channels
+            channel: array with the index of the channel (in channel_ids) of each pulse
+            start: array with the start time of each pulse in ns
+            duration: array with the duration of each pulse in ns
+            sequence_index: array with the index of the sequence to which the pulse belongs
+            num_sequences: number of sequences
+        """
+        self.channel_ids = list(channel_ids)
+        self.channel = np.asarray(channel, dtype=np.int64)
+        self.start = np.asarray(start, dtype=float)
+        self.duration = np.asarray(duration, dtype=float)
+        self.sequence_index = np.asarray(sequence_index, dtype=np.int64)
+        self.num_sequences = num_sequences
+
+        assert len(self.channel) == len(self.start) == len(self.duration) == len(self.sequence_index), \
+            'all columns of the pulse arrays need to have the same length'
+
+    def __len__(self):
+        return len(self.start)
+
+    def __repr__(self):
+        return 'PulseArrays({:d} pulses in {:d} sequences)'.format(len(self), self.num_sequences)
+
+    @classmethod
+    def from_sequences(cls, pulse_sequences):
+        """
+        Args:
+            pulse_sequences: list of pulse sequences, each a list of Pulse objects
+
+        Returns: the PulseArrays of the sequences
+
+        """
+        channel_ids = []
+        channel_index = {}
+        channel, start, duration = [], [], []
+        for pulse_sequence in pulse_sequences:
+            for pulse in pulse_sequence:
+                if pulse.channel_id not in channel_index:
+                    channel_index[pulse.channel_id] = len(channel_ids)
+                    channel_ids.append(pulse.channel_id)
+                channel.append(channel_index[pulse.channel_id])
+                start.append(pulse.start_time)
+                duration.append(pulse.duration)
+        lengths = [len(pulse_sequence) for pulse_sequence in pulse_sequences]
+        sequence_index = np.repeat(np.arange(len(pulse_sequences)), lengths)
+
+        return cls(channel_ids, channel, start, duration, sequence_index, len(pulse_sequences))
+
+    def end_times(self):
+        """
+        Returns: array with the end time of the last pulse of each sequence in ns (0 for empty sequences)
+        """
+        end_times = np.zeros(self.num_sequences)
+        np.maximum.at(end_times, self.sequence_index, self.start + self.duration)
+        return end_times
+
+    def to_sequences(self):
+        """
+        Returns: list of pulse sequences, each a list of Pulse objects
+        """
+        channel_ids = np.array(self.channel_ids + [None], dtype=object)[self.channel].tolist()
+        pulses = Pulse.from_arrays(channel_ids, self.start.tolist(), self.duration.tolist())
+        offsets = np.searchsorted(self.sequence_index, np.arange(self.num_sequences + 1)).tolist()
+
+        return [pulses[offsets[index]:offsets[index + 1]] for index in range(self.num_sequences)]
+
+    def _channel(self, channel_id):
+        """
+        Returns: the index of the channel, the channel is added to channel_ids if it is not there yet
+        """
+        if channel_id not in self.channel_ids:
+            self.channel_ids.append(channel_id)
+        return self.channel_ids.index(channel_id)
+
+    def _take(self, rows):
+        """
+        Returns: new PulseArrays with the given rows, rows is reordered by sequence (stable, i.e. within a sequence
+            the order of rows is kept)
+        """
+        rows = np.asarray(rows)[np.argsort(self.sequence_index[rows], kind='stable')]
+        return PulseArrays(self.channel_ids, self.channel[rows], self.start[rows], self.duration[rows],
+                           self.sequence_index[rows], self.num_sequences)
+
+    def _append(self, channel, start, duration, sequence_index):
+        """
+        Returns: new PulseArrays with the pulses appended at the end of their sequences
+        """
+        appended = PulseArrays(self.channel_ids, np.concatenate([self.channel, channel]),
+                               np.concatenate([self.start, start]), np.concatenate([self.duration, duration]),
+                               np.concatenate([self.sequence_index, sequence_index]), self.num_sequences)
+        return appended._take(np.arange(len(appended)))
+
+    def combine(self, channel_id, overlap_window):
+        """
+        combines the pulses of a channel that overlap or are closer than overlap_window into single pulses, in all
+        sequences at once (union of the intervals of the pulses)
+
+        Args:
+            channel_id: name of the channel whose pulses are combined
+            overlap_window: pulses that are closer than this (in ns) are combined
+
+        Returns: new PulseArrays, in each sequence the combined pulses (sorted by start time) come first, followed by
+            the pulses of the other channels in their previous order
+
+        """
+        is_channel = self.channel == self._channel(channel_id)
+        rows = np.flatnonzero(is_channel)
+        order = np.lexsort((self.start[rows], self.sequence_index[rows]))
+        sequence_index = self.sequence_index[rows][order]
+        start = self.start[rows][order]
+        end = start + self.duration[rows][order]
+
+        if len(rows) > 0:
+            # the running maximum of the end times of the previous pulses of the same sequence, the sequences are shifted
+            # apart in time so that a single running maximum does not leak from one sequence into the next
+            shift = sequence_index * (np.max(end) - np.min(start) + overlap_window + 1.0)
+            running_end = np.maximum.accumulate(end + shift) - shift
+            is_first = np.ones(len(rows), dtype=bool)
+            is_first[1:] = (sequence_index[1:] != sequence_index[:-1]) | (start[1:] - running_end[:-1] >= overlap_window)
+            first = np.flatnonzero(is_first)
+            sequence_index, start, end = sequence_index[first], start[first], np.maximum.reduceat(end, first)
+
+        others = np.flatnonzero(~is_channel)
+        combined = PulseArrays(self.channel_ids, np.concatenate([np.full(len(start), self._channel(channel_id)),
+                                                                 self.channel[others]]),
+                               np.concatenate([start, self.start[others]]),
+                               np.concatenate([end - start, self.duration[others]]),
+                               np.concatenate([sequence_index, self.sequence_index[others]]), self.num_sequences)
+        return combined._take(np.arange(len(combined)))
+
+    def add_mw_switch(self, gating, extra_time):
+        """
+        adds the microwave switch to all sequences, see PulsedExperimentBaseScript._add_mw_switch_to_sequences
+
+        Args:
+            gating: 'mw_iq' if the pulses are carved out by the i and q channels, 'mw_switch' if they are carved out by
+                the microwave switch
+            extra_time: time that is added before and after the i and q pulses (in ns)
+
+        Returns: new PulseArrays with the microwave switch
+
+        """
+        is_iq = np.isin(self.channel, [self._channel('microwave_i'), self._channel('microwave_q')])
+        switch_channel = np.full(np.count_nonzero(is_iq), self._channel('microwave_switch'))
+
+        if gating == 'mw_iq':
+            # wide mw switch pulses around the i and q pulses suppress leakage
+            with_switch = self._append(switch_channel, self.start[is_iq] - extra_time,
+                                       self.duration[is_iq] + 2 * extra_time, self.sequence_index[is_iq])
+            return with_switch.combine('microwave_switch', 2 * extra_time)
+        elif gating == 'mw_switch':
+            # the pulses are carved out by the switch, the i and q pulses are extended by extra_time on both sides
+            widened = PulseArrays(self.channel_ids, self.channel, np.where(is_iq, self.start - extra_time, self.start),
+                                  np.where(is_iq, self.duration + 2 * extra_time, self.duration), self.sequence_index,
+                                  self.num_sequences)
+            with_switch = widened._append(switch_channel, self.start[is_iq], self.duration[is_iq],
+                                          self.sequence_index[is_iq])
+            return with_switch.combine('microwave_i', 2 * extra_time).combine('microwave_q', 2 * extra_time)
+        return self
+
+
+class SequenceTemplate(object):
+    """
+    Declarative description of the pulse sequences of a tau sweep. Each pulse has a channel, a start time and a duration
+    that are affine functions of tau (see Affine and TAU) and can be repeated with a period that is an affine function
+    of tau as well (e.g. the pi pulses of a CPMG sequence). The sequences of all values of tau are then created at once
+    with numpy (materialize) instead of pulse by pulse.
+
+        template = SequenceTemplate()
+        template.add('microwave_i', laser_off_time, pi_half_time)
+        end_of_pi_pulses = template.add('microwave_q', laser_off_time + TAU / 2, pi_time, repeat=N, period=TAU)
+
+    Pulses with a duration that is not positive for some tau (e.g. a mw pulse of duration tau for tau = 0) are left
+    out of these sequences.
+
+    """
+
+    def __init__(self):
+        self._pulses = []
+
+    def __len__(self):
+        """
+        Returns: the maximum number of pulses of a sequence
+        """
+        return sum(repeat for _, _, _, repeat, _, _ in self._pulses)
+
+    def add(self, channel_id, start_time, duration, repeat=1, period=0, positive_tau_only=False):
+        """
+        adds a pulse (or a train of repeat pulses) to the template
+
+        Args:
+            channel_id: name of the channel
+            start_time: start time of the (first) pulse in ns, a number or an Affine time
+            duration: duration of the pulses in ns, a number or an Affine time
+            repeat: number of pulses
+            period: time between the start of consecutive pulses in ns, a number or an Affine time
+            positive_tau_only: if True the pulses are only added to the sequences with tau > 0
+
+        Returns: the end time of the last pulse as Affine time
+
+        """
+        start_time, duration, period = affine(start_time), affine(duration), affine(period)
+        self._pulses.append((channel_id, start_time, duration, int(repeat), period, positive_tau_only))
+        return start_time + period * (repeat - 1) + duration
+
+    def materialize(self, tau_list):
+        """
+        Args:
+            tau_list: the values of tau
+
+        Returns: PulseArrays with one sequence for each value of tau
+
+        """
+        tau = np.asarray(tau_list, dtype=float)
+        channel_ids = []
+        for channel_id, _, _, _, _, _ in self._pulses:
+            if channel_id not in channel_ids:
+                channel_ids.append(channel_id)
+
+        # coefficients of the start time and the duration of each pulse, the repetitions are expanded
+        repeats = np.array([repeat for _, _, _, repeat, _, _ in self._pulses], dtype=np.int64)
+        repetition = np.arange(np.sum(repeats)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        coefficients = np.repeat(np.array([[start.offset, start.slope, period.offset, period.slope,
+                                            duration.offset, duration.slope, positive_tau_only]
+                                           for _, start, duration, _, period, positive_tau_only in self._pulses]
+                                          ).reshape(-1, 7), repeats, axis=0)
+        channel = np.repeat([channel_ids.index(pulse[0]) for pulse in self._pulses], repeats).astype(np.int64)
+
+        start_offset = coefficients[:, 0] + repetition * coefficients[:, 2]
+        start_slope = coefficients[:, 1] + repetition * coefficients[:, 3]
+        start = start_offset[np.newaxis, :] + tau[:, np.newaxis] * start_slope[np.newaxis, :]
+        duration = coefficients[np.newaxis, :, 4] + tau[:, np.newaxis] * coefficients[np.newaxis, :, 5]
+
+        keep = (duration > 0) & ~((coefficients[np.newaxis, :, 6] != 0) & (tau[:, np.newaxis] <= 0))
+        sequence_index = np.repeat(np.arange(len(tau)), keep.shape[1]).reshape(keep.shape)
+
+        return PulseArrays(channel_ids, np.broadcast_to(channel, keep.shape)[keep], start[keep], duration[keep],
+                           sequence_index[keep], len(tau))
+
+    def create_pulse_sequences(self, tau_list):
+        """
+        Args:
+            tau_list: the values of tau
+
+        Returns: list of pulse sequences (lists of Pulse objects), one for each value of tau
+
+        """
+        return self.materialize(tau_list).to_sequences()
@@ -18,6 +18,7 @@
 import numpy as np
 
 from b26_toolkit.scripts.pulse_sequences.pulsed_experiment_base_script import PulsedExperimentBaseScript
+from b26_toolkit.scripts.pulse_sequences.sequence_template import SequenceTemplate, TAU
 from b26_toolkit.instruments import NI6259, NI9402, B26PulseBlaster, MicrowaveGenerator, Pulse
 from pylabcontrol.core import Parameter, Script
 from b26_toolkit.data_processing.fit_functions import fit_exp_decay, exp_offset
@@ -58,6 +59,7 @@ This script runs a Hahn echo on the NV to find the Hahn echo T2. To symmetrize t
 #    _INSTRUMENTS = {'NI6259': NI6259, 'NI9402': NI9402, 'PB': B26PulseBlaster, 'mw_gen': MicrowaveGenerator} #ER 20181218
   #  _INSTRUMENTS = {'daq': NI6259, 'PB': B26PulseBlaster, 'mw_gen': MicrowaveGenerator}
     _INSTRUMENTS = {'NI6259': NI6259, 'NI9402': NI9402, 'PB': B26PulseBlaster, 'mw_gen': MicrowaveGenerator}
+    _LIVE_FIT_MODEL = 'exp_decay'
 
     def _function(self):
         #COMMENT_ME
@@ -79,19 +81,16 @@ This script runs a Hahn echo on the NV to find the Hahn echo T2. To symmetrize t
             self.data['fits'] = None
             self.log('t2 fit failed')
 
-    def _create_pulse_sequences(self):
+    def _live_fit_signal(self, counts):
+        # signal of the live fit: the T2 decay (contrast of the two readouts)
+        return (counts[:, 0] - counts[:, 1]) / (counts[:, 0] + counts[:, 1])
+
+    def _create_tau_list(self):
         '''
 
-        Returns: pulse_sequences, num_averages, tau_list, meas_time
-            pulse_sequences: a list of pulse sequences, each corresponding to a different time 'tau' that is to be
-            scanned over. Each pulse sequence is a list of pulse objects containing the desired pulses. Each pulse
-            sequence must have the same number of daq read pulses
-            num_averages: the number of times to repeat each pulse sequence
-            tau_list: the list of times tau, with each value corresponding to a pulse sequence in pulse_sequences
-            meas_time: the width (in ns) of the daq measurement
+        Returns: tau_list, the list of times tau that are scanned over
 
         '''
-        pulse_sequences = []
         # tau_list = range(int(max(15, self.settings['tau_times']['time_step'])), int(self.settings['tau_times']['max_time'] + 15),
         #                  self.settings['tau_times']['time_step'])
         # JG 16-08-25 changed (15ns min spacing is taken care of later):
@@ -104,6 +103,15 @@ This script runs a Hahn echo on the NV to find the Hahn echo T2. To symmetrize t
         # ignore the sequence if the mw-pulse is shorter than 15ns (0 is ok because there is no mw pulse!)
         tau_list = [x for x in tau_list if x == 0 or x >= 15]
 
+        return tau_list
+
+    def _create_sequence_template(self):
+        '''
+
+        Returns: template of the pulse sequences
+
+        '''
+        tau = TAU
         nv_reset_time = self.settings['read_out']['nv_reset_time']
         delay_readout = self.settings['read_out']['delay_readout']
         microwave_channel = 'microwave_' + self.settings['mw_pulses']['microwave_channel']
@@ -117,81 +125,43 @@ This script runs a Hahn echo on the NV to find the Hahn echo T2. To symmetrize t
         meas_time = self.settings['read_out']['meas_time']
         delay_mw_readout = self.settings['read_out']['delay_mw_readout']
 
+        k = self.settings['mw_pulses']['pi_pulse_blocks_k']
 
-        for tau in tau_list:
-            pulse_sequence = \
-            [
-                Pulse(microwave_channel_pi2, laser_off_time, pi_half_time), # pi/2 pulse
-            ]
+        def add_xy8_blocks(template, next_pi_t):
+            # k blocks of 8 pi pulses spaced by tau (x y x y y x y x), each position of the block is a train of k
+            # pulses with the period of a block
+            for position in range(8):
+                if position in (0, 2, 5, 7):
+                    template.add(microwave_channel_pi2, next_pi_t + position * tau, pi_time, repeat=k, period=8 * tau)  # pulses along x
+                else:
+                    template.add(microwave_channel, next_pi_t + position * tau, pi_time_mwchan, repeat=k, period=8 * tau)  # pulses along y
+            return next_pi_t + 8 * k * tau
 
-          #  next_pi_t = laser_off_time + pi_half_time/2. + tau/2 - pi_time/2.
-            next_pi_t = laser_off_time + pi_half_time + tau/2 - pi_time/2.
+        template = SequenceTemplate()
+        template.add(microwave_channel_pi2, laser_off_time, pi_half_time)  # pi/2 pulse
 
-            N = self.settings['mw_pulses']['pi_pulse_blocks_k']*8
-            counter = 0
-            for ind in range(0, N):
-                if counter == 0 or counter == 2 or counter == 5 or counter == 7:
-                    pulse_sequence += [
-                        Pulse(microwave_channel_pi2, next_pi_t, pi_time) # pulses along x
-                    ]
-                else:
-                    pulse_sequence += [
-                        Pulse(microwave_channel, next_pi_t, pi_time_mwchan) # pulses along y
-                    ]
-                if counter == 7:
-                    counter = -1
-                next_pi_t = next_pi_t + tau
-                counter += 1
+        next_pi_t = add_xy8_blocks(template, laser_off_time + pi_half_time + tau/2 - pi_time/2.)
 
-            pulse_sequence += [
-                Pulse(microwave_channel_pi2, next_pi_t - tau/2., pi_half_time)
-                ]
-            end_of_first_CPMG = next_pi_t - tau/2. + pi_half_time
+        template.add(microwave_channel_pi2, next_pi_t - tau/2., pi_half_time)
+        end_of_first_CPMG = next_pi_t - tau/2. + pi_half_time
 
-            pulse_sequence += \
-                [
-                 Pulse('laser', end_of_first_CPMG + delay_mw_readout, nv_reset_time),
-                 Pulse('apd_readout', end_of_first_CPMG + delay_mw_readout + delay_readout, meas_time)
-                ]
+        template.add('laser', end_of_first_CPMG + delay_mw_readout, nv_reset_time)
+        template.add('apd_readout', end_of_first_CPMG + delay_mw_readout + delay_readout, meas_time)
 
-            start_of_second_CPMG = end_of_first_CPMG + delay_mw_readout + nv_reset_time + laser_off_time
+        start_of_second_CPMG = end_of_first_CPMG + delay_mw_readout + nv_reset_time + laser_off_time
 
-            pulse_sequence += \
-            [
-                Pulse(microwave_channel_pi2, start_of_second_CPMG, pi_half_time),
-            ]
+        template.add(microwave_channel_pi2, start_of_second_CPMG, pi_half_time)
 
-            next_pi_t = start_of_second_CPMG + pi_half_time + tau/2. - pi_time/2.
-            counter = 0
-            for ind in range(0, N):
-                if counter == 0 or counter == 2 or counter == 5 or counter == 7:
-                    pulse_sequence += [
-                        Pulse(microwave_channel_pi2, next_pi_t, pi_time) # pulses along x
-                    ]
-                else:
-                    pulse_sequence += [
-                        Pulse(microwave_channel, next_pi_t, pi_time_mwchan) # pulses along y
-                    ]
-                if counter == 7:
-                    counter = -1
-                next_pi_t = next_pi_t + tau
-                counter += 1
+        next_pi_t = add_xy8_blocks(template, start_of_second_CPMG + pi_half_time + tau/2. - pi_time/2.)
 
-            pulse_sequence += [
-                Pulse(microwave_channel_pi2, next_pi_t - tau/2., three_pi_half_time)
-                ]
+        template.add(microwave_channel_pi2, next_pi_t - tau/2., three_pi_half_time)
 
-            end_of_second_CPMG = next_pi_t - tau/2. + three_pi_half_time
+        end_of_second_CPMG = next_pi_t - tau/2. + three_pi_half_time
 
-            pulse_sequence += [
-                Pulse('laser', end_of_second_CPMG + delay_mw_readout, nv_reset_time),
-                Pulse('apd_readout', end_of_second_CPMG + delay_mw_readout + delay_readout, meas_time)
-            ]
-            # ignore the sequence is the mw is shorter than 15ns (0 is ok because there is no mw pulse!)
-            # if tau == 0 or tau>=15:
-            pulse_sequences.append(pulse_sequence)
+        template.add('laser', end_of_second_CPMG + delay_mw_readout, nv_reset_time)
+        template.add('apd_readout', end_of_second_CPMG + delay_mw_readout + delay_readout, meas_time)
 
-        return pulse_sequences, tau_list, meas_time
+        return template
 
     def _plot(self, axislist, data = None):
         '''
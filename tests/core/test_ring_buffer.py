@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.core.ring_buffer import RingBuffer
+
+
+class TestRingBuffer(TestCase):
+    def test_write_read(self):
+        buffer = RingBuffer(10, num_columns=2)
+        subscriber = buffer.subscribe()
+        samples = np.arange(14.).reshape(7, 2)
+        buffer.write(samples)
+        np.testing.assert_array_equal(subscriber.read(), samples)
+        self.assertEqual(subscriber.read().shape, (0, 2))
+
+        # the buffer wraps around
+        buffer.write(samples)
+        np.testing.assert_array_equal(buffer.latest(10), np.vstack((samples, samples))[-10:])
+        np.testing.assert_array_equal(subscriber.read(max_samples=3), samples[:3])
+        np.testing.assert_array_equal(subscriber.read(), samples[3:])
+        with self.assertRaises(IndexError):
+            buffer.read(0, 5)
+
+    def test_decimation(self):
+        buffer = RingBuffer(100)
+        full_rate = buffer.subscribe()
+        decimated = buffer.subscribe(decimation=4)
+        buffer.write(np.arange(10.))
+        np.testing.assert_array_equal(full_rate.read()[:, 0], np.arange(10.))
+        # only complete groups of 4 samples are averaged
+        np.testing.assert_array_equal(decimated.read()[:, 0], [1.5, 5.5])
+        buffer.write(np.arange(10., 12.))
+        np.testing.assert_array_equal(decimated.read()[:, 0], [9.5])
+
+    def test_overflow(self):
+        buffer = RingBuffer(10)
+        subscriber = buffer.subscribe()
+        buffer.write(np.arange(25.))
+        # a subscriber that does not keep up loses the overwritten samples
+        np.testing.assert_array_equal(subscriber.read()[:, 0], np.arange(15., 25.))
+        self.assertEqual(subscriber.num_lost, 15)
+
+        # a subscriber waits for the next samples until the stream is closed
+        buffer.close()
+        self.assertEqual(len(subscriber.read(timeout=10)), 0)
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from b26_toolkit.b26_toolkit.core.runtime_model import RuntimeModel, ACQUISITION_PHASES, estimate_remaining_time
+
+
+class TestRuntimeModel(TestCase):
+    def setUp(self):
+        overhead = {phase: 0.01 for phase in ACQUISITION_PHASES}
+        overhead.update({'find_nv': 10., 'esr_tracking': 30.})
+        self.model = RuntimeModel(overhead=overhead)
+        # two sequences of 1 us and 3 us
+        self.sequence_durations = [1000, 3000]
+
+    def test_estimate(self):
+        estimate = self.model.estimate(self.sequence_durations, 2500000, 1000000, tracking=True, esr_every_n=2)
+        times = dict(zip(estimate['phase'], estimate['time']))
+        counts = dict(zip(estimate['phase'], estimate['count']))
+        self.assertEqual(estimate['phase'][0], 'acquire')
+        self.assertAlmostEqual(times['acquire'], 10.)
+        # 3 blocks of 2 sequences
+        self.assertEqual(counts['compile'], 6)
+        self.assertAlmostEqual(times['compile'], 0.06)
+        self.assertEqual(counts['find_nv'], 1)
+        self.assertEqual(counts['esr_tracking'], 1)
+
+        single_program = self.model.estimate(self.sequence_durations, 2500000, 1000000, single_program=True)
+        self.assertEqual(single_program['count'][1], 3)
+        # 3 blocks with 500 ns between the two sequences
+        separated = self.model.estimate(self.sequence_durations, 2500000, 1000000, single_program=True,
+                                        sequence_separation=500)
+        self.assertAlmostEqual(separated['time'][0] - single_program['time'][0], 3 * 500e-9)
+
+        # the overhead is hidden behind the acquisition of the previous sequence
+        pipelined = self.model.estimate(self.sequence_durations, 2500000, 1000000, pipelined=True)
+        self.assertEqual(pipelined['phase'], ['acquire', 'overhead'])
+        self.assertEqual(pipelined['time'][1], 0.)
+
+        sweep_2d = self.model.estimate(self.sequence_durations, 2500000, 1000000, num_outer=5, settle_time=0.5)
+        self.assertAlmostEqual(sweep_2d['time'][0], 50.)
+        self.assertEqual(dict(zip(sweep_2d['phase'], sweep_2d['time']))['settle'], 2.5)
+
+    def test_update(self):
+        summary = {'phase': ['acquire', 'compile', 'find_nv'], 'count': [10, 10, 3], 'total': [4., 1., 30.]}
+        self.model.update(summary, predicted_acquire=2.)
+        self.assertEqual(self.model.num_runs, 1)
+        # the first run replaces the defaults
+        self.assertAlmostEqual(self.model.overhead['compile'], 0.1)
+        self.assertAlmostEqual(self.model.acquire_scale, 2.)
+        self.assertAlmostEqual(self.model.tracking_rate, 0.2)
+
+        # the later runs are averaged
+        self.model.update(summary, predicted_acquire=4.)
+        self.assertAlmostEqual(self.model.acquire_scale, 1.5)
+
+    def test_num_averages_for(self):
+        runtime = sum(self.model.estimate(self.sequence_durations, 5000000, 1000000)['time'])
+        num_averages = self.model.num_averages_for(runtime, self.sequence_durations, 1000000)
+        self.assertEqual(num_averages, 5000000)
+        self.assertEqual(self.model.num_averages_for(runtime - 1, self.sequence_durations, 1000000), 4000000)
+        self.assertEqual(self.model.num_averages_for(1e-3, self.sequence_durations, 1000000), 0)
+
+    def test_save_load(self):
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, 'runtime_model.json')
+            self.model.tracking_rate = 0.1
+            self.model.save(filename, 'Rabi')
+            RuntimeModel().save(filename, 'T1')
+
+            loaded = RuntimeModel.load(filename, 'Rabi')
+            self.assertEqual(loaded.to_dict(), self.model.to_dict())
+            self.assertEqual(RuntimeModel.load(filename, 'HahnEcho').to_dict(), RuntimeModel().to_dict())
+        finally:
+            shutil.rmtree(path)
+
+    def test_estimate_remaining_time(self):
+        # at the start the prediction, at the end nothing
+        self.assertEqual(estimate_remaining_time(100., 0., 0.), 100.)
+        self.assertEqual(estimate_remaining_time(100., 120., 1.), 0.)
+        # on schedule the remaining part of the prediction
+        self.assertAlmostEqual(estimate_remaining_time(100., 50., 0.5), 50.)
+        # twice as slow as predicted: the observed rate is weighted with the fraction done
+        self.assertAlmostEqual(estimate_remaining_time(100., 100., 0.5), 75.)
+        self.assertAlmostEqual(estimate_remaining_time(100., 180., 0.9), 10. * (0.1 + 0.9 * 2))
+        # without prediction the elapsed time is extrapolated
+        self.assertAlmostEqual(estimate_remaining_time(0., 30., 0.25), 90.)
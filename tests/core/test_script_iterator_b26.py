@@ -18,9 +18,12 @@
 
 
 from unittest import TestCase
+import datetime
 
+from PyQt5.QtCore import QObject
 from pylabcontrol.core import ScriptIterator
 from pylabcontrol.scripts.script_dummy import ScriptDummy
+from b26_toolkit.b26_toolkit.core.script_iterator import ScriptIteratorB26
 import inspect
 
 class TestScriptIterator(TestCase):
@@ -50,5 +53,73 @@ class TestScriptIterator(TestCase):
         print(si)
 
 
-
-
+class SubscriptStub(object):
+    """
+    stands in for a subscript of the iterator
+    """
+    def __init__(self, name):
+        self.name = name
+        self.progress = 0.
+        self.settings = {}
+        self.data = {}
+
+
+class PulsedStub(SubscriptStub):
+    """
+    stands in for a subscript that predicts its runtime, like a pulsed experiment
+    """
+    def __init__(self, name, runtime):
+        super(PulsedStub, self).__init__(name)
+        self.runtime = runtime
+
+    def estimate_runtime(self):
+        return {'phase': ['acquire'], 'time': [self.runtime]}
+
+
+class TestScriptIteratorB26Runtime(TestCase):
+    def setUp(self):
+        # 4 nvs: find_nv (10 s measured, no estimate) on every point and a pulsed experiment predicted to take 90 s
+        self.iterator = ScriptIteratorB26.__new__(ScriptIteratorB26)
+        QObject.__init__(self.iterator)
+        self.iterator.iterator_type = 'iter nvs'
+        self.iterator.is_running = True
+        select_points = SubscriptStub('select_points')
+        select_points.data['nv_locations'] = [[0., 0.]] * 4
+        self.iterator._scripts = {'select_points': select_points, 'find_nv': SubscriptStub('find_nv'),
+                                  'pulsed': PulsedStub('pulsed', 90.)}
+        self.iterator._settings = {'script_order': {'select_points': -3, 'find_nv': -1, 'pulsed': 0},
+                                   'script_execution_freq': {'select_points': 0, 'find_nv': 1, 'pulsed': 1},
+                                   'run_all_first': True}
+        self.iterator._current_subscript_stage = {'current_subscript': None, 'subscript_exec_count': {},
+                                                  'subscript_exec_duration': {'find_nv': datetime.timedelta(seconds=10)}}
+        self.iterator._runtime_estimate = self.iterator.estimate_runtime()
+        self.iterator._point_index = 0
+
+    def run_until(self, point_index, progress, elapsed_time):
+        # the pulsed experiment of point point_index is at progress (in percent)
+        self.iterator._point_index = point_index
+        self.iterator.scripts['pulsed'].progress = progress
+        self.iterator._current_subscript_stage['current_subscript'] = self.iterator.scripts['pulsed']
+        self.iterator.start_time = datetime.datetime.now() - datetime.timedelta(seconds=elapsed_time)
+
+    def test_estimate_runtime(self):
+        self.assertEqual(self.iterator._runtime_estimate['runs'], [4, 4])
+        self.assertEqual(self.iterator._runtime_estimate['time'], [40., 360.])
+        # find_nv of the first point has just been started
+        self.iterator._current_subscript_stage['current_subscript'] = self.iterator.scripts['find_nv']
+        self.assertEqual(self.iterator._runtime_progress(), (0., 400.))
+
+    def test_remaining_time(self):
+        # on schedule: half of the iteration (2 points of 100 s) is done after 200 s
+        self.run_until(1, 100., 200.)
+        self.assertAlmostEqual(self.iterator.remaining_time.total_seconds(), 200., delta=1.)
+        # the elapsed time and the remaining time add up to the blended total, which is between the prediction and
+        # the total time extrapolated from the observed rate
+        self.run_until(1, 100., 400.)
+        remaining_time = self.iterator.remaining_time.total_seconds()
+        self.assertAlmostEqual(remaining_time, 200. * (0.5 + 0.5 * 2), delta=1.)
+        self.assertGreater(400. + remaining_time, 400.)
+        self.assertLess(400. + remaining_time, 800.)
+        # nothing remains at the end
+        self.run_until(3, 100., 500.)
+        self.assertEqual(self.iterator.remaining_time.total_seconds(), 0.)
@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from b26_toolkit.b26_toolkit.core.setting_planner import SettingPlanner
+
+
+class FakeInstrument(object):
+    def __init__(self, settings):
+        self.settings = settings
+        self.writes = []
+
+    def update(self, settings):
+        self.writes.append(settings)
+        for key, value in settings.items():
+            if isinstance(value, dict):
+                self.settings[key].update(value)
+            else:
+                self.settings[key] = value
+
+
+class TestSettingPlanner(TestCase):
+    def setUp(self):
+        self.mw_gen = FakeInstrument({'frequency': 2.87e9, 'amplitude': -10.})
+        self.awg = FakeInstrument({'default_waveform_ch1': {'amplitude': 0.5, 'frequency': 1e6}})
+        self.instruments = {'mw_gen': self.mw_gen, 'awg': self.awg}
+
+    def test_only_changes_are_written(self):
+        points = [{'mw_gen': {'frequency': 2.87e9, 'amplitude': amplitude}} for amplitude in [-10., -5., -5., 0.]]
+        planner = SettingPlanner(self.instruments, points)
+        self.assertEqual(planner.plan(), (2, 8))
+        self.assertEqual(planner.changes(1), {'mw_gen': {'amplitude': -5.}})
+
+        self.assertEqual([planner.apply(index) for index in range(len(planner))], [0, 1, 0, 1])
+        self.assertEqual(self.mw_gen.writes, [{'amplitude': -5.}, {'amplitude': 0.}])
+        self.assertEqual((planner.num_writes, planner.num_skipped), (2, 6))
+
+        self.assertEqual(planner.restore(), 1)
+        self.assertEqual(self.mw_gen.settings['amplitude'], -10.)
+        self.assertEqual(planner.restore(), 0)
+
+    def test_nested_settings(self):
+        points = [{'awg': {'default_waveform_ch1': {'amplitude': amplitude}}} for amplitude in [0.1, 0.2]]
+        planner = SettingPlanner(self.instruments, points)
+        planner.apply(0)
+        planner.apply(1)
+        self.assertEqual(self.awg.writes, [{'default_waveform_ch1': {'amplitude': 0.1}},
+                                           {'default_waveform_ch1': {'amplitude': 0.2}}])
+        planner.restore()
+        self.assertEqual(self.awg.settings['default_waveform_ch1'], {'amplitude': 0.5, 'frequency': 1e6})
+
+    def test_invalidate(self):
+        points = [{'mw_gen': {'amplitude': -5.}, 'awg': {'default_waveform_ch1': {'amplitude': 0.1}}}] * 2
+        planner = SettingPlanner(self.instruments, points)
+        self.assertEqual(planner.apply(0), 2)
+        self.assertEqual(planner.apply(1), 0)
+        # something else has changed the microwave generator, its settings are written again
+        planner.invalidate('mw_gen')
+        self.assertEqual(planner.changes(1), {'mw_gen': {'amplitude': -5.}})
+        planner.invalidate()
+        self.assertEqual(planner.apply(1), 2)
+
+    def test_unknown_instrument(self):
+        with self.assertRaises(ValueError):
+            SettingPlanner(self.instruments, [{'pulse_blaster': {'laser': {'status': True}}}])
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.core.sweep_order import SweepOrder
+
+
+class TestSweepOrder(TestCase):
+    def test_permutations(self):
+        for mode in SweepOrder.MODES:
+            orders = SweepOrder(23, mode, seed=7).blocks(5)
+            self.assertEqual(orders.shape, (5, 23))
+            for order in orders:
+                np.testing.assert_array_equal(np.sort(order), np.arange(23))
+        np.testing.assert_array_equal(SweepOrder(5, 'sequential').block(3), np.arange(5))
+
+    def test_reproducible(self):
+        sweep_order = SweepOrder(20, 'shuffle', seed=11)
+        # the order of a block only depends on the seed and the index of the block
+        np.testing.assert_array_equal(sweep_order.blocks(2, first=3)[1], SweepOrder(20, 'shuffle', seed=11).block(4))
+        self.assertFalse(np.array_equal(sweep_order.block(0), sweep_order.block(1)))
+
+        # a new seed is drawn if there is none, it can be saved to reproduce the orders
+        sweep_order = SweepOrder(20, 'stratified')
+        self.assertGreater(sweep_order.seed, 0)
+        np.testing.assert_array_equal(SweepOrder(20, **sweep_order.to_dict()).block(2), sweep_order.block(2))
+
+        with self.assertRaises(ValueError):
+            SweepOrder(20, 'random')
+
+    def test_stratified(self):
+        sweep_order = SweepOrder(20, 'stratified', seed=3, num_strata=4)
+        for index in range(10):
+            strata = sweep_order.block(index) * 4 // 20
+            # every round of 4 sequences takes one of each stratum
+            for round_strata in strata.reshape(-1, 4):
+                np.testing.assert_array_equal(np.sort(round_strata), np.arange(4))
+
+    def test_low_discrepancy(self):
+        order = SweepOrder(20, 'low_discrepancy', seed=5).block(0)
+        # consecutive points are far apart and every half of the block covers both halves of the sweep
+        self.assertTrue(np.all(np.abs(np.diff(order)) > 1))
+        for half in order.reshape(2, -1):
+            self.assertGreaterEqual(np.sum(half < 10), 4)
+            self.assertGreaterEqual(np.sum(half >= 10), 4)
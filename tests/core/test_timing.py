@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.core.timing import Timer, timed, store_timing, BIN_EDGES
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class TestTimer(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = Timer(clock=self.clock)
+
+    def test_span(self):
+        for duration in [1e-3, 2e-3, 3e-3]:
+            with self.timer.span('acquire'):
+                self.clock.time += duration
+        with self.timer.span('readback'):
+            self.clock.time += 3e-5
+
+        summary = self.timer.summary()
+        self.assertEqual(summary['phase'], ['acquire', 'readback'])
+        self.assertEqual(summary['count'], [3, 1])
+        self.assertAlmostEqual(summary['total'][0], 6e-3)
+        self.assertAlmostEqual(summary['mean'][0], 2e-3)
+        self.assertAlmostEqual(summary['min'][0], 1e-3)
+        self.assertAlmostEqual(summary['max'][0], 3e-3)
+        self.assertEqual(np.sum(summary['histogram'][0]), 3)
+        # the duration is in the bin between its bin edges
+        bin_index = np.argmax(summary['histogram'][1])
+        self.assertTrue(BIN_EDGES[bin_index] <= 3e-5 < BIN_EDGES[bin_index + 1])
+
+    def test_span_exception(self):
+        # the span is recorded even if the code in the with block raises
+        with self.assertRaises(ValueError):
+            with self.timer.span('fit'):
+                self.clock.time += 1.
+                raise ValueError
+        self.assertEqual(self.timer.summary()['count'], [1])
+
+    def test_disabled(self):
+        timer = Timer(enabled=False, clock=self.clock)
+        with timer.span('acquire'):
+            self.clock.time += 1.
+        timer.add('acquire', 0., 1.)
+        self.assertEqual(timer.summary()['phase'], [])
+        self.assertEqual(timer.events, [])
+
+    def test_decorators(self):
+        class Experiment(object):
+            def __init__(self, timer):
+                self.timer = timer
+
+            @timed('plot')
+            def plot(self, value):
+                return 2 * value
+
+        self.assertEqual(Experiment(self.timer).plot(3), 6)
+        self.assertEqual(Experiment(Timer(enabled=False)).plot(3), 6)
+        self.assertEqual(self.timer.summary()['count'], [1])
+
+        @self.timer.timed('fit')
+        def fit(value):
+            return value + 1
+        self.assertEqual(fit(1), 2)
+        self.assertEqual(self.timer.summary()['phase'], ['plot', 'fit'])
+
+    def test_max_events(self):
+        timer = Timer(max_events=5, clock=self.clock)
+        for i in range(10):
+            timer.add('acquire', float(i), 0.5)
+        self.assertEqual(len(timer.events), 5)
+        self.assertEqual(timer.dropped_events, 5)
+        self.assertEqual(timer.summary()['count'], [10])
+
+    def test_chrome_trace(self):
+        self.clock.time = 10.
+        timer = Timer(clock=self.clock)
+        with timer.span('acquire'):
+            self.clock.time += 0.5
+        thread = threading.Thread(target=timer.add, args=('readback', 10.25, 0.1), name='worker')
+        thread.start()
+        thread.join()
+
+        trace = timer.to_chrome_trace()
+        events = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        self.assertEqual([event['name'] for event in events], ['acquire', 'readback'])
+        self.assertAlmostEqual(events[0]['ts'], 0.)
+        self.assertAlmostEqual(events[0]['dur'], 0.5e6)
+        self.assertAlmostEqual(events[1]['ts'], 0.25e6)
+        self.assertNotEqual(events[0]['tid'], events[1]['tid'])
+        thread_names = [event['args']['name'] for event in trace['traceEvents'] if event['name'] == 'thread_name']
+        self.assertIn('worker', thread_names)
+
+        path = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(path, 'data', 'run-trace.json')
+            timer.save_chrome_trace(filename)
+            with open(filename, 'r') as trace_file:
+                self.assertEqual(len(json.load(trace_file)['traceEvents']), len(trace['traceEvents']))
+        finally:
+            shutil.rmtree(path)
+
+    def test_store_timing(self):
+        class Script(object):
+            def __init__(self, timer):
+                self.timer = timer
+                self.data = {}
+                self.settings = {'save': False}
+
+        script = Script(Timer(enabled=False))
+        store_timing(script)
+        self.assertNotIn('timing', script.data)
+
+        with self.timer.span('acquire'):
+            self.clock.time += 1.
+        script = Script(self.timer)
+        store_timing(script)
+        self.assertEqual(script.data['timing']['phase'], ['acquire'])
@@ -0,0 +1,64 @@
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.data_processing.adaptive_averaging import AdaptiveAveraging, simulate_nv_counts, \
+    benchmark
+
+
+class TestAdaptiveAveraging(TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+
+    def _first_block(self, tau, criterion):
+        scheduler = AdaptiveAveraging(tau, 2, criterion)
+        num_loops = scheduler.allocate(100000 * len(tau))
+        # without data, the loops are distributed evenly
+        np.testing.assert_array_equal(num_loops, np.full(len(tau), 100000))
+        scheduler.add_counts(simulate_nv_counts(tau, num_loops, criterion, random_state=self.random_state), num_loops)
+        return scheduler
+
+    def test_allocate(self):
+        tau = np.linspace(1e4, 5e6, 40)
+        scheduler = self._first_block(tau, 'variance')
+        num_loops = scheduler.allocate(100000 * len(tau))
+        self.assertEqual(np.sum(num_loops), 100000 * len(tau))
+        self.assertTrue(np.all(num_loops >= 0.2 * 100000))
+
+        scheduler = AdaptiveAveraging(tau, 2, 'variance', max_loops=150000)
+        scheduler.add_counts(np.ones((len(tau), 2)), 1)
+        self.assertLessEqual(np.max(scheduler.allocate(100000 * len(tau))), 150000)
+
+    def test_fisher_information(self):
+        # for the same number of loops, the adaptive allocation predicts a smaller uncertainty of T1 and of the period
+        for criterion, tau in [('exponential', np.linspace(1e4, 5e6, 40)), ('cosine', np.linspace(10, 500, 40))]:
+            scheduler = self._first_block(tau, criterion)
+            num_loops = scheduler.allocate(100000 * len(tau))
+            self.assertIsNotNone(scheduler.fit_params)
+            adaptive = scheduler.target_uncertainty(scheduler.num_loops + num_loops)
+            uniform = scheduler.target_uncertainty(scheduler.num_loops + 100000)
+            self.assertLess(adaptive, uniform)
+
+    def test_signal_function(self):
+        tau = np.linspace(10, 500, 20)
+        counts = simulate_nv_counts(tau, 100000, 'cosine', random_state=self.random_state)
+        # e.g. rabi, where the first readout is the reference
+        scheduler = AdaptiveAveraging(tau, 2, 'cosine', signal_function=lambda rates: rates[:, 1] / rates[:, 0])
+        scheduler.add_counts(counts, 100000)
+        signal, variance = scheduler.signal()
+        rates = counts / 100000.
+        np.testing.assert_allclose(signal, rates[:, 1] / rates[:, 0])
+        np.testing.assert_allclose(variance, signal ** 2 * (1 / rates[:, 0] + 1 / rates[:, 1]), rtol=1e-5)
+
+        # the default signal is the first readout normalized to the second
+        default = AdaptiveAveraging(tau, 2, 'cosine')
+        default.add_counts(counts, 100000)
+        np.testing.assert_allclose(default.signal()[0], 1 / signal)
+
+    def test_benchmark(self):
+        # with a few trials the scatter of the fitted parameter is too uncertain to show the gain, which has to be
+        # reported as not significant
+        for criterion in ['exponential', 'cosine']:
+            result = benchmark(criterion, num_blocks=3, num_trials=10, num_resamples=200)
+            self.assertFalse(result['significant'])
+            self.assertLess(result['ratio'] - 2 * result['ratio_spread'], 1)
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.data_processing.block_store import BlockStore
+
+
+class TestBlockStore(TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'blocks')
+        self.tau = np.arange(100, 1100, 100)
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def test_append_and_lazy_load(self):
+        store = BlockStore.create(self.path, self.tau, 3, 2, {'script': 'Rabi'})
+        reader = BlockStore(self.path)
+        self.assertEqual(reader.num_completed, 0)
+        self.assertEqual(len(reader['counts']), 0)
+
+        counts = np.random.poisson(100, (2, len(self.tau), 2)).astype(float)
+        for block in range(2):
+            store.append(counts[block], np.random.permutation(len(self.tau)), block, block + 1, 100000,
+                         2.87e9, (0.1, -0.2))
+
+        # the reader sees the blocks that have been completed in the meantime
+        self.assertEqual(reader.num_completed, 2)
+        np.testing.assert_array_equal(reader['counts'], counts)
+        np.testing.assert_array_equal(reader.total_counts(), counts.sum(0))
+        np.testing.assert_array_equal(reader.total_loops(), np.full(len(self.tau), 200000))
+        np.testing.assert_array_equal(reader['nv_position'][1], [0.1, -0.2])
+        self.assertEqual(reader.meta['script'], 'Rabi')
+
+    def test_resume(self):
+        store = BlockStore.create(self.path, self.tau, 2, 1)
+        store.append(np.ones((len(self.tau), 1)), np.arange(len(self.tau)), 0, 1, 10)
+        del store
+
+        store = BlockStore(self.path)
+        self.assertTrue(store.is_compatible(self.tau, 2, 1))
+        self.assertFalse(store.is_compatible(self.tau[:-1], 2, 1))
+        self.assertFalse(store.is_compatible(self.tau, 3, 1))
+        self.assertEqual(store.append(np.ones((len(self.tau), 1)), np.arange(len(self.tau)), 1, 2, 10), 1)
+        with self.assertRaises(IndexError):
+            store.append(np.ones((len(self.tau), 1)), np.arange(len(self.tau)), 2, 3, 10)
+        with self.assertRaises(IOError):
+            BlockStore.create(self.path, self.tau, 2, 1)
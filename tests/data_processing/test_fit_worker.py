@@ -0,0 +1,69 @@
+import threading
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.data_processing.fit_worker import FitWorker
+from b26_toolkit.b26_toolkit.data_processing.fit_functions import exp_offset, cose_with_decay
+
+
+class TestFitWorker(TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.tau = np.linspace(0, 5000, 50)
+
+    def _decay(self, noise):
+        return exp_offset(self.tau, 0.3, 1500., 0.1) + noise * self.random_state.randn(len(self.tau))
+
+    def test_exp_decay(self):
+        worker = FitWorker('exp_decay')
+        self.assertTrue(worker.fit(self.tau, self._decay(0.01)))
+        self.assertEqual(worker.result['parameter'], ['amplitude', 'tau', 'offset'])
+        self.assertAlmostEqual(worker.result['value'][1], 1500., delta=150.)
+        self.assertAlmostEqual(worker.relative_uncertainty, worker.result['uncertainty'][1] / worker.result['value'][1])
+
+        # values that have not been measured yet are ignored
+        y = self._decay(0.01)
+        y[::2] = np.nan
+        self.assertTrue(worker.fit(self.tau, y))
+        self.assertFalse(worker.fit(self.tau[:3], y[:3]))
+
+    def test_rabi(self):
+        tau = np.linspace(0, 400, 80)
+        y = cose_with_decay(tau, 0.1, 2 * np.pi / 100., 0., 0.9, 2000.) + 0.005 * self.random_state.randn(len(tau))
+        worker = FitWorker('rabi')
+        self.assertTrue(worker.fit(tau, y))
+        self.assertAlmostEqual(abs(worker.result['value'][1]), 2 * np.pi / 100., delta=0.005)
+
+    def test_early_stop(self):
+        # the uncertainty drops as the noise averages down
+        worker = FitWorker('exp_decay', target_uncertainty=0.02)
+        self.assertTrue(worker.fit(self.tau, self._decay(0.05)))
+        self.assertFalse(worker.converged)
+        self.assertTrue(worker.fit(self.tau, self._decay(0.002)))
+        self.assertTrue(worker.converged)
+        self.assertFalse(FitWorker('exp_decay').converged)
+
+    def test_coalesce(self):
+        fitted = []
+        worker = FitWorker('exp_decay', callback=lambda result: fitted.append(result['value'][1]))
+        # submit while the worker is not running, only the last request is fitted
+        for tau_decay in [500., 1000., 1500.]:
+            worker.submit(self.tau, exp_offset(self.tau, 0.3, tau_decay, 0.1))
+        self.assertEqual(worker.num_coalesced, 2)
+        worker.start()
+        self.assertTrue(worker.wait(10.))
+        worker.stop()
+        self.assertEqual(len(fitted), 1)
+        self.assertAlmostEqual(fitted[0], 1500., places=3)
+        self.assertEqual(worker.num_fits, 1)
+
+    def test_background(self):
+        threads = []
+        worker = FitWorker('exp_decay', callback=lambda result: threads.append(threading.current_thread().name))
+        worker.start()
+        worker.submit(self.tau, self._decay(0.01))
+        # stop fits the pending data before the thread ends
+        worker.stop()
+        self.assertEqual(threads, ['fit_worker'])
+        self.assertIsNotNone(worker.result)
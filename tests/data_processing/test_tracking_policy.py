@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.data_processing.tracking_policy import TrackingPolicy
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+class TestTrackingPolicy(TestCase):
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+        self.clock = FakeClock()
+
+    def _counts(self, reference, num_values, relative_noise=0.05):
+        return reference * (1 + relative_noise * self.random_state.randn(num_values))
+
+    def _run(self, policy, values):
+        decisions = []
+        for index, value in enumerate(values):
+            self.clock.time += 1.0
+            track = policy.update(value, index)
+            if track:
+                policy.tracked(0.0)
+            decisions.append(track)
+        return np.array(decisions)
+
+    def test_shot_noise(self):
+        # shot noise of a few percent triggers the threshold detector now and then, but not the cusum detector
+        values = self._counts(20., 2000, 0.06)
+        threshold = TrackingPolicy(20., 'threshold', threshold=0.85, hysteresis=0, clock=self.clock)
+        cusum = TrackingPolicy(20., 'cusum', clock=self.clock)
+        self.assertGreater(np.sum(self._run(threshold, values)), 0)
+        self.assertEqual(np.sum(self._run(cusum, values)), 0)
+        self.assertEqual(len(cusum.log['time']), 0)
+
+    def test_slow_drift(self):
+        # a 10% drop is never seen by the threshold detector, but detected by the cusum and ema detectors
+        values = np.concatenate([self._counts(20., 200, 0.02), self._counts(18., 200, 0.02)])
+        threshold = TrackingPolicy(20., 'threshold', threshold=0.85, clock=self.clock)
+        self.assertEqual(np.sum(self._run(threshold, values)), 0)
+        for detector in ['cusum', 'ema']:
+            policy = TrackingPolicy(20., detector, threshold=0.95, clock=self.clock)
+            decisions = self._run(policy, values)
+            self.assertFalse(np.any(decisions[:200]))
+            self.assertTrue(np.any(decisions[200:220]))
+            self.assertEqual(policy.log['index'][0], np.argmax(decisions))
+
+    def test_hysteresis(self):
+        # if tracking does not fix the deviation, we do not track again until the counts are back
+        values = np.concatenate([np.full(50, 20.), np.full(50, 15.), np.full(50, 20.), np.full(50, 15.)])
+        policy = TrackingPolicy(20., 'threshold', threshold=0.85, hysteresis=0.5, clock=self.clock)
+        self.assertEqual(np.sum(self._run(policy, values)), 2)
+        policy = TrackingPolicy(20., 'threshold', threshold=0.85, hysteresis=0, clock=self.clock)
+        self.assertEqual(np.sum(self._run(policy, values)), 100)
+
+    def test_budget(self):
+        policy = TrackingPolicy(20., 'threshold', threshold=0.85, hysteresis=0, max_time_fraction=0.25,
+                                clock=self.clock)
+        for index in range(100):
+            self.clock.time += 1.0
+            if policy.update(10., index):
+                self.clock.time += 1.0
+                policy.tracked(1.0)
+        # the budget is checked before tracking, so it is exceeded by at most one tracking duration
+        self.assertAlmostEqual(policy.time_fraction, 0.25, delta=1. / 100)
+        self.assertEqual(len(policy.log['tracked']), 100)
+        self.assertEqual(np.sum(policy.log['tracked']), policy.tracking_time)
+        self.assertEqual(np.sum(policy.log['duration']), policy.tracking_time)
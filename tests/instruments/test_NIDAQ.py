@@ -1,6 +1,10 @@
+import threading
+import time
 from unittest import TestCase
 
-from b26_toolkit.b26_toolkit.instruments import NI6259
+import numpy as np
+
+from b26_toolkit.b26_toolkit.instruments import NI6259, SimulatedDAQmx, ConfocalModel, DAQStream
 
 
 class TestDAQ(TestCase):
@@ -14,4 +18,208 @@ class TestDAQ(TestCase):
         result, _ = self.someDAQ.gated_DI_read(timeout=30)
         for i in range(0, 5):
             print((result[i]))
-        self.someDAQ.gated_DI_stop()
\ No newline at end of file
+        self.someDAQ.gated_DI_stop()
+
+
+class TestSimulatedDAQmx(TestCase):
+    def setUp(self):
+        self.nidaq = SimulatedDAQmx(model=ConfocalModel(nv_positions=[[0.1, 0.]]), time_scale=0, seed=1)
+        self.daq = NI6259(nidaq=self.nidaq)
+
+    def test_analog_voltages(self):
+        self.daq.set_analog_voltages({'ao0': 0.3, 'ao1': -0.1})
+        voltages = np.array(self.daq.get_analog_voltages(['ao0', 'ao1'])) - self.daq.settings['ao_read_offset']
+        np.testing.assert_allclose(voltages, [0.3, -0.1], atol=1e-3)
+
+    def test_line_scan(self):
+        # same calls as the galvo scan, the counter is clocked together with the x waveform
+        x = np.linspace(-0.2, 0.4, 61)
+        self.daq.set_analog_voltages({'ao0': x[0], 'ao1': 0.})
+        counter = self.daq.setup_counter('ctr0', len(x) + 1)
+        ao = self.daq.setup_AO(['ao0'], x, counter)
+        self.daq.run(ao)
+        self.daq.run(counter)
+        self.daq.waitToFinish(ao)
+        self.daq.stop(ao)
+        data, num_read = self.daq.read(counter, as_array=True)
+        self.daq.stop(counter)
+
+        self.assertEqual(num_read.value, len(x) + 1)
+        counts = np.diff(data)
+        self.assertAlmostEqual(x[np.argmax(counts)], 0.1, delta=0.011)
+        # the output keeps the last voltage of the waveform
+        self.assertAlmostEqual(self.daq.get_analog_voltages(['ao0'])[0] - self.daq.settings['ao_read_offset'], 0.4,
+                               delta=1e-3)
+        self.assertEqual(self.nidaq.tasks, {})
+
+    def test_task_pool(self):
+        x = np.linspace(-0.2, 0.4, 61)
+        for line in range(3):
+            # same calls as the galvo scan
+            self.daq.set_analog_voltages({'ao0': x[0], 'ao1': 0.})
+            counter = self.daq.setup_counter('ctr0', len(x) + 1, pooled=True)
+            ao = self.daq.setup_AO(['ao0'], x, counter, pooled=True)
+            self.daq.run(ao)
+            self.daq.run(counter)
+            self.daq.waitToFinish(ao)
+            self.daq.stop(ao)
+            data, _ = self.daq.read(counter, as_array=True)
+            self.daq.stop(counter)
+            self.assertAlmostEqual(x[np.argmax(np.diff(data))], 0.1, delta=0.011)
+        # the counter, its clock and the analog output are only created for the first line
+        self.assertEqual(self.nidaq.num_calls['DAQmxCreateTask'], 3 + 3)
+        self.assertEqual(len(self.nidaq.tasks), 3)
+
+        # a task that uses the same counter unreserves the pooled tasks, which are committed again when they are reused
+        gated_counter = self.daq.setup_gated_counter('ctr0', 10)
+        self.daq.run(gated_counter)
+        self.daq.stop(gated_counter)
+        counter = self.daq.setup_counter('ctr0', len(x) + 1, pooled=True)
+        self.daq.run(counter)
+        data, num_read = self.daq.read(counter)
+        self.daq.stop(counter)
+        self.assertEqual(num_read.value, len(x) + 1)
+        self.assertEqual(self.nidaq.num_calls['DAQmxCreateTask'], 3 + 3 + 1)
+
+        # the pooled tasks are cleared when the settings change
+        self.daq.update({'ao_read_offset': 0.})
+        self.assertEqual(self.nidaq.tasks, {})
+
+    def test_task_pool_pipelined(self):
+        # same calls as the pipelined pulsed experiments: the gated counter of the next sequence is set up while the
+        # current one is running and the one after that as soon as the current one is released, before the next one
+        # is started, so two pooled counters with the same configuration alternate
+        task = self.daq.setup_gated_counter('ctr0', 10, pooled=True)
+        next_task = self.daq.setup_gated_counter('ctr0', 10, pooled=True)
+        self.daq.run(task)
+        for sequence in range(5):
+            self.daq.stop(task)
+            if sequence == 2:
+                # tracking in between the sequences uses the same counter
+                counter = self.daq.setup_counter('ctr0', 20)
+                self.daq.run(counter)
+                _, num_read = self.daq.read(counter)
+                self.daq.stop(counter)
+                self.assertEqual(num_read.value, 20)
+            following_task = self.daq.setup_gated_counter('ctr0', 10, pooled=True)
+            self.daq.run(next_task)
+            task, next_task = next_task, following_task
+        self.daq.stop(task)
+        self.daq.stop(next_task)
+        # the two gated counters and the counter of the tracking with its clock
+        self.assertEqual(self.nidaq.num_calls['DAQmxCreateTask'], 2 + 2)
+        self.daq.clear_task_pool()
+        self.assertEqual(self.nidaq.tasks, {})
+
+    def test_task_pool_threads(self):
+        # a worker thread sets up and releases pooled gated counters with varying configurations while this thread runs
+        # pooled analog outputs on the same daq, the latency of the calls makes the threads switch in between them
+        self.nidaq.call_latency = 1e-4
+        errors = []
+
+        def set_up_counters():
+            try:
+                for i in range(200):
+                    self.daq.stop(self.daq.setup_gated_counter('ctr0', 10 + i % 7, pooled=True))
+            except Exception as e:
+                errors.append(e)
+
+        worker = threading.Thread(target=set_up_counters)
+        worker.start()
+        x = np.linspace(-0.2, 0.4, 11)
+        while worker.is_alive():
+            ao = self.daq.setup_AO(['ao0'], x, pooled=True)
+            self.daq.run(ao)
+            self.daq.waitToFinish(ao)
+            self.daq.stop(ao)
+        worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual([task for task in self.daq.tasklist if task.startswith(('gatedctr', 'ao'))], [])
+        self.daq.clear_task_pool()
+        self.assertEqual(self.nidaq.tasks, {})
+
+    def test_reproducible(self):
+        def counts(seed):
+            daq = NI6259(nidaq=SimulatedDAQmx(time_scale=0, seed=seed))
+            counter = daq.setup_counter('ctr0', 50)
+            daq.run(counter)
+            data, _ = daq.read(counter, as_array=True)
+            daq.stop(counter)
+            return data.copy()
+
+        np.testing.assert_array_equal(counts(3), counts(3))
+        self.assertFalse(np.array_equal(counts(3), counts(4)))
+
+    def test_read_counter_out(self):
+        # the gated counts are read directly into a row of a preallocated array, e.g. data['raw_counts'] of a pulsed
+        # experiment, with the same values as a read into a new buffer
+        def read(out=None):
+            daq = NI6259(nidaq=SimulatedDAQmx(time_scale=0, seed=3))
+            counter = daq.setup_gated_counter('ctr0', 40)
+            daq.run(counter)
+            try:
+                return daq.read(counter, as_array=True, out=out)
+            finally:
+                daq.stop(counter)
+
+        expected, _ = read()
+        raw_counts = np.full((3, 50), np.nan)
+        data, num_read = read(raw_counts[1][:40])
+        self.assertEqual(num_read.value, 40)
+        self.assertTrue(np.shares_memory(data, raw_counts))
+        np.testing.assert_array_equal(raw_counts[1][:40], expected)
+        # the rest of the array is not touched
+        self.assertTrue(np.all(np.isnan(raw_counts[1][40:])))
+        self.assertTrue(np.all(np.isnan(raw_counts[[0, 2]])))
+
+        # out has to be a contiguous float64 array that is large enough
+        with self.assertRaises(ValueError):
+            read(np.zeros(39))
+        with self.assertRaises(ValueError):
+            read(raw_counts[:, 0])
+        with self.assertRaises(ValueError):
+            read(np.zeros(40, dtype=np.int64))
+
+    def test_timing(self):
+        self.nidaq.time_scale = 1
+        sample_rate = self.daq.settings['digital_input']['ctr0']['sample_rate']
+        counter = self.daq.setup_counter('ctr0', 100, continuous_acquisition=True)
+        self.daq.run(counter)
+        time.sleep(0.05)
+        data, num_read = self.daq.read(counter, as_array=True)
+        # a continuous counter returns the samples that have been acquired until now
+        self.assertAlmostEqual(num_read.value, 0.05 * sample_rate, delta=0.03 * sample_rate)
+        self.assertTrue(np.all(np.diff(data[:num_read.value]) >= 0))
+
+        # the buffer overflows if it is not read in time
+        time.sleep(2 * 100 / sample_rate)
+        with self.assertRaises(RuntimeError):
+            self.daq.read(counter)
+        self.daq.stop(counter)
+
+        gated_counter = self.daq.setup_gated_counter('ctr0', 1000)
+        start = time.time()
+        self.daq.run(gated_counter)
+        self.daq.read(gated_counter, as_array=True)
+        self.daq.stop(gated_counter)
+        self.assertGreaterEqual(time.time() - start, 1000 * self.nidaq.gate_period)
+        self.assertEqual(self.nidaq.num_calls['DAQmxReadCounterF64'], 3)
+
+    def test_stream(self):
+        self.nidaq.time_scale = 1
+        self.daq.set_analog_voltages({'ao0': 0.1, 'ao1': 0.})
+        stream = DAQStream(self.daq, 'ctr0', ['ai2'], sample_rate=2000, read_time=0.01)
+        full_rate = stream.subscribe()
+        decimated = stream.subscribe(decimation=20)
+        stream.start()
+        time.sleep(0.2)
+        stream.stop()
+
+        samples = full_rate.read()
+        self.assertEqual(stream.columns, ['counts', 'ai2'])
+        self.assertGreater(len(samples), 200)
+        # the counts of each sample interval, on the NV
+        self.assertAlmostEqual(np.mean(samples[:, 0]) * 2000, 63e3, delta=5e3)
+        np.testing.assert_allclose(decimated.read(), samples[:len(samples) // 20 * 20].reshape(-1, 20, 2).mean(axis=1))
+        self.assertIsNone(stream.error)
+        self.assertEqual(self.nidaq.tasks, {})
@@ -2,13 +2,13 @@ from unittest import TestCase
 
 import numpy as np
 
-from b26_toolkit.b26_toolkit.instruments import B26PulseBlaster, Pulse
+from b26_toolkit.b26_toolkit.instruments import B26PulseBlaster, Pulse, QuantizedPulse, SimulatedSpinAPI
 
 
 class TestPulseBlaster(TestCase):
 
     def setUp(self):
-        self.pb = B26PulseBlaster()
+        self.pb = B26PulseBlaster(spinapi=SimulatedSpinAPI())
 
         self.pulses = [Pulse('laser', 0, 1E3),
                        Pulse('microwave_switch', 1.5E3, 100),
@@ -95,6 +95,22 @@ class TestPulseBlaster(TestCase):
                     self.assertTrue(pulse_1.start_time < pulse_2.start_time + pulse_2.duration)
                     self.assertTrue(pulse_2.start_time < pulse_1.start_time + pulse_1.duration)
 
+    def test_overlapping_pulses_dead_time(self):
+        pulses = [Pulse('microwave_i', 100, 50),
+                  Pulse('microwave_q', 160, 50),
+                  Pulse('microwave_i', 220, 50)]
+
+        self.assertEqual(B26PulseBlaster.find_overlapping_pulses(pulses, dead_time=5), [])
+        self.assertEqual(B26PulseBlaster.find_overlapping_pulses(pulses, dead_time=80), [(pulses[0], pulses[2])])
+        self.assertEqual(B26PulseBlaster.find_overlapping_pulses(pulses, combine_channels=['microwave_i', 'microwave_q'],
+                                                                 dead_time=15),
+                         [(pulses[0], pulses[1]), (pulses[1], pulses[2])])
+
+        pulse_sequences = [self.pulses, pulses, [Pulse('laser', 0, 1E3), Pulse('laser', 0.5E3, 1E3)]]
+        np.testing.assert_array_equal(B26PulseBlaster.has_overlapping_pulses(pulse_sequences, dead_time=80),
+                                      [False, True, True])
+        np.testing.assert_array_equal(B26PulseBlaster.has_overlapping_pulses(pulse_sequences), [False, False, True])
+
     def test_pulseblaster_conversion(self):
         correct_commands = [self.pb.PBStateChange(channel_bits=1, time=1000.0),
                             self.pb.PBStateChange(channel_bits=0, time=500.0),
@@ -159,3 +175,159 @@ class TestPulseBlaster(TestCase):
         self.assertEqual(len(correct_breakdown), len(generated_breakdown))
         for correct_breakdown_item, generated_breakdown_item in zip(correct_breakdown, generated_breakdown):
             self.assertEqual(correct_breakdown_item, generated_breakdown_item)
+
+    def test_compile_sweep(self):
+        # the vectorized compiler has to give exactly the same commands as the reference implementation
+        self.pb.update({'laser': {'delay_time': 350.2}, 'apd_readout': {'delay_time': 15}})
+        instrument_choices = ['laser', 'microwave_switch', 'microwave_q', 'microwave_i', 'apd_readout']
+
+        pulse_sequences = [self.pulses]
+        for i in range(20):
+            pulses = []
+            for instrument in instrument_choices:
+                start_time = np.random.randint(0, 100) * 2.5
+                for j in range(np.random.randint(1, 4)):
+                    duration = np.random.randint(1, 2000) * 2.5
+                    pulses.append(Pulse(instrument, start_time, duration))
+                    start_time += duration + np.random.choice([0, 50, 5000])
+            pulse_sequences.append(pulses)
+
+        instruction_table = self.pb.compile_sweep(pulse_sequences, num_loops=100)
+        self.assertEqual(len(instruction_table), len(pulse_sequences))
+        for index, pulses in enumerate(pulse_sequences):
+            delayed_pulses = self.pb.create_physical_pulse_seq(pulses)
+            pb_commands = self.pb.create_commands(self.pb.generate_pb_sequence(delayed_pulses), 100)
+            self.assertEqual(instruction_table.get_commands(index), pb_commands)
+
+    def test_program_cache(self):
+        pulses = [Pulse('laser', 0, 1E3),
+                  Pulse('microwave_i', 1.5E3, 100),
+                  Pulse('laser', 2E3, 1E3),
+                  Pulse('apd_readout', 2E3, 100)]
+
+        self.pb.clear_program_cache()
+        program = self.pb.get_program(pulses, num_loops=100)
+        self.assertEqual(self.pb.get_program(pulses, num_loops=100), program)
+        self.assertEqual((self.pb.program_cache_hits, self.pb.program_cache_misses), (1, 1))
+
+        # a different number of loops or different delays result in a different program
+        self.pb.get_program(pulses, num_loops=200)
+        self.pb.update({'laser': {'delay_time': self.pb.settings['laser']['delay_time'] + 10}})
+        self.pb.get_program(pulses, num_loops=100)
+        self.assertEqual((self.pb.program_cache_hits, self.pb.program_cache_misses), (1, 3))
+
+    def _unroll(self, instructions):
+        # executes the LOOP/END_LOOP/LONG_DELAY instructions of a program and returns the output states
+        states = []
+        loops = []
+        address = 0
+        while True:
+            channel_bits, command, command_arg, duration = instructions[address]
+            if command == 7:
+                duration *= command_arg
+            if states and states[-1][0] == channel_bits:
+                states[-1][1] += duration
+            else:
+                states.append([channel_bits, duration])
+
+            if command == 2 and not (loops and loops[-1][0] == address):
+                loops.append([address, command_arg])
+            elif command == 3:
+                self.assertEqual(loops[-1][0], command_arg)
+                loops[-1][1] -= 1
+                if loops[-1][1] > 0:
+                    address = command_arg
+                    continue
+                loops.pop()
+            elif command == 6:
+                return states
+            address += 1
+
+    def test_loop_compression(self):
+        def xy8_sequence(k, tau):
+            pulses = [Pulse('microwave_i', 1000, 25)]
+            next_pi_time = 1000 + 25 + tau / 2. - 25
+            for i in range(k):
+                for channel in ['i', 'q', 'i', 'q', 'q', 'i', 'q', 'i']:
+                    pulses.append(Pulse('microwave_' + channel, next_pi_time, 50))
+                    next_pi_time += tau
+            end_time = next_pi_time - tau + 50 + tau / 2. - 12.5
+            pulses += [Pulse('microwave_i', end_time, 25),
+                       Pulse('laser', end_time + 1000, 2000),
+                       Pulse('apd_readout', end_time + 1030, 250)]
+            return pulses
+
+        num_commands = []
+        for k in [4, 16, 64, 256]:
+            compressed = self.pb.compile_sweep([xy8_sequence(k, 500)], 10, compress_loops=True)
+            unrolled = self.pb.compile_sweep([xy8_sequence(k, 500)], 10)
+            self.assertEqual(self._unroll(compressed.instructions(0)), self._unroll(unrolled.instructions(0)))
+            num_commands.append(compressed.num_commands(0))
+
+        self.assertEqual(len(set(num_commands)), 1)
+        self.assertGreater(unrolled.num_commands(0), 4096)
+
+    def test_sweep_program(self):
+        pulse_sequences = [[Pulse('laser', 0, 1E3), Pulse('apd_readout', 1.5E3, 300), Pulse('laser', 2E3, 500 + 100 * i)]
+                           for i in range(3)]
+        num_loops = [4, 2, 3]
+
+        instructions, estimated_runtime = self.pb.get_sweep_program(pulse_sequences, num_loops)
+        self.assertEqual([command for __, command, __, __ in instructions].count(6), 1)
+
+        # the sweep program runs the single programs one after the other, separated by the steady state
+        expected_states = []
+        for pulse_sequence, loops in zip(pulse_sequences, num_loops):
+            expected_states += self._unroll(self.pb.get_program(pulse_sequence, loops)[0])
+            expected_states[-1][1] = self.pb.SEQUENCE_SEPARATION_TIME
+        expected_states[-1][1] = 100
+        self.assertEqual(self._unroll(instructions), expected_states)
+
+    def test_simulated_spinapi(self):
+        spinapi = SimulatedSpinAPI()
+        pb = B26PulseBlaster(settings={'laser': {'delay_time': 350.2}}, spinapi=spinapi)
+
+        pulses = [Pulse('laser', 0, 1E3),
+                  Pulse('microwave_i', 1.5E3, 100),
+                  Pulse('microwave_q', 1750, 100),
+                  Pulse('laser', 2E3, 1E3),
+                  Pulse('apd_readout', 2E3, 100)]
+        pb.program_pb(pulses, num_loops=3)
+        pb.start_pulse_seq()
+        self.assertEqual(spinapi.pb_read_status() & 0b100, 0b100)
+
+        physical_pulses = pb.create_physical_pulse_seq(pulses)
+        period = max(pulse.end_time for pulse in physical_pulses)
+        edges = spinapi.get_edges()
+        for channel_id in ['microwave_i', 'microwave_q', 'apd_readout']:
+            channel_pulses = [pulse for pulse in physical_pulses if pulse.channel_id == channel_id]
+            rising, falling = edges[pb._get_channel(channel_id)]
+            np.testing.assert_allclose(rising, [pulse.start_time + i * period for i in range(3) for pulse in channel_pulses])
+            np.testing.assert_allclose(falling, [pulse.end_time + i * period for i in range(3) for pulse in channel_pulses])
+
+        start_times, durations, channel_bits = spinapi.get_timeline()
+        self.assertEqual(start_times[-1], 3 * period)
+        self.assertEqual(channel_bits[-1], pb.settings2bits())
+
+        # instructions that are too short are rejected like by the dll
+        spinapi.pb_start_programming(0)
+        self.assertLess(spinapi.pb_inst_pbonly(0, 0, 0, 5.0), 0)
+
+    def test_quantized_pulse(self):
+        quantized_pulses = self.pb.quantize_pulses(self.pulses)
+        for pulse, quantized_pulse in zip(self.pulses, quantized_pulses):
+            self.assertEqual(quantized_pulse.channel_id, pulse.channel_id)
+            self.assertEqual(quantized_pulse.start_time, pulse.start_time)
+            self.assertEqual(quantized_pulse.end_time, pulse.end_time)
+            # round trip
+            self.assertEqual(QuantizedPulse.from_pulse(quantized_pulse.to_pulse()), quantized_pulse)
+
+        # equal pulses have the same hash, pulses on a different clock are different
+        self.assertEqual(len(set(quantized_pulses + self.pb.quantize_pulses(self.pulses))), len(self.pulses))
+        self.assertNotEqual(QuantizedPulse('laser', 4, 40, 2.5), QuantizedPulse('laser', 4, 40, 10.0))
+        with self.assertRaises(AttributeError):
+            quantized_pulses[0].start_tick = 3
+
+        # quantized pulses compile to the same program as the pulses they were created from
+        self.assertEqual(self.pb.compile_sweep([quantized_pulses]).get_commands(0),
+                         self.pb.compile_sweep([self.pulses]).get_commands(0))
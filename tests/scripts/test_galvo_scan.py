@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.instruments import NI6259, SimulatedDAQmx, ConfocalModel
+from b26_toolkit.b26_toolkit.scripts.galvo_scan.galvo_scan import GalvoScan
+from b26_toolkit.b26_toolkit.scripts.galvo_scan.galvo_scan_generic import GalvoScanGeneric
+
+
+def spots(x, y):
+    return np.exp(-((x - 12.3) ** 2 + (y - 20) ** 2) / 8.) + 0.5 * np.exp(-((x - 30.8) ** 2 + (y - 9) ** 2) / 4.)
+
+
+class TestGalvoScan(TestCase):
+    def test_raster_waveform(self):
+        x_array, y_array = np.linspace(-0.1, 0.1, 4), np.linspace(0.2, 0.5, 3)
+        waveform, pixel_of_sample = GalvoScan.raster_waveform(x_array, y_array, 5, 3, 2)
+        line_length = 3 + 2 + 4 * 5
+        self.assertEqual(waveform.shape, (2, 3 * line_length))
+        self.assertEqual(pixel_of_sample.shape, (3 * line_length,))
+
+        lines = waveform.reshape(2, 3, line_length)
+        # the flyback ends at the start of the line, where the galvo settles
+        np.testing.assert_allclose(lines[0, 1, :5], [1 / 30., -1 / 30., -0.1, -0.1, -0.1])
+        np.testing.assert_allclose(lines[1, 1, :5], [0.25, 0.3, 0.35, 0.35, 0.35])
+        np.testing.assert_allclose(lines[0, 2, 5:], np.repeat(x_array, 5))
+
+        # the samples of each point without the first and last one are counted, the image is reshaped from the counts
+        counts = np.arange(waveform.shape[1], dtype=float)
+        counted = pixel_of_sample >= 0
+        image = np.bincount(pixel_of_sample[counted], weights=counts[counted]).reshape(3, 4)
+        np.testing.assert_array_equal(image[2], [3 * (2 * line_length + 5 + 5 * i + 2) for i in range(4)])
+        self.assertEqual(np.sum(counted), 3 * 4 * 3)
+
+    def test_serpentine_waveform(self):
+        x_array, y_array = np.linspace(-0.1, 0.1, 4), np.linspace(0.2, 0.5, 3)
+        waveform, pixel_of_sample = GalvoScan.raster_waveform(x_array, y_array, 5, 0, 2, serpentine=True)
+        lines = waveform.reshape(2, 3, 2 + 4 * 5)
+        pixels = pixel_of_sample.reshape(3, 2 + 4 * 5)
+        # the odd lines are scanned backwards, starting where the previous line ended
+        np.testing.assert_allclose(lines[0, 1], np.concatenate(([0.1, 0.1], np.repeat(x_array[::-1], 5))))
+        np.testing.assert_allclose(lines[0, 2, :2], [-0.1, -0.1])
+        np.testing.assert_array_equal(pixels[1, 2 + 1:2 + 4], [7, 7, 7])
+        np.testing.assert_array_equal(pixels[2, 2 + 1:2 + 4], [8, 8, 8])
+
+    def test_line_shift(self):
+        y, x = np.mgrid[0:32, 0:40].astype(float)
+        # the galvo lags behind by 1.3 pixels in the direction of the scan
+        lag = np.where(y % 2 == 0, -1.3, 1.3)
+        image = spots(x + lag, y)
+
+        shift, correlation = GalvoScanGeneric.estimate_line_shift(image)
+        self.assertAlmostEqual(shift, 2.6, delta=0.2)
+        self.assertGreater(correlation, 0.5)
+
+        corrected = GalvoScanGeneric.correct_line_shift(image, shift)
+        error = np.abs(corrected - spots(x, y))[:, 3:-3].max()
+        self.assertLess(error, 0.1 * np.abs(image - spots(x, y)).max())
+
+        # without structure there is no shift
+        self.assertEqual(GalvoScanGeneric.estimate_line_shift(np.ones((10, 10))), (0., 0.))
+
+    def test_scan_simulated(self):
+        # scans an NV at (0.1, 0.05) with all combinations of scan mode and pattern on the simulated daq
+        daq = NI6259(nidaq=SimulatedDAQmx(model=ConfocalModel(nv_positions=[[0.1, 0.05]]), time_scale=0,
+                                          call_latency=0, seed=1))
+        images = {}
+        for scan_mode in ['line', 'frame']:
+            for scan_pattern in ['raster', 'serpentine']:
+                scan = GalvoScan(instruments={name: {'instance': daq, 'settings': {}}
+                                              for name in ['NI6259', 'NI9263', 'NI9402']})
+                self.assertEqual(scan.settings['daq_type'], 'PCI')
+                scan.settings['num_points'].update({'x': 30, 'y': 30})
+                scan.settings['point_a'].update({'x': 0.1, 'y': 0.05})
+                scan.settings['point_b'].update({'x': 0.1, 'y': 0.1})
+                scan.settings['time_per_pt'] = .002
+                scan.settings['scan_mode'] = scan_mode
+                scan.settings['scan_pattern'] = scan_pattern
+                scan.settings['ending_behavior'] = 'leave_at_corner'
+                scan._function()
+
+                image = scan.data['image_data']
+                self.assertEqual(image.shape, (30, 30))
+                i, j = np.unravel_index(image.argmax(), image.shape)
+                self.assertAlmostEqual(scan.y_array[i], 0.05, delta=0.01)
+                self.assertAlmostEqual(scan.x_array[j * scan.clockAdjust], 0.1, delta=0.01)
+                images[(scan_mode, scan_pattern)] = image
+
+        reference = images[('line', 'raster')].ravel()
+        for image in images.values():
+            self.assertGreater(np.corrcoef(reference, image.ravel())[0, 1], 0.8)
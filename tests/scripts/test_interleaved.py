@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.instruments import Pulse
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.interleaved import InterleavedPulsedExperiment, REFERENCE
+
+
+class SubscriptDummy(object):
+    """
+    stands in for the subscripts, creates sequences with two readouts
+    """
+    def __init__(self, tau_list, gate_width):
+        self.tau_list = tau_list
+        self.gate_width = gate_width
+        self.data = {}
+
+    def _create_pulse_sequences(self):
+        pulse_sequences = [[Pulse('laser', 0, 100), Pulse('apd_readout', 10, self.gate_width),
+                            Pulse('laser', 500 + tau, 100), Pulse('apd_readout', 510 + tau, self.gate_width)]
+                           for tau in self.tau_list]
+        return pulse_sequences, self.tau_list, self.gate_width
+
+
+class TestInterleavedPulsedExperiment(TestCase):
+    def setUp(self):
+        # the routing only needs the settings and the subscripts
+        self.experiment = InterleavedPulsedExperiment.__new__(InterleavedPulsedExperiment)
+        self.experiment._settings = {
+            'experiments': {'rabi': True, 't1': True, 'hahn_echo': False, 'xy8': False},
+            'mw_pulses': {'mw_power': -45., 'mw_frequency': 2.87e9, 'microwave_channel': 'i', 'pi_time': 50.},
+            'reference': {'num_sequences': 2},
+            'read_out': {'meas_time': 250, 'nv_reset_time': 1750, 'laser_off_time': 1000, 'delay_mw_readout': 100,
+                         'delay_readout': 30}}
+        self.experiment._scripts = {'rabi': SubscriptDummy([10, 20, 30], 250), 't1': SubscriptDummy([1000, 2000], 500)}
+        self.experiment.log_data = []
+        self.experiment.log_function = lambda message: None
+
+    def test_sequence_map(self):
+        pulse_sequences, tau_list, gate_width = self.experiment._create_pulse_sequences()
+        self.assertEqual(len(pulse_sequences), 3 + 2 + 2)
+        self.assertEqual(tau_list, list(range(7)))
+        self.assertEqual(self.experiment.sequence_map['experiment'].tolist(),
+                         ['rabi'] * 3 + ['t1'] * 2 + [REFERENCE] * 2)
+        self.assertEqual(self.experiment.sequence_map['tau'].tolist(), [10, 20, 30, 1000, 2000, 0, 0])
+        # the second readout of the reference measures |1> after the pi pulse
+        self.assertEqual([pulse.channel_id for pulse in pulse_sequences[-1]],
+                         ['laser', 'apd_readout', 'microwave_i', 'laser', 'apd_readout'])
+
+    def test_route_counts(self):
+        self.experiment._create_pulse_sequences()
+        # rabi tau = 20 is invalid and has been removed, t1 tau = 2000 is invalid and skipped (lazy sequences)
+        self.experiment.tau_list = [0, 2, 3, 4, 5, 6]
+        self.experiment.count_data = np.arange(12, dtype=float).reshape(6, 2)
+        self.experiment.loops_per_tau = np.array([10, 10, 10, 0, 10, 10])
+        self.experiment.data = {'counts': self.experiment.count_data.copy()}
+        self.experiment.data['counts'][3] = np.nan
+        self.experiment._route_counts()
+
+        rabi, t1 = self.experiment.scripts['rabi'].data, self.experiment.scripts['t1'].data
+        np.testing.assert_array_equal(rabi['tau'], [10, 30])
+        np.testing.assert_allclose(rabi['counts'], np.array([[0, 1], [2, 3]]) * 1e6 / (250 * 10.))
+        np.testing.assert_array_equal(t1['tau'], [1000])
+        np.testing.assert_allclose(t1['counts'], np.array([[4, 5]]) * 1e6 / (500 * 10.))
+        # the reference sequences are summed
+        np.testing.assert_allclose(self.experiment.data['reference'], np.array([8 + 10, 9 + 11]) * 1e6 / (250 * 20.))
+        np.testing.assert_array_equal(rabi['reference'], self.experiment.data['reference'])
+        np.testing.assert_array_equal(self.experiment.data['t1_tau'], [1000])
+
+    def test_log_validation(self):
+        self.experiment._create_pulse_sequences()
+        report = {check: np.zeros(7, dtype=bool) for check in ['overlapping_pulses', 'commands_too_short',
+                                                              'bad_start_time', 'too_many_commands']}
+        report['overlapping_pulses'][1] = True
+        report['valid'] = ~report['overlapping_pulses']
+        self.experiment._log_validation(report, np.arange(7.))
+        # the invalid sequence is logged with its experiment and tau
+        self.assertIn("overlapping_pulses: tau = ['rabi 20']", self.experiment.log_data)
@@ -0,0 +1,308 @@
+from collections import OrderedDict
+from unittest import TestCase
+
+import numpy as np
+from PyQt5.QtCore import QObject
+
+from b26_toolkit.b26_toolkit.core.timing import Timer
+from b26_toolkit.b26_toolkit.data_processing.tracking_policy import TrackingPolicy
+from b26_toolkit.b26_toolkit.instruments import B26PulseBlaster, SimulatedSpinAPI, NI6259, SimulatedDAQmx, \
+    ConfocalModel, Pulse
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.pulsed_experiment_base_script import \
+    PulsedExperimentBaseScript, PulseSequenceSet, PIPELINE_PHASES, MAX_AVERAGES_PER_SCAN
+
+
+class FindNVDummy(object):
+    """
+    stands in for find_nv, reads a counter on the same daq as the experiment
+    """
+    def __init__(self, daq):
+        self.daq = daq
+        self.settings = {'initial_point': {'x': 0., 'y': 0.}}
+        self.data = {'maximum_point': {'x': 0., 'y': 0.}, 'fluorescence': 50.}
+        self.num_runs = 0
+        self.tasklist_changed = False
+
+    def run(self):
+        tasks = dict(self.daq.tasklist)
+        counter = self.daq.setup_counter('ctr0', 20)
+        self.daq.run(counter)
+        self.daq.read(counter)
+        self.daq.stop(counter)
+        # the experiment must not set up or release its tasks while we track
+        self.tasklist_changed |= self.daq.tasklist != tasks
+        self.num_runs += 1
+
+
+class MicrowaveGeneratorDummy(object):
+    """
+    stands in for the microwave generator, keeps the settings that are written
+    """
+    def __init__(self):
+        self.settings = {'frequency': 2.87e9, 'amplitude': -5., 'enable_modulation': True}
+
+    def update(self, settings):
+        self.settings.update(settings)
+
+
+class ESRDummy(object):
+    """
+    stands in for the esr of the ESR tracking, which changes the settings of the microwave generator
+    """
+    def __init__(self, microwave_generator, fail_on_run=None):
+        self.instruments = {'microwave_generator': {'instance': microwave_generator}}
+        self.data = {'fit_params': None}
+        self.fail_on_run = fail_on_run
+        self.num_runs = 0
+
+    def run(self):
+        self.num_runs += 1
+        if self.num_runs == self.fail_on_run:
+            raise RuntimeError('esr failed')
+        self.instruments['microwave_generator']['instance'].update({'frequency': 2.8e9, 'amplitude': -30.})
+
+
+def create_experiment(pulse_blaster, daq, pulse_sequences, num_daq_reads=2, **settings):
+    """
+    Returns: a PulsedExperimentBaseScript with the instruments, the settings and the state that _function sets up, as
+        far as the sweep needs them
+    """
+    experiment = PulsedExperimentBaseScript.__new__(PulsedExperimentBaseScript)
+    QObject.__init__(experiment)
+    experiment._settings = {'randomize': False, 'single_program': False, 'pipelined': False,
+                            'keep_raw_counts': False, 'Tracking': {'readout': 'signal'}}
+    experiment._settings.update(settings)
+    experiment._instruments = {'PB': {'instance': pulse_blaster}, 'NI6259': {'instance': daq}}
+    experiment._scripts = {'find_nv': FindNVDummy(daq)}
+    experiment._daq = daq
+    experiment._abort = False
+    experiment.timer = Timer(False)
+    experiment.pulse_sequences = pulse_sequences
+    experiment.measurement_gate_width = 300
+    experiment.num_averages = experiment.current_averages = 20
+    experiment.counts_2d = None
+    experiment.count_data = np.zeros((len(pulse_sequences), num_daq_reads))
+    experiment.loops_per_tau = np.full(len(pulse_sequences), 20)
+    experiment.data = {'counts': np.zeros((len(pulse_sequences), num_daq_reads)),
+                       'phase_times': OrderedDict([(phase, 0.0) for phase in PIPELINE_PHASES])}
+    experiment.tracking_policy = None
+    experiment._command_counts = {}
+    return experiment
+
+
+def create_pulse_sequence(tau):
+    return [Pulse('laser', 0, 1000), Pulse('apd_readout', 1500, 300), Pulse('laser', 2500 + tau, 1000),
+            Pulse('apd_readout', 2600 + tau, 300)]
+
+
+class TestPipelinedSweep(TestCase):
+    def setUp(self):
+        self.nidaq = SimulatedDAQmx(model=ConfocalModel(nv_positions=[[0., 0.]]), time_scale=0, gate_width=1e-4,
+                                    seed=1)
+        self.daq = NI6259(nidaq=self.nidaq)
+        self.pulse_blaster = B26PulseBlaster(spinapi=SimulatedSpinAPI())
+        self.pulse_sequences = [create_pulse_sequence(tau) for tau in range(0, 600, 100)]
+        self.experiment = create_experiment(self.pulse_blaster, self.daq, self.pulse_sequences, pipelined=True)
+
+    def tearDown(self):
+        self.daq.clear_task_pool()
+
+    def test_run_sweep_pipelined(self):
+        for block in range(3):
+            self.experiment._run_sweep(self.pulse_sequences, 20, 2)
+        # all sequences have been run on the simulated daq and the tasks are released
+        self.assertEqual(self.nidaq.num_samples_acquired, 3 * len(self.pulse_sequences) * 20 * 2)
+        self.assertTrue(np.all(self.experiment.count_data > 0))
+        self.assertEqual(self.experiment.sequence_index, len(self.pulse_sequences) - 1)
+        self.assertEqual([task for task in self.daq.tasklist if 'gatedctr' in task], [])
+        self.assertGreater(self.experiment.data['duty_cycle'], 0)
+
+    def test_varying_loops(self):
+        # every sequence has a different number of loops and thus a different daq task, which misses the task pool
+        num_loops = np.arange(10, 10 + 5 * len(self.pulse_sequences), 5)
+        self.experiment.loops_per_tau = num_loops
+        self.experiment._run_sweep(self.pulse_sequences, num_loops, 2)
+        self.assertEqual(self.nidaq.num_samples_acquired, np.sum(num_loops) * 2)
+        self.assertTrue(np.all(self.experiment.count_data > 0))
+        # the counts are normalized with the loops of their own sequence
+        np.testing.assert_allclose(self.experiment.data['counts'],
+                                   self.experiment._normalize_to_kCounts(self.experiment.count_data, 300,
+                                                                         num_loops[:, np.newaxis]))
+        self.assertEqual([task for task in self.daq.tasklist if 'gatedctr' in task], [])
+
+    def test_abort(self):
+        # abort in the middle of the block, once the third sequence has been run
+        def abort(progress):
+            if self.experiment.sequence_index == 2:
+                self.experiment._abort = True
+        self.experiment._calc_progress = lambda index: index
+        self.experiment.updateProgress.connect(abort)
+        self.experiment._run_sweep(self.pulse_sequences, 20, 2)
+        # the counts of all sequences that have been run are added, the prepared task of the next one is released
+        self.assertEqual(self.nidaq.num_samples_acquired, 3 * 20 * 2)
+        self.assertTrue(np.all(self.experiment.count_data[:3] > 0))
+        self.assertTrue(np.all(self.experiment.count_data[3:] == 0))
+        self.assertEqual([task for task in self.daq.tasklist if 'gatedctr' in task], [])
+        self.assertGreater(self.experiment.data['phase_times']['prepare'], 0)
+
+    def test_keep_raw_counts(self):
+        # the raw counts are allocated on the first block and overwritten by the next ones, a block with less loops is
+        # padded with nan
+        self.experiment.settings['keep_raw_counts'] = True
+        self.experiment._run_sweep(self.pulse_sequences, 20, 2)
+        raw_counts = self.experiment.data['raw_counts']
+        self.assertEqual(raw_counts.shape, (len(self.pulse_sequences), 40))
+        count_data = self.experiment.count_data.copy()
+        self.experiment._run_sweep(self.pulse_sequences, 10, 2)
+        self.assertIs(self.experiment.data['raw_counts'], raw_counts)
+        self.assertTrue(np.all(np.isnan(raw_counts[:, 20:])))
+        np.testing.assert_array_equal(raw_counts[:, :20].reshape(len(self.pulse_sequences), -1, 2).sum(axis=1),
+                                      self.experiment.count_data - count_data)
+
+    def test_tracking(self):
+        # every sequence asks for tracking, find_nv uses the same counter as the experiment
+        self.experiment.tracking_policy = TrackingPolicy(1e9, 'threshold', 0.85, hysteresis=0)
+        self.experiment._run_sweep(self.pulse_sequences, 20, 2)
+        find_nv = self.experiment.scripts['find_nv']
+        self.assertEqual(find_nv.num_runs, len(self.pulse_sequences))
+        self.assertFalse(find_nv.tasklist_changed)
+        self.assertTrue(np.all(self.experiment.count_data > 0))
+
+    def test_tracking_readout(self):
+        # the reference readout of rabi, t1 and the baseline is the first one, signal is the last one
+        def needs_tracking(readout, counts):
+            self.experiment.tracking_policy = TrackingPolicy(30., 'threshold', 0.85, hysteresis=0)
+            self.experiment.settings['Tracking']['readout'] = readout
+            return self.experiment._needs_tracking(counts)
+
+        self.assertFalse(needs_tracking('reference', [30., 10.]))
+        self.assertTrue(needs_tracking('reference', [10., 30.]))
+        self.assertFalse(needs_tracking('signal', [10., 30.]))
+        self.assertTrue(needs_tracking('signal', [10.]))
+
+
+class TestSingleProgramSweep(TestCase):
+    def setUp(self):
+        self.nidaq = SimulatedDAQmx(model=ConfocalModel(nv_positions=[[0., 0.]]), time_scale=0, gate_width=1e-4,
+                                    seed=1)
+        self.daq = NI6259(nidaq=self.nidaq)
+        self.pulse_blaster = B26PulseBlaster(spinapi=SimulatedSpinAPI())
+
+    def tearDown(self):
+        self.daq.clear_task_pool()
+
+    def test_lazy_pulse_sequences(self):
+        # the sequence with a negative tau starts before 0 and can not be compiled, so it must be skipped
+        tau_list = [0, 100, -5000, 300, 400]
+
+        def create_sequence(index):
+            return create_pulse_sequence(tau_list[index])
+
+        def validate(pulse_sequences, taus):
+            return {'valid': np.array([tau >= 0 for tau in taus])}
+
+        pulse_sequences = PulseSequenceSet(tau_list, create_sequence, validate, chunk_size=2)
+        experiment = create_experiment(self.pulse_blaster, self.daq, pulse_sequences, single_program=True)
+        experiment._run_sweep(pulse_sequences, 20, 2)
+        self.assertTrue(np.all(np.isnan(experiment.data['counts'][2])))
+        self.assertTrue(np.all(experiment.count_data[[0, 1, 3, 4]] > 0))
+        self.assertEqual(self.nidaq.num_samples_acquired, 4 * 20 * 2)
+
+    def test_demultiplexed_counts(self):
+        # the single program acquires the same gates as the sequential runner, so with the same seed it has to assign
+        # the same counts to every sequence and readout
+        pulse_sequences = [create_pulse_sequence(tau) for tau in range(0, 600, 100)]
+        num_loops = np.arange(10, 10 + 5 * len(pulse_sequences), 5)
+        order = np.array([3, 0, 5, 1, 4, 2])
+        count_data, raw_counts = [], []
+        for single_program in [False, True]:
+            nidaq = SimulatedDAQmx(model=ConfocalModel(nv_positions=[[0., 0.]]), time_scale=0, gate_width=1e-4, seed=1)
+            daq = NI6259(nidaq=nidaq)
+            experiment = create_experiment(self.pulse_blaster, daq, pulse_sequences, single_program=single_program,
+                                           keep_raw_counts=True)
+            experiment.loops_per_tau = num_loops
+            experiment._run_sweep(pulse_sequences, num_loops, 2, order=order)
+            count_data.append(experiment.count_data)
+            raw_counts.append(experiment.data['raw_counts'])
+            daq.clear_task_pool()
+        np.testing.assert_array_equal(count_data[0], count_data[1])
+        np.testing.assert_array_equal(raw_counts[0], raw_counts[1])
+        self.assertTrue(np.all(count_data[1] > 0))
+
+    def test_sum_gates(self):
+        # 2 sequences with 2 and 3 loops of 2 readouts, the gates are in the order sequence, loop, readout
+        gates = np.arange(10.)
+        np.testing.assert_array_equal(PulsedExperimentBaseScript._sum_gates(gates, [2, 3], 2),
+                                      [[0 + 2, 1 + 3], [4 + 6 + 8, 5 + 7 + 9]])
+        np.testing.assert_array_equal(PulsedExperimentBaseScript._sum_gates(gates, 5, 2), [[20, 25]])
+
+    def test_compiled_once(self):
+        # the number of commands of the sequences is compiled on the first block and reused by the next ones
+        pulse_sequences = [create_pulse_sequence(tau) for tau in range(0, 600, 100)]
+        experiment = create_experiment(self.pulse_blaster, self.daq, pulse_sequences, single_program=True)
+        compiled = []
+        compile_sweep = self.pulse_blaster.compile_sweep
+        self.pulse_blaster.compile_sweep = lambda sequences, *args, **kwargs: \
+            compiled.append(len(sequences)) or compile_sweep(sequences, *args, **kwargs)
+        for block in range(3):
+            experiment._run_sweep(pulse_sequences, 20, 2)
+        self.assertEqual(compiled, [len(pulse_sequences)])
+        self.assertEqual(self.nidaq.num_samples_acquired, 3 * len(pulse_sequences) * 20 * 2)
+
+
+class TestSweep2D(TestCase):
+    def setUp(self):
+        self.nidaq = SimulatedDAQmx(model=ConfocalModel(nv_positions=[[0., 0.]]), time_scale=0, gate_width=1e-4,
+                                    seed=1)
+        self.daq = NI6259(nidaq=self.nidaq)
+        self.pulse_blaster = B26PulseBlaster(spinapi=SimulatedSpinAPI())
+        self.microwave_generator = MicrowaveGeneratorDummy()
+        self.pulse_sequences = [create_pulse_sequence(tau) for tau in range(0, 300, 100)]
+
+    def tearDown(self):
+        self.daq.clear_task_pool()
+
+    def create_experiment(self, min_value, max_value, fail_on_run=None):
+        # a single average block for each of the 3 values of the microwave amplitude, with ESR tracking before it
+        experiment = create_experiment(self.pulse_blaster, self.daq, self.pulse_sequences)
+        experiment.settings.update({
+            'sweep_2d': {'setting': 'mw_amplitude', 'min_value': min_value, 'max_value': max_value, 'num_points': 3,
+                         'settle_time': 0.},
+            'ESR_Tracking': {'track_every_N': 1, 'allowed_delta_freq': 10.}})
+        experiment._scripts['esr'] = ESRDummy(self.microwave_generator, fail_on_run)
+        experiment.messages = []
+        experiment.log = experiment.messages.append
+        experiment.num_averages = MAX_AVERAGES_PER_SCAN
+        experiment.loops_per_tau = np.zeros(len(self.pulse_sequences), dtype=np.int64)
+        experiment.tau_list = list(range(len(self.pulse_sequences)))
+        experiment.data['sweep_order'] = [np.arange(len(self.pulse_sequences))] * 3
+        experiment.adaptive_averaging = experiment.fit_worker = experiment._block_store = experiment._durations = None
+        experiment._block_index = 0
+        experiment._esr_tracking = True
+        experiment._mw_settings = {'frequency': 2.87e9, 'amplitude': -5., 'enable_modulation': True}
+        return experiment
+
+    def test_run_sweep_2d(self):
+        experiment = self.create_experiment(-20., -10.)
+        experiment._run_sweep_2d(2)
+        self.assertEqual(experiment.counts_2d.shape, (3, len(self.pulse_sequences), 2))
+        self.assertEqual(experiment.data['counts_2d'].shape, (3, len(self.pulse_sequences)))
+        self.assertTrue(np.all(experiment.counts_2d > 0))
+        np.testing.assert_array_equal(experiment.data['sweep_values'], [-20., -15., -10.])
+        self.assertEqual(experiment.scripts['esr'].num_runs, 3)
+        # the amplitude is set back to its value before the sweep
+        self.assertEqual(self.microwave_generator.settings['amplitude'], -5.)
+
+    def test_esr_tracking(self):
+        # all values are the same, but the ESR changes the microwave generator, so every value is written again
+        experiment = self.create_experiment(-10., -10.)
+        experiment._run_sweep_2d(2)
+        self.assertIn('2D sweep: wrote 4 settings, skipped 0 settings that did not change', experiment.messages)
+        self.assertEqual(self.microwave_generator.settings['amplitude'], -5.)
+
+    def test_restore_after_error(self):
+        experiment = self.create_experiment(-20., -10., fail_on_run=2)
+        with self.assertRaises(RuntimeError):
+            experiment._run_sweep_2d(2)
+        self.assertEqual(self.microwave_generator.settings['amplitude'], -5.)
+        self.assertIsNone(experiment._setting_planner)
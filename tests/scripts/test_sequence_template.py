@@ -0,0 +1,241 @@
+from unittest import TestCase
+
+import numpy as np
+
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.sequence_template import Affine, TAU, PulseArrays, SequenceTemplate
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.rabi import Rabi
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.t1 import T1
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.hahn_echo import HahnEcho
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.xy import XY8_k
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.cpmg import CPMG
+from b26_toolkit.b26_toolkit.scripts.pulse_sequences.pdd import PDD
+from b26_toolkit.b26_toolkit.instruments import Pulse
+from pylabcontrol.core import Parameter
+
+
+def pulse_set(pulse_sequence):
+    return sorted((pulse.channel_id, pulse.start_time, pulse.duration) for pulse in pulse_sequence)
+
+
+# the pulse sequences as the scripts created them pulse by pulse before they were converted to sequence templates
+
+def rabi_sequence(settings, tau):
+    read_out = settings['read_out']
+    microwave_channel = 'microwave_' + settings['mw_pulses']['microwave_channel']
+    start = read_out['laser_off_time'] + tau + 2*40
+    pulse_sequence = [Pulse('laser', start, read_out['nv_reset_time']),
+                      Pulse('apd_readout', start + read_out['delay_readout'], read_out['meas_time'])]
+    if tau > 0:
+        pulse_sequence.append(Pulse(microwave_channel, start + read_out['nv_reset_time'] + read_out['laser_off_time'], tau))
+    start += read_out['nv_reset_time'] + read_out['laser_off_time'] + tau + 2*40 + read_out['delay_mw_readout']
+    pulse_sequence += [Pulse('laser', start, read_out['nv_reset_time']),
+                       Pulse('apd_readout', start + read_out['delay_readout'], read_out['meas_time'])]
+    return pulse_sequence
+
+
+def t1_sequence(settings, tau):
+    read_out = settings['read_out']
+    microwave_channel = 'microwave_' + settings['mw_pulse']['microwave_channel']
+    laser_off_time, nv_reset_time = read_out['laser_off_time'], read_out['nv_reset_time']
+    pulse_sequence = [Pulse('laser', laser_off_time + tau, nv_reset_time),
+                      Pulse('apd_readout', laser_off_time + read_out['delay_readout'] + tau, read_out['meas_time'])]
+    if tau > 0:
+        pulse_sequence.append(Pulse(microwave_channel, laser_off_time + nv_reset_time + laser_off_time + tau,
+                                    settings['mw_pulse']['pi_time']))
+    start = laser_off_time + nv_reset_time + laser_off_time + read_out['delay_mw_readout'] + 2*tau
+    pulse_sequence += [Pulse('laser', start, nv_reset_time),
+                       Pulse('apd_readout', start + read_out['delay_readout'], read_out['meas_time'])]
+    return pulse_sequence
+
+
+def readout(settings, end_of_mw_pulses):
+    read_out = settings['read_out']
+    start = end_of_mw_pulses + read_out['delay_mw_readout']
+    return [Pulse('laser', start, read_out['nv_reset_time']),
+            Pulse('apd_readout', start + read_out['delay_readout'], read_out['meas_time'])]
+
+
+def second_start(settings, end_of_mw_pulses):
+    read_out = settings['read_out']
+    return end_of_mw_pulses + read_out['delay_mw_readout'] + read_out['nv_reset_time'] + read_out['laser_off_time']
+
+
+def hahn_echo_sequence(settings, tau):
+    mw_pulses = settings['mw_pulses']
+    microwave_channel = 'microwave_' + mw_pulses['microwave_channel']
+    pi_time, pi_half_time = mw_pulses['pi_pulse_time'], mw_pulses['pi_half_pulse_time']
+    pulse_sequence = []
+    start = settings['read_out']['laser_off_time']
+    for last_pulse_time in [pi_half_time, mw_pulses['3pi_half_pulse_time']]:
+        pulse_sequence += [
+            Pulse(microwave_channel, start, pi_half_time),
+            Pulse(microwave_channel, start + pi_half_time/2. + tau - pi_time/2., pi_time),
+            Pulse(microwave_channel, start + pi_half_time/2. + tau + tau - pi_half_time/2., last_pulse_time)]
+        end = start + pi_half_time/2. + tau + tau - pi_half_time/2. + pi_half_time
+        pulse_sequence += readout(settings, end)
+        start = second_start(settings, end)
+    return pulse_sequence
+
+
+def xy8_sequence(settings, tau):
+    mw_pulses = settings['mw_pulses']
+    microwave_channel = 'microwave_' + mw_pulses['microwave_channel']
+    microwave_channel_pi2 = 'microwave_' + mw_pulses['microwave_channel_pi2']
+    pi_time, pi_half_time = mw_pulses['pi_pulse_time'], mw_pulses['pi_half_pulse_time']
+    pulse_sequence = []
+    start = settings['read_out']['laser_off_time']
+    for last_pulse_time in [pi_half_time, mw_pulses['3pi_half_pulse_time']]:
+        pulse_sequence.append(Pulse(microwave_channel_pi2, start, pi_half_time))
+        next_pi_t = start + pi_half_time + tau/2 - pi_time/2.
+        for ind in range(mw_pulses['pi_pulse_blocks_k']*8):
+            if ind % 8 in [0, 2, 5, 7]:
+                pulse_sequence.append(Pulse(microwave_channel_pi2, next_pi_t, pi_time))
+            else:
+                pulse_sequence.append(Pulse(microwave_channel, next_pi_t, mw_pulses['pi_pulse_time_mwchan']))
+            next_pi_t = next_pi_t + tau
+        pulse_sequence.append(Pulse(microwave_channel_pi2, next_pi_t - tau/2., last_pulse_time))
+        end = next_pi_t - tau/2. + last_pulse_time
+        pulse_sequence += readout(settings, end)
+        start = second_start(settings, end)
+    return pulse_sequence
+
+
+def cpmg_sequence(settings, tau):
+    mw_pulses = settings['mw_pulses']
+    microwave_channel = 'microwave_' + mw_pulses['microwave_channel']
+    microwave_channel_pi2 = 'microwave_' + mw_pulses['microwave_channel_pi2']
+    pi_time, pi_half_time = mw_pulses['pi_pulse_time'], mw_pulses['pi_half_pulse_time']
+    pulse_sequence = []
+    start = settings['read_out']['laser_off_time']
+    for last_pulse_time in [pi_half_time, mw_pulses['3pi_half_pulse_time']]:
+        pulse_sequence += [Pulse(microwave_channel_pi2, start, pi_half_time),
+                           Pulse(microwave_channel, start + pi_half_time/2. + tau/2 - pi_time/2., pi_time)]
+        next_pi_t = start + pi_half_time/2. + tau/2 - pi_time/2. + tau
+        for ind in range(mw_pulses['Number of pi pulses N'] - 1):
+            pulse_sequence.append(Pulse(microwave_channel, next_pi_t, pi_time))
+            next_pi_t = next_pi_t + tau
+        last_pulse_start = next_pi_t - tau + pi_time/2. + tau/2 - last_pulse_time/2.
+        pulse_sequence.append(Pulse(microwave_channel_pi2, last_pulse_start, last_pulse_time))
+        pulse_sequence += readout(settings, last_pulse_start + last_pulse_time)
+        start = second_start(settings, last_pulse_start + last_pulse_time)
+    return pulse_sequence
+
+
+def pdd_sequence(settings, tau):
+    read_out, mw_pulses = settings['read_out'], settings['mw_pulses']
+    reset_time, meas_time = read_out['nv_reset_time'], read_out['meas_time']
+    pi_time = mw_pulses['pi_pulse_time']
+    pi_half_time = pi_time/2.0
+    pulse_sequence = [Pulse('laser', 0, reset_time - read_out['ref_meas_off_time'] - 15 - meas_time),
+                      Pulse('apd_readout', reset_time - 15 - meas_time, meas_time),
+                      Pulse('laser', reset_time - 15 - meas_time, meas_time),
+                      Pulse('microwave_i', reset_time + read_out['delay_mw_init'] - pi_half_time/2, pi_half_time)]
+    next_pi_pulse_time = reset_time + read_out['delay_mw_init']
+    for n in range(mw_pulses['number_of_pi_pulses']):
+        next_pi_pulse_time += tau/2
+        pulse_sequence.append(Pulse('microwave_q', next_pi_pulse_time - pi_time/2, pi_time))
+        next_pi_pulse_time += tau/2
+    if mw_pulses['number_of_pi_pulses'] == 0:
+        next_pi_pulse_time += tau
+    start = next_pi_pulse_time + pi_half_time + read_out['delay_mw_readout']
+    pulse_sequence += [Pulse('microwave_i', next_pi_pulse_time - pi_half_time/2, pi_half_time),
+                       Pulse('laser', start, meas_time), Pulse('apd_readout', start, meas_time)]
+    return pulse_sequence
+
+
+class TestAffine(TestCase):
+    def test_arithmetic(self):
+        time = 100 + TAU / 2 - 25
+        self.assertEqual((time.offset, time.slope), (75., 0.5))
+        self.assertEqual(time(200), 175.)
+        np.testing.assert_array_equal(time(np.array([0, 100])), [75., 125.])
+
+        time = 10 - 3 * TAU
+        self.assertEqual((time.offset, time.slope), (10., -3.))
+        self.assertEqual((-time).slope, 3.)
+        self.assertIsInstance(TAU + 0, Affine)
+        with self.assertRaises(TypeError):
+            TAU * TAU
+
+
+class TestSequenceTemplate(TestCase):
+    def test_materialize(self):
+        template = SequenceTemplate()
+        template.add('laser', 0, 1000)
+        # train of 3 pi pulses spaced by tau, centered at tau / 2, 3 tau / 2 and 5 tau / 2
+        end = template.add('microwave_q', 1000 + TAU / 2 - 20, 40, repeat=3, period=TAU)
+        template.add('microwave_i', 1000, TAU)
+        template.add('microwave_i', end + 10, 20, positive_tau_only=True)
+        self.assertEqual(len(template), 6)
+        self.assertEqual((end.offset, end.slope), (1020., 2.5))
+
+        tau_list = [0, 100]
+        pulse_arrays = template.materialize(tau_list)
+        self.assertEqual(pulse_arrays.num_sequences, 2)
+        # the mw pulse of duration tau and the positive_tau_only pulse are left out for tau = 0
+        self.assertEqual(len(pulse_arrays), 4 + 6)
+
+        pulse_sequences = template.create_pulse_sequences(tau_list)
+        self.assertEqual(pulse_set(pulse_sequences[1]), pulse_set([
+            Pulse('laser', 0, 1000),
+            Pulse('microwave_q', 1030, 40), Pulse('microwave_q', 1130, 40), Pulse('microwave_q', 1230, 40),
+            Pulse('microwave_i', 1000, 100), Pulse('microwave_i', 1280, 20)]))
+        self.assertEqual(len(pulse_sequences[0]), 4)
+
+
+class TestScriptTemplates(TestCase):
+    def assert_template(self, script_class, reference, **settings):
+        script = script_class.__new__(script_class)
+        script._settings = Parameter(script_class._DEFAULT_SETTINGS)
+        for key, value in settings.items():
+            script._settings[key].update(value)
+        tau_list = script._create_tau_list()
+        self.assertGreater(len(tau_list), 1)
+        pulse_sequences = script._create_sequence_template().create_pulse_sequences(tau_list)
+        for tau, pulse_sequence in zip(tau_list, pulse_sequences):
+            expected = pulse_set(reference(script.settings, tau))
+            actual = pulse_set(pulse_sequence)
+            self.assertEqual([pulse[0] for pulse in actual], [pulse[0] for pulse in expected])
+            np.testing.assert_allclose([pulse[1:] for pulse in actual], [pulse[1:] for pulse in expected])
+
+    def test_scripts(self):
+        tau_times = {'min_time': 0, 'max_time': 1000, 'time_step': 100}
+        self.assert_template(Rabi, rabi_sequence, tau_times=tau_times)
+        self.assert_template(T1, t1_sequence, tau_times=tau_times)
+        self.assert_template(HahnEcho, hahn_echo_sequence, tau_times=tau_times)
+        self.assert_template(XY8_k, xy8_sequence, tau_times=tau_times, mw_pulses={'pi_pulse_blocks_k': 2})
+        self.assert_template(CPMG, cpmg_sequence, tau_times=tau_times, mw_pulses={'Number of pi pulses N': 3})
+        for number_of_pi_pulses in [0, 3]:
+            self.assert_template(PDD, pdd_sequence, tau_times={'min_time': 15, 'max_time': 100, 'time_step': 20},
+                                 mw_pulses={'number_of_pi_pulses': number_of_pi_pulses})
+
+
+class TestPulseArrays(TestCase):
+    def test_round_trip(self):
+        pulse_sequences = [[Pulse('laser', 0, 100), Pulse('apd_readout', 20, 50)], [], [Pulse('microwave_i', 10, 30)]]
+        pulse_arrays = PulseArrays.from_sequences(pulse_sequences)
+        self.assertEqual(len(pulse_arrays), 3)
+        self.assertEqual([pulse_set(sequence) for sequence in pulse_arrays.to_sequences()],
+                         [pulse_set(sequence) for sequence in pulse_sequences])
+
+    def test_combine(self):
+        pulse_sequences = [[Pulse('microwave_switch', 300, 10), Pulse('laser', 0, 50),
+                            Pulse('microwave_switch', 100, 100), Pulse('microwave_switch', 120, 20),
+                            Pulse('microwave_switch', 205, 10)],
+                           [Pulse('microwave_switch', 0, 10)]]
+        combined = PulseArrays.from_sequences(pulse_sequences).combine('microwave_switch', 10).to_sequences()
+        # pulses that overlap or are less than the overlap window apart are merged, including contained pulses
+        self.assertEqual([(pulse.channel_id, pulse.start_time, pulse.duration) for pulse in combined[0]],
+                         [('microwave_switch', 100, 115), ('microwave_switch', 300, 10), ('laser', 0, 50)])
+        self.assertEqual(pulse_set(combined[1]), [('microwave_switch', 0, 10)])
+
+    def test_add_mw_switch(self):
+        pulse_sequences = [[Pulse('microwave_i', 100, 20), Pulse('microwave_q', 130, 20), Pulse('laser', 300, 100)]]
+
+        mw_iq = PulseArrays.from_sequences(pulse_sequences).add_mw_switch('mw_iq', 10).to_sequences()[0]
+        self.assertEqual(pulse_set(mw_iq), pulse_set(pulse_sequences[0] + [Pulse('microwave_switch', 90, 70)]))
+
+        mw_switch = PulseArrays.from_sequences(pulse_sequences).add_mw_switch('mw_switch', 10).to_sequences()[0]
+        self.assertEqual(pulse_set(mw_switch), pulse_set([
+            Pulse('microwave_i', 90, 40), Pulse('microwave_q', 120, 40), Pulse('laser', 300, 100),
+            Pulse('microwave_switch', 100, 20), Pulse('microwave_switch', 130, 20)]))